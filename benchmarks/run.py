@@ -0,0 +1,206 @@
+"""
+基于合成区块链的性能测试，输出 JSON 格式的结果（吞吐量与峰值内存），便于做回归对比。
+
+    python benchmarks/run.py --blocks 50 --txs 1000 --output bench.json
+
+默认使用 fakeredis 作为进程内的 redis 测试 RedisEngine ，也可以通过 --redis-host 指定一个本地 redis
+（会往其中写数据，请使用单独的数据库编号）。指定本地 redis 时还会测试多进程的 RedisEngine.parallel_write_data
+（子进程不能共享 fakeredis ），并给出相对单进程导入的加速比
+"""
+from typing import Callable
+import multiprocessing
+import tempfile
+import argparse
+import platform
+import tracemalloc
+import time
+import json
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import SyntheticChain  # noqa: E402
+from bitcoin_toolkit import parser_block, FileEngine, RedisEngine, SqliteEngine, Trace  # noqa: E402
+
+
+def measure(func: Callable, memory: bool = True) -> dict:
+    """
+    运行 func 并统计耗时，memory 为真时再用 tracemalloc 单独运行一次统计峰值内存（不影响计时）
+    :param func: 无参函数，返回值为附加的统计信息字典
+    :param memory:
+    :return:
+    """
+    start = time.perf_counter()
+    result = func() or {}
+    result['seconds'] = time.perf_counter() - start
+    if memory:
+        tracemalloc.start()
+        func()
+        result['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def add_rates(result: dict, n_blocks: int, n_txs: int) -> dict:
+    result['blocks'] = n_blocks
+    result['txs'] = n_txs
+    result['blocks_per_second'] = n_blocks / result['seconds']
+    result['txs_per_second'] = n_txs / result['seconds']
+    return result
+
+
+def create_redis_client(args):
+    """
+    创建 redis 客户端，没有指定 redis 时使用进程内的 fakeredis
+    :param args:
+    :return: (客户端, 名称) ，都不可用时返回 (None, None)
+    """
+    if args.redis_host:
+        import redis
+        client = redis.Redis(host=args.redis_host, port=args.redis_port, db=args.redis_db, decode_responses=True)
+        return client, f'redis://{args.redis_host}:{args.redis_port}/{args.redis_db}'
+    try:
+        import fakeredis
+    except ImportError:
+        return None, None
+    return fakeredis.FakeRedis(decode_responses=True), 'fakeredis'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='bitcoin_toolkit 性能测试')
+    parser.add_argument('--blocks', type=int, default=20, help='区块数')
+    parser.add_argument('--txs', type=int, default=500, help='每个区块的交易数')
+    parser.add_argument('--fanout', type=int, default=2, help='每笔交易的输出数')
+    parser.add_argument('--hubs', type=int, default=10, help='热点地址数')
+    parser.add_argument('--hub-share', type=float, default=0.1, help='输出转给热点地址的比例')
+    parser.add_argument('--multisig-share', type=float, default=0.05, help='多签输出的比例')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    parser.add_argument('--depths', type=int, nargs='+', default=[1, 2, 3, 4], help='Trace.start 的追溯深度')
+    parser.add_argument('--redis-host', default=None, help='本地 redis 地址，不指定时使用 fakeredis')
+    parser.add_argument('--redis-port', type=int, default=6379)
+    parser.add_argument('--redis-db', type=int, default=15)
+    parser.add_argument('--redis-flush', action='store_true', help='测试前清空指定的 redis 数据库')
+    parser.add_argument('--workers', type=int, default=4, help='并行导入的进程数')
+    parser.add_argument('--no-memory', action='store_true', help='不统计峰值内存（统计时每项测试会多运行一次）')
+    parser.add_argument('--output', default=None, help='结果输出路径，默认打印到标准输出')
+    args = parser.parse_args()
+
+    chain = SyntheticChain(n_blocks=args.blocks, txs_per_block=args.txs, fanout=args.fanout, n_hubs=args.hubs,
+                           hub_share=args.hub_share, multisig_share=args.multisig_share, seed=args.seed)
+    raw_blocks = list(chain.iter_raw_blocks())
+    min_height, max_height = chain.heights
+    n_blocks, n_txs = len(raw_blocks), len(raw_blocks) * args.txs
+    memory = not args.no_memory
+
+    from blockchain_parser.block import Block
+
+    def new_blocks():
+        # blockchain_parser 的 Block 会缓存解析结果，每次测试都需要重新创建
+        return [Block(raw, height) for height, raw in raw_blocks]
+
+    dir_blocks = tempfile.mkdtemp()
+    os.makedirs(os.path.join(dir_blocks, 'index'))
+    results = {}
+
+    # parser_block
+    def bench_parser():
+        for block in new_blocks():
+            parser_block(block)
+
+    results['parser_block'] = add_rates(measure(bench_parser, memory), n_blocks, n_txs)
+
+    # FileEngine.read_data
+    def bench_file_engine():
+        engine = FileEngine(dir_blocks, min_height, max_height, show_warning=False)
+        engine.read_data(blocks=new_blocks())
+        return {'n_tx': len(engine.dict_tx), 'n_txo': len(engine.dict_output), 'n_address': len(engine.dict_address)}
+
+    results['file_engine.read_data'] = add_rates(measure(bench_file_engine, memory), n_blocks, n_txs)
+
+    # RedisEngine.write_data
+    client, redis_name = create_redis_client(args)
+    if client is None:
+        results['redis_engine.write_data'] = {'skipped': '没有指定 redis ，也没有安装 fakeredis'}
+    else:
+        def bench_redis_engine():
+            if args.redis_flush or redis_name == 'fakeredis':
+                client.flushdb()
+            RedisEngine(client=client).write_data(dir_blocks, min_height, max_height, blocks=new_blocks())
+            return {'backend': redis_name}
+
+        results['redis_engine.write_data'] = add_rates(measure(bench_redis_engine, memory), n_blocks, n_txs)
+
+    # RedisEngine.parallel_write_data
+    if client is None or redis_name == 'fakeredis':
+        results['redis_engine.parallel_write_data'] = {'skipped': '需要用 --redis-host 指定本地 redis'}
+    elif not args.redis_flush:
+        results['redis_engine.parallel_write_data'] = {'skipped': '需要 --redis-flush ，从空的数据库开始与单进程导入对比'}
+    elif multiprocessing.get_start_method() != 'fork':
+        results['redis_engine.parallel_write_data'] = {'skipped': '子进程需要通过 fork 继承合成区块'}
+    else:
+        from blockchain_parser.blockchain import Blockchain
+
+        def get_ordered_blocks(self, index, start=0, end=None, cache=None):
+            return (Block(raw, height) for height, raw in raw_blocks
+                    if height >= start and (end is None or height < end))
+
+        def bench_redis_parallel():
+            client.flushdb()
+            # 子进程通过 fork 继承替换后的读取函数，直接读取内存里的合成区块，不需要区块索引
+            origin, Blockchain.get_ordered_blocks = Blockchain.get_ordered_blocks, get_ordered_blocks
+            try:
+                RedisEngine(client=client).parallel_write_data(
+                    dir_blocks, min_height, max_height, workers=args.workers,
+                    blocks_per_task=max(1, n_blocks // (args.workers * 4)))
+            finally:
+                Blockchain.get_ordered_blocks = origin
+            return {'backend': redis_name, 'workers': args.workers, 'cpu_count': os.cpu_count()}
+
+        result = add_rates(measure(bench_redis_parallel, memory=False), n_blocks, n_txs)
+        result['speedup'] = results['redis_engine.write_data']['seconds'] / result['seconds']
+        results['redis_engine.parallel_write_data'] = result
+
+    # SqliteEngine.write_data
+    def bench_sqlite_engine():
+        path = os.path.join(dir_blocks, 'bench.sqlite')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        engine_ = SqliteEngine(path).write_data(dir_blocks, min_height, max_height, blocks=new_blocks())
+        engine_.close()
+        return {'file_bytes': os.path.getsize(path)}
+
+    results['sqlite_engine.write_data'] = add_rates(measure(bench_sqlite_engine, memory), n_blocks, n_txs)
+
+    # Trace.start ，从第一个区块里输出最多的交易开始追溯
+    engine = FileEngine(dir_blocks, min_height, max_height, show_warning=False)
+    engine.read_data(blocks=new_blocks())
+    init_txid = max((i for i in engine.dict_tx.values() if i['block_height'] == min_height and not i['is_coinbase']),
+                    key=lambda x: x['n_outputs'])['txid']
+    for depth in args.depths:
+        def bench_trace():
+            trace = Trace(min_height, max_height, init_txid=init_txid, max_depth=depth).set_search_engine(engine)
+            metrics = trace.enable_metrics()
+            trace.start()
+            return {'depth': depth, 'edges': len(trace.edges), 'lookups': {k: v['keys'] for k, v in
+                                                                           metrics.to_dict()['calls'].items()}}
+
+        results[f'trace.start.depth_{depth}'] = measure(bench_trace, memory)
+
+    report = {
+        'config': dict(vars(args), output=None),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+"""
+确定性的合成区块链生成器，不需要本地的 Bitcoin Core blocks 目录即可构造测试和压测数据。
+
+生成的是真实的比特币二进制格式（ legacy 交易），因此既可以直接包装成 blockchain_parser 的 Block 对象，
+也可以写成 blk*.dat 文件
+"""
+from typing import Iterator, List, Tuple
+import hashlib
+import random
+import struct
+import os
+
+MAGIC = bytes.fromhex('f9beb4d9')  # 主网的区块文件魔数
+OP_RETURN = 0x6a
+OP_CHECKMULTISIG = 0xae
+
+
+def double_sha256(data: bytes) -> bytes:
+    return hashlib.sha256(hashlib.sha256(data).digest()).digest()
+
+
+def varint(n: int) -> bytes:
+    if n < 0xfd:
+        return bytes([n])
+    if n <= 0xffff:
+        return b'\xfd' + struct.pack('<H', n)
+    if n <= 0xffffffff:
+        return b'\xfe' + struct.pack('<I', n)
+    return b'\xff' + struct.pack('<Q', n)
+
+
+def push(data: bytes) -> bytes:
+    assert len(data) < 0x4c, len(data)
+    return bytes([len(data)]) + data
+
+
+def p2pkh_script(hash160: bytes) -> bytes:
+    return b'\x76\xa9\x14' + hash160 + b'\x88\xac'
+
+
+def multisig_script(m: int, pubkeys: List[bytes]) -> bytes:
+    return bytes([0x50 + m]) + b''.join(push(i) for i in pubkeys) + bytes([0x50 + len(pubkeys), OP_CHECKMULTISIG])
+
+
+def merkle_root(hashes: List[bytes]) -> bytes:
+    while len(hashes) > 1:
+        if len(hashes) % 2:
+            hashes = hashes + hashes[-1:]
+        hashes = [double_sha256(hashes[i] + hashes[i + 1]) for i in range(0, len(hashes), 2)]
+    return hashes[0]
+
+
+class SyntheticChain:
+    """
+    合成区块链：
+    1. 每个区块有 1 笔 coinbase 交易与 txs_per_block - 1 笔普通交易
+    2. 普通交易从 UTXO 池里随机花费 1~max_inputs 笔输出
+       （池子为空或按 pre_range_share 的概率时，花费一笔区块范围之前的虚构输出）
+    3. 每笔交易有 fanout 个输出，按 hub_share 的概率转给少数几个热点地址，按 multisig_share 的概率为多签输出，
+       按 return_share 的概率为 OP_RETURN 输出，其余为普通的 P2PKH 输出
+    相同的参数总是生成完全相同的区块
+    """
+
+    def __init__(self,
+                 n_blocks: int = 100,
+                 txs_per_block: int = 500,
+                 fanout: int = 2,
+                 max_inputs: int = 3,
+                 n_hubs: int = 10,
+                 hub_share: float = 0.1,
+                 multisig_share: float = 0.05,
+                 return_share: float = 0.01,
+                 pre_range_share: float = 0.1,
+                 start_height: int = 0,
+                 start_time: int = 1500000000,
+                 seed: int = 0):
+        """
+        :param n_blocks: 区块数
+        :param txs_per_block: 每个区块的交易数（含 coinbase 交易）
+        :param fanout: 每笔交易的输出数
+        :param max_inputs: 每笔交易最多的输入数
+        :param n_hubs: 热点地址数
+        :param hub_share: 输出转给热点地址的比例
+        :param multisig_share: 多签输出的比例
+        :param return_share: OP_RETURN 输出的比例
+        :param pre_range_share: 输入花费区块范围之前的输出的比例
+        :param start_height: 起始区块高度
+        :param start_time: 起始区块时间戳，之后每个区块加 600 秒
+        :param seed: 随机种子
+        """
+        assert isinstance(n_blocks, int) and n_blocks > 0, n_blocks
+        assert isinstance(txs_per_block, int) and txs_per_block > 0, txs_per_block
+        assert isinstance(fanout, int) and fanout > 0, fanout
+        assert isinstance(max_inputs, int) and max_inputs > 0, max_inputs
+        assert isinstance(n_hubs, int) and n_hubs >= 0, n_hubs
+        assert hub_share + multisig_share + return_share <= 1, '输出类型的比例之和不能大于 1'
+        self.n_blocks = n_blocks
+        self.txs_per_block = txs_per_block
+        self.fanout = fanout
+        self.max_inputs = max_inputs
+        self.n_hubs = n_hubs
+        self.hub_share = hub_share if n_hubs else 0
+        self.multisig_share = multisig_share
+        self.return_share = return_share
+        self.pre_range_share = pre_range_share
+        self.start_height = start_height
+        self.start_time = start_time
+        self.seed = seed
+
+    def __repr__(self):
+        return f'SyntheticChain({self.start_height}~{self.start_height + self.n_blocks - 1})'
+
+    @property
+    def heights(self) -> Tuple[int, int]:
+        return self.start_height, self.start_height + self.n_blocks - 1
+
+    def iter_raw_blocks(self) -> Iterator[Tuple[int, bytes]]:
+        """
+        按高度依次生成区块的原始字节
+        :return: (高度, 区块字节) 的生成器
+        """
+        rng = random.Random(self.seed)
+
+        def rand_bytes(n):
+            return rng.getrandbits(n * 8).to_bytes(n, 'little')
+
+        def rand_pubkey():
+            return bytes([2 + rng.getrandbits(1)]) + rand_bytes(32)
+
+        hubs = [rand_bytes(20) for _ in range(self.n_hubs)]
+        utxos = []  # [(交易哈希, 输出位置), ...]
+        prev_hash = b'\x00' * 32
+
+        for offset in range(self.n_blocks):
+            height = self.start_height + offset
+            txs = []
+
+            # coinbase 交易
+            script_sig = push(struct.pack('<I', height)) + rand_bytes(8)
+            script = p2pkh_script(rand_bytes(20))
+            coinbase = (struct.pack('<I', 1)
+                        + varint(1) + b'\x00' * 32 + b'\xff\xff\xff\xff' + varint(len(script_sig)) + script_sig
+                        + b'\xff\xff\xff\xff'
+                        + varint(1) + struct.pack('<Q', 625000000) + varint(len(script)) + script
+                        + b'\x00\x00\x00\x00')
+            txs.append(coinbase)
+            utxos.append((double_sha256(coinbase), 0))
+
+            # 普通交易
+            for _ in range(self.txs_per_block - 1):
+                n_inputs = rng.randint(1, self.max_inputs)
+                inputs = []
+                for _ in range(n_inputs):
+                    if not utxos or rng.random() < self.pre_range_share:
+                        inputs.append((rand_bytes(32), rng.randrange(4)))
+                    else:
+                        i = rng.randrange(len(utxos))
+                        utxos[i], utxos[-1] = utxos[-1], utxos[i]
+                        inputs.append(utxos.pop())
+                outputs = []
+                for _ in range(self.fanout):
+                    r = rng.random()
+                    if r < self.hub_share:
+                        script = p2pkh_script(hubs[rng.randrange(self.n_hubs)])
+                    elif r < self.hub_share + self.multisig_share:
+                        n = rng.randint(2, 3)
+                        script = multisig_script(rng.randint(1, n), [rand_pubkey() for _ in range(n)])
+                    elif r < self.hub_share + self.multisig_share + self.return_share:
+                        script = bytes([OP_RETURN]) + push(rand_bytes(20))
+                    else:
+                        script = p2pkh_script(rand_bytes(20))
+                    value = 0 if script[0] == OP_RETURN else rng.randint(10000, 10 ** 9)
+                    outputs.append(struct.pack('<Q', value) + varint(len(script)) + script)
+
+                raw = [struct.pack('<I', 1), varint(len(inputs))]
+                for tx_hash, index in inputs:
+                    script_sig = push(rand_bytes(71)) + push(rand_pubkey())
+                    raw.append(tx_hash + struct.pack('<I', index) + varint(len(script_sig)) + script_sig
+                               + b'\xff\xff\xff\xff')
+                raw.append(varint(len(outputs)))
+                raw.extend(outputs)
+                raw.append(b'\x00\x00\x00\x00')
+                tx = b''.join(raw)
+                txs.append(tx)
+                tx_hash = double_sha256(tx)
+                for index, output in enumerate(outputs):
+                    if output[9] != OP_RETURN:
+                        utxos.append((tx_hash, index))
+
+            header = (struct.pack('<I', 0x20000000) + prev_hash + merkle_root([double_sha256(i) for i in txs])
+                      + struct.pack('<III', self.start_time + 600 * offset, 0x1d00ffff, rng.getrandbits(32)))
+            prev_hash = double_sha256(header)
+            yield height, header + varint(len(txs)) + b''.join(txs)
+
+    def iter_blocks(self) -> Iterator:
+        """
+        按高度依次生成 blockchain_parser 的 Block 对象
+        :return:
+        """
+        from blockchain_parser.block import Block
+        for height, raw in self.iter_raw_blocks():
+            yield Block(raw, height)
+
+    def write_blk_files(self, directory: str, max_file_size: int = 128 * 1024 * 1024) -> List[str]:
+        """
+        按 Bitcoin Core 的格式（魔数 + 区块大小 + 区块数据）写成 blk*.dat 文件，
+        可以通过 blockchain_parser 的 Blockchain(directory).get_unordered_blocks() 读取
+        :param directory: 输出目录
+        :param max_file_size: 单个文件的最大字节数
+        :return: 文件路径列表
+        """
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        f = None
+        for _, raw in self.iter_raw_blocks():
+            if f is None or f.tell() + len(raw) + 8 > max_file_size:
+                if f:
+                    f.close()
+                paths.append(os.path.join(directory, f'blk{len(paths):05d}.dat'))
+                f = open(paths[-1], 'wb')
+            f.write(MAGIC + struct.pack('<I', len(raw)) + raw)
+        if f:
+            f.close()
+        return paths
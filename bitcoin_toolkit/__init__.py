@@ -1,6 +1,28 @@
-from .parser import gen_txo_key, parser_block
+from .parser import (gen_txo_key, parser_block, parser_raw_block, merge_address, merge_output, diff_address_stats,
+                     merge_address_stats, placeholder_spent_txid, parser_block_info)
+from .blocks import BlockIndex
 from .node import Node
-from .engine import FileEngine, RedisEngine
+from .engine import FileEngine, RedisEngine, SqliteEngine
+from .arrow import ArrowEngine, export_arrow
+from .follow import Follower
+from .federated import FederatedEngine
+from .shared import SharedEngine
+from .cluster import AddressClusters
+from .labels import LabelStore
+from .filters import IngestFilter
+from .outpoints import OutpointIndex
 from .trace import Trace
 
 __version__ = '0.0.2'
+
+# 查询服务依赖 http.server ，导入较慢，只在用到时才导入
+_LAZY = {'LockedEngine': 'server', 'Coalescer': 'server', 'TraceServer': 'server'}
+
+
+def __getattr__(name: str):
+    if name in _LAZY:
+        import importlib
+        value = getattr(importlib.import_module(f'.{_LAZY[name]}', __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,400 @@
+from typing import List, Iterable
+from .utils import hash_key, BloomFilter, build_key_filter
+import glob
+import os
+
+# 导出的列式数据，每张表一个目录，目录下是按排序键切分、范围互不重叠的若干分片：
+#     tx/part-00000.arrow               按 txid 排序
+#     txo/part-00000.arrow              按 key 排序（ txid 相同时按 index 的数值排序）
+#     address_output/part-00000.arrow   按地址的哈希排序，每行是一个 (地址, 输出) 对
+#     address_label/part-00000.arrow    按地址的哈希排序，每行是一个 (地址, 标签) 对
+# 每张表额外保存一列定长的排序键（ *_bin / address_hash ），查询时在内存映射的排序键上做 searchsorted
+TABLES = ('tx', 'txo', 'address_output', 'address_label')
+FORMATS = ('arrow', 'parquet')
+
+
+def txo_key_bin(key: str) -> bytes:
+    """
+    txo 的 key 转为 36 字节的排序键（ 32 字节的 txid + 4 字节大端的 index ）
+    :param key: txid,index
+    :return:
+    """
+    txid, index = key.split(',')
+    return bytes.fromhex(txid) + int(index).to_bytes(4, 'big')
+
+
+def _schemas():
+    import pyarrow as pa
+    return {
+        'tx': pa.schema([
+            ('txid_bin', pa.binary(32)),
+            ('txid', pa.string()),
+            ('block_height', pa.int64()),
+            ('is_coinbase', pa.bool_()),
+            ('inputs', pa.list_(pa.string())),
+            ('n_outputs', pa.int64()),
+        ]),
+        'txo': pa.schema([
+            ('key_bin', pa.binary(36)),
+            ('key', pa.string()),
+            ('txid', pa.string()),
+            ('index', pa.int64()),
+            ('value', pa.int64()),
+            ('type', pa.string()),
+            ('addresses', pa.list_(pa.string())),
+            ('spent_txid', pa.string()),
+        ]),
+        'address_output': pa.schema([
+            ('address_hash', pa.uint64()),
+            ('address', pa.string()),
+            ('key', pa.string()),
+        ]),
+        'address_label': pa.schema([
+            ('address_hash', pa.uint64()),
+            ('address', pa.string()),
+            ('label', pa.string()),
+        ]),
+    }
+
+
+def _write_parts(directory: str, name: str, rows: list, fmt: str, rows_per_part: int) -> int:
+    """
+    把排好序的行切分成若干分片写入
+    :param directory: 导出目录
+    :param name: 表名
+    :param rows: 排好序的行（元组，顺序同表结构）
+    :param fmt: arrow/parquet
+    :param rows_per_part: 每个分片的行数
+    :return: 分片数
+    """
+    import pyarrow as pa
+    schema = _schemas()[name]
+    dir_table = os.path.join(directory, name)
+    os.makedirs(dir_table, exist_ok=True)
+    for path in glob.glob(os.path.join(dir_table, 'part-*')):
+        os.remove(path)  # 清理上一次导出的分片
+
+    n_parts, start = 0, 0
+    while start < len(rows):
+        # 排序键相同的行（同一个地址）不能跨分片
+        end = start + rows_per_part
+        while end < len(rows) and rows[end][0] == rows[end - 1][0]:
+            end += 1
+        chunk = rows[start:end]
+        start = end
+        columns = list(zip(*chunk))
+        table = pa.table([pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema)
+        path = os.path.join(dir_table, f'part-{n_parts:05d}.{fmt}')
+        if fmt == 'arrow':
+            with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+                writer.write_table(table)  # 每个分片只有一个 record batch ，读取时可以零拷贝
+        else:
+            import pyarrow.parquet as pq
+            pq.write_table(table, path)
+        n_parts += 1
+    return n_parts
+
+
+def export_arrow(engine, directory: str, fmt: str = 'arrow', rows_per_part: int = 1 << 20) -> dict:
+    """
+    把引擎里的全部数据导出为列式的 Arrow IPC 或 Parquet 文件，
+    引擎需要有 iter_tx/iter_txo/iter_address 方法
+    （ FileEngine 、 RedisEngine 、 SqliteEngine 都支持），导出时需要在内存里排序
+    :param engine: 搜索引擎
+    :param directory: 导出目录
+    :param fmt: arrow （可以内存映射，供 ArrowEngine 使用）或 parquet （体积更小，便于分析）
+    :param rows_per_part: 每个分片的最大行数
+    :return: 每张表的行数与分片数
+    """
+    assert fmt in FORMATS, f'fmt 只能是 {FORMATS} 之一'
+    assert isinstance(rows_per_part, int) and rows_per_part > 0, rows_per_part
+    directory = str(directory)
+    os.makedirs(directory, exist_ok=True)
+
+    rows = {
+        'tx': sorted((bytes.fromhex(i['txid']), i['txid'], i['block_height'], i['is_coinbase'], i['inputs'],
+                      i['n_outputs']) for i in engine.iter_tx()),
+        'txo': sorted((txo_key_bin(i['key']), i['key'], i['txid'], i['index'], i['value'], i['type'], i['addresses'],
+                       i['spent_txid']) for i in engine.iter_txo()),
+        'address_output': [],
+        'address_label': [],
+    }
+    for info in engine.iter_address():
+        address_hash = hash_key(info['address'])
+        rows['address_output'].extend((address_hash, info['address'], key) for key in info['outputs'])
+        rows['address_label'].extend((address_hash, info['address'], label) for label in info['labels'])
+    rows['address_output'].sort()
+    rows['address_label'].sort()
+
+    result = {}
+    for name in TABLES:
+        table_rows = rows.pop(name)
+        result[name] = {'rows': len(table_rows), 'parts': _write_parts(directory, name, table_rows, fmt, rows_per_part)}
+    return result
+
+
+class _SortedTable:
+    """
+    由若干个按排序键切分的分片组成的只读表，排序键为内存映射的 numpy 数组
+    """
+
+    def __init__(self, directory: str, name: str, key_column: str):
+        """
+        :param directory: 导出目录
+        :param name: 表名
+        :param key_column: 排序键的列名（定长二进制或 uint64 ）
+        """
+        import numpy as np
+        import pyarrow as pa
+        self.parts = []  # [(arrow 表, 排序键数组), ...]
+        paths = sorted(glob.glob(os.path.join(directory, name, 'part-*')))
+        for path in paths:
+            if path.endswith('.arrow'):
+                table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+            else:
+                import pyarrow.parquet as pq
+                table = pq.read_table(path, memory_map=True)
+            column = table.column(key_column).combine_chunks()
+            if pa.types.is_fixed_size_binary(column.type):
+                width = column.type.byte_width
+                keys = np.frombuffer(column.buffers()[1], dtype=f'S{width}', count=len(column),
+                                     offset=column.offset * width)
+            else:
+                keys = column.to_numpy(zero_copy_only=True)
+            if len(keys):
+                self.parts.append((table, keys))
+        # 每个分片的第一个排序键，用来定位分片（单个元素会去掉末尾的 0 字节，需要指定与排序键相同的类型，
+        # 否则查询时按 bounds 的宽度截断的 key 会匹配到别的行）
+        self.bounds = np.array([keys[0] for _, keys in self.parts], dtype=self.parts[0][1].dtype) \
+            if self.parts else None
+
+    def __len__(self):
+        return sum(len(keys) for _, keys in self.parts)
+
+    def search(self, keys, unique: bool = True):
+        """
+        向量化地查找排序键
+        :param keys: 排好序或未排序的 numpy 数组
+        :param unique: 排序键是否唯一，唯一时返回每个 key 所在的行，否则返回每个 key 对应的行范围
+        :return: [(分片序号, key 的位置数组, 行起始数组, 行结束数组), ...] ，找不到的 key 不会出现在结果里
+        """
+        import numpy as np
+        if not self.parts or not len(keys):
+            return []
+        part_ids = np.searchsorted(self.bounds, keys, side='right') - 1
+        result = []
+        for part_id in np.unique(part_ids):
+            if part_id < 0:
+                continue  # 比第一个排序键还小
+            positions = np.nonzero(part_ids == part_id)[0]
+            part_keys = self.parts[part_id][1]
+            query = keys[positions]
+            starts = np.searchsorted(part_keys, query, side='left')
+            ends = np.searchsorted(part_keys, query, side='right') if not unique else starts + 1
+            found = (starts < len(part_keys)) & (part_keys[np.minimum(starts, len(part_keys) - 1)] == query)
+            if found.any():
+                result.append((int(part_id), positions[found], starts[found], ends[found]))
+        return result
+
+    def take(self, part_id: int, rows, columns: List[str]) -> List[dict]:
+        """
+        取出某个分片的若干行
+        :param part_id: 分片序号
+        :param rows: 行号数组
+        :param columns: 需要的列
+        :return:
+        """
+        return self.parts[part_id][0].select(columns).take(rows).to_pylist()
+
+
+class ArrowEngine:
+    """
+    基于 export_arrow 导出的 Arrow IPC 文件的只读搜索引擎，数据通过内存映射读取，多个进程可以共享同一份页缓存；
+    批量查询在排好序的排序键上用 numpy 的 searchsorted 向量化地查找（也支持 Parquet 文件，但需要读入内存）
+    """
+
+    TX_COLUMNS = ['txid', 'block_height', 'is_coinbase', 'inputs', 'n_outputs']
+    TXO_COLUMNS = ['key', 'txid', 'index', 'value', 'type', 'addresses', 'spent_txid']
+
+    def __init__(self, directory: str):
+        """
+        :param directory: export_arrow 的导出目录
+        """
+        directory = str(directory)
+        assert os.path.exists(directory), f'路径 {directory} 不存在'
+        self.directory = directory
+        self.tx = _SortedTable(directory, 'tx', 'txid_bin')
+        self.txo = _SortedTable(directory, 'txo', 'key_bin')
+        self.address_output = _SortedTable(directory, 'address_output', 'address_hash')
+        self.address_label = _SortedTable(directory, 'address_label', 'address_hash')
+        self.output_filter = None  # 有真实数据的输出 key 的布隆过滤器，见 self.get_output_filter
+
+    def __lookup(self, table: _SortedTable, keys: list, columns: List[str]) -> list:
+        """
+        按唯一的排序键批量查询
+        :param table:
+        :param keys: 排序键列表
+        :param columns: 需要返回的列
+        :return: 与 keys 一一对应的结果，找不到时为 None
+        """
+        import numpy as np
+        result = [None] * len(keys)
+        width = table.bounds.dtype.itemsize if table.parts else 1
+        for part_id, positions, starts, _ in table.search(np.array(keys, dtype=f'S{width}')):
+            for position, info in zip(positions.tolist(), table.take(part_id, starts, columns)):
+                result[position] = info
+        return result
+
+    def __group(self, table: _SortedTable, addresses: list, column: str) -> list:
+        """
+        按地址批量查询一对多的表
+        :param table:
+        :param addresses:
+        :param column: 需要返回的列
+        :return: 与 addresses 一一对应的值列表，找不到时为空列表
+        """
+        import numpy as np
+        result = [[] for _ in addresses]
+        hashes = np.array([hash_key(i) for i in addresses], dtype=np.uint64)
+        for part_id, positions, starts, ends in table.search(hashes, unique=False):
+            rows = np.concatenate([np.arange(s, e) for s, e in zip(starts.tolist(), ends.tolist())])
+            owners = np.repeat(positions, ends - starts)
+            for position, info in zip(owners.tolist(), table.take(part_id, rows, ['address', column])):
+                if info['address'] == addresses[position]:  # 排除哈希冲突
+                    result[position].append(info[column])
+        return result
+
+    def get_address(self, address: str) -> dict:
+        """
+        获取单个地址详情，详情内容请见 FileEngine.get_address
+        :param address:
+        :return:
+        """
+        if isinstance(address, str):
+            return self.batch_get_address([address])[0]
+        return {}
+
+    def batch_get_address(self, addresses: List[str]) -> List[dict]:
+        """
+        批量获取地址详情，详情内容请见 FileEngine.get_address
+        :param addresses:
+        :return:
+        """
+        addresses = list(addresses)
+        outputs = self.__group(self.address_output, addresses, 'key')
+        labels = self.__group(self.address_label, addresses, 'label')
+        return [{'address': address, 'outputs': keys, 'labels': label} if keys or label else None
+                for address, keys, label in zip(addresses, outputs, labels)]
+
+    def get_tx(self, txid: str) -> dict:
+        """
+        获取单个交易详情，详情内容请见 FileEngine.get_tx
+        :param txid:
+        :return:
+        """
+        if isinstance(txid, str):
+            return self.batch_get_tx([txid])[0]
+        return {}
+
+    def batch_get_tx(self, txids: List[str]) -> List[dict]:
+        """
+        批量获取交易详情，详情内容请见 FileEngine.get_tx
+        :param txids:
+        :return:
+        """
+        return self.__lookup(self.tx, [bytes.fromhex(i) for i in txids], self.TX_COLUMNS)
+
+    def get_txo(self, key: str) -> dict:
+        """
+        获取单个 txo 详情，详情内容请见 FileEngine.get_txo
+        :param key:
+        :return:
+        """
+        if isinstance(key, str):
+            return self.batch_get_txo([key])[0]
+        return {}
+
+    def batch_get_txo(self, keys: List[str]) -> List[dict]:
+        """
+        批量获取 txo 详情，详情内容请见 FileEngine.get_txo
+        :param keys:
+        :return:
+        """
+        return self.__lookup(self.txo, [txo_key_bin(i) for i in keys], self.TXO_COLUMNS)
+
+    def iter_address(self, batch_size: int = 1000) -> Iterable[dict]:
+        """
+        遍历所有地址详情，包括只有标签、没有输出的地址
+        :param batch_size: 每批补充标签的地址数
+        :return:
+        """
+        def fill_labels(infos):
+            if len(self.address_label):
+                labels = self.__group(self.address_label, [i['address'] for i in infos], 'label')
+                for info, label in zip(infos, labels):
+                    info['labels'] = label
+            return infos
+
+        buffer, info = [], None
+        for table, _ in self.address_output.parts:
+            for batch in table.select(['address', 'key']).to_batches():
+                for address, key in zip(batch.column(0).to_pylist(), batch.column(1).to_pylist()):
+                    if info is None or info['address'] != address:
+                        info = {'address': address, 'outputs': [], 'labels': []}
+                        buffer.append(info)
+                        if len(buffer) > batch_size:
+                            yield from fill_labels(buffer[:-1])
+                            buffer = buffer[-1:]
+                    info['outputs'].append(key)
+        yield from fill_labels(buffer)
+        yield from self.__iter_label_only_address(batch_size)
+
+    def __iter_label_only_address(self, batch_size: int) -> Iterable[dict]:
+        """
+        遍历只有标签、没有输出的地址（ address_output 表里没有这些地址）
+        :param batch_size: 每批查询输出的地址数
+        :return:
+        """
+        def flush(labels):
+            outputs = self.__group(self.address_output, list(labels), 'key')
+            for (address, label), keys in zip(labels.items(), outputs):
+                if not keys:
+                    yield {'address': address, 'outputs': [], 'labels': label}
+
+        labels = {}  # 地址 -> 标签列表，同一个地址的标签在表里是相邻的
+        for table, _ in self.address_label.parts:
+            for batch in table.select(['address', 'label']).to_batches():
+                for address, label in zip(batch.column(0).to_pylist(), batch.column(1).to_pylist()):
+                    if address not in labels and len(labels) >= batch_size:
+                        yield from flush(labels)
+                        labels = {}
+                    labels.setdefault(address, []).append(label)
+        if labels:
+            yield from flush(labels)
+
+    def iter_tx(self) -> Iterable[dict]:
+        """
+        遍历所有交易详情
+        :return:
+        """
+        for table, _ in self.tx.parts:
+            yield from table.select(self.TX_COLUMNS).to_pylist()
+
+    def iter_txo(self) -> Iterable[dict]:
+        """
+        遍历所有输出详情
+        :return:
+        """
+        for table, _ in self.txo.parts:
+            yield from table.select(self.TXO_COLUMNS).to_pylist()
+
+    def get_output_filter(self) -> BloomFilter:
+        """
+        有真实数据的输出 key 的布隆过滤器（见 FileEngine.get_output_filter ），第一次调用时建立
+        :return:
+        """
+        if self.output_filter is None:
+            keys = (info['key'] for table, _ in self.txo.parts
+                    for info in table.select(['key', 'type']).to_pylist() if info['type'] is not None)
+            self.output_filter = build_key_filter(keys, len(self.txo))
+        return self.output_filter
@@ -0,0 +1,121 @@
+from typing import Iterable, Iterator, Tuple
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from array import array
+
+
+def to_timestamp(t) -> int:
+    """
+    把时间转换为 unix 时间戳（秒）
+    :param t: unix 时间戳，或 datetime （没有时区的按 UTC 处理，与 blockchain_parser 的区块时间一致）
+    :return:
+    """
+    if isinstance(t, datetime):
+        if t.tzinfo is None:
+            t = t.replace(tzinfo=timezone.utc)
+        return int(t.timestamp())
+    assert isinstance(t, (int, float)), t
+    return int(t)
+
+
+class BlockIndex:
+    """
+    按高度排序的区块时间索引，用于把时间范围转换为高度范围。
+    区块时间并不严格递增（只要求大于前 11 个区块时间的中位数），因此同时保存到每个高度为止的最大时间，
+    它是单调不减的，可以直接二分查找
+    """
+
+    def __init__(self):
+        self.heights = array('q')  # 升序的区块高度
+        self.timestamps = array('q')  # 与高度一一对应的区块时间
+        self.max_timestamps = array('q')  # 到该高度为止的最大区块时间
+
+    @classmethod
+    def from_items(cls, items: Iterable[Tuple[int, int]]) -> 'BlockIndex':
+        """
+        由 (高度, 区块时间) 一次性建立索引
+        :param items: 不需要排好序，高度重复时保留后面的
+        :return:
+        """
+        index = cls()
+        for height, timestamp in sorted(dict(items).items()):
+            index.heights.append(height)
+            index.timestamps.append(timestamp)
+        index.__refresh(0)
+        return index
+
+    def __refresh(self, start: int):
+        """
+        从 start 开始重新计算最大区块时间
+        :param start:
+        :return:
+        """
+        del self.max_timestamps[start:]
+        current = self.max_timestamps[-1] if self.max_timestamps else None
+        for timestamp in self.timestamps[start:]:
+            current = timestamp if current is None else max(current, timestamp)
+            self.max_timestamps.append(current)
+
+    def add(self, height: int, timestamp: int):
+        """
+        添加一个区块（按高度顺序添加时不需要移动数据）
+        :param height:
+        :param timestamp: unix 时间戳（秒）
+        :return:
+        """
+        i = bisect_left(self.heights, height)
+        if i < len(self.heights) and self.heights[i] == height:
+            self.timestamps[i] = timestamp
+        else:
+            self.heights.insert(i, height)
+            self.timestamps.insert(i, timestamp)
+        self.__refresh(i)
+
+    def remove(self, height: int):
+        """
+        删除一个区块（回滚时使用），不存在时忽略
+        :param height:
+        :return:
+        """
+        i = bisect_left(self.heights, height)
+        if i < len(self.heights) and self.heights[i] == height:
+            del self.heights[i]
+            del self.timestamps[i]
+            self.__refresh(i)
+
+    def get_timestamp(self, height: int) -> int:
+        """
+        区块时间
+        :param height:
+        :return: 没有该区块时返回 None
+        """
+        i = bisect_left(self.heights, height)
+        if i < len(self.heights) and self.heights[i] == height:
+            return self.timestamps[i]
+        return None
+
+    def height_range(self, start_time=None, end_time=None) -> Tuple[int, int]:
+        """
+        时间范围 [start_time, end_time] 对应的高度范围
+        :param start_time: 开始时间（ unix 时间戳或 datetime ），为空时不限制
+        :param end_time: 结束时间，为空时不限制
+        :return: (最低高度, 最高高度) ，范围内没有区块时返回 None
+        """
+        lo, hi = 0, len(self.heights)
+        if start_time is not None:
+            lo = bisect_left(self.max_timestamps, to_timestamp(start_time))
+        if end_time is not None:
+            hi = bisect_right(self.max_timestamps, to_timestamp(end_time))
+        if lo >= hi:
+            return None
+        return self.heights[lo], self.heights[hi - 1]
+
+    def items(self) -> Iterator[Tuple[int, int]]:
+        """
+        按高度遍历所有区块
+        :return: (高度, 区块时间) 的生成器
+        """
+        return zip(self.heights, self.timestamps)
+
+    def __len__(self) -> int:
+        return len(self.heights)
@@ -0,0 +1,374 @@
+"""
+命令行工具，安装后通过 bitcoin-toolkit 调用（也可以 python -m bitcoin_toolkit.cli ）：
+
+    bitcoin-toolkit ingest --engine redis --dir-blocks ~/.bitcoin/blocks \\
+        --min-height 575012 --max-height 575300
+    bitcoin-toolkit trace --engine redis --seeds seeds.txt --depth 4 \\
+        --workers 8 --output result.jsonl
+    bitcoin-toolkit export --engine sqlite --sqlite btc.sqlite \\
+        --output arrow_dir
+
+运行时在标准错误输出里刷新吞吐量（区块/秒、交易/秒、查询 key/秒）与峰值内存，结束时输出一行 json 格式的汇总
+"""
+from typing import Iterator, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import threading
+import argparse
+import json
+import time
+import csv
+import sys
+
+ENGINES = ('file', 'redis', 'sqlite', 'arrow')
+
+
+def peak_rss() -> int:
+    """
+    当前进程的峰值常驻内存（字节）
+    :return:
+    """
+    try:
+        import resource
+    except ImportError:  # windows 没有 resource 模块
+        import psutil
+        return psutil.Process().memory_info().peak_wset
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # macOS 的单位是字节，linux 是 KB
+
+
+class Progress:
+    """
+    吞吐量统计：累计各项计数，每隔 interval 秒在标准错误输出里刷新一行（标准输出留给结果），可以在多个线程里更新
+    """
+
+    def __init__(self, interval: float = 1.0, stream=None, enabled: bool = True):
+        """
+        :param interval: 刷新间隔（秒）
+        :param stream: 输出流，默认为标准错误输出
+        :param enabled: 为假时只统计不输出
+        """
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        self.enabled = enabled
+        self.counters = {}  # 名称 -> 累计数
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.last_show = self.start
+
+    def add(self, **counts):
+        """
+        累加计数，距离上次刷新超过 interval 秒时刷新一次
+        :param counts: 名称 -> 增量，例如 blocks=1, txs=2000
+        :return:
+        """
+        with self.lock:
+            for name, n in counts.items():
+                self.counters[name] = self.counters.get(name, 0) + n
+            now = time.perf_counter()
+            if self.enabled and now - self.last_show >= self.interval:
+                self.last_show = now
+                self.stream.write(self.format() + '\r')
+                self.stream.flush()
+
+    def summary(self) -> dict:
+        """
+        各项计数、每秒速率、耗时与峰值内存
+        :return:
+        """
+        seconds = time.perf_counter() - self.start
+        result = {}
+        for name, n in self.counters.items():
+            result[name] = n
+            result[f'{name}_per_second'] = n / seconds if seconds else None
+        result['seconds'] = seconds
+        result['peak_rss_bytes'] = peak_rss()
+        return result
+
+    def format(self) -> str:
+        """
+        单行的进度文本
+        :return:
+        """
+        seconds = max(time.perf_counter() - self.start, 1e-9)
+        parts = [f'{name} {n} ({n / seconds:.1f}/s)' for name, n in self.counters.items()]
+        parts.append(f'{seconds:.1f}s')
+        parts.append(f'peak RSS {peak_rss() / 1024 / 1024:.1f} MB')
+        return ' | '.join(parts)
+
+    def finish(self, **extra) -> dict:
+        """
+        输出最后的进度与 json 格式的汇总
+        :param extra: 附加到汇总里的信息
+        :return: 汇总
+        """
+        result = dict(self.summary(), **extra)
+        if self.enabled:
+            self.stream.write(self.format() + '\n')
+            self.stream.write(json.dumps(result, ensure_ascii=False) + '\n')
+            self.stream.flush()
+        return result
+
+
+def count_blocks(engine, progress: Progress):
+    """
+    替换引擎的写入函数（ RedisEngine 为 from_blocks ，其他引擎为 from_block ），每写入一批区块就更新一次进度
+    :param engine:
+    :param progress:
+    :return:
+    """
+    name = 'from_blocks' if hasattr(engine, 'from_blocks') else 'from_block'
+    func = getattr(engine, name)
+
+    def n_txs(block) -> int:
+        n = getattr(block, 'n_transactions', None)  # 只读取区块头后面的交易数，不用解析交易
+        return n if n is not None else len(block.transactions)
+
+    if name == 'from_blocks':
+        def wrapper(blocks):
+            blocks = list(blocks)
+            result = func(blocks)
+            progress.add(blocks=len(blocks), txs=sum(n_txs(i) for i in blocks))
+            return result
+    else:
+        def wrapper(block):
+            result = func(block)
+            progress.add(blocks=1, txs=n_txs(block))
+            return result
+
+    setattr(engine, name, wrapper)  # 与 outpoints.OutpointIndex.build 一样覆盖实例上的函数
+
+
+def add_engine_args(parser: argparse.ArgumentParser, engines: Tuple[str, ...] = ENGINES):
+    """
+    添加选择与创建引擎的参数
+    :param parser:
+    :param engines: 可选的引擎
+    :return:
+    """
+    group = parser.add_argument_group('引擎')
+    group.add_argument('--engine', choices=engines, default=engines[0], help='搜索引擎')
+    group.add_argument('--dir-blocks', default=None, help='全节点下 blocks 目录的路径（ file 引擎与导入时需要）')
+    group.add_argument('--min-height', type=int, default=None, help='最低的区块高度')
+    group.add_argument('--max-height', type=int, default=None, help='最高的区块高度，为空时读取到最新的区块')
+    group.add_argument('--index-cache', default=None, help='区块索引的缓存路径，建议设置')
+    group.add_argument('--outpoints', default=None, help='OutpointIndex.build 生成的目录，导入时补全区块范围之前的输出')
+    group.add_argument('--redis-host', default='localhost')
+    group.add_argument('--redis-port', type=int, default=6379)
+    group.add_argument('--redis-db', type=int, default=0)
+    group.add_argument('--layout', choices=('flat', 'grouped'), default=None, help='redis 的数据布局，为空时沿用数据库里的')
+    group.add_argument('--sqlite', default=None, help='sqlite 数据库文件路径')
+    group.add_argument('--arrow', default=None, help='export_arrow 的导出目录（ arrow 引擎）')
+
+
+def create_engine(args: argparse.Namespace):
+    """
+    根据参数创建引擎（ file 引擎只创建，还没有读取数据）
+    :param args:
+    :return:
+    """
+    from . import FileEngine, RedisEngine, SqliteEngine, ArrowEngine
+    if args.engine == 'file':
+        assert args.dir_blocks, 'file 引擎需要 --dir-blocks'
+        engine = FileEngine(args.dir_blocks, args.min_height, args.max_height, args.index_cache)
+    elif args.engine == 'redis':
+        engine = RedisEngine(args.redis_host, args.redis_port, args.redis_db, layout=args.layout)
+    elif args.engine == 'sqlite':
+        assert args.sqlite, 'sqlite 引擎需要 --sqlite'
+        engine = SqliteEngine(args.sqlite)
+    else:
+        assert args.arrow, 'arrow 引擎需要 --arrow'
+        engine = ArrowEngine(args.arrow)
+    if args.outpoints and hasattr(engine, 'outpoint_index'):
+        from . import OutpointIndex
+        engine.outpoint_index = OutpointIndex(args.outpoints)
+    return engine
+
+
+def ingest(engine, args: argparse.Namespace, progress: Progress):
+    """
+    导入区块，各引擎的导入方法见 FileEngine.read_data 、 RedisEngine.write_data 、
+    SqliteEngine.write_data
+    :param engine:
+    :param args:
+    :param progress:
+    :return:
+    """
+    workers = getattr(args, 'workers', 1)
+    if args.engine == 'file':
+        count_blocks(engine, progress)
+        engine.read_data()
+    elif args.engine == 'redis' and workers > 1:
+        # 并行导入在子进程里写入，只能按完成的区间统计
+        assert args.min_height is not None and args.max_height is not None, '并行导入需要指定 --min-height 与 --max-height'
+        engine.parallel_write_data(args.dir_blocks, args.min_height, args.max_height, args.index_cache,
+                                   resume=args.resume, batch_blocks=args.batch_blocks or 10, workers=workers)
+        progress.add(blocks=args.max_height - args.min_height + 1)
+    else:
+        assert args.engine in ('redis', 'sqlite'), f'{args.engine} 引擎不支持导入'
+        assert args.dir_blocks, '导入需要 --dir-blocks'
+        count_blocks(engine, progress)
+        kwargs = {'batch_blocks': args.batch_blocks} if args.batch_blocks else {}
+        if args.engine == 'redis':
+            kwargs['resume'] = args.resume
+        engine.write_data(args.dir_blocks, args.min_height, args.max_height, args.index_cache, **kwargs)
+
+
+def iter_seeds(path: str = None, txids: list = None, addresses: list = None) -> Iterator[Tuple[str, str]]:
+    """
+    读取追溯的起点，文件里每行一个 txid 或地址（ 64 位十六进制的为 txid ），忽略空行与 # 开头的行
+    :param path: 起点文件，为 - 时从标准输入读取
+    :param txids:
+    :param addresses:
+    :return: ('txid' 或 'address', 值) 的生成器
+    """
+    for txid in txids or []:
+        yield 'txid', txid
+    for address in addresses or []:
+        yield 'address', address
+    if not path:
+        return
+    f = sys.stdin if path == '-' else open(path, encoding='utf-8')
+    try:
+        for line in f:
+            seed = line.strip()
+            if not seed or seed.startswith('#'):
+                continue
+            is_txid = len(seed) == 64 and all(c in '0123456789abcdefABCDEF' for c in seed)
+            yield ('txid', seed.lower()) if is_txid else ('address', seed)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def run_trace(engine, kind: str, seed: str, args: argparse.Namespace, progress: Progress) -> dict:
+    """
+    追溯一个起点
+    :return: {"seed": 起点, "result": 追溯结果（见 Trace.to_dict ）, "seconds": 耗时}
+    """
+    from . import Trace
+    start = time.perf_counter()
+    trace = Trace(args.min_height or 0, args.max_height, max_depth=args.depth, **{f'init_{kind}': seed})
+    trace.set_search_engine(engine)
+    trace.enable_metrics(lambda event, data: progress.add(lookups=data['keys']) if event == 'call' else None)
+    trace.start()
+    progress.add(seeds=1, edges=len(trace.edges))
+    return {'seed': seed, 'result': trace.to_dict(), 'seconds': time.perf_counter() - start}
+
+
+def trace(engine, args: argparse.Namespace, progress: Progress) -> dict:
+    """
+    在线程池里追溯所有起点，按起点的顺序写出结果；超过时间预算后不再开始新的起点
+    :return: 附加到汇总里的信息
+    """
+    output = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+    writer = csv.writer(output) if args.format == 'csv' else None
+    if writer:
+        writer.writerow(['seed', 'from', 'to', 'value'])
+    deadline = time.perf_counter() + args.budget if args.budget else None
+    n_failed, n_skipped = 0, 0
+
+    def write(future, seed):
+        nonlocal n_failed
+        try:
+            line = future.result()
+        except Exception as e:
+            n_failed += 1
+            line = {'seed': seed, 'error': f'{type(e).__name__}: {e}'}
+        if writer:
+            for u, v, w in line.get('result', {}).get('edges', []):
+                writer.writerow([line['seed'], u, v, w])
+        else:
+            output.write(json.dumps(line, ensure_ascii=False) + '\n')
+
+    futures = deque()  # 按提交顺序排列的 (future, 起点)
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            for kind, seed in iter_seeds(args.seeds, args.txid, args.address):
+                if deadline is not None and time.perf_counter() > deadline:
+                    n_skipped += 1
+                    continue
+                # 限制同时排队的起点数，起点很多时不会一次性全部提交；
+                # 结果按提交顺序写出，输出与线程完成的先后无关
+                while len(futures) >= 2 * args.workers:
+                    write(*futures.popleft())
+                futures.append((executor.submit(run_trace, engine, kind, seed, args, progress), seed))
+            while futures:
+                write(*futures.popleft())
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return {'failed': n_failed, 'skipped': n_skipped}
+
+
+def run(argv: list = None) -> dict:
+    """
+    运行命令
+    :param argv: 命令行参数，为空时读取 sys.argv
+    :return: 汇总，见 Progress.finish
+    """
+    parser = argparse.ArgumentParser(prog='bitcoin-toolkit', description='bitcoin_toolkit 命令行工具')
+    parser.add_argument('--quiet', action='store_true', help='不输出进度与汇总')
+    parser.add_argument('--progress-interval', type=float, default=1.0, help='进度刷新间隔（秒）')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    # 导入
+    sub = subparsers.add_parser('ingest', help='导入区块到 redis/sqlite （ file 引擎只读取到内存，用于测试吞吐量）')
+    add_engine_args(sub, ('redis', 'sqlite', 'file'))
+    sub.add_argument('--workers', type=int, default=1, help='redis 并行导入的进程数')
+    sub.add_argument('--batch-blocks', type=int, default=None, help='每次写入的区块数')
+    sub.add_argument('--resume', action='store_true', help='跳过已经导入过的区块（ redis ）')
+
+    # 追溯
+    sub = subparsers.add_parser('trace', help='批量追溯')
+    add_engine_args(sub, ('redis', 'sqlite', 'arrow', 'file'))
+    sub.add_argument('--seeds', default=None, help='起点文件，每行一个 txid 或地址，为 - 时从标准输入读取')
+    sub.add_argument('--txid', action='append', default=[], help='起点 txid ，可以重复')
+    sub.add_argument('--address', action='append', default=[], help='起点地址，可以重复')
+    sub.add_argument('--depth', type=int, default=3, help='追溯深度')
+    sub.add_argument('--budget', type=float, default=None, help='时间预算（秒），超过后不再开始新的起点')
+    sub.add_argument('--workers', type=int, default=4, help='同时追溯的起点数')
+    sub.add_argument('--format', choices=('jsonl', 'csv'), default='jsonl',
+                     help='jsonl 每行一个起点的完整结果， csv 每行一条边')
+    sub.add_argument('--output', default=None, help='结果输出路径，默认为标准输出')
+
+    # 导出
+    sub = subparsers.add_parser('export', help='导出为列式文件，见 export_arrow')
+    add_engine_args(sub, ('redis', 'sqlite', 'file'))
+    sub.add_argument('--output', required=True, help='导出目录')
+    sub.add_argument('--format', choices=('arrow', 'parquet'), default='arrow')
+    sub.add_argument('--rows-per-part', type=int, default=1 << 20, help='每个分片的最大行数')
+
+    args = parser.parse_args(argv)
+    progress = Progress(args.progress_interval, enabled=not args.quiet)
+    try:
+        engine = create_engine(args)
+        extra = {'command': args.command, 'engine': args.engine}
+        if args.command == 'ingest':
+            ingest(engine, args, progress)
+        elif args.command == 'trace':
+            assert args.seeds or args.txid or args.address, '需要 --seeds 、 --txid 或 --address'
+            assert isinstance(args.workers, int) and args.workers > 0, args.workers
+            if args.engine == 'file':
+                ingest(engine, args, progress)
+            extra.update(trace(engine, args, progress))
+        else:
+            from .arrow import export_arrow
+            if args.engine == 'file':
+                ingest(engine, args, progress)
+            extra['tables'] = export_arrow(engine, args.output, args.format, args.rows_per_part)
+    except AssertionError as e:
+        parser.error(str(e))
+    return progress.finish(**extra)
+
+
+def main():
+    """
+    console_scripts 的入口（返回值会作为退出码，因此不返回汇总）
+    """
+    run()
+
+
+if __name__ == '__main__':
+    main()
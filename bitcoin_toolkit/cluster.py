@@ -0,0 +1,282 @@
+from typing import Iterator, List
+from collections import Counter
+from bisect import bisect_left, bisect_right
+from array import array
+from .parser import gen_txo_key
+from .utils import hash_key
+import struct
+import mmap
+import sys
+import os
+
+# 聚类文件的布局（所有整数都是本机字节序的 64 位无符号整数）：
+#     magic（ 8 字节）
+#     [地址数 n, 簇数 m, 参与聚类的交易数, 疑似 coinjoin 而跳过的交易数]
+#     按哈希排序的地址哈希数组（ n 个）、与之对应的行号数组（ n 个）
+#     每个簇的起始行号数组（ m + 1 个，同一个簇的地址是连续的行）
+#     每行地址的起始偏移数组（ n + 1 个）、拼接起来的地址字符串
+# 查询时对哈希数组做二分查找，再比对地址排除哈希冲突，行号所在的区间就是簇 id
+MAGIC = b'BTKCLU01'
+_HEADER = struct.Struct('=4Q')
+
+
+def looks_like_coinjoin(n_input_addresses: int, output_values: List[int], min_equal_outputs: int = 2) -> bool:
+    """
+    是否疑似 coinjoin 交易：有至少 min_equal_outputs 笔金额相同的输出，且输入地址数不少于这些输出的笔数
+    （多个参与者各自出资、各自收到一笔相同金额的输出），这类交易的输入不属于同一个人
+    :param n_input_addresses: 不同的输入地址数
+    :param output_values: 各笔输出的金额
+    :param min_equal_outputs: 相同金额的输出至少有几笔
+    :return:
+    """
+    counter = Counter(i for i in output_values if i)
+    if not counter:
+        return False
+    n_equal = counter.most_common(1)[0][1]
+    return n_equal >= min_equal_outputs and n_input_addresses >= n_equal
+
+
+class _UnionFind:
+    """
+    基于数组的并查集（按大小合并 + 路径减半），每个元素只占 16 字节
+    """
+
+    def __init__(self):
+        self.parent = array('q')
+        self.size = array('q')
+
+    def add(self) -> int:
+        self.parent.append(len(self.parent))
+        self.size.append(1)
+        return len(self.parent) - 1
+
+    def find(self, x: int) -> int:
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, a: int, b: int):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+
+
+class AddressClusters:
+    """
+    基于共同输入启发式的地址聚类：同一笔交易（coinjoin 除外）的所有输入地址属于同一个人。
+    通过 build 遍历一次引擎的所有交易建立聚类，save 保存到文件后可以通过 load 以内存映射的方式加载。
+    只保存至少包含 2 个地址的簇，其他地址查不到簇 id
+    """
+
+    def __init__(self, buf):
+        """
+        :param buf: 聚类数据，见 build 与 load
+        """
+        self.buf = memoryview(buf)
+        assert bytes(self.buf[:len(MAGIC)]) == MAGIC, '不是由 AddressClusters 生成的聚类数据'
+        self.n_addresses, self.n_clusters, self.n_txs, self.n_coinjoin = _HEADER.unpack_from(self.buf, len(MAGIC))
+        n, m = self.n_addresses, self.n_clusters
+        offset = len(MAGIC) + _HEADER.size
+        self.hashes, offset = self.buf[offset:offset + 8 * n].cast('Q'), offset + 8 * n
+        self.rows, offset = self.buf[offset:offset + 8 * n].cast('Q'), offset + 8 * n
+        self.starts, offset = self.buf[offset:offset + 8 * (m + 1)].cast('Q'), offset + 8 * (m + 1)
+        self.offsets, offset = self.buf[offset:offset + 8 * (n + 1)].cast('Q'), offset + 8 * (n + 1)
+        self.data = self.buf[offset:]
+        self.file = None
+
+    @classmethod
+    def build(cls,
+              engine,
+              min_equal_outputs: int = 2,
+              batch_size: int = 10000,
+              show_progress: bool = False) -> 'AddressClusters':
+        """
+        遍历引擎的所有交易建立聚类，交易按批查询输入（以及可能是 coinjoin 的交易的输出）的详情
+        :param engine: 搜索引擎，需要有 iter_tx 与 batch_get_txo 方法
+        :param min_equal_outputs: 判断 coinjoin 的参数，见 looks_like_coinjoin
+        :param batch_size: 每批处理的交易数
+        :param show_progress: 是否显示进度
+        :return:
+        """
+        assert hasattr(engine, 'iter_tx'), 'engine 需要有 iter_tx 方法'
+        assert hasattr(engine, 'batch_get_txo'), 'engine 需要有 batch_get_txo 方法'
+        assert isinstance(min_equal_outputs, int) and min_equal_outputs > 1, min_equal_outputs
+        assert isinstance(batch_size, int) and batch_size > 0, batch_size
+
+        dict_id, uf = {}, _UnionFind()  # 地址 -> 并查集里的序号
+        stats = [0, 0]  # 参与聚类的交易数，跳过的交易数
+
+        def union_batch(txs: List[dict]):
+            keys = [key for tx in txs for key in tx['inputs']]
+            dict_txo = {key: info for key, info in zip(keys, engine.batch_get_txo(keys)) if info}
+            candidates = []  # (交易, 输入地址)
+            for tx in txs:
+                addresses = []
+                for key in tx['inputs']:
+                    info = dict_txo.get(key)
+                    # 多签与数据缺失的输入不参与聚类
+                    if info and len(info['addresses']) == 1 and info['addresses'][0] not in addresses:
+                        addresses.append(info['addresses'][0])
+                if len(addresses) > 1:
+                    candidates.append((tx, addresses))
+
+            # 输入地址数与输出数都足够多时才可能是 coinjoin ，只为这些交易查询输出
+            keys = [gen_txo_key(tx['txid'], i) for tx, addresses in candidates
+                    if len(addresses) >= min_equal_outputs and tx['n_outputs'] >= min_equal_outputs
+                    for i in range(tx['n_outputs'])]
+            dict_txo = {key: info for key, info in zip(keys, engine.batch_get_txo(keys)) if info}
+            for tx, addresses in candidates:
+                if len(addresses) >= min_equal_outputs and tx['n_outputs'] >= min_equal_outputs:
+                    values = [dict_txo.get(gen_txo_key(tx['txid'], i), {}).get('value')
+                              for i in range(tx['n_outputs'])]
+                    if looks_like_coinjoin(len(addresses), values, min_equal_outputs):
+                        stats[1] += 1
+                        continue
+                ids = []
+                for address in addresses:
+                    if address not in dict_id:
+                        dict_id[address] = uf.add()
+                    ids.append(dict_id[address])
+                for i in ids[1:]:
+                    uf.union(ids[0], i)
+                stats[0] += 1
+
+        batch = []
+        for index, tx in enumerate(engine.iter_tx(), 1):
+            if tx and not tx['is_coinbase'] and len(tx['inputs']) > 1:
+                batch.append(tx)
+                if len(batch) >= batch_size:
+                    union_batch(batch)
+                    batch = []
+            if show_progress and index % batch_size == 0:
+                sys.stdout.write(f'已遍历 {index} 笔交易，{len(dict_id)} 个地址\r')
+                sys.stdout.flush()
+        if batch:
+            union_batch(batch)
+        return cls(cls.__serialize(dict_id, uf, *stats))
+
+    @staticmethod
+    def __serialize(dict_id: dict, uf: _UnionFind, n_txs: int, n_coinjoin: int) -> bytes:
+        """
+        把并查集按簇整理成紧凑的聚类数据（簇 id 按簇里最早出现的地址排序）
+        :return:
+        """
+        dict_members = {}  # 根 -> [地址, ...] ，字典保持了插入顺序
+        for address, i in dict_id.items():
+            root = uf.find(i)
+            if uf.size[root] > 1:
+                dict_members.setdefault(root, []).append(address)
+
+        addresses, starts = [], array('Q', [0])
+        for members in dict_members.values():
+            addresses.extend(members)
+            starts.append(len(addresses))
+        payloads = [i.encode() for i in addresses]
+        offsets, position = array('Q', [0]), 0
+        for payload in payloads:
+            position += len(payload)
+            offsets.append(position)
+        index = sorted((hash_key(address), row) for row, address in enumerate(addresses))
+
+        return b''.join([MAGIC,
+                         _HEADER.pack(len(addresses), len(starts) - 1, n_txs, n_coinjoin),
+                         array('Q', (h for h, _ in index)).tobytes(),
+                         array('Q', (row for _, row in index)).tobytes(),
+                         starts.tobytes(),
+                         offsets.tobytes(),
+                         b''.join(payloads)])
+
+    def save(self, path: str):
+        """
+        保存到文件
+        :param path:
+        :return:
+        """
+        path = str(path)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(self.buf)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path: str) -> 'AddressClusters':
+        """
+        以内存映射的方式加载 save 保存的文件，多个进程加载同一个文件时共用操作系统的页缓存
+        :param path:
+        :return:
+        """
+        with open(str(path), 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        instance = cls(buf)
+        instance.file = buf
+        return instance
+
+    def __address(self, row: int) -> str:
+        return self.data[self.offsets[row]:self.offsets[row + 1]].tobytes().decode()
+
+    def get_cluster(self, address: str) -> int:
+        """
+        地址所在的簇 id
+        :param address:
+        :return: 簇 id ，地址不在任何簇里（只有自己一个地址）时返回 None
+        """
+        if not isinstance(address, str):
+            return None
+        h = hash_key(address)
+        i = bisect_left(self.hashes, h)
+        while i < self.n_addresses and self.hashes[i] == h:
+            row = self.rows[i]
+            if self.__address(row) == address:
+                return bisect_right(self.starts, row) - 1
+            i += 1
+        return None
+
+    def batch_get_cluster(self, addresses: List[str]) -> List[int]:
+        """
+        批量获取地址所在的簇 id
+        :param addresses:
+        :return:
+        """
+        return [self.get_cluster(i) for i in addresses]
+
+    def cluster_size(self, cluster_id: int) -> int:
+        """
+        簇里的地址数
+        :param cluster_id:
+        :return:
+        """
+        assert 0 <= cluster_id < self.n_clusters, cluster_id
+        return self.starts[cluster_id + 1] - self.starts[cluster_id]
+
+    def get_members(self, cluster_id: int) -> List[str]:
+        """
+        簇里的所有地址
+        :param cluster_id:
+        :return:
+        """
+        assert 0 <= cluster_id < self.n_clusters, cluster_id
+        return [self.__address(i) for i in range(self.starts[cluster_id], self.starts[cluster_id + 1])]
+
+    def iter_clusters(self) -> Iterator[List[str]]:
+        """
+        遍历所有簇
+        :return: 每个簇的地址列表，顺序与簇 id 一致
+        """
+        for i in range(self.n_clusters):
+            yield self.get_members(i)
+
+    def close(self):
+        """
+        释放内存映射
+        :return:
+        """
+        for view in (self.hashes, self.rows, self.starts, self.offsets, self.data, self.buf):
+            view.release()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -1,20 +1,31 @@
-from typing import List
-from blockchain_parser.blockchain import Block, Blockchain
-from . import parser_block
-import redis
+from typing import List, Iterable, Iterator, TYPE_CHECKING
+from . import (gen_txo_key, parser_block, parser_block_info, merge_address, merge_output, diff_address_stats,
+               merge_address_stats, placeholder_spent_txid)
+from .blocks import BlockIndex
+from .utils import BloomFilter, build_key_filter
+from .spill import SpillDict, estimate_sizeof
+from .models import Transaction, Output, Address, Block as BlockView
+import threading
 import json
 import sys
 import os
-import psutil
+
+if TYPE_CHECKING:
+    from blockchain_parser.block import Block
 
 
 class FileEngine:
+    # 内存预算不够时可以转移到磁盘的数据，见 self.memory_report
+    SPILLABLE = ('dict_tx', 'dict_output', 'dict_address', 'dict_address_stats', 'dict_block')
+
     def __init__(self,
                  dir_blocks: str,
                  min_height: int = None,
                  max_height: int = None,
                  index_cache: str = None,
-                 show_warning: bool = True):
+                 show_warning: bool = True,
+                 memory_limit: int = None,
+                 spill_dir: str = None):
         """
         通过区块数据文件，构建基于字典的搜索引擎（适用于搜索的区块不太多的时候）
         :param dir_blocks: 全节点下 blocks 目录的路径
@@ -22,27 +33,33 @@ class FileEngine:
         :param max_height: 最高的区块高度
         :param index_cache: 整个区块索引的缓存路径，建议设置，下次可以不用再构建区块索引
         :param show_warning: 当读取数据太多的时候，显示告警
+        :param memory_limit: 内存预算（字节），导入时统计各数据实际占用的内存，超过预算时把最早写入的数据转移到磁盘上，
+                             查询时透明地从磁盘读取（见 spill.SpillDict ），为空时全部放在内存里
+        :param spill_dir: 转移到磁盘的数据的目录，为空时使用临时目录（引擎被回收时删除）
         """
 
         dir_blocks = str(dir_blocks)
         dir_index = os.path.join(dir_blocks, 'index')
-        index_cache = str(index_cache)
+        index_cache = str(index_cache) if index_cache else None
         min_height = max(min_height or 0, 0)
-        max_height = max(max_height or sys.maxsize, 0)
+        max_height = max(max_height if max_height is not None else sys.maxsize, 0)
         assert os.path.exists(dir_blocks), f'路径 {dir_blocks} 不存在'
         assert os.path.exists(dir_index), f'路径 {dir_index} 不存在'
         assert isinstance(min_height, int), min_height
         assert isinstance(max_height, int), max_height
         assert 0 <= min_height <= max_height, f'min_height 不能大于 max_height'
+        assert memory_limit is None or isinstance(memory_limit, int) and memory_limit > 0, memory_limit
 
         # 粗略地用 10 个区块和 50 个区块的数据估计了一下，平均每个区块的数据大概会占 0.8 M 左右的内存大小
-        if show_warning:
+        if show_warning and memory_limit is None:
+            import psutil
             num_blocks = max_height - min_height + 1
             byte_cost_estimate = num_blocks * 0.8 * 1024 * 1024
             mem_total = float(psutil.virtual_memory().total)
             # 预估内存使用量超过系统内存 25% 后，发出警告（ 16GB 的内存建议读取的区块总数在 5000 个左右）
             if byte_cost_estimate > mem_total * 0.25:
-                sys.stdout.write(F'系统总内存为 {mem_total:.3} GB，预读取的区块有 {num_blocks} 个，建议减少区块数量\n')
+                sys.stdout.write(F'系统总内存为 {mem_total:.3} GB，预读取的区块有 {num_blocks} 个，'
+                                 F'建议减少区块数量或设置 memory_limit\n')
                 sys.stdout.flush()
 
         # 解析所需的参数
@@ -57,6 +74,31 @@ class FileEngine:
         self.dict_tx = {}
         self.dict_output = {}
         self.dict_block = {}
+        self.dict_address_stats = {}  # 地址 -> 统计，见 self.get_address_stats
+        self.block_index = BlockIndex()  # 区块时间索引，见 self.get_block_index
+
+        # 内存预算：超过预算时可以转移到磁盘的数据改用 SpillDict
+        self.memory_limit = memory_limit
+        self.spill_dir = None
+        if memory_limit is not None:
+            if spill_dir is None:
+                import tempfile
+                import weakref
+                import shutil
+                spill_dir = tempfile.mkdtemp(prefix='bitcoin_toolkit_spill_')
+                weakref.finalize(self, shutil.rmtree, spill_dir, True)
+            os.makedirs(str(spill_dir), exist_ok=True)
+            self.spill_dir = str(spill_dir)
+            for name in self.SPILLABLE:
+                setattr(self, name, SpillDict(os.path.join(self.spill_dir, f'{name}.sqlite')))
+
+        # 导入进度与回滚信息
+        self.dict_ingested = {}  # 已导入的区块：高度 -> 区块 hash
+        self.dict_undo = {}  # 最近 undo_depth 个区块的回滚信息：高度 -> {"hash": 区块 hash, "tx"/"address"/"txo": {key: 旧详情}}
+        self.undo_depth = 0  # 保留回滚信息的区块数，为 0 时不记录（见 follow.Follower ）
+        self.output_filter = None  # 有真实数据的输出 key 的布隆过滤器，见 self.get_output_filter
+        self.outpoint_index = None  # 设置后，导入时用全链的输出索引补全区块范围之前的输出，见 outpoints.OutpointIndex
+        self.ingest_filter = None  # 设置后，导入时丢弃不关心的输出，见 filters.IngestFilter
 
     def get_address(self, address: str) -> dict:
         """
@@ -81,6 +123,34 @@ class FileEngine:
         """
         return [self.get_address(i) for i in addresses]
 
+    def get_address_stats(self, address: str) -> dict:
+        """
+        获取单个地址的统计（导入时同步更新，不需要查询地址的所有输出），只统计有真实数据的输出
+        {
+            "address": "address",              // 传入的地址
+            "received": received,              // 收到的总金额（聪）
+            "spent": spent,                    // 花费的总金额（聪）
+            "n_outputs": n_outputs,            // 收到的输出数
+            "n_utxo": n_utxo,                  // 未花费的输出数
+            "utxo_value": utxo_value,          // 未花费的总金额（聪），即余额
+            "first_height": first_height,      // 最早有收支的区块高度
+            "last_height": last_height,        // 最近有收支的区块高度
+        }
+        :param address:
+        :return:
+        """
+        if isinstance(address, str):
+            return self.dict_address_stats.get(address)
+        return {}
+
+    def batch_get_address_stats(self, addresses: List[str]) -> List[dict]:
+        """
+        批量获取地址的统计
+        :param addresses:
+        :return:
+        """
+        return [self.get_address_stats(i) for i in addresses]
+
     def get_tx(self, txid: str) -> dict:
         """
         获取单个交易详情
@@ -133,38 +203,128 @@ class FileEngine:
         """
         return [self.get_txo(i) for i in keys]
 
-    # def get_block(self, block_hash: str) -> dict:
-    #     """
-    #     单个或批量获取区块详情
-    #     {
-    #         "block_hash": block_hash,          // 传入的区块 hash
-    #         "height": height,                  // 区块高度
-    #         "txid_list": [txid]                // 交易 id 列表
-    #     }
-    #     :param block_hash:
-    #     :return:
-    #     """
-    #     if isinstance(block_hash, str):
-    #         return self.dict_block.get(block_hash)
-    #     return {}
-    #
-    # def batch_get_block(self, block_hashes: List[str]) -> List[dict]:
-    #     """
-    #     批量获取区块详情
-    #     :param block_hashes:
-    #     :return:
-    #     """
-    #     return [self.get_block(i) for i in block_hashes]
-
-    def read_data(self, show_progress: bool = False):
+    def iter_address(self) -> Iterator[dict]:
+        """
+        遍历所有地址详情
+        :return:
+        """
+        return iter(self.dict_address.values())
+
+    def iter_tx(self) -> Iterator[dict]:
+        """
+        遍历所有交易详情
+        :return:
+        """
+        return iter(self.dict_tx.values())
+
+    def iter_txo(self) -> Iterator[dict]:
+        """
+        遍历所有输出详情
+        :return:
+        """
+        return iter(self.dict_output.values())
+
+    def expand(self, addresses: List[str], min_height: int = None, max_height: int = None) -> dict:
+        """
+        一次完成追溯的一轮查询：地址详情 -> 地址的输出 -> 花费这些输出的交易 -> 高度范围内的交易的输入与输出
+        {
+            "address": {address: 地址详情},      // 找到的地址详情
+            "tx": {txid: 交易详情},              // 花费了这些地址的输出的所有交易（包括高度范围外的）
+            "txo": {key: 输出详情},              // 地址的输出，以及高度范围内的交易的输入与输出
+                                                 // （不包含没有找到的输出）
+        }
+        :param addresses:
+        :param min_height: 为空时不限制
+        :param max_height: 为空时不限制
+        :return:
+        """
+        min_height = min_height if min_height is not None else 0
+        max_height = max_height if max_height is not None else sys.maxsize
+        result = {'address': {}, 'tx': {}, 'txo': {}}
+        txids = set()
+        for address in addresses:
+            info = self.dict_address.get(address)
+            if not info:
+                continue
+            result['address'][address] = info
+            for key in info['outputs']:
+                output = self.dict_output.get(key)
+                if output:
+                    result['txo'][key] = output
+                    if output['spent_txid']:
+                        txids.add(output['spent_txid'])
+        for txid in txids:
+            tx = self.dict_tx.get(txid)
+            if not tx:
+                continue
+            result['tx'][txid] = tx
+            if min_height <= tx['block_height'] <= max_height:
+                for key in tx['inputs'] + [gen_txo_key(txid, i) for i in range(tx['n_outputs'])]:
+                    output = self.dict_output.get(key)
+                    if output:
+                        result['txo'][key] = output
+        return result
+
+    def get_output_filter(self) -> BloomFilter:
+        """
+        有真实数据（不是由输入生成的、没有金额与地址的占位详情）的输出 key 的布隆过滤器，
+        不在过滤器里的 key 一定查不到输出的金额与地址，追溯时可以跳过查询。第一次调用时建立，之后导入区块时同步更新
+        :return:
+        """
+        if self.output_filter is None:
+            # 预留一倍的容量给之后导入的区块
+            self.output_filter = build_key_filter((key for key, info in self.dict_output.items()
+                                                   if info['type'] is not None), 2 * len(self.dict_output))
+        return self.output_filter
+
+    def get_block(self, block_hash: str) -> dict:
+        """
+        获取单个区块详情
+        {
+            "hash": block_hash,                // 传入的区块 hash
+            "height": height,                  // 区块高度
+            "timestamp": timestamp,            // 区块时间（ unix 时间戳，秒）
+            "txids": [txid],                   // 交易 id 列表
+            "n_tx": n_tx,                      // 交易数
+        }
+        :param block_hash:
+        :return:
+        """
+        if isinstance(block_hash, str):
+            return self.dict_block.get(block_hash)
+        return {}
+
+    def batch_get_block(self, block_hashes: List[str]) -> List[dict]:
+        """
+        批量获取区块详情
+        :param block_hashes:
+        :return:
+        """
+        return [self.get_block(i) for i in block_hashes]
+
+    def get_block_index(self) -> BlockIndex:
+        """
+        已导入区块的时间索引（导入时同步更新），可以把时间范围转换为高度范围，见 BlockIndex.height_range
+        :return:
+        """
+        return self.block_index
+
+    def read_data(self, show_progress: bool = False, blocks: Iterable['Block'] = None):
         """
         从区块数据生成器里依次构建
         :param show_progress: 是否显示进度
+        :param blocks: 按高度排好序的区块迭代器，为空时从 dir_blocks 里读取
         :return:
         """
-        block_chain = Blockchain(self.dir_blocks)
+        if blocks is None:
+            from blockchain_parser.blockchain import Blockchain
+            block_chain = Blockchain(self.dir_blocks)
+            # 索引按高度排列，直接从 min_height 开始读取（ end 不包含在内）
+            end = self.max_height + 1 if self.max_height < sys.maxsize else None
+            blocks = block_chain.get_ordered_blocks(index=self.dir_index, start=self.min_height, end=end,
+                                                    cache=self.index_cache)
         index = 0
-        for i, block in enumerate(block_chain.get_ordered_blocks(index=self.dir_index, cache=self.index_cache)):
+        for block in blocks:
             if block.height < self.min_height:
                 continue
             if block.height > self.max_height:
@@ -176,45 +336,311 @@ class FileEngine:
                 sys.stdout.write(f'已完成 {rate * 100:.1f}% -- {index}/{self.max_height - self.min_height + 1}\r')
                 sys.stdout.flush()
 
-    def from_block(self, block: Block):
+    def from_block(self, block: 'Block'):
         """
         读取区块数据，并更新 self 里的几个字典
         :param block:
         :return:
         """
         dict_tx, dict_address, dict_output = parser_block(block)
+        if self.outpoint_index is not None:
+            self.outpoint_index.fill(dict_output)
+        if self.ingest_filter is not None:
+            self.ingest_filter.apply(dict_tx, dict_address, dict_output)
+
+        # 地址统计的变化量（合并前计算）
+        deltas = {}
+        for key, info_new in dict_output.items():
+            info_old = self.dict_output.get(key)
+            spent_txid = placeholder_spent_txid(info_old, info_new)
+            spent_tx = self.dict_tx.get(spent_txid) if spent_txid else None
+            diff_address_stats(info_old, merge_output(dict(info_new), info_old), deltas, block.height,
+                               spent_height=spent_tx['block_height'] if spent_tx else None)
+
+        # 记录回滚信息（合并时总是生成新的字典，旧的详情不会被修改，因此直接保存引用即可）
+        if self.undo_depth:
+            self.dict_undo[block.height] = {
+                'hash': block.hash,
+                'tx': {key: self.dict_tx.get(key) for key in dict_tx},
+                'address': {key: self.dict_address.get(key) for key in dict_address},
+                'txo': {key: self.dict_output.get(key) for key in dict_output},
+                'stats': {key: self.dict_address_stats.get(key) for key in deltas},
+            }
+            self.dict_undo.pop(block.height - self.undo_depth, None)
 
-        # 批量保存交易
+        # 保存区块与交易
+        block_info = parser_block_info(block, dict_tx)
+        self.dict_block[block.hash] = block_info
+        self.block_index.add(block.height, block_info['timestamp'])
         self.dict_tx.update(dict_tx)
 
         # 批量更新地址
         for key, info_new in dict_address.items():
-            info_old = self.dict_address.get(key)
-            if info_old:
-                info_new['outputs'] = list(set(info_new['outputs'] + info_old['outputs']))
-                info_new['labels'] = list(set(info_new['labels'] + info_old['labels']))
+            merge_address(info_new, self.dict_address.get(key))
         self.dict_address.update(dict_address)
 
         # 批量更新输出
         for key, info_new in dict_output.items():
-            info_old = self.dict_output.get(key)
-            if info_old:
-                info_new['spent_txid'] = info_new['spent_txid'] or info_old['spent_txid']
-                info_new['value'] = info_new['value'] or info_old['value']
-                info_new['type'] = info_new['type'] or info_old['type']
-                info_new['addresses'] = info_new['addresses'] or info_old['addresses']
+            merge_output(info_new, self.dict_output.get(key))
         self.dict_output.update(dict_output)
+        if self.output_filter is not None:
+            for key, info in dict_output.items():
+                if info['type'] is not None:
+                    self.output_filter.add(key)
+
+        # 批量更新地址统计
+        for address, delta in deltas.items():
+            self.dict_address_stats[address] = merge_address_stats(address, delta,
+                                                                   self.dict_address_stats.get(address))
+        self.dict_ingested[block.height] = block.hash
+        if self.memory_limit is not None:
+            self.__enforce_memory_limit()
+
+    def __enforce_memory_limit(self):
+        """
+        内存超过预算时，从占用最多的数据开始，把最早写入的数据转移到磁盘，直到降到预算的 80% （多转移一些，避免每个区块都要转移）
+        :return:
+        """
+        usage = self.memory_usage()
+        if usage <= self.memory_limit:
+            return
+        target = int(self.memory_limit * 0.8)
+        spillable = [getattr(self, name) for name in self.SPILLABLE]
+        while usage > target:
+            data = max(spillable, key=lambda x: x.memory_usage())
+            if not data.hot:
+                break  # 只剩不能转移的数据
+            n = int((usage - target) / max(data.record_bytes(), 1)) + 1
+            freed = data.spill(min(n, len(data.hot)))
+            usage = self.memory_usage() if not freed else usage - freed
+
+    def memory_usage(self) -> int:
+        """
+        内存预算统计的字节数：可以转移的数据、区块时间索引与输出过滤器（不含回滚信息），见 self.memory_report
+        :return:
+        """
+        total = sum(i.memory_usage() if isinstance(i, SpillDict) else estimate_sizeof(i)
+                    for i in (getattr(self, name) for name in self.SPILLABLE))
+        total += sum(len(i) * i.itemsize for i in (self.block_index.heights, self.block_index.timestamps,
+                                                   self.block_index.max_timestamps))
+        if self.output_filter is not None:
+            total += len(self.output_filter.bits)
+        return total
+
+    def memory_report(self) -> dict:
+        """
+        各项数据占用的内存。设置了 memory_limit 时按导入时的采样统计，否则对现有数据采样估计
+        {
+            "dict_tx": {"entries": 内存里的条数, "bytes": 内存字节数,
+                        "spilled_entries": 磁盘上的条数, "disk_bytes": 文件大小},
+            ...         // dict_output 、 dict_address 、 dict_address_stats 、
+                        // dict_block 同上
+            "dict_undo": {"entries": 条数, "bytes": 字节数},
+            "block_index": {"entries": 区块数, "bytes": 字节数},
+            "output_filter": {"bytes": 字节数},
+            "total_bytes": 合计的内存字节数,
+            "memory_limit": 内存预算,
+            "rss_bytes": 进程的常驻内存（没有安装 psutil 时为空）,
+        }
+        :return:
+        """
+        report = {}
+        for name in self.SPILLABLE:
+            data = getattr(self, name)
+            if isinstance(data, SpillDict):
+                report[name] = data.memory_report()
+            else:
+                report[name] = {'entries': len(data), 'bytes': estimate_sizeof(data), 'spilled_entries': 0,
+                                'disk_bytes': 0}
+        report['dict_undo'] = {'entries': len(self.dict_undo), 'bytes': estimate_sizeof(self.dict_undo)}
+        report['block_index'] = {
+            'entries': len(self.block_index),
+            'bytes': sum(len(i) * i.itemsize for i in (self.block_index.heights, self.block_index.timestamps,
+                                                       self.block_index.max_timestamps)),
+        }
+        report['output_filter'] = {'bytes': len(self.output_filter.bits) if self.output_filter is not None else 0}
+        total = sum(i['bytes'] for i in report.values())
+        report['total_bytes'] = total
+        report['memory_limit'] = self.memory_limit
+        try:
+            import psutil
+            report['rss_bytes'] = psutil.Process().memory_info().rss
+        except ImportError:
+            report['rss_bytes'] = None
+        return report
+
+    def get_ingest_height(self) -> int:
+        """
+        已经导入的最高区块高度
+        :return: 没有导入过时返回 None
+        """
+        return max(self.dict_ingested) if self.dict_ingested else None
+
+    def get_ingested_blocks(self) -> dict:
+        """
+        已经导入的区块
+        :return: {高度: 区块 hash}
+        """
+        return dict(self.dict_ingested)
+
+    def rollback_block(self, height: int):
+        """
+        回滚最高的一个区块（处理分叉时使用），需要在导入前设置 undo_depth
+        :param height: 区块高度，必须是当前已导入的最高高度
+        :return:
+        """
+        assert height == self.get_ingest_height(), f'只能回滚最高的区块 {self.get_ingest_height()}'
+        undo = self.dict_undo.pop(height, None)
+        assert undo is not None, f'区块 {height} 没有回滚信息'
+        for data, old in ((self.dict_tx, undo['tx']), (self.dict_address, undo['address']),
+                          (self.dict_output, undo['txo']), (self.dict_address_stats, undo['stats'])):
+            for key, info in old.items():
+                if info is None:
+                    data.pop(key, None)
+                else:
+                    data[key] = info
+        self.dict_block.pop(undo['hash'], None)
+        self.block_index.remove(height)
+        del self.dict_ingested[height]
 
 
 class RedisEngine:
     """
-    自定义的 Redis 引擎
+    自定义的 Redis 引擎，支持两种数据布局：
+    1. flat ：每个交易、输出、地址各占一个 key （ key 分别为 txid 、 txid,index 、地址）
+    2. grouped ：交易、地址分别加上 tx: 、 addr: 前缀，同一笔交易的所有输出保存在一个 hash 里
+       （ key 为 txo: 加 txid ，字段为输出的 index ，值为紧凑的 [金额, 类型, 地址, 花费交易] ），
+       输出数量巨大时可以省去大部分 key 的额外开销，批量查询同一笔交易的多个输出时也只需要一次 HMGET
     """
 
-    def __init__(self):
+    # 导入进度：已导入的最高区块高度，以及每个已导入区块的标记（高度 -> 区块 hash ）
+    KEY_INGEST_HEIGHT = '__ingest__:height'
+    KEY_INGEST_BLOCKS = '__ingest__:blocks'
+    KEY_UNDO = '__undo__:'  # 每个区块的回滚信息，后面拼接区块高度
+    KEY_STATS = '__stats__:'  # 地址统计，后面拼接地址
+    KEY_BLOCK = '__block__:'  # 区块详情，后面拼接区块 hash
+    KEY_BLOCK_TIME = '__block__:time'  # 区块时间：高度 -> unix 时间戳
+    KEY_LAYOUT = '__layout__'  # 数据布局
+    # 导入时一个事务最多写入的地址或输出数（见 from_blocks ）
+    WATCH_CHUNK = 1000
+    # grouped 布局的 key 前缀
+    PREFIX_TX = 'tx:'
+    PREFIX_TXO = 'txo:'
+    PREFIX_ADDRESS = 'addr:'
+
+    # 在服务端完成 expand 的所有查询，返回原始的 json 字符串（见 self.expand ）
+    # ARGV: 布局, 最低高度, 最高高度, 地址...
+    # 返回: [[地址, json, ...], [txid, json, ...], [输出 key, json, ...]]
+    EXPAND_SCRIPT = '''
+local grouped = ARGV[1] == 'grouped'
+local min_height, max_height = tonumber(ARGV[2]), tonumber(ARGV[3])
+local prefix_tx, prefix_address = '', ''
+if grouped then
+    prefix_tx, prefix_address = 'tx:', 'addr:'
+end
+local addresses, txs, txos, seen_tx, seen_txo = {}, {}, {}, {}, {}
+
+local function get_txo(key)
+    if grouped then
+        local sep = string.find(key, ',', 1, true)
+        return redis.call('HGET', 'txo:' .. string.sub(key, 1, sep - 1), string.sub(key, sep + 1))
+    end
+    return redis.call('GET', key)
+end
+
+local function add_txo(key)
+    if seen_txo[key] then
+        return nil
+    end
+    seen_txo[key] = true
+    local r = get_txo(key)
+    if not r then
+        return nil
+    end
+    table.insert(txos, key)
+    table.insert(txos, r)
+    return r
+end
+
+local spent = {}
+for i = 4, #ARGV do
+    local r = redis.call('GET', prefix_address .. ARGV[i])
+    if r then
+        table.insert(addresses, ARGV[i])
+        table.insert(addresses, r)
+        for _, key in ipairs(cjson.decode(r)['outputs']) do
+            local output = add_txo(key)
+            if output then
+                output = cjson.decode(output)
+                local spent_txid = output['spent_txid']
+                if grouped then
+                    spent_txid = output[4]
+                end
+                if type(spent_txid) == 'string' and not seen_tx[spent_txid] then
+                    seen_tx[spent_txid] = true
+                    table.insert(spent, spent_txid)
+                end
+            end
+        end
+    end
+end
+
+for _, txid in ipairs(spent) do
+    local r = redis.call('GET', prefix_tx .. txid)
+    if r then
+        table.insert(txs, txid)
+        table.insert(txs, r)
+        local tx = cjson.decode(r)
+        if tx['block_height'] >= min_height and tx['block_height'] <= max_height then
+            for _, key in ipairs(tx['inputs']) do
+                add_txo(key)
+            end
+            for i = 0, tx['n_outputs'] - 1 do
+                add_txo(txid .. ',' .. i)
+            end
+        end
+    end
+end
+return {addresses, txs, txos}
+'''
+
+    def __init__(self,
+                 host: str = 'localhost',
+                 port: int = 6379,
+                 db: int = 0,
+                 client=None,
+                 layout: str = None):
+        """
+        :param host: redis 地址
+        :param port: redis 端口
+        :param db: redis 数据库编号
+        :param client: 已经创建好的 redis 客户端（需要设置 decode_responses=True ），
+            传入时忽略上面的连接参数
+        :param layout: 数据布局 flat/grouped ，为空时使用数据库里已有数据的布局（没有时为 flat ）
+        """
+        assert layout in (None, 'flat', 'grouped'), layout
         super().__init__()
-        self.pool = redis.ConnectionPool(host='localhost', port=6379, decode_responses=True)
-        self.redis = redis.Redis(connection_pool=self.pool)
+        if client is not None:
+            self.pool = client.connection_pool
+            self.redis = client
+        else:
+            import redis
+            self.pool = redis.ConnectionPool(host=host, port=port, db=db, decode_responses=True)
+            self.redis = redis.Redis(connection_pool=self.pool)
+        stored_layout = self.redis.get(self.KEY_LAYOUT)
+        assert layout is None or stored_layout in (None, layout), f'数据库里已有 {stored_layout} 布局的数据'
+        self.layout = layout or stored_layout or 'flat'
+        self.grouped = self.layout == 'grouped'
+        self.expand_script = self.redis.register_script(self.EXPAND_SCRIPT)
+        self.record_views = False  # 设置后查询返回 models 里的只读视图（第一次访问字段时才解码），而不是解码后的字典
+        self.undo_depth = 0  # 保留回滚信息的区块数，为 0 时不记录（见 follow.Follower ）
+        self.output_filter = None  # 有真实数据的输出 key 的布隆过滤器，见 self.build_output_filter
+        self.output_filter_height = None  # 建立布隆过滤器时的导入高度
+        self.outpoint_index = None  # 设置后，导入时用全链的输出索引补全区块范围之前的输出，见 outpoints.OutpointIndex
+        self.ingest_filter = None  # 设置后，导入时丢弃不关心的输出，见 filters.IngestFilter
+        # 导入时是否推进导入高度。并行导入的子进程设为否，不监视全局的导入高度（否则所有事务都会互相冲突），
+        # 由主进程在所有区间完成后推进，见 self.parallel_write_data
+        self.advance_height = True
 
     def get_address(self, address: str) -> dict:
         """
@@ -222,8 +648,9 @@ class RedisEngine:
         :param address:
         :return:
         """
-        r = self.redis.get(address)
-        return json.loads(r) if r else None
+        if isinstance(address, str):
+            return self.batch_get_address([address])[0]
+        return {}
 
     def batch_get_address(self, addresses: List[str]) -> List[dict]:
         """
@@ -231,7 +658,27 @@ class RedisEngine:
         :param addresses:
         :return:
         """
-        return [json.loads(r) if r else None for r in self.redis.mget(addresses)]
+        return [self.__decode(Address, r) for r in self.__read('address', list(addresses))]
+
+    def get_address_stats(self, address: str) -> dict:
+        """
+        获取单个地址的统计，详情内容请见 FileEngine.get_address_stats
+        :param address:
+        :return:
+        """
+        if isinstance(address, str):
+            return self.batch_get_address_stats([address])[0]
+        return {}
+
+    def batch_get_address_stats(self, addresses: List[str]) -> List[dict]:
+        """
+        批量获取地址的统计，详情内容请见 FileEngine.get_address_stats
+        :param addresses:
+        :return:
+        """
+        if not addresses:
+            return []
+        return [json.loads(r) if r else None for r in self.redis.mget([self.KEY_STATS + i for i in addresses])]
 
     def get_tx(self, txid: str) -> dict:
         """
@@ -239,8 +686,9 @@ class RedisEngine:
         :param txid:
         :return:
         """
-        r = self.redis.get(txid)
-        return json.loads(r) if r else None
+        if isinstance(txid, str):
+            return self.batch_get_tx([txid])[0]
+        return {}
 
     def batch_get_tx(self, txids: List[str]) -> List[dict]:
         """
@@ -248,7 +696,7 @@ class RedisEngine:
         :param txids:
         :return:
         """
-        return [json.loads(r) if r else None for r in self.redis.mget(txids)]
+        return [self.__decode(Transaction, r) for r in self.__read('tx', list(txids))]
 
     def get_txo(self, key: str) -> dict:
         """
@@ -256,84 +704,1075 @@ class RedisEngine:
         :param key:
         :return:
         """
-        r = self.redis.get(key)
-        return json.loads(r) if r else None
+        if isinstance(key, str):
+            return self.batch_get_txo([key])[0]
+        return {}
 
-    def batch_get_txo(self, keys: List[str]) -> List[str]:
+    def batch_get_txo(self, keys: List[str]) -> List[dict]:
         """
         批量获取 txo 详情，详情内容请见 FileEngine.get_txo
         :param keys:
         :return:
         """
-        return [json.loads(r) if r else None for r in self.redis.mget(keys)]
-
-    # def get_block(self, block_hash: str) -> dict:
-    #     """
-    #     获取单个区块详情
-    #     :param block_hash:
-    #     :return:
-    #     """
-    #     r = self.redis.get(block_hash)
-    #     return json.loads(r) if r else None
-    #
-    # def batch_get_block(self, block_hashes: List[str]) -> List[str]:
-    #     """
-    #     批量获取区块详情
-    #     :param block_hashes:
-    #     :return:
-    #     """
-    #     return [json.loads(r) if r else None for r in self.redis.mget(block_hashes)]
+        keys = list(keys)
+        decode = self.__view_txo if self.record_views else self.__decode_txo
+        return [decode(key, r) for key, r in zip(keys, self.__read('txo', keys))]
+
+    def __read(self, kind: str, keys: List[str], client=None) -> List[str]:
+        """
+        按数据布局批量读取原始的 json 字符串
+        :param kind: tx/txo/address
+        :param keys: 交易为 txid ，输出为 txid,index ，地址为地址
+        :param client: 执行 MGET 的客户端（导入时为已经 WATCH 的 pipeline ），为空时使用 self.redis
+        :return: 与 keys 一一对应，不存在时为 None
+        """
+        if not keys:
+            return []
+        client = client if client is not None else self.redis
+        if not self.grouped:
+            return client.mget(keys)
+        if kind != 'txo':
+            prefix = self.PREFIX_TX if kind == 'tx' else self.PREFIX_ADDRESS
+            return client.mget([prefix + i for i in keys])
+
+        # 按交易分组，每笔交易一次 HMGET ，所有 HMGET 在一次往返里完成
+        # （ WATCH 之后用另一个连接读取不影响乐观锁：读取之后的修改仍然会让事务失败）
+        groups = {}  # txid -> [(在 keys 里的位置, index), ...]
+        for position, key in enumerate(keys):
+            txid, index = key.rsplit(',', 1)
+            groups.setdefault(txid, []).append((position, index))
+        pipe = self.redis.pipeline(transaction=False)
+        for txid, items in groups.items():
+            pipe.hmget(self.PREFIX_TXO + txid, [index for _, index in items])
+        result = [None] * len(keys)
+        for items, values in zip(groups.values(), pipe.execute()):
+            for (position, _), value in zip(items, values):
+                result[position] = value
+        return result
+
+    def __write(self, pipe, kind: str, data: dict):
+        """
+        按数据布局在事务里写入（或删除）原始的 json 字符串
+        :param pipe: 已经调用了 multi 的 pipeline
+        :param kind: tx/txo/address
+        :param data: key -> json 字符串，为 None 时删除
+        :return:
+        """
+        restore = {key: j for key, j in data.items() if j is not None}
+        delete = [key for key, j in data.items() if j is None]
+        if not self.grouped or kind != 'txo':
+            prefix = '' if not self.grouped else self.PREFIX_TX if kind == 'tx' else self.PREFIX_ADDRESS
+            if restore:
+                pipe.mset({prefix + key: j for key, j in restore.items()})
+            if delete:
+                pipe.delete(*[prefix + key for key in delete])
+            return
+        groups = {}
+        for key, j in restore.items():
+            txid, index = key.rsplit(',', 1)
+            groups.setdefault(txid, {})[index] = j
+        for txid, mapping in groups.items():
+            pipe.hset(self.PREFIX_TXO + txid, mapping=mapping)
+        groups = {}
+        for key in delete:
+            txid, index = key.rsplit(',', 1)
+            groups.setdefault(txid, []).append(index)
+        for txid, indexes in groups.items():
+            pipe.hdel(self.PREFIX_TXO + txid, *indexes)
+
+    def __watch_keys(self, kind: str, keys: List[str]) -> List[str]:
+        """
+        导入时需要 WATCH 的 redis key
+        :param kind: tx/txo/address
+        :param keys:
+        :return:
+        """
+        if not self.grouped:
+            return keys
+        if kind == 'txo':
+            return list({self.PREFIX_TXO + key.rsplit(',', 1)[0] for key in keys})
+        prefix = self.PREFIX_TX if kind == 'tx' else self.PREFIX_ADDRESS
+        return [prefix + i for i in keys]
+
+    def __get_heights(self, txids: List[str]) -> dict:
+        """
+        批量获取交易所在的区块高度
+        :param txids: 可以包含 None 与重复的 txid
+        :return: txid -> 区块高度，不存在的交易不返回
+        """
+        txids = list({i for i in txids if i})
+        return {txid: json.loads(r)['block_height'] for txid, r in zip(txids, self.__read('tx', txids)) if r}
+
+    def __encode_txo(self, info: dict) -> str:
+        """
+        输出详情编码为 json 字符串， grouped 布局只保存 [金额, 类型, 地址, 花费交易]
+        :param info:
+        :return:
+        """
+        if not self.grouped:
+            return json.dumps(info)
+        return json.dumps([info['value'], info['type'], info['addresses'], info['spent_txid']])
+
+    def __decode_txo(self, key: str, r: str) -> dict:
+        """
+        由 json 字符串解码输出详情
+        :param key: txid,index
+        :param r:
+        :return:
+        """
+        if not r:
+            return None
+        if not self.grouped:
+            return json.loads(r)
+        value, output_type, addresses, spent_txid = json.loads(r)
+        txid, index = key.rsplit(',', 1)
+        return {'key': key, 'txid': txid, 'index': int(index), 'value': value, 'type': output_type,
+                'addresses': addresses, 'spent_txid': spent_txid}
+
+    def __decode(self, view: type, r: str):
+        """
+        由 json 字符串解码交易、地址或区块详情
+        :param view: 设置了 self.record_views 时返回的视图类型
+        :param r:
+        :return:
+        """
+        if not r:
+            return None
+        return view(r) if self.record_views else json.loads(r)
+
+    def __view_txo(self, key: str, r: str) -> Output:
+        """
+        由 json 字符串生成输出详情的视图， grouped 布局的 [金额, 类型, 地址, 花费交易] 直接作为视图的字段，不需要新建字典
+        :param key: txid,index
+        :param r:
+        :return:
+        """
+        if not r:
+            return None
+        if not self.grouped:
+            return Output(r)
+        txid, index = key.rsplit(',', 1)
+        return Output((key, txid, int(index), *json.loads(r)))
+
+    def __scan(self, kind: str, batch_size: int = 1000) -> Iterator[dict]:
+        """
+        遍历某一类数据（ key 的格式：交易为 64 位的 txid ，输出为 txid,index ，其他为地址）
+        :param kind: tx/txo/address
+        :param batch_size: 每次 mget 的 key 数
+        :return:
+        """
+        if self.grouped:
+            yield from self.__scan_grouped(kind, batch_size)
+            return
+
+        def match(key):
+            if key.startswith('__'):
+                return False  # 内部使用的 key
+            if ',' in key:
+                return kind == 'txo'
+            if len(key) == 64:
+                return kind == 'tx'
+            return kind == 'address'
+
+        keys = []
+        for key in self.redis.scan_iter(match='*,*' if kind == 'txo' else None, count=batch_size):
+            if match(key):
+                keys.append(key)
+            if len(keys) >= batch_size:
+                yield from (json.loads(r) for r in self.redis.mget(keys) if r)
+                keys = []
+        if keys:
+            yield from (json.loads(r) for r in self.redis.mget(keys) if r)
+
+    def __scan_grouped(self, kind: str, batch_size: int) -> Iterator[dict]:
+        """
+        遍历 grouped 布局的某一类数据
+        :param kind: tx/txo/address
+        :param batch_size: 每次读取的 key 数
+        :return:
+        """
+        prefix = {'tx': self.PREFIX_TX, 'txo': self.PREFIX_TXO, 'address': self.PREFIX_ADDRESS}[kind]
+
+        def read(keys):
+            if kind != 'txo':
+                return (json.loads(r) for r in self.redis.mget(keys) if r)
+            pipe = self.redis.pipeline(transaction=False)
+            for key in keys:
+                pipe.hgetall(key)
+            return (self.__decode_txo(key[len(prefix):] + ',' + index, r)
+                    for key, mapping in zip(keys, pipe.execute())
+                    for index, r in sorted(mapping.items(), key=lambda x: int(x[0])))
+
+        keys = []
+        for key in self.redis.scan_iter(match=prefix + '*', count=batch_size):
+            keys.append(key)
+            if len(keys) >= batch_size:
+                yield from read(keys)
+                keys = []
+        if keys:
+            yield from read(keys)
+
+    def iter_address(self) -> Iterator[dict]:
+        """
+        遍历所有地址详情
+        :return:
+        """
+        return self.__scan('address')
+
+    def iter_tx(self) -> Iterator[dict]:
+        """
+        遍历所有交易详情
+        :return:
+        """
+        return self.__scan('tx')
+
+    def iter_txo(self) -> Iterator[dict]:
+        """
+        遍历所有输出详情
+        :return:
+        """
+        return self.__scan('txo')
+
+    def expand(self, addresses: List[str], min_height: int = None, max_height: int = None) -> dict:
+        """
+        一次完成追溯的一轮查询，结果见 FileEngine.expand 。所有查询在服务端的 lua 脚本里完成，只需要一次往返；
+        脚本执行期间 redis 不处理其他请求，输出很多的地址（例如交易所）会阻塞较长时间。
+        脚本访问的 key 由参数计算得到，不能用于 redis 集群
+        :param addresses:
+        :param min_height: 为空时不限制
+        :param max_height: 为空时不限制
+        :return:
+        """
+        addresses = list(addresses)
+        if not addresses:
+            return {'address': {}, 'tx': {}, 'txo': {}}
+        min_height = min_height if min_height is not None else 0
+        max_height = max_height if max_height is not None else sys.maxsize
+        address_items, tx_items, txo_items = self.expand_script(
+            args=[self.layout, min_height, min(max_height, 1 << 53), *addresses])
+        decode_txo = self.__view_txo if self.record_views else self.__decode_txo
+        return {
+            'address': {address_items[i]: self.__decode(Address, address_items[i + 1])
+                        for i in range(0, len(address_items), 2)},
+            'tx': {tx_items[i]: self.__decode(Transaction, tx_items[i + 1]) for i in range(0, len(tx_items), 2)},
+            'txo': {txo_items[i]: decode_txo(txo_items[i], txo_items[i + 1]) for i in range(0, len(txo_items), 2)},
+        }
+
+    def build_output_filter(self, capacity: int = None) -> BloomFilter:
+        """
+        遍历所有输出，建立有真实数据的输出 key 的布隆过滤器（见 FileEngine.get_output_filter ），
+        需要遍历整个数据库，耗时较长。
+        之后由当前实例导入的区块会同步更新过滤器
+        :param capacity: 预计的输出数，为空时使用数据库的 key 数
+        :return:
+        """
+        height = self.get_ingest_height()
+        keys = (i['key'] for i in self.__scan('txo') if i['type'] is not None)
+        self.output_filter = build_key_filter(keys, capacity or self.redis.dbsize())
+        self.output_filter_height = height
+        return self.output_filter
+
+    def get_output_filter(self) -> BloomFilter:
+        """
+        build_output_filter 建立的布隆过滤器
+        :return: 没有建立过，或者建立之后有其他进程导入或回滚了区块（导入高度发生了变化）时返回 None
+        """
+        if self.output_filter is None or self.get_ingest_height() != self.output_filter_height:
+            return None
+        return self.output_filter
+
+    def get_block(self, block_hash: str) -> dict:
+        """
+        获取单个区块详情，详情内容请见 FileEngine.get_block
+        :param block_hash:
+        :return:
+        """
+        if isinstance(block_hash, str):
+            return self.batch_get_block([block_hash])[0]
+        return {}
+
+    def batch_get_block(self, block_hashes: List[str]) -> List[dict]:
+        """
+        批量获取区块详情
+        :param block_hashes:
+        :return:
+        """
+        if not block_hashes:
+            return []
+        return [self.__decode(BlockView, r) for r in self.redis.mget([self.KEY_BLOCK + i for i in block_hashes])]
+
+    def get_block_index(self) -> BlockIndex:
+        """
+        已导入区块的时间索引（每次调用时从 redis 读取所有区块的时间，几十万个区块也只有几 MB ）
+        :return:
+        """
+        return BlockIndex.from_items((int(k), int(v)) for k, v in self.redis.hgetall(self.KEY_BLOCK_TIME).items())
+
+    def get_ingest_height(self) -> int:
+        """
+        已经导入的最高区块高度
+        :return: 没有导入过时返回 None
+        """
+        r = self.redis.get(self.KEY_INGEST_HEIGHT)
+        return int(r) if r is not None else None
+
+    def get_ingested_blocks(self) -> dict:
+        """
+        已经导入的区块
+        :return: {高度: 区块 hash}
+        """
+        return {int(k): v for k, v in self.redis.hgetall(self.KEY_INGEST_BLOCKS).items()}
 
     def write_data(self,
                    dir_blocks: str,
                    min_height: int = None,
                    max_height: int = None,
                    index_cache: str = None,
-                   show_progress: bool = False):
+                   show_progress: bool = False,
+                   blocks: Iterable['Block'] = None,
+                   resume: bool = False,
+                   batch_blocks: int = 10):
         """
-        从区块数据里构建 4 种数据字典，并保存在 redis ，各字段含义见 FileEngine.__init__ 方法
+        从区块数据里构建 4 种数据字典，并保存在 redis ，各字段含义见 FileEngine.__init__ 方法。
+        每 batch_blocks 个区块合并后写入，最后记录这些区块的导入标记（见 from_blocks ），
+        中断后可以用 resume=True 继续导入
         :param dir_blocks:
         :param min_height:
         :param max_height:
         :param index_cache:
         :param show_progress: 是否显示进度
+        :param blocks: 按高度排好序的区块迭代器，为空时从 dir_blocks 里读取
+        :param resume: 是否跳过已经导入过的区块
+        :param batch_blocks: 每次写入的区块数，越大往返次数越少，但占用的内存越多
         :return:
         """
+        assert isinstance(batch_blocks, int) and batch_blocks > 0, batch_blocks
+        ingested = self.get_ingested_blocks() if resume else {}
+        batch = []
+
+        def from_block(block: 'Block'):
+            block_hash = ingested.get(block.height)
+            if block_hash is not None:
+                assert block_hash == block.hash, f'高度 {block.height} 已导入的区块 {block_hash} 与 {block.hash} 不一致'
+                return  # 已经导入过
+            batch.append(block)
+            if len(batch) >= batch_blocks:
+                self.from_blocks(batch)
+                batch.clear()
 
-        file_engine = FileEngine(dir_blocks, min_height, max_height, index_cache)
-        file_engine.from_block = self.from_block  # 覆盖 FileEngine 的读取数据的函数
-        file_engine.read_data(show_progress)
+        file_engine = FileEngine(dir_blocks, min_height, max_height, index_cache, show_warning=False)
+        file_engine.from_block = from_block  # 覆盖 FileEngine 的读取数据的函数
+        file_engine.read_data(show_progress, blocks)
+        if batch:
+            self.from_blocks(batch)
         return self
 
-    def from_block(self, block: Block):
+    def from_block(self, block: 'Block'):
         """
         读取区块数据，并更新 redis 的数据
         :param block:
         :return:
         """
+        self.from_blocks([block])
+
+    def from_blocks(self, blocks: List['Block']):
+        """
+        读取多个区块的数据，合并后更新 redis 的数据，最后写入导入标记（见下面的注释，导入标记之前的数据分成多个事务写入）
+        :param blocks:
+        :return:
+        """
+        if self.undo_depth and len(blocks) > 1:
+            for block in blocks:
+                self.from_blocks([block])  # 回滚信息按区块记录，每个区块单独写入
+            return
+
+        dict_tx, dict_address, dict_output, dict_block = {}, {}, {}, {}
+        dict_heights = {}  # 输出 key -> 修改了它的区块的 (最低高度, 最高高度)
+        for block in blocks:
+            block_tx, block_address, block_output = parser_block(block)
+            if self.outpoint_index is not None:
+                self.outpoint_index.fill(block_output)
+            if self.ingest_filter is not None:
+                self.ingest_filter.apply(block_tx, block_address, block_output)
+            dict_block[self.KEY_BLOCK + block.hash] = parser_block_info(block, block_tx)
+            for key in block_output:
+                heights = dict_heights.get(key)
+                dict_heights[key] = (min(heights[0], block.height), max(heights[1], block.height)) if heights \
+                    else (block.height, block.height)
+            dict_tx.update(block_tx)
+            for key, info_new in block_address.items():
+                merge_address(info_new, dict_address.get(key))
+            dict_address.update(block_address)
+            for key, info_new in block_output.items():
+                merge_output(info_new, dict_output.get(key))
+            dict_output.update(block_output)
+
+        # 与已有的数据合并后写入。多个进程同时写入时用 WATCH 做乐观锁，
+        # 被其他进程修改过则重新读取、合并后再写入（合并规则满足交换律，与写入顺序无关）
+        from redis.exceptions import WatchError
+        height = max(block.height for block in blocks)
+        assert self.advance_height or not self.undo_depth, '记录回滚信息时必须推进导入高度'
+        watch_height = [self.KEY_INGEST_HEIGHT] if self.advance_height else []
+
+        def write(tx_keys: List[str], address_keys: List[str], output_keys: List[str], final: bool):
+            """
+            在一个事务里合并、写入一部分地址与输出，final 为真时同时写入交易、区块、导入标记与回滚信息
+            """
+            with self.redis.pipeline(transaction=True) as pipe:
+                while True:
+                    try:
+                        watch_keys = [*(watch_height if final else []), *self.__watch_keys('tx', tx_keys),
+                                      *self.__watch_keys('address', address_keys),
+                                      *self.__watch_keys('txo', output_keys)]
+                        if watch_keys:
+                            pipe.watch(*watch_keys)
+                        old_tx = self.__read('tx', tx_keys, pipe)
+                        old_address = self.__read('address', address_keys, pipe)
+                        old_output = self.__read('txo', output_keys, pipe)
+                        merged_address = {key: merge_address(dict(dict_address[key]), json.loads(j) if j else None)
+                                          for key, j in zip(address_keys, old_address)}
+                        merged_output, deltas = {}, {}
+                        infos_old = [self.__decode_txo(key, j) for key, j in zip(output_keys, old_output)]
+                        # 其他进程先导入了花费输出的区块时，由花费交易查到花费的高度（交易不会被修改，不需要监视）
+                        spent_txids = [placeholder_spent_txid(info_old, dict_output[key])
+                                       for key, info_old in zip(output_keys, infos_old)]
+                        spent_heights = self.__get_heights(spent_txids)
+                        for key, info_old, spent_txid in zip(output_keys, infos_old, spent_txids):
+                            merged_output[key] = merge_output(dict(dict_output[key]), info_old)
+                            diff_address_stats(info_old, merged_output[key], deltas, *dict_heights[key],
+                                               spent_height=spent_heights.get(spent_txid))
+                        # 地址统计的 key 在读取输出后才知道，再追加监视
+                        stats_keys = [self.KEY_STATS + i for i in deltas]
+                        if stats_keys:
+                            pipe.watch(*stats_keys)
+                        old_stats = pipe.mget(stats_keys) if stats_keys else []
+                        merged_stats = {key: merge_address_stats(address, deltas[address],
+                                                                 json.loads(j) if j else None)
+                                        for key, address, j in zip(stats_keys, deltas, old_stats)}
+                        ingest_height = pipe.get(self.KEY_INGEST_HEIGHT) if final and self.advance_height else None
+
+                        pipe.multi()
+                        self.__write(pipe, 'address', {key: json.dumps(info) for key, info in merged_address.items()})
+                        self.__write(pipe, 'txo', {key: self.__encode_txo(info) for key, info in merged_output.items()})
+                        if merged_stats:
+                            pipe.mset({key: json.dumps(info) for key, info in merged_stats.items()})
+                        if final and self.undo_depth:
+                            # 不记录回滚信息时交易已经在开始时写入
+                            self.__write(pipe, 'tx', {key: json.dumps(info) for key, info in dict_tx.items()})
+                        if final:
+                            pipe.mset({key: json.dumps(info) for key, info in dict_block.items()})
+                            pipe.set(self.KEY_LAYOUT, self.layout)
+                            pipe.hset(self.KEY_BLOCK_TIME,
+                                      mapping={i['height']: i['timestamp'] for i in dict_block.values()})
+                            pipe.hset(self.KEY_INGEST_BLOCKS, mapping={block.height: block.hash for block in blocks})
+                            if self.advance_height and (ingest_height is None or height > int(ingest_height)):
+                                pipe.set(self.KEY_INGEST_HEIGHT, height)
+                        if self.undo_depth:
+                            # 回滚信息：被修改的 key 原来的值（原始的 json 字符串，不存在时为空）
+                            undo = {
+                                'hash': blocks[0].hash,
+                                'tx': dict(zip(tx_keys, old_tx)),
+                                'address': dict(zip(address_keys, old_address)),
+                                'txo': dict(zip(output_keys, old_output)),
+                                'stats': dict(zip(stats_keys, old_stats)),
+                            }
+                            pipe.set(self.KEY_UNDO + str(height), json.dumps(undo))
+                            pipe.delete(self.KEY_UNDO + str(height - self.undo_depth))
+                        pipe.execute()
+                        break
+                    except WatchError:
+                        continue
+            if self.output_filter is not None:
+                for key, info in merged_output.items():
+                    if info['type'] is not None:
+                        self.output_filter.add(key)
+                # 写入前过滤器是最新的，写入后也是
+                ingest_height = int(ingest_height) if ingest_height is not None else None
+                if final and self.advance_height and ingest_height == self.output_filter_height:
+                    self.output_filter_height = max(height, ingest_height or 0)
+
+        address_keys = list(dict_address.keys())
+        output_keys = list(dict_output.keys())
+        if self.undo_depth:
+            # 回滚信息需要所有 key 在同一时刻的旧值，整个区块在一个事务里写入
+            write(list(dict_tx.keys()), address_keys, output_keys, True)
+            return
+        # redis 监视每个 key 时都要遍历当前连接已经监视的所有 key ，一个事务监视 n 个 key 的耗时与 n 的平方成正比，
+        # 因此地址与输出分成多个小事务写入，最后再写入交易、区块与导入标记。中断时可能留下部分地址与输出，
+        # 但区块没有导入标记，重新导入时的合并结果不变（合并满足幂等性）。
+        # 小事务也让并行导入时热点地址的冲突只需要重试很少的 key
+        size = self.WATCH_CHUNK
+        # 先写入交易（不需要合并）：其他进程读到这些区块写入的占位输出时，可以由花费交易查到花费的高度
+        with self.redis.pipeline(transaction=False) as pipe:
+            self.__write(pipe, 'tx', {key: json.dumps(info) for key, info in dict_tx.items()})
+            pipe.execute()
+        for i in range(0, len(address_keys), size):
+            write([], address_keys[i:i + size], [], False)
+        for i in range(0, len(output_keys), size):
+            write([], [], output_keys[i:i + size], False)
+        write([], [], [], True)
+
+    def rollback_block(self, height: int):
+        """
+        回滚最高的一个区块（处理分叉时使用），需要在导入前设置 undo_depth
+        :param height: 区块高度，必须是当前已导入的最高高度
+        :return:
+        """
+        from redis.exceptions import WatchError
+        key_undo = self.KEY_UNDO + str(height)
+        with self.redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    pipe.watch(self.KEY_INGEST_HEIGHT, key_undo)
+                    ingest_height = pipe.get(self.KEY_INGEST_HEIGHT)
+                    assert ingest_height is not None and height == int(ingest_height), \
+                        f'只能回滚最高的区块 {ingest_height}'
+                    undo = pipe.get(key_undo)
+                    assert undo is not None, f'区块 {height} 没有回滚信息'
+                    undo = json.loads(undo)
+
+                    pipe.multi()
+                    for kind in ('tx', 'address', 'txo'):
+                        self.__write(pipe, kind, undo.get(kind, {}))
+                    restore = {key: j for key, j in undo.get('stats', {}).items() if j is not None}
+                    delete = [key for key, j in undo.get('stats', {}).items() if j is None]
+                    if restore:
+                        pipe.mset(restore)
+                    if delete:
+                        pipe.delete(*delete)
+                    pipe.delete(self.KEY_BLOCK + undo['hash'])
+                    pipe.hdel(self.KEY_BLOCK_TIME, height)
+                    pipe.hdel(self.KEY_INGEST_BLOCKS, height)
+                    pipe.set(self.KEY_INGEST_HEIGHT, height - 1)
+                    pipe.delete(key_undo)
+                    pipe.execute()
+                    if self.output_filter_height == height:
+                        self.output_filter_height = height - 1  # 回滚的输出留在过滤器里，只会多查询几次
+                    return
+                except WatchError:
+                    continue
+
+    def __advance_ingest_height(self, height: int):
+        """
+        把导入高度推进到 height （已经更高时不变）
+        :param height:
+        :return:
+        """
+        from redis.exceptions import WatchError
+        with self.redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    pipe.watch(self.KEY_INGEST_HEIGHT)
+                    ingest_height = pipe.get(self.KEY_INGEST_HEIGHT)
+                    if ingest_height is not None and int(ingest_height) >= height:
+                        pipe.unwatch()
+                        return
+                    pipe.multi()
+                    pipe.set(self.KEY_INGEST_HEIGHT, height)
+                    pipe.execute()
+                    return
+                except WatchError:
+                    continue
+
+    def parallel_write_data(self,
+                            dir_blocks: str,
+                            min_height: int,
+                            max_height: int,
+                            index_cache: str = None,
+                            show_progress: bool = False,
+                            resume: bool = False,
+                            batch_blocks: int = 10,
+                            workers: int = None,
+                            blocks_per_task: int = 1000):
+        """
+        多进程并行导入：把 [min_height, max_height] 切分成若干个互不重叠的高度区间，每个进程各自读取、解析区块，
+        并通过自己的连接池写入 redis 。不同进程修改同一个地址或输出时（例如一个区间里的输入花费了另一个区间里的输出），
+        由 from_blocks 的乐观锁保证合并结果正确。
+        子进程不推进导入高度（见 self.advance_height ），所有区间都完成后再由当前进程一次推进到已导入的最高区块，
+        因此导入中断时导入高度不变，可以用 resume=True 重新导入。各参数含义见 write_data 方法
+        :param dir_blocks:
+        :param min_height:
+        :param max_height:
+        :param index_cache: 建议先生成好，否则每个进程都要单独构建一次区块索引
+        :param show_progress: 是否显示进度（按完成的区间数）
+        :param resume: 是否跳过已经导入过的区块
+        :param batch_blocks: 每次写入的区块数
+        :param workers: 进程数，默认为 CPU 核数
+        :param blocks_per_task: 每个区间的区块数，区间越小各进程的负载越均衡
+        :return:
+        """
+        import multiprocessing
+        assert isinstance(min_height, int) and isinstance(max_height, int), '并行导入需要指定高度范围'
+        assert 0 <= min_height <= max_height, 'min_height 不能大于 max_height'
+        assert isinstance(blocks_per_task, int) and blocks_per_task > 0, blocks_per_task
+        assert self.ingest_filter is None, '并行导入不支持导入过滤器，请使用 write_data'
+        workers = workers or os.cpu_count() or 1
+        # 子进程用相同的参数创建自己的连接池（只保留可以序列化的基础参数）
+        connection_kwargs = {key: value for key, value in self.pool.connection_kwargs.items()
+                             if value is None or isinstance(value, (str, int, float, bool))}
+        connection_kwargs['connection_class'] = self.pool.connection_class
+        outpoint_path = self.outpoint_index.path if self.outpoint_index is not None else None
+        tasks = [(connection_kwargs, dir_blocks, start, min(start + blocks_per_task - 1, max_height), index_cache,
+                  resume, batch_blocks, outpoint_path, self.layout)
+                 for start in range(min_height, max_height + 1, blocks_per_task)]
+        with multiprocessing.Pool(min(workers, len(tasks))) as pool:
+            for index, _ in enumerate(pool.imap_unordered(_parallel_write_worker, tasks)):
+                if show_progress:
+                    sys.stdout.write(f'已完成 {(index + 1) / len(tasks) * 100:.1f}% -- {index + 1}/{len(tasks)}\r')
+                    sys.stdout.flush()
+        heights = [i for i in self.get_ingested_blocks() if min_height <= i <= max_height]
+        if heights:
+            self.__advance_ingest_height(max(heights))
+        return self
+
+
+def _parallel_write_worker(args) -> int:
+    """
+    并行导入的子进程：用自己的连接池导入一个高度区间
+    :param args: (连接参数, dir_blocks, min_height, max_height, index_cache, resume,
+        batch_blocks, 输出索引的目录, 数据布局)
+    :return: 区间的起始高度
+    """
+    import redis
+    (connection_kwargs, dir_blocks, min_height, max_height, index_cache, resume, batch_blocks, outpoint_path,
+     layout) = args
+    engine = RedisEngine(client=redis.Redis(connection_pool=redis.ConnectionPool(**connection_kwargs)), layout=layout)
+    engine.advance_height = False
+    if outpoint_path:
+        from .outpoints import OutpointIndex
+        engine.outpoint_index = OutpointIndex(outpoint_path)
+    engine.write_data(dir_blocks, min_height, max_height, index_cache, resume=resume, batch_blocks=batch_blocks)
+    engine.pool.disconnect()
+    return min_height
+
+
+class SqliteEngine:
+    """
+    基于 sqlite 的磁盘搜索引擎，不需要额外的服务，内存占用也不随区块数增长（适用于搜索的区块很多的时候）
+    """
+
+    # 单条 SQL 里最多的参数个数（旧版本的 sqlite 限制为 999 ）
+    CHUNK_SIZE = 900
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS tx ('
+        ' txid TEXT PRIMARY KEY, block_height INTEGER, is_coinbase INTEGER, inputs TEXT, n_outputs INTEGER'
+        ') WITHOUT ROWID',
+        'CREATE TABLE IF NOT EXISTS txo ('
+        ' key TEXT PRIMARY KEY, txid TEXT, "index" INTEGER, value INTEGER, type TEXT, addresses TEXT, spent_txid TEXT'
+        ') WITHOUT ROWID',
+        # 地址与输出的对应关系，导入时不建索引，导入完成后再统一建索引
+        'CREATE TABLE IF NOT EXISTS address_output (address TEXT, key TEXT)',
+        'CREATE TABLE IF NOT EXISTS address_stats ('
+        ' address TEXT PRIMARY KEY, received INTEGER, spent INTEGER, n_outputs INTEGER, n_utxo INTEGER,'
+        ' utxo_value INTEGER, first_height INTEGER, last_height INTEGER'
+        ') WITHOUT ROWID',
+        'CREATE TABLE IF NOT EXISTS block ('
+        ' hash TEXT PRIMARY KEY, height INTEGER, timestamp INTEGER, txids TEXT, n_tx INTEGER'
+        ') WITHOUT ROWID',
+        # 区块数很少，直接建索引
+        'CREATE INDEX IF NOT EXISTS block_height_index ON block (height)',
+    )
+    INDEXES = (
+        'CREATE UNIQUE INDEX IF NOT EXISTS address_output_index ON address_output (address, key)',
+    )
+
+    # 与 FileEngine.from_block 一致的合并规则：新值为空时保留旧值
+    UPSERT_TXO = (
+        'INSERT INTO txo VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET '
+        'spent_txid = COALESCE(excluded.spent_txid, txo.spent_txid), '
+        'value = CASE WHEN excluded.value THEN excluded.value ELSE txo.value END, '
+        'type = COALESCE(NULLIF(excluded.type, \'\'), txo.type), '
+        'addresses = CASE WHEN excluded.addresses != \'[]\' THEN excluded.addresses ELSE txo.addresses END'
+    )
+    # 累加地址统计的变化量
+    UPSERT_STATS = (
+        'INSERT INTO address_stats VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (address) DO UPDATE SET '
+        'received = received + excluded.received, '
+        'spent = spent + excluded.spent, '
+        'n_outputs = n_outputs + excluded.n_outputs, '
+        'n_utxo = n_utxo + excluded.n_utxo, '
+        'utxo_value = utxo_value + excluded.utxo_value, '
+        'first_height = MIN(first_height, excluded.first_height), '
+        'last_height = MAX(last_height, excluded.last_height)'
+    )
+    STATS_COLUMNS = ('address', 'received', 'spent', 'n_outputs', 'n_utxo', 'utxo_value', 'first_height',
+                     'last_height')
+
+    def __init__(self, path: str):
+        """
+        :param path: 数据库文件路径，不存在时自动创建
+        """
+        import sqlite3
+        assert sqlite3.sqlite_version_info >= (3, 24), f'sqlite 版本 {sqlite3.sqlite_version} 过低，至少需要 3.24'
+        self.path = str(path)
+        self.local = threading.local()  # 每个线程使用单独的连接（ WAL 模式下读操作可以并发）
+        self.record_views = False  # 设置后查询直接把查询到的行作为 models 里的只读视图返回，不再为每行新建字典
+        self.output_filter = None  # 有真实数据的输出 key 的布隆过滤器，见 self.get_output_filter
+        self.outpoint_index = None  # 设置后，导入时用全链的输出索引补全区块范围之前的输出，见 outpoints.OutpointIndex
+        self.ingest_filter = None  # 设置后，导入时丢弃不关心的输出，见 filters.IngestFilter
+        conn = self.conn
+        conn.execute('PRAGMA journal_mode = WAL')
+        for sql in self.SCHEMA:
+            conn.execute(sql)
+        conn.commit()
+
+    @property
+    def conn(self):
+        """
+        当前线程的数据库连接
+        :return:
+        """
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            import sqlite3
+            conn = sqlite3.connect(self.path)
+            conn.execute('PRAGMA cache_size = -65536')  # 64 MB 的页缓存
+            # WAL 模式下 NORMAL 只在检查点时同步，断电或系统崩溃时可能丢失最近提交的几个事务，但不会损坏数据库
+            # （ OFF 在系统崩溃时可能损坏数据库，即使是 WAL 模式）
+            conn.execute('PRAGMA synchronous = NORMAL')
+            self.local.conn = conn
+        return conn
+
+    def close(self):
+        """
+        关闭当前线程的数据库连接
+        :return:
+        """
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+    def __select(self, sql: str, keys: List[str]) -> list:
+        """
+        分批执行 IN 查询
+        :param sql: 含有一个 {} 占位符的 SQL ，占位符会被替换为 ?,?,...
+        :param keys:
+        :return: 所有结果行
+        """
+        rows = []
+        for i in range(0, len(keys), self.CHUNK_SIZE):
+            chunk = keys[i:i + self.CHUNK_SIZE]
+            rows.extend(self.conn.execute(sql.format(','.join('?' * len(chunk))), chunk))
+        return rows
+
+    def get_address(self, address: str) -> dict:
+        """
+        获取单个地址详情，详情内容请见 FileEngine.get_address
+        :param address:
+        :return:
+        """
+        if isinstance(address, str):
+            return self.batch_get_address([address])[0]
+        return {}
+
+    def batch_get_address(self, addresses: List[str]) -> List[dict]:
+        """
+        批量获取地址详情，详情内容请见 FileEngine.get_address
+        :param addresses:
+        :return:
+        """
+        addresses = list(addresses)
+        dict_address = {}
+        sql = 'SELECT address, key FROM address_output WHERE address IN ({}) ORDER BY rowid'
+        for address, key in self.__select(sql, list(set(addresses))):
+            outputs = dict_address.get(address)
+            if outputs is None:
+                dict_address[address] = [key]
+            elif key not in outputs:
+                outputs.append(key)  # 建索引之前可能有重复数据
+        if self.record_views:
+            return [Address((i, dict_address[i], [])) if i in dict_address else None for i in addresses]
+        return [{'address': i, 'outputs': dict_address[i], 'labels': []} if i in dict_address else None
+                for i in addresses]
+
+    def get_address_stats(self, address: str) -> dict:
+        """
+        获取单个地址的统计，详情内容请见 FileEngine.get_address_stats
+        :param address:
+        :return:
+        """
+        if isinstance(address, str):
+            return self.batch_get_address_stats([address])[0]
+        return {}
+
+    def batch_get_address_stats(self, addresses: List[str]) -> List[dict]:
+        """
+        批量获取地址的统计，详情内容请见 FileEngine.get_address_stats
+        :param addresses:
+        :return:
+        """
+        addresses = list(addresses)
+        sql = 'SELECT * FROM address_stats WHERE address IN ({})'
+        dict_stats = {row[0]: dict(zip(self.STATS_COLUMNS, row)) for row in self.__select(sql, list(set(addresses)))}
+        return [dict_stats.get(i) for i in addresses]
+
+    def get_block(self, block_hash: str) -> dict:
+        """
+        获取单个区块详情，详情内容请见 FileEngine.get_block
+        :param block_hash:
+        :return:
+        """
+        if isinstance(block_hash, str):
+            return self.batch_get_block([block_hash])[0]
+        return {}
+
+    def batch_get_block(self, block_hashes: List[str]) -> List[dict]:
+        """
+        批量获取区块详情
+        :param block_hashes:
+        :return:
+        """
+        block_hashes = list(block_hashes)
+        dict_block = {}
+        sql = 'SELECT hash, height, timestamp, txids, n_tx FROM block WHERE hash IN ({})'
+        if self.record_views:
+            dict_block = {row[0]: BlockView(row) for row in self.__select(sql, list(set(block_hashes)))}
+            return [dict_block.get(i) for i in block_hashes]
+        for block_hash, height, timestamp, txids, n_tx in self.__select(sql, list(set(block_hashes))):
+            dict_block[block_hash] = {
+                'hash': block_hash,
+                'height': height,
+                'timestamp': timestamp,
+                'txids': json.loads(txids),
+                'n_tx': n_tx,
+            }
+        return [dict_block.get(i) for i in block_hashes]
+
+    def get_block_index(self) -> BlockIndex:
+        """
+        已导入区块的时间索引（每次调用时从数据库读取）
+        :return:
+        """
+        return BlockIndex.from_items(self.conn.execute('SELECT height, timestamp FROM block'))
+
+    def get_tx(self, txid: str) -> dict:
+        """
+        获取单个交易详情，详情内容请见 FileEngine.get_tx
+        :param txid:
+        :return:
+        """
+        if isinstance(txid, str):
+            return self.batch_get_tx([txid])[0]
+        return {}
+
+    def batch_get_tx(self, txids: List[str]) -> List[dict]:
+        """
+        批量获取交易详情，详情内容请见 FileEngine.get_tx
+        :param txids:
+        :return:
+        """
+        txids = list(txids)
+        dict_tx = {}
+        sql = 'SELECT txid, block_height, is_coinbase, inputs, n_outputs FROM tx WHERE txid IN ({})'
+        if self.record_views:
+            dict_tx = {row[0]: Transaction(row) for row in self.__select(sql, list(set(txids)))}
+            return [dict_tx.get(i) for i in txids]
+        for txid, block_height, is_coinbase, inputs, n_outputs in self.__select(sql, list(set(txids))):
+            dict_tx[txid] = {
+                'txid': txid,
+                'block_height': block_height,
+                'is_coinbase': bool(is_coinbase),
+                'inputs': json.loads(inputs),
+                'n_outputs': n_outputs,
+            }
+        return [dict_tx.get(i) for i in txids]
+
+    def get_txo(self, key: str) -> dict:
+        """
+        获取单个 txo 详情，详情内容请见 FileEngine.get_txo
+        :param key:
+        :return:
+        """
+        if isinstance(key, str):
+            return self.batch_get_txo([key])[0]
+        return {}
+
+    def batch_get_txo(self, keys: List[str]) -> List[dict]:
+        """
+        批量获取 txo 详情，详情内容请见 FileEngine.get_txo
+        :param keys:
+        :return:
+        """
+        keys = list(keys)
+        dict_output = {}
+        sql = 'SELECT key, txid, "index", value, type, addresses, spent_txid FROM txo WHERE key IN ({})'
+        if self.record_views:
+            dict_output = {row[0]: Output(row) for row in self.__select(sql, list(set(keys)))}
+            return [dict_output.get(i) for i in keys]
+        for key, txid, index, value, output_type, addresses, spent_txid in self.__select(sql, list(set(keys))):
+            dict_output[key] = {
+                'key': key,
+                'txid': txid,
+                'index': index,
+                'value': value,
+                'type': output_type,
+                'addresses': json.loads(addresses),
+                'spent_txid': spent_txid,
+            }
+        return [dict_output.get(i) for i in keys]
+
+    def iter_address(self) -> Iterator[dict]:
+        """
+        遍历所有地址详情
+        :return:
+        """
+        info = None
+        for address, key in self.conn.execute('SELECT DISTINCT address, key FROM address_output ORDER BY address'):
+            if info is None or info['address'] != address:
+                if info is not None:
+                    yield info
+                info = {'address': address, 'outputs': [], 'labels': []}
+            info['outputs'].append(key)
+        if info is not None:
+            yield info
+
+    def iter_tx(self) -> Iterator[dict]:
+        """
+        遍历所有交易详情
+        :return:
+        """
+        for txid, block_height, is_coinbase, inputs, n_outputs in self.conn.execute('SELECT * FROM tx'):
+            yield {
+                'txid': txid,
+                'block_height': block_height,
+                'is_coinbase': bool(is_coinbase),
+                'inputs': json.loads(inputs),
+                'n_outputs': n_outputs,
+            }
+
+    def iter_txo(self) -> Iterator[dict]:
+        """
+        遍历所有输出详情
+        :return:
+        """
+        for key, txid, index, value, output_type, addresses, spent_txid in self.conn.execute('SELECT * FROM txo'):
+            yield {
+                'key': key,
+                'txid': txid,
+                'index': index,
+                'value': value,
+                'type': output_type,
+                'addresses': json.loads(addresses),
+                'spent_txid': spent_txid,
+            }
+
+    def get_output_filter(self, rebuild: bool = False) -> BloomFilter:
+        """
+        有真实数据的输出 key 的布隆过滤器（见 FileEngine.get_output_filter ），第一次调用时建立，
+        之后由当前实例导入的区块会同步更新过滤器
+        :param rebuild: 是否重新建立（其他进程写入了数据时使用）
+        :return:
+        """
+        if self.output_filter is None or rebuild:
+            n_keys = self.conn.execute('SELECT COUNT(*) FROM txo').fetchone()[0]
+            keys = (key for key, in self.conn.execute('SELECT key FROM txo WHERE type IS NOT NULL'))
+            self.output_filter = build_key_filter(keys, 2 * n_keys)
+        return self.output_filter
+
+    def write_data(self,
+                   dir_blocks: str,
+                   min_height: int = None,
+                   max_height: int = None,
+                   index_cache: str = None,
+                   show_progress: bool = False,
+                   blocks: Iterable['Block'] = None,
+                   batch_blocks: int = 100):
+        """
+        从区块数据里构建交易、输出、地址 3 张表，各参数含义见 RedisEngine.write_data 方法
+        :param dir_blocks:
+        :param min_height:
+        :param max_height:
+        :param index_cache:
+        :param show_progress: 是否显示进度
+        :param blocks: 按高度排好序的区块迭代器，为空时从 dir_blocks 里读取
+        :param batch_blocks: 每个事务写入的区块数，越大导入越快，但中断时丢失的进度越多
+        :return:
+        """
+        assert isinstance(batch_blocks, int) and batch_blocks > 0, batch_blocks
+        conn = self.conn
+        conn.execute('PRAGMA temp_store = MEMORY')
+        n_blocks = 0
+
+        def from_block(block: 'Block'):
+            nonlocal n_blocks
+            self.from_block(block)  # 第一条写语句会自动开启事务
+            n_blocks += 1
+            if n_blocks % batch_blocks == 0:
+                conn.commit()
+
+        file_engine = FileEngine(dir_blocks, min_height, max_height, index_cache, show_warning=False)
+        file_engine.from_block = from_block  # 覆盖 FileEngine 的读取数据的函数
+        file_engine.read_data(show_progress, blocks)
+        conn.commit()
+        self.create_indexes()
+        return self
+
+    def from_block(self, block: 'Block'):
+        """
+        读取区块数据，并更新数据库（不提交事务）
+        :param block:
+        :return:
+        """
         dict_tx, dict_address, dict_output = parser_block(block)
+        if self.outpoint_index is not None:
+            self.outpoint_index.fill(dict_output)
+        if self.ingest_filter is not None:
+            self.ingest_filter.apply(dict_tx, dict_address, dict_output)
+        conn = self.conn
 
-        # 批量保存交易
-        self.redis.mset({key: json.dumps(info) for key, info in dict_tx.items()})
+        # 地址统计的变化量（更新输出前计算）
+        deltas = {}
+        old_outputs = self.batch_get_txo(list(dict_output))
+        spent_txids = [placeholder_spent_txid(info_old, info_new)
+                       for info_new, info_old in zip(dict_output.values(), old_outputs)]
+        spent_heights = {i['txid']: i['block_height'] for i in self.batch_get_tx([i for i in spent_txids if i]) if i}
+        for info_new, info_old, spent_txid in zip(dict_output.values(), old_outputs, spent_txids):
+            diff_address_stats(info_old, merge_output(dict(info_new), info_old), deltas, block.height,
+                               spent_height=spent_heights.get(spent_txid))
 
-        # 批量更新地址
-        key_list = list(dict_address.keys())
-        for key, j in zip(key_list, self.redis.mget(key_list)):
-            info_old = json.loads(j) if j else None
-            info_new = dict_address[key]
-            if info_old:
-                info_new['outputs'] = list(set(info_new['outputs'] + info_old['outputs']))
-                info_new['labels'] = list(set(info_new['labels'] + info_old['labels']))
-        self.redis.mset({key: json.dumps(info) for key, info in dict_address.items()})
+        # 保存区块与交易
+        block_info = parser_block_info(block, dict_tx)
+        conn.execute('INSERT OR REPLACE INTO block VALUES (?, ?, ?, ?, ?)', (
+            block_info['hash'], block_info['height'], block_info['timestamp'], json.dumps(block_info['txids']),
+            block_info['n_tx']))
+        conn.executemany('INSERT OR REPLACE INTO tx VALUES (?, ?, ?, ?, ?)', [
+            (i['txid'], i['block_height'], i['is_coinbase'], json.dumps(i['inputs']), i['n_outputs'])
+            for i in dict_tx.values()
+        ])
+
+        # 批量更新地址（建索引前直接追加，建索引后由唯一索引去重）
+        conn.executemany('INSERT OR IGNORE INTO address_output VALUES (?, ?)', [
+            (address, key) for address, info in dict_address.items() for key in info['outputs']
+        ])
 
         # 批量更新输出
-        key_list = list(dict_output.keys())
-        for key, j in zip(key_list, self.redis.mget(key_list)):
-            info_old = json.loads(j) if j else None
-            if info_old:
-                info_new = dict_output[key]
-                info_new['spent_txid'] = info_new['spent_txid'] or info_old['spent_txid']
-                info_new['value'] = info_new['value'] or info_old['value']
-                info_new['type'] = info_new['type'] or info_old['type']
-                info_new['addresses'] = info_new['addresses'] or info_old['addresses']
-        self.redis.mset({key: json.dumps(info) for key, info in dict_output.items()})
+        conn.executemany(self.UPSERT_TXO, [
+            (i['key'], i['txid'], i['index'], i['value'], i['type'], json.dumps(i['addresses']), i['spent_txid'])
+            for i in dict_output.values()
+        ])
+        if self.output_filter is not None:
+            for key, info in dict_output.items():
+                if info['type'] is not None:
+                    self.output_filter.add(key)
+
+        # 批量更新地址统计
+        conn.executemany(self.UPSERT_STATS, [
+            (address, *(delta[i] for i in self.STATS_COLUMNS[1:])) for address, delta in deltas.items()
+        ])
+
+    def create_indexes(self):
+        """
+        去掉重复的地址数据后建索引，并更新查询优化器的统计信息
+        :return:
+        """
+        conn = self.conn
+        if not conn.execute('SELECT 1 FROM sqlite_master WHERE name = ?', ('address_output_index',)).fetchone():
+            conn.execute('DELETE FROM address_output WHERE rowid NOT IN '
+                         '(SELECT MIN(rowid) FROM address_output GROUP BY address, key)')
+        for sql in self.INDEXES:
+            conn.execute(sql)
+        conn.commit()
+        conn.execute('ANALYZE')
+        conn.commit()
@@ -0,0 +1,250 @@
+from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from .parser import merge_address, merge_output
+from .blocks import BlockIndex
+from .utils import hash_key
+import copy
+import sys
+
+
+class _AnyFilter:
+    """
+    多个布隆过滤器的并集
+    """
+
+    def __init__(self, filters: list):
+        self.filters = filters
+
+    def __contains__(self, key: str) -> bool:
+        h = hash_key(key)
+        return any(i.contains_hash(h) for i in self.filters)
+
+
+class FederatedEngine:
+    """
+    按区块高度分片的联合搜索引擎：每个分片是一个覆盖一段高度区间的引擎（例如不同的 redis 数据库、不同的 sqlite 文件），
+    查询时并行地发给各个分片，再合并结果：
+    1. 交易只存在于所在区块的分片里，已知高度的交易（查到过的）直接发给对应的分片
+    2. 输出的金额、地址在创建它的分片里，而消费它的 spent_txid 在消费交易所在的分片里，需要合并
+    3. 地址的输出分布在多个分片里，需要合并
+    通过 set_height_range 限定高度范围后，范围外的分片不会被查询（与只加载该范围的数据的引擎行为一致）。
+    多个调用方（例如同时运行的多个追溯）共用一个引擎时，每个调用方用 view 得到自己的视图后再限定范围
+    """
+
+    def __init__(self, shards: List[Tuple[int, int, object]], max_workers: int = None, tx_cache_size: int = 1 << 20):
+        """
+        :param shards: [(最低区块高度, 最高区块高度, 引擎), ...] ，各分片的高度区间不能重叠
+        :param max_workers: 并行查询的线程数，默认为分片数
+        :param tx_cache_size: 缓存的 txid -> 分片 的最大个数
+        """
+        assert shards, 'shards 不能为空'
+        shards = sorted(shards, key=lambda x: x[0])
+        for min_height, max_height, engine in shards:
+            assert isinstance(min_height, int) and isinstance(max_height, int), (min_height, max_height)
+            assert min_height <= max_height, f'min_height {min_height} 不能大于 max_height {max_height}'
+            for method in ('batch_get_tx', 'batch_get_txo', 'batch_get_address'):
+                assert hasattr(engine, method), f'engine 需要有 {method} 方法'
+        for (_, max_height, _), (min_height, _, _) in zip(shards, shards[1:]):
+            assert max_height < min_height, f'分片的高度区间重叠：{max_height} >= {min_height}'
+
+        self.shards = shards
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or len(shards))
+        self.tx_cache_size = tx_cache_size
+        self.dict_tx_shard = {}  # txid -> 分片序号
+        self.active = list(range(len(shards)))  # 参与查询的分片序号，见 set_height_range
+
+    def view(self, min_height: int = None, max_height: int = None) -> 'FederatedEngine':
+        """
+        创建一个视图：与当前引擎共用分片、线程池与交易所在分片的缓存，只有查询的高度范围是自己的，创建的开销很小
+        :param min_height: 为空时不限制
+        :param max_height: 为空时不限制
+        :return:
+        """
+        return copy.copy(self).set_height_range(min_height, max_height)
+
+    def set_height_range(self, min_height: int = None, max_height: int = None):
+        """
+        限定当前对象查询的高度范围，与该范围没有交集的分片不会被查询。
+        只影响调用的对象本身，共用引擎时请在各自的视图（见 view ）上调用
+        :param min_height: 为空时不限制
+        :param max_height: 为空时不限制
+        :return:
+        """
+        min_height = min_height if min_height is not None else 0
+        max_height = max_height if max_height is not None else sys.maxsize
+        self.active = [i for i, (low, high, _) in enumerate(self.shards) if low <= max_height and high >= min_height]
+        return self
+
+    def shard_of_height(self, height: int) -> int:
+        """
+        区块高度所在的分片
+        :param height:
+        :return: 分片序号，不在任何分片里时返回 None
+        """
+        for i, (low, high, _) in enumerate(self.shards):
+            if low <= height <= high:
+                return i
+        return None
+
+    def __fan_out(self, method: str, keys: list, shard_ids: List[int]) -> List[list]:
+        """
+        并行地在多个分片上执行批量查询
+        :param method: 批量查询的方法名
+        :param keys:
+        :param shard_ids: 分片序号
+        :return: 每个分片的查询结果
+        """
+        if len(shard_ids) == 1:
+            return [getattr(self.shards[shard_ids[0]][2], method)(keys)]
+        futures = [self.executor.submit(getattr(self.shards[i][2], method), keys) for i in shard_ids]
+        return [future.result() for future in futures]
+
+    def get_address(self, address: str) -> dict:
+        """
+        获取单个地址详情，详情内容请见 FileEngine.get_address
+        :param address:
+        :return:
+        """
+        if isinstance(address, str):
+            return self.batch_get_address([address])[0]
+        return {}
+
+    def batch_get_address(self, addresses: List[str]) -> List[dict]:
+        """
+        批量获取地址详情，合并各个分片里的输出与标签，详情内容请见 FileEngine.get_address
+        :param addresses:
+        :return:
+        """
+        addresses = list(addresses)
+        result = [None] * len(addresses)
+        for shard_result in self.__fan_out('batch_get_address', addresses, self.active):
+            for i, info in enumerate(shard_result):
+                if info:
+                    result[i] = merge_address(dict(info), result[i])
+        return result
+
+    def get_tx(self, txid: str) -> dict:
+        """
+        获取单个交易详情，详情内容请见 FileEngine.get_tx
+        :param txid:
+        :return:
+        """
+        if isinstance(txid, str):
+            return self.batch_get_tx([txid])[0]
+        return {}
+
+    def batch_get_tx(self, txids: List[str]) -> List[dict]:
+        """
+        批量获取交易详情，已知所在分片的交易只查询对应的分片，其他交易发给所有分片，详情内容请见 FileEngine.get_tx
+        :param txids:
+        :return:
+        """
+        txids = list(txids)
+        dict_tx = {}
+
+        # 已知所在分片的交易
+        routed = {}
+        for txid in txids:
+            shard_id = self.dict_tx_shard.get(txid)
+            if shard_id is not None and shard_id in self.active:
+                routed.setdefault(shard_id, []).append(txid)
+        futures = {i: self.executor.submit(self.shards[i][2].batch_get_tx, keys) for i, keys in routed.items()}
+        for shard_id, future in futures.items():
+            dict_tx.update((txid, info) for txid, info in zip(routed[shard_id], future.result()) if info)
+
+        # 未知所在分片的交易
+        unknown = list({i for i in txids if i not in dict_tx and self.dict_tx_shard.get(i) is None})
+        if unknown:
+            for shard_result in self.__fan_out('batch_get_tx', unknown, self.active):
+                dict_tx.update((txid, info) for txid, info in zip(unknown, shard_result) if info)
+
+        # 记录交易所在的分片
+        if len(self.dict_tx_shard) > self.tx_cache_size:
+            self.dict_tx_shard.clear()  # 清空而不是替换，各个视图继续共用同一个缓存
+        for txid, info in dict_tx.items():
+            self.dict_tx_shard[txid] = self.shard_of_height(info['block_height'])
+        return [dict_tx.get(i) for i in txids]
+
+    def get_txo(self, key: str) -> dict:
+        """
+        获取单个 txo 详情，详情内容请见 FileEngine.get_txo
+        :param key:
+        :return:
+        """
+        if isinstance(key, str):
+            return self.batch_get_txo([key])[0]
+        return {}
+
+    def batch_get_txo(self, keys: List[str]) -> List[dict]:
+        """
+        批量获取 txo 详情，合并创建输出的分片与消费输出的分片里的数据，详情内容请见 FileEngine.get_txo
+        :param keys:
+        :return:
+        """
+        keys = list(keys)
+        result = [None] * len(keys)
+        for shard_result in self.__fan_out('batch_get_txo', keys, self.active):
+            for i, info in enumerate(shard_result):
+                if info:
+                    result[i] = merge_output(dict(info), result[i])
+        return result
+
+    def get_block(self, block_hash: str) -> dict:
+        """
+        获取单个区块详情，详情内容请见 FileEngine.get_block
+        :param block_hash:
+        :return:
+        """
+        if isinstance(block_hash, str):
+            return self.batch_get_block([block_hash])[0]
+        return {}
+
+    def batch_get_block(self, block_hashes: List[str]) -> List[dict]:
+        """
+        批量获取区块详情，区块 hash 看不出所在的分片，因此查询所有支持的分片
+        :param block_hashes:
+        :return:
+        """
+        block_hashes = list(block_hashes)
+        result = [None] * len(block_hashes)
+        shard_ids = [i for i, (_, _, engine) in enumerate(self.shards) if hasattr(engine, 'batch_get_block')]
+        for shard_result in self.__fan_out('batch_get_block', block_hashes, shard_ids):
+            for i, info in enumerate(shard_result):
+                if info:
+                    result[i] = info
+        return result
+
+    def get_block_index(self) -> BlockIndex:
+        """
+        合并各分片的区块时间索引
+        :return:
+        """
+        indexes = [engine.get_block_index() for _, _, engine in self.shards if hasattr(engine, 'get_block_index')]
+        return BlockIndex.from_items(item for index in indexes for item in index.items())
+
+    def get_output_filter(self) -> '_AnyFilter':
+        """
+        有真实数据的输出 key 的过滤器（见 FileEngine.get_output_filter ），任一分片的过滤器里有该 key 即可
+        :return: 有分片不支持过滤器时返回 None
+        """
+        filters = [engine.get_output_filter() if hasattr(engine, 'get_output_filter') else None
+                   for _, _, engine in self.shards]
+        if any(i is None for i in filters):
+            return None
+        return _AnyFilter(filters)
+
+    def get_ingest_height(self) -> int:
+        """
+        各分片已经导入的最高区块高度
+        :return: 都没有导入过时返回 None
+        """
+        heights = [engine.get_ingest_height() for _, _, engine in self.shards if hasattr(engine, 'get_ingest_height')]
+        heights = [i for i in heights if i is not None]
+        return max(heights) if heights else None
+
+    def close(self):
+        """
+        关闭查询线程池
+        :return:
+        """
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,120 @@
+from typing import Iterable
+
+
+class IngestFilter:
+    """
+    导入过滤器：在 parser_block 解析之后、写入引擎之前丢弃不关心的输出（粉尘、OP_RETURN 等），减少引擎占用的内存。
+    设置到引擎的 ingest_filter 属性上即可生效，被丢弃的输出不会写入输出与地址数据（交易仍然保留，追溯时
+    Trace 会把这些输出标记为 filtered 节点）。
+    由输入生成的占位详情（类型为空）不会被过滤：它们记录了区块范围内的输出被哪笔交易花费
+    """
+
+    def __init__(self,
+                 min_value: int = None,
+                 exclude_types: Iterable[str] = None,
+                 allow_addresses: Iterable[str] = None,
+                 allow_clusters: Iterable[int] = None,
+                 clusters=None):
+        """
+        :param min_value: 金额（聪）小于该值的输出被丢弃，为空时不限制
+        :param exclude_types: 被丢弃的输出类型，例如 ['OP_RETURN', 'nonstandard']
+        :param allow_addresses: 地址白名单，设置后只保留收款地址在白名单里
+                                （或所在的簇在 allow_clusters 里）的输出，
+                                可以是集合或 LabelStore 等支持 in 的对象
+        :param allow_clusters: 簇 id 白名单，需要同时传入 clusters
+        :param clusters: 地址聚类，见 AddressClusters
+        """
+        assert min_value is None or isinstance(min_value, int) and min_value >= 0, min_value
+        assert allow_clusters is None or clusters is not None, 'allow_clusters 需要同时传入 clusters'
+        assert clusters is None or hasattr(clusters, 'get_cluster'), 'clusters 需要有 get_cluster 方法'
+        self.min_value = min_value
+        self.exclude_types = set(exclude_types or [])
+        if isinstance(allow_addresses, (list, tuple)) or allow_addresses is not None and not hasattr(
+                allow_addresses, '__contains__'):
+            allow_addresses = set(allow_addresses)  # 列表与迭代器转换为集合
+        self.allow_addresses = allow_addresses
+        self.allow_clusters = set(allow_clusters) if allow_clusters is not None else None
+        self.clusters = clusters
+
+        # 过滤统计
+        self.n_outputs = 0  # 检查过的输出数（不含占位详情）
+        self.dropped = {'type': 0, 'min_value': 0, 'allowlist': 0}  # 每个条件丢弃的输出数
+        self.dropped_value = 0  # 丢弃的输出的总金额（聪）
+        self.dropped_addresses = 0  # 因所有输出都被丢弃而不再写入的地址数（按区块累计）
+
+    def __allowed(self, addresses: list) -> bool:
+        """
+        输出的收款地址是否在白名单里
+        :param addresses:
+        :return:
+        """
+        if self.allow_addresses is not None and any(i in self.allow_addresses for i in addresses):
+            return True
+        if self.allow_clusters is not None:
+            return any(i in self.allow_clusters for i in self.clusters.batch_get_cluster(addresses))
+        return False
+
+    def check(self, info: dict) -> str:
+        """
+        检查一个输出
+        :param info: 输出详情
+        :return: 丢弃它的条件（ type/min_value/allowlist ），保留时返回 None
+        """
+        if info['type'] is None:
+            return None  # 占位详情
+        if info['type'] in self.exclude_types:
+            return 'type'
+        if self.min_value is not None and (info['value'] or 0) < self.min_value:
+            return 'min_value'
+        has_allowlist = self.allow_addresses is not None or self.allow_clusters is not None
+        if has_allowlist and not self.__allowed(info['addresses']):
+            return 'allowlist'
+        return None
+
+    def apply(self, dict_tx: dict, dict_address: dict, dict_output: dict):
+        """
+        过滤一个区块的解析结果（直接修改传入的字典）
+        :param dict_tx: 交易字典，不会被修改
+        :param dict_address: 地址字典
+        :param dict_output: 输出字典
+        :return: 与 parser_block 相同的 3 个字典
+        """
+        dropped_keys = set()
+        for key, info in dict_output.items():
+            if info['type'] is None:
+                continue
+            self.n_outputs += 1
+            reason = self.check(info)
+            if reason is not None:
+                self.dropped[reason] += 1
+                self.dropped_value += info['value'] or 0
+                dropped_keys.add(key)
+        if not dropped_keys:
+            return dict_tx, dict_address, dict_output
+
+        for key in dropped_keys:
+            del dict_output[key]
+        for address in list(dict_address):
+            info = dict_address[address]
+            outputs = [i for i in info['outputs'] if i not in dropped_keys]
+            if not outputs:
+                del dict_address[address]
+                self.dropped_addresses += 1
+            elif len(outputs) < len(info['outputs']):
+                info['outputs'] = outputs
+        return dict_tx, dict_address, dict_output
+
+    def report(self) -> dict:
+        """
+        过滤统计
+        :return: {"n_outputs": 检查过的输出数, "dropped": {条件: 丢弃的输出数},
+                  "dropped_outputs": 丢弃的输出数, "dropped_value": 丢弃的总金额,
+                  "dropped_addresses": 不再写入的地址数}
+        """
+        return {
+            'n_outputs': self.n_outputs,
+            'dropped': dict(self.dropped),
+            'dropped_outputs': sum(self.dropped.values()),
+            'dropped_value': self.dropped_value,
+            'dropped_addresses': self.dropped_addresses,
+        }
@@ -0,0 +1,264 @@
+from typing import Iterator, List, Optional, Tuple
+from .script import double_sha256
+from .parser import _read_varint
+import logging
+import struct
+import glob
+import time
+import os
+
+MAGIC = bytes.fromhex('f9beb4d9')  # 主网的区块文件魔数
+
+
+def get_coinbase_height(raw: bytes) -> Optional[int]:
+    """
+    从 coinbase 交易输入脚本开头的高度读取区块高度（ BIP34 ，版本号 >= 2 的区块才有）
+    :param raw: 区块字节
+    :return: 区块高度，读取不到时返回 None
+    """
+    if struct.unpack_from('<I', raw)[0] < 2:
+        return None
+    try:
+        _, offset = _read_varint(raw, 80)  # 交易数
+        offset += 4  # 交易版本号
+        if raw[offset] == 0:
+            offset += 2  # 隔离见证的 marker 和 flag
+        _, offset = _read_varint(raw, offset)  # 输入数
+        _, offset = _read_varint(raw, offset + 36)  # 跳过引用的输出，读取脚本长度
+        size = raw[offset]
+        if 1 <= size <= 8:
+            return int.from_bytes(raw[offset + 1:offset + 1 + size], 'little')
+        if 0x51 <= size <= 0x60:
+            return size - 0x50  # OP_1 ~ OP_16
+    except (IndexError, struct.error):
+        pass
+    return None
+
+
+class Follower:
+    """
+    实时跟踪全节点新写入的区块，并增量地更新搜索引擎（ FileEngine 或 RedisEngine ）。
+
+    全节点运行时会锁住 blocks/index 的 leveldb ，因此这里不读索引，而是直接读取 blk*.dat 文件末尾新追加的区块，
+    再通过区块头里的上一个区块 hash 把区块连到已导入的链上：
+    1. 能接到当前最高区块后面的，直接导入
+    2. 接到更早区块上的（分叉），先缓存起来，等分叉链比当前链更长时，逐个回滚当前链的区块后再导入分叉链
+    3. 父区块还没出现的（ blk 文件里的区块不一定按顺序写入），也先缓存起来
+    回滚依赖引擎在导入时记录的回滚信息，因此要求引擎已经导入过至少一个区块（例如先调用 write_data 追到最新高度）。
+    创建 Follower 之前导入的区块没有回滚信息，分叉点低于创建时的最高区块的分叉链会被忽略
+    """
+
+    def __init__(self,
+                 engine,
+                 dir_blocks: str,
+                 poll_interval: float = 5.0,
+                 undo_depth: int = 100,
+                 n_files: int = 2,
+                 max_pending_bytes: int = 256 * 1024 * 1024):
+        """
+        :param engine: 搜索引擎，
+            需要有 from_block 、 rollback_block 、 get_ingested_blocks 方法
+        :param dir_blocks: 全节点下 blocks 目录的路径
+        :param poll_interval: 轮询间隔（秒）
+        :param undo_depth: 引擎保留回滚信息的区块数，即能处理的最大分叉深度
+        :param n_files: 启动时从最新的几个 blk 文件的开头开始读取（已经导入过的区块会被跳过）
+        :param max_pending_bytes: 缓存的未连接区块的总大小上限（字节），超过时丢弃最早缓存的区块
+        """
+        dir_blocks = str(dir_blocks)
+        assert os.path.exists(dir_blocks), f'路径 {dir_blocks} 不存在'
+        for method in ('from_block', 'rollback_block', 'get_ingested_blocks'):
+            assert hasattr(engine, method), f'engine 需要有 {method} 方法'
+        assert isinstance(undo_depth, int) and undo_depth > 0, undo_depth
+        assert isinstance(n_files, int) and n_files > 0, n_files
+        ingested = engine.get_ingested_blocks()
+        assert ingested, 'engine 还没有导入过区块，请先调用 write_data/read_data 导入到接近最新的高度'
+
+        self.engine = engine
+        self.dir_blocks = dir_blocks
+        self.poll_interval = poll_interval
+        self.n_files = n_files
+        self.max_pending_bytes = max_pending_bytes
+        self.logger = logging.getLogger(__name__)
+        engine.undo_depth = max(engine.undo_depth, undo_depth)
+
+        # 主链上最近的区块：高度 -> hash ，以及反向的 hash -> 高度
+        self.main_chain = dict(sorted(ingested.items())[-undo_depth:])
+        self.main_heights = {v: k for k, v in self.main_chain.items()}
+        # 创建时的最高区块，它和之前的区块是在提高 undo_depth 之前导入的，没有回滚信息，不能作为回滚的对象
+        self.start_height = max(self.main_chain)
+        # 未连接到主链的区块：
+        # hash -> (上一个区块 hash, blk 文件路径, 偏移量, 大小) ，只记录位置，导入时再读取
+        self.pending = {}
+        self.pending_bytes = 0  # pending 里区块的总大小
+        self.imported = {}  # 由 Follower 导入、还在回滚范围内的区块，回滚后放回 pending ，以便再次切换回来
+        self.positions = {}  # 每个 blk 文件已经读取到的位置：路径 -> 偏移量
+
+    @property
+    def tip(self) -> Tuple[int, str]:
+        """
+        当前的最高区块
+        :return: (高度, hash)
+        """
+        height = max(self.main_chain)
+        return height, self.main_chain[height]
+
+    @property
+    def min_fork_height(self) -> int:
+        """
+        能处理的最低分叉点：分叉点之后的主链区块都需要有回滚信息
+        :return:
+        """
+        return max(self.start_height, min(self.main_chain))
+
+    def iter_new_blocks(self) -> Iterator[Tuple[str, int, bytes]]:
+        """
+        读取 blk 文件里新追加的区块（全节点会预先用 0 填充文件，读到 0 或不完整的区块时停止，下次再从这里继续读）
+        :return: (blk 文件路径, 区块的偏移量, 区块字节) 的生成器
+        """
+        paths = sorted(glob.glob(os.path.join(self.dir_blocks, 'blk*.dat')))
+        if not self.positions:
+            for path in paths[:-self.n_files]:
+                self.positions[path] = None  # 启动时跳过较早的文件
+        for path in paths:
+            offset = self.positions.get(path, 0)
+            if offset is None:
+                continue
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                while True:
+                    head = f.read(8)
+                    if len(head) < 8 or head[:4] != MAGIC:
+                        break
+                    size = struct.unpack('<I', head[4:])[0]
+                    raw = f.read(size)
+                    if len(raw) < size:
+                        break  # 区块还没写完
+                    yield path, offset + 8, raw
+                    offset += 8 + size
+            self.positions[path] = offset
+
+    def poll(self) -> int:
+        """
+        读取一次新区块，并更新引擎
+        :return: 本次导入的区块数（不含回滚的区块）
+        """
+        min_height = self.min_fork_height
+        for path, offset, raw in self.iter_new_blocks():
+            block_hash = double_sha256(raw[:80])[::-1].hex()
+            if block_hash in self.main_heights or block_hash in self.pending:
+                continue
+            prev_hash = raw[4:36][::-1].hex()
+            height = self.main_heights[prev_hash] + 1 if prev_hash in self.main_heights else get_coinbase_height(raw)
+            if height is not None and height <= min_height:
+                # 分叉点只能在回滚范围内，更低的区块不可能再连到主链上
+                if height >= min(self.main_chain):
+                    self.logger.warning(f'区块 {block_hash} （高度 {height} ）所在的分叉链需要回滚没有回滚信息的区块'
+                                        f'（分叉点最低为 {min_height} ），忽略')
+                continue
+            self.__add_pending(block_hash, (prev_hash, path, offset, len(raw)))
+        while self.pending_bytes > self.max_pending_bytes:
+            self.__pop_pending(next(iter(self.pending)))
+
+        n_blocks = 0
+        while True:
+            fork_height, branch = self.__best_branch()
+            if not branch or fork_height + len(branch) <= self.tip[0]:
+                return n_blocks
+            n_blocks += self.__switch(fork_height, branch)
+
+    def __add_pending(self, block_hash: str, location: Tuple[str, str, int, int]):
+        """
+        缓存未连接的区块
+        :param block_hash: 区块 hash
+        :param location: (上一个区块 hash, blk 文件路径, 偏移量, 大小)
+        :return:
+        """
+        self.pending[block_hash] = location
+        self.pending_bytes += location[3]
+
+    def __pop_pending(self, block_hash: str) -> Tuple[str, str, int, int]:
+        """
+        从缓存里取出区块
+        :param block_hash: 区块 hash
+        :return: (上一个区块 hash, blk 文件路径, 偏移量, 大小)
+        """
+        location = self.pending.pop(block_hash)
+        self.pending_bytes -= location[3]
+        return location
+
+    @staticmethod
+    def read_block(path: str, offset: int, size: int) -> bytes:
+        """
+        从 blk 文件里读取区块
+        :param path: blk 文件路径
+        :param offset: 区块的偏移量
+        :param size: 区块大小
+        :return: 区块字节
+        """
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            return f.read(size)
+
+    def __best_branch(self) -> Tuple[int, List[str]]:
+        """
+        在缓存的区块里找出能连到主链上、且最长的一条链
+        :return: (分叉点的高度, [区块 hash, ...]) ，没有时返回 (None, [])
+        """
+        best_height, best_branch = None, []
+        for block_hash in self.pending:
+            branch = [block_hash]
+            prev_hash = self.pending[block_hash][0]
+            while prev_hash in self.pending and len(branch) <= len(self.pending):
+                branch.append(prev_hash)
+                prev_hash = self.pending[prev_hash][0]
+            fork_height = self.main_heights.get(prev_hash)
+            if fork_height is None or fork_height < self.min_fork_height:
+                continue  # 还连不到主链上，或者需要回滚没有回滚信息的区块
+            if best_height is None or fork_height + len(branch) > best_height + len(best_branch):
+                best_height, best_branch = fork_height, branch[::-1]
+        return best_height, best_branch
+
+    def __switch(self, fork_height: int, branch: List[str]) -> int:
+        """
+        回滚分叉点之后的主链区块，再导入新的链
+        :param fork_height: 分叉点的高度
+        :param branch: 从分叉点之后开始的区块 hash 列表
+        :return: 导入的区块数
+        """
+        from blockchain_parser.block import Block
+        tip_height = self.tip[0]
+        if fork_height < tip_height:
+            self.logger.warning(f'区块 {fork_height} 之后发生分叉，回滚 {tip_height - fork_height} 个区块')
+        for height in range(tip_height, fork_height, -1):
+            self.engine.rollback_block(height)
+            block_hash = self.main_chain.pop(height)
+            del self.main_heights[block_hash]
+            if block_hash in self.imported:
+                self.__add_pending(block_hash, self.imported.pop(block_hash))
+
+        for height, block_hash in enumerate(branch, fork_height + 1):
+            self.imported[block_hash] = self.__pop_pending(block_hash)
+            self.engine.from_block(Block(self.read_block(*self.imported[block_hash][1:]), height))
+            self.main_chain[height] = block_hash
+            self.main_heights[block_hash] = height
+            old_hash = self.main_chain.pop(height - self.engine.undo_depth, None)
+            self.main_heights.pop(old_hash, None)
+            self.imported.pop(old_hash, None)
+        if hasattr(self.engine, 'max_height'):
+            self.engine.max_height = max(self.engine.max_height, self.tip[0])
+        return len(branch)
+
+    def run(self, max_polls: int = None):
+        """
+        持续跟踪新区块
+        :param max_polls: 最多轮询的次数，为空时一直运行
+        :return:
+        """
+        n_polls = 0
+        while max_polls is None or n_polls < max_polls:
+            n_blocks = self.poll()
+            if n_blocks:
+                self.logger.info(f'导入 {n_blocks} 个区块，当前高度 {self.tip[0]}')
+            n_polls += 1
+            if max_polls is None or n_polls < max_polls:
+                time.sleep(self.poll_interval)
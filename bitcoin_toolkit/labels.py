@@ -0,0 +1,185 @@
+from typing import Iterable, List, Tuple
+from bisect import bisect_left
+from array import array
+from .utils import hash_key, BloomFilter
+import struct
+import mmap
+import csv
+import os
+
+# 标签文件的布局（整数都是本机字节序）：
+#     magic（ 8 字节）
+#     [地址数 n, 标签数 m, 布隆过滤器的位数, 布隆过滤器的哈希函数个数]（ 64 位无符号整数）
+#     按哈希排序的地址哈希数组（ n 个 64 位无符号整数）
+#     每个标签的起始偏移数组（ m + 1 个 64 位无符号整数）
+#     布隆过滤器的位数组（按 8 字节对齐）
+#     与地址哈希一一对应的标签序号数组（ n 个 32 位无符号整数）、拼接起来的标签字符串
+# 只保存地址的 64 位哈希而不保存地址本身（千万级地址时误判的概率仍然可以忽略），查询时先查布隆过滤器，再对哈希数组二分查找
+MAGIC = b'BTKLBL01'
+_HEADER = struct.Struct('=4Q')
+
+
+class LabelStore:
+    """
+    大规模的地址标签库（交易所、服务商、制裁名单等），可以直接作为 Trace.set_labels 的 dict_label 使用。
+    通过 from_csv/build 建立后 save 保存到文件，之后通过 load 以内存映射的方式加载，多个进程共用操作系统的页缓存
+    """
+
+    def __init__(self, buf):
+        """
+        :param buf: 标签数据，见 build 与 load
+        """
+        self.buf = memoryview(buf)
+        assert bytes(self.buf[:len(MAGIC)]) == MAGIC, '不是由 LabelStore 生成的标签数据'
+        self.n_addresses, n_labels, n_bits, n_hashes = _HEADER.unpack_from(self.buf, len(MAGIC))
+        n = self.n_addresses
+        offset = len(MAGIC) + _HEADER.size
+        self.hashes, offset = self.buf[offset:offset + 8 * n].cast('Q'), offset + 8 * n
+        offsets, offset = self.buf[offset:offset + 8 * (n_labels + 1)].cast('Q'), offset + 8 * (n_labels + 1)
+        n_bytes = (n_bits + 7) // 8
+        self.bloom = BloomFilter(n_bits, n_hashes, self.buf[offset:offset + n_bytes])
+        offset += (n_bytes + 7) // 8 * 8
+        self.label_ids, offset = self.buf[offset:offset + 4 * n].cast('I'), offset + 4 * n
+        self.labels = [self.buf[offset + offsets[i]:offset + offsets[i + 1]].tobytes().decode()
+                       for i in range(n_labels)]
+        offsets.release()
+        self.file = None
+
+    @classmethod
+    def build(cls, items: Iterable[Tuple[str, str]], bits_per_key: int = 10) -> 'LabelStore':
+        """
+        由 (地址, 标签) 建立标签库，同一个地址有多个标签时只保留其中一个
+        :param items: (地址, 标签) 的迭代器，也可以传入 地址 -> 标签 字典的 items()
+        :param bits_per_key: 布隆过滤器里每个地址占用的位数
+        :return:
+        """
+        dict_label_id = {}  # 标签 -> 序号，标签的种类很少
+        keys = []  # 地址哈希 << 32 | 标签序号，排序后即按地址哈希排序
+        for address, label in items:
+            label_id = dict_label_id.setdefault(label, len(dict_label_id))
+            keys.append(hash_key(address) << 32 | label_id)
+        keys.sort()
+
+        hashes, label_ids, last = array('Q'), array('I'), None
+        for key in keys:
+            h = key >> 32
+            if h != last:
+                hashes.append(h)
+                label_ids.append(key & 0xffffffff)
+                last = h
+        del keys
+
+        bloom = BloomFilter.for_capacity(len(hashes), bits_per_key)
+        for h in hashes:
+            bloom.add_hash(h)
+        payloads = [i.encode() for i in dict_label_id]
+        offsets, position = array('Q', [0]), 0
+        for payload in payloads:
+            position += len(payload)
+            offsets.append(position)
+        padding = b'\x00' * ((len(bloom.bits) + 7) // 8 * 8 - len(bloom.bits))
+
+        return cls(b''.join([MAGIC,
+                             _HEADER.pack(len(hashes), len(payloads), bloom.n_bits, bloom.n_hashes),
+                             hashes.tobytes(),
+                             offsets.tobytes(),
+                             bytes(bloom.bits),
+                             padding,
+                             label_ids.tobytes(),
+                             b''.join(payloads)]))
+
+    @classmethod
+    def from_csv(cls,
+                 path: str,
+                 address_column: int = 0,
+                 label_column: int = 1,
+                 delimiter: str = ',',
+                 skip_header: bool = False,
+                 bits_per_key: int = 10) -> 'LabelStore':
+        """
+        从 csv 文件建立标签库
+        :param path: csv 文件路径
+        :param address_column: 地址所在的列
+        :param label_column: 标签所在的列
+        :param delimiter: 分隔符
+        :param skip_header: 是否跳过第一行
+        :param bits_per_key: 布隆过滤器里每个地址占用的位数
+        :return:
+        """
+        with open(str(path), newline='', encoding='utf-8') as f:
+            reader = csv.reader(f, delimiter=delimiter)
+            if skip_header:
+                next(reader, None)
+            n_columns = max(address_column, label_column) + 1
+            return cls.build(((row[address_column], row[label_column]) for row in reader if len(row) >= n_columns),
+                             bits_per_key)
+
+    def save(self, path: str):
+        """
+        保存到文件
+        :param path:
+        :return:
+        """
+        path = str(path)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(self.buf)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path: str) -> 'LabelStore':
+        """
+        以内存映射的方式加载 save 保存的文件
+        :param path:
+        :return:
+        """
+        with open(str(path), 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        instance = cls(buf)
+        instance.file = buf
+        return instance
+
+    def __get_hash(self, h: int) -> str:
+        if not self.bloom.contains_hash(h):
+            return None
+        i = bisect_left(self.hashes, h)
+        if i < self.n_addresses and self.hashes[i] == h:
+            return self.labels[self.label_ids[i]]
+        return None
+
+    def get(self, address: str, default: str = None) -> str:
+        """
+        地址的标签
+        :param address:
+        :param default: 没有标签时返回的值
+        :return:
+        """
+        if not isinstance(address, str):
+            return default
+        label = self.__get_hash(hash_key(address))
+        return default if label is None else label
+
+    def batch_get(self, addresses: List[str]) -> List[str]:
+        """
+        批量获取地址的标签（大部分地址没有标签，只需查询布隆过滤器）
+        :param addresses:
+        :return: 标签列表，没有标签的地址为 None
+        """
+        return [self.__get_hash(hash_key(i)) if isinstance(i, str) else None for i in addresses]
+
+    def __contains__(self, address: str) -> bool:
+        return self.get(address) is not None
+
+    def __len__(self) -> int:
+        return self.n_addresses
+
+    def close(self):
+        """
+        释放内存映射
+        :return:
+        """
+        self.bloom.bits.release()
+        for view in (self.hashes, self.label_ids, self.buf):
+            view.release()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,166 @@
+from types import MethodType, FunctionType
+from functools import wraps
+import time
+
+
+class _NullTimer:
+    """
+    未开启指标统计时使用的空计时器
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    def __init__(self, metrics, name: str):
+        self.metrics = metrics
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.metrics.record_stage(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    """
+    运行指标，包括各阶段耗时、每一轮的搜索规模、批量查询的调用统计、缓存命中率等。
+    既可以通过 to_dict 读取，也可以传入 hook 在每次记录时回调
+    """
+
+    def __init__(self, hook: (FunctionType, MethodType) = None):
+        """
+        :param hook: 回调函数，签名为 hook(event, data) ，
+            event 取值为 stage/call/cache/depth ，data 为本次记录的字典
+        """
+        assert hook is None or callable(hook), hook
+        self.hook = hook
+        self.stages = {}  # 阶段 -> {"count": 次数, "seconds": 累计耗时}
+        self.calls = {}  # 函数名 -> {"count": 次数, "keys": 累计 key 数, "max_keys": 单次最多 key 数, "seconds": 累计耗时}
+        self.cache = {}  # 缓存名 -> {"hits": 命中数, "misses": 未命中数}
+        self.depths = []  # 每一轮的搜索情况 [{"depth": 深度, "frontier": 节点数, "nodes_created": 新建节点数, "seconds": 耗时}]
+
+    def reset(self):
+        """
+        清空已记录的指标
+        :return:
+        """
+        self.stages = {}
+        self.calls = {}
+        self.cache = {}
+        self.depths = []
+
+    def timer(self, name: str) -> _Timer:
+        """
+        计时上下文，退出时记录该阶段的耗时
+        :param name: 阶段名
+        :return:
+        """
+        return _Timer(self, name)
+
+    def record_stage(self, name: str, seconds: float):
+        """
+        记录阶段耗时
+        :param name:
+        :param seconds:
+        :return:
+        """
+        info = self.stages.setdefault(name, {'count': 0, 'seconds': 0.0})
+        info['count'] += 1
+        info['seconds'] += seconds
+        if self.hook:
+            self.hook('stage', {'name': name, 'seconds': seconds})
+
+    def record_call(self, name: str, n_keys: int, seconds: float):
+        """
+        记录一次批量查询
+        :param name: 函数名
+        :param n_keys: 查询的 key 数
+        :param seconds: 耗时
+        :return:
+        """
+        info = self.calls.setdefault(name, {'count': 0, 'keys': 0, 'max_keys': 0, 'seconds': 0.0})
+        info['count'] += 1
+        info['keys'] += n_keys
+        info['max_keys'] = max(info['max_keys'], n_keys)
+        info['seconds'] += seconds
+        if self.hook:
+            self.hook('call', {'name': name, 'keys': n_keys, 'seconds': seconds})
+
+    def record_cache(self, name: str, hits: int, misses: int):
+        """
+        记录缓存命中情况
+        :param name: 缓存名
+        :param hits: 命中数
+        :param misses: 未命中数
+        :return:
+        """
+        info = self.cache.setdefault(name, {'hits': 0, 'misses': 0})
+        info['hits'] += hits
+        info['misses'] += misses
+        if self.hook:
+            self.hook('cache', {'name': name, 'hits': hits, 'misses': misses})
+
+    def record_depth(self, depth: int, frontier: int, nodes_created: int, seconds: float):
+        """
+        记录一轮广度优先搜索
+        :param depth: 深度
+        :param frontier: 本轮搜索的节点数
+        :param nodes_created: 本轮新建的节点数
+        :param seconds: 耗时
+        :return:
+        """
+        data = {'depth': depth, 'frontier': frontier, 'nodes_created': nodes_created, 'seconds': seconds}
+        self.depths.append(data)
+        if self.hook:
+            self.hook('depth', data)
+
+    def wrap(self, name: str, func: (FunctionType, MethodType)) -> FunctionType:
+        """
+        包装批量查询函数，记录每次调用的 key 数与耗时
+        :param name: 函数名
+        :param func: 批量查询函数，第一个参数为 key 列表
+        :return:
+        """
+        if getattr(func, '__metrics__', None) is self:
+            return func  # 已经包装过
+        while hasattr(func, '__metrics__'):
+            func = func.__wrapped__  # 被其他 Metrics 包装过，先还原
+
+        @wraps(func)
+        def wrapper(keys, *args, **kwargs):
+            keys = keys if isinstance(keys, (list, tuple)) else list(keys)
+            start = time.perf_counter()
+            result = func(keys, *args, **kwargs)
+            self.record_call(name, len(keys), time.perf_counter() - start)
+            return result
+
+        wrapper.__metrics__ = self
+        return wrapper
+
+    def to_dict(self) -> dict:
+        """
+        以字典形式返回所有指标
+        :return:
+        """
+        cache = {}
+        for name, info in self.cache.items():
+            total = info['hits'] + info['misses']
+            cache[name] = dict(info, hit_rate=info['hits'] / total if total else None)
+        return {
+            'stages': {k: dict(v) for k, v in self.stages.items()},
+            'calls': {k: dict(v) for k, v in self.calls.items()},
+            'cache': cache,
+            'depths': [dict(i) for i in self.depths],
+        }
@@ -1,3 +1,4 @@
+from .record import Record
 from .address import Address
 from .transaction import Transaction
 from .output import Output
@@ -0,0 +1,14 @@
+from .record import Record
+
+
+class Address(Record):
+    """
+    地址详情的只读视图，字段见 FileEngine.get_address
+    """
+
+    __slots__ = ('_outputs', '_labels')
+    FIELDS = ('address', 'outputs', 'labels')
+    LAZY = ('outputs', 'labels')
+
+    def __repr__(self):
+        return f'Address({self["address"]})'
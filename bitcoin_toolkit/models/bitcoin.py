@@ -0,0 +1,95 @@
+from typing import List
+from . import Address, Transaction, Output, Block
+
+
+class Bitcoin:
+    """
+    比特币数据的只读入口：通过搜索引擎查询，结果统一为 models 里的只读视图。
+    引擎设置了 record_views 时直接使用引擎返回的视图，否则把引擎返回的详情字典包装为视图（不复制数据）
+    """
+
+    def __init__(self, engine):
+        """
+        :param engine: 搜索引擎，
+            需要有 batch_get_tx 、 batch_get_txo 、 batch_get_address 方法
+        """
+        for method in ('batch_get_tx', 'batch_get_txo', 'batch_get_address'):
+            assert hasattr(engine, method), f'engine 需要有 {method} 方法'
+        self.engine = engine
+
+    def __repr__(self):
+        return 'Bitcoin'
+
+    @staticmethod
+    def output_key(txid, index):
+        return str(txid) + ',' + str(index)
+
+    def get_tx(self, txid: str) -> Transaction:
+        """
+        获取交易
+        :param txid:
+        :return: 不存在时返回 None
+        """
+        assert isinstance(txid, str), txid
+        return self.batch_get_tx([txid])[0]
+
+    def batch_get_tx(self, txids: List[str]) -> List[Transaction]:
+        return [Transaction.of(i) for i in self.engine.batch_get_tx(list(txids))]
+
+    def get_output(self, key: str) -> Output:
+        """
+        获取输出
+        :param key: txid,index
+        :return: 不存在时返回 None
+        """
+        assert isinstance(key, str), key
+        return self.batch_get_output([key])[0]
+
+    def batch_get_output(self, keys: List[str]) -> List[Output]:
+        return [Output.of(i) for i in self.engine.batch_get_txo(list(keys))]
+
+    def get_address(self, address: str) -> Address:
+        """
+        获取地址
+        :param address:
+        :return: 不存在时返回 None
+        """
+        assert isinstance(address, str), address
+        return self.batch_get_address([address])[0]
+
+    def batch_get_address(self, addresses: List[str]) -> List[Address]:
+        return [Address.of(i) for i in self.engine.batch_get_address(list(addresses))]
+
+    def get_block(self, block_hash: str) -> Block:
+        """
+        获取区块（引擎需要有 batch_get_block 方法）
+        :param block_hash:
+        :return: 不存在时返回 None
+        """
+        assert isinstance(block_hash, str), block_hash
+        assert hasattr(self.engine, 'batch_get_block'), '引擎不支持查询区块'
+        return Block.of(self.engine.batch_get_block([block_hash])[0])
+
+    def get_inputs(self, tx: Transaction) -> List[Output]:
+        """
+        交易的输入对应的输出
+        :param tx:
+        :return: 与 tx['inputs'] 一一对应，不存在时为 None
+        """
+        return self.batch_get_output(tx['inputs'])
+
+    def get_outputs(self, tx: Transaction) -> List[Output]:
+        """
+        交易的输出
+        :param tx:
+        :return: 与输出的位置一一对应，不存在时为 None
+        """
+        return self.batch_get_output(Transaction.of(tx).output_keys())
+
+    def get_spent_tx(self, output: Output) -> Transaction:
+        """
+        花费该输出的交易
+        :param output:
+        :return: 未被花费或者不存在时返回 None
+        """
+        return self.get_tx(output['spent_txid']) if output['spent_txid'] else None
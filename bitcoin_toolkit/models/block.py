@@ -0,0 +1,14 @@
+from .record import Record
+
+
+class Block(Record):
+    """
+    区块详情的只读视图，字段见 FileEngine.get_block
+    """
+
+    __slots__ = ('_txids',)
+    FIELDS = ('hash', 'height', 'timestamp', 'txids', 'n_tx')
+    LAZY = ('txids',)
+
+    def __repr__(self):
+        return f'Block({self["hash"]})' + (f'({self["height"]})' if self['height'] is not None else '')
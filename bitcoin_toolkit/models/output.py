@@ -0,0 +1,21 @@
+from .record import Record
+
+
+class Output(Record):
+    """
+    输出详情的只读视图，字段见 FileEngine.get_txo
+    """
+
+    __slots__ = ('_addresses',)
+    FIELDS = ('key', 'txid', 'index', 'value', 'type', 'addresses', 'spent_txid')
+    LAZY = ('addresses',)
+
+    def __repr__(self):
+        return f'Output({self["key"]})'
+
+    def is_placeholder(self) -> bool:
+        """
+        是否为由输入生成的占位详情（没有金额、类型与地址）
+        :return:
+        """
+        return self['type'] is None
@@ -0,0 +1,101 @@
+from collections.abc import Mapping
+import json
+
+
+class Record(Mapping):
+    """
+    引擎数据的只读视图，可以像字典一样使用（ record['txid'] 、 record.get('txid') 、 dict(record) ），
+    也可以用属性访问字段。
+    视图只保存引擎的原始数据，不会为每个字段新建字典：
+    1. 元组或列表：按 FIELDS 的顺序保存的字段（例如 sqlite 查询得到的行）
+    2. 字典：字段名 -> 值（例如 FileEngine 里保存的详情）
+    3. json 字符串：第一次访问字段时才解码（例如 redis 里保存的详情）
+    LAZY 里的字段在原始数据里可以是 json 文本，第一次访问时解码并缓存在同名的 _ 前缀 slot 里
+    """
+
+    __slots__ = ('_row',)
+    FIELDS = ()  # 字段名，与元组的顺序一致
+    LAZY = ()  # 可能以 json 文本保存的字段
+    CASTS = {}  # 访问时需要转换类型的字段，例如 sqlite 里以整数保存的布尔值
+    _INDEX = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._INDEX = {name: i for i, name in enumerate(cls.FIELDS)}
+        cls.LAZY = frozenset(cls.LAZY)
+
+    def __init__(self, row):
+        """
+        :param row: 元组、列表、字典或者 json 字符串，见类的说明
+        """
+        assert isinstance(row, (tuple, list, dict, str, bytes)), row
+        object.__setattr__(self, '_row', row)
+
+    @classmethod
+    def of(cls, info):
+        """
+        把查询结果包装为视图
+        :param info: 视图、详情字典或者原始数据，为空时返回 None
+        :return:
+        """
+        if not info:
+            return None
+        return info if isinstance(info, cls) else cls(info)
+
+    def __getitem__(self, name: str):
+        row = self._row
+        if type(row) is tuple or type(row) is list:
+            value = row[self._INDEX[name]]
+        else:
+            if not isinstance(row, dict):
+                row = json.loads(row)
+                object.__setattr__(self, '_row', row)
+            if name not in self._INDEX:
+                raise KeyError(name)
+            value = row[name]
+        if type(value) is str and name in self.LAZY:
+            try:
+                return object.__getattribute__(self, '_' + name)
+            except AttributeError:
+                value = json.loads(value)
+                object.__setattr__(self, '_' + name, value)
+        cast = self.CASTS.get(name)
+        return cast(value) if cast is not None and value is not None else value
+
+    def get(self, name: str, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def __contains__(self, name) -> bool:
+        return name in self._INDEX
+
+    def __iter__(self):
+        return iter(self.FIELDS)
+
+    def __len__(self) -> int:
+        return len(self.FIELDS)
+
+    def __getattr__(self, name: str):
+        # 只有 slot 与方法以外的名字会到这里
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name: str, value):
+        raise AttributeError(f'{type(self).__name__} 是只读的')
+
+    def __delattr__(self, name: str):
+        raise AttributeError(f'{type(self).__name__} 是只读的')
+
+    def __reduce__(self):
+        return type(self), (self._row,)
+
+    def to_dict(self) -> dict:
+        """
+        转换为普通字典（例如需要修改或者序列化为 json 时）
+        :return:
+        """
+        return {name: self[name] for name in self.FIELDS}
@@ -0,0 +1,23 @@
+from .record import Record
+
+
+class Transaction(Record):
+    """
+    交易详情的只读视图，字段见 FileEngine.get_tx
+    """
+
+    __slots__ = ('_inputs',)
+    FIELDS = ('txid', 'block_height', 'is_coinbase', 'inputs', 'n_outputs')
+    LAZY = ('inputs',)
+    CASTS = {'is_coinbase': bool}
+
+    def __repr__(self):
+        return f'Transaction({self["txid"]})'
+
+    def output_keys(self) -> list:
+        """
+        所有输出的 key
+        :return: ["txid,index", ...]
+        """
+        txid = self['txid']
+        return [f'{txid},{i}' for i in range(self['n_outputs'] or 0)]
@@ -1,4 +1,5 @@
 from typing import List
+from .utils import hash_key
 
 
 class Node:
@@ -15,10 +16,13 @@ class Node:
             3 ：multisig (多签地址)
             4 ：unknown (因数据缺失导致所有输入都无法解析出一个有效的地址，因此合并所有输入为一个地址)
             5 ：return (销毁比特币，该节点的类型是 OP_RETURN )
-        :param addresses: 如果该节点类型是多签，那么需要传入转换前的地址列表
+            6 ：cluster (地址聚类后的簇，代表同一个人的多个地址)
+            7 ：filtered (被导入过滤器丢弃的输出，见 filters.IngestFilter )
+        :param addresses: 如果该节点类型是多签或簇，那么需要传入转换前的地址列表
         """
         assert isinstance(address, str), address
-        assert address_type in ['normal', 'middle', 'multisig', 'unknown', 'return'], address_type
+        assert address_type in ['normal', 'middle', 'multisig', 'unknown', 'return', 'cluster',
+                                'filtered'], address_type
         assert ((address_type != 'multisig' and addresses is None)
                 or (address_type == 'multisig' or isinstance(addresses, list) and len(addresses) > 1)), addresses
         self.address = address
@@ -35,12 +39,12 @@ class Node:
     @staticmethod
     def generate_multisig_address(addresses: List[str]):
         """
-        将多签地址转换成一个新地址
+        将多签地址转换成一个新地址（按排序后的地址计算的稳定哈希，不同进程里相同，可以用于导出与布局缓存）
         :param addresses:
         :return:
         """
         assert isinstance(addresses, list), addresses
-        return str(hash(','.join(addresses)))
+        return str(hash_key(','.join(sorted(addresses))))
 
     def add_in(self, address: str, money: int):
         """
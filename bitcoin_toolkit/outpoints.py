@@ -0,0 +1,288 @@
+from typing import Iterable, Iterator, List, TYPE_CHECKING
+from bisect import bisect_right, bisect_left
+from array import array
+from .parser import iter_raw_transactions, _iter_block_transactions
+from .utils import hash_key
+import tempfile
+import shutil
+import struct
+import heapq
+import json
+import mmap
+import os
+
+if TYPE_CHECKING:
+    from blockchain_parser.block import Block
+
+# 输出索引的目录结构（整数都是本机字节序）：
+#     meta.json          输出数、地址数、输出类型列表
+#     outpoints.bin      按输出 key 的哈希排序的定长记录： (key 哈希, 金额, 地址 id, 类型序号)
+#     addresses.bin      按地址 id 排序的定长记录： (地址 id, 在 addresses.dat 里的偏移, 长度)
+#     addresses.dat      地址字符串（多签输出的多个地址用逗号拼接）
+#     *.fence            每 FENCE 条记录的第一个哈希，常驻内存，查询时先在这里二分查找，再只读取一段记录（一次随机读）
+# 地址 id 为地址字符串的 64 位哈希，只保存哈希而不保存 key 本身，误判的概率可以忽略
+_OUTPOINT = struct.Struct('=QQQB')
+_ADDRESS = struct.Struct('=QQI')
+_RUN_ADDRESS = struct.Struct('=QH')
+FENCE = 256
+
+
+def _mmap(path: str):
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _iter_records(path: str, record: struct.Struct, chunk_records: int = 1 << 14) -> Iterator[tuple]:
+    """
+    顺序读取定长记录的临时文件
+    :param path:
+    :param record:
+    :param chunk_records: 每次读取的记录数
+    :return:
+    """
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(record.size * chunk_records)
+            if not chunk:
+                break
+            yield from record.iter_unpack(chunk)
+
+
+def _iter_address_run(path: str) -> Iterator[tuple]:
+    """
+    顺序读取地址的临时文件
+    :param path:
+    :return: (地址 id, 地址字符串的字节) 的生成器
+    """
+    with open(path, 'rb') as f:
+        while True:
+            head = f.read(_RUN_ADDRESS.size)
+            if not head:
+                break
+            address_id, length = _RUN_ADDRESS.unpack(head)
+            yield address_id, f.read(length)
+
+
+class _SortedFile:
+    """
+    按哈希排序、内存映射的定长记录文件
+    """
+
+    def __init__(self, path: str, record: struct.Struct, n: int):
+        self.record = record
+        self.n = n
+        self.buf = _mmap(path)
+        self.fences = array('Q')
+        with open(path + '.fence', 'rb') as f:
+            self.fences.frombytes(f.read())
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i: int) -> int:
+        return struct.unpack_from('=Q', self.buf, i * self.record.size)[0]
+
+    def find(self, h: int) -> tuple:
+        """
+        :param h: 哈希
+        :return: 记录，找不到时返回 None
+        """
+        block = bisect_right(self.fences, h) - 1
+        if block < 0:
+            return None
+        lo = block * FENCE
+        hi = min(lo + FENCE, self.n)
+        i = bisect_left(self, h, lo, hi)
+        if i < hi and self[i] == h:
+            return self.record.unpack_from(self.buf, i * self.record.size)
+        return None
+
+    def close(self):
+        if isinstance(self.buf, mmap.mmap):
+            self.buf.close()
+
+
+class OutpointIndex:
+    """
+    全链的输出索引：输出 key -> (金额, 类型, 地址) 。
+    引擎只导入一段区块时，花费了区块范围之前的输出的输入只能得到没有金额与地址的占位详情，追溯时会变成金额未知的 unknown 节点。
+    通过 build 遍历一次全链建立索引后，把索引设置到引擎的 outpoint_index 属性上，导入区块时就会补全这些占位详情
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: build 生成的目录
+        """
+        path = str(path)
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        self.path = path
+        self.types = meta['types']
+        self.outpoints = _SortedFile(os.path.join(path, 'outpoints.bin'), _OUTPOINT, meta['n_outpoints'])
+        self.addresses = _SortedFile(os.path.join(path, 'addresses.bin'), _ADDRESS, meta['n_addresses'])
+        self.address_data = _mmap(os.path.join(path, 'addresses.dat'))
+
+    @classmethod
+    def build(cls,
+              path: str,
+              dir_blocks: str,
+              max_height: int = None,
+              index_cache: str = None,
+              show_progress: bool = False,
+              blocks: Iterable['Block'] = None,
+              run_size: int = 1 << 22) -> 'OutpointIndex':
+        """
+        遍历一次区块建立索引：每 run_size 个输出排序后写入一个临时文件，最后多路归并成排好序的索引文件，内存占用与区块数无关
+        :param path: 索引目录，不存在时自动创建
+        :param dir_blocks: 全节点下 blocks 目录的路径
+        :param max_height: 最高的区块高度，为空时读取到最新的区块
+        :param index_cache: 整个区块索引的缓存路径
+        :param show_progress: 是否显示进度
+        :param blocks: 按高度排好序的区块迭代器，为空时从 dir_blocks 里读取
+        :param run_size: 每个临时文件的输出数
+        :return:
+        """
+        from .engine import FileEngine
+        assert isinstance(run_size, int) and run_size > 0, run_size
+        path = str(path)
+        os.makedirs(path, exist_ok=True)
+        dir_runs = tempfile.mkdtemp(dir=path)
+        dict_type = {}  # 输出类型 -> 序号
+        outpoint_runs, address_runs = [], []
+        outpoints, addresses = [], {}
+
+        def flush():
+            run = os.path.join(dir_runs, f'outpoints-{len(outpoint_runs)}')
+            with open(run, 'wb') as f:
+                f.write(b''.join(_OUTPOINT.pack(*i) for i in sorted(outpoints)))
+            outpoint_runs.append(run)
+            run = os.path.join(dir_runs, f'addresses-{len(address_runs)}')
+            with open(run, 'wb') as f:
+                f.write(b''.join(_RUN_ADDRESS.pack(k, len(v)) + v for k, v in sorted(addresses.items())))
+            address_runs.append(run)
+            outpoints.clear()
+            addresses.clear()
+
+        def from_block(block: 'Block'):
+            raw = getattr(block, 'hex', None)
+            if isinstance(raw, (bytes, bytearray, memoryview)):
+                transactions = iter_raw_transactions(raw)
+            else:
+                transactions = _iter_block_transactions(block)
+            for txid, _, _, outputs in transactions:
+                for index, (value, output_type, output_addresses) in enumerate(outputs):
+                    if output_type is None or output_type == 'OP_RETURN':
+                        continue  # 不会被花费的输出
+                    joined = ','.join(output_addresses if len(output_addresses) < 2 else sorted(set(output_addresses)))
+                    address_id = 0
+                    if joined:
+                        address_id = hash_key(joined)
+                        addresses[address_id] = joined.encode()
+                    type_id = dict_type.setdefault(output_type, len(dict_type))
+                    outpoints.append((hash_key(txid + ',' + str(index)), value, address_id, type_id))
+            if len(outpoints) >= run_size:
+                flush()
+
+        try:
+            file_engine = FileEngine(dir_blocks, 0, max_height, index_cache, show_warning=False)
+            file_engine.from_block = from_block  # 覆盖 FileEngine 的读取数据的函数
+            file_engine.read_data(show_progress, blocks)
+            flush()
+
+            # 多路归并，相同的 key （例如 BIP30 之前重复的 coinbase 交易）只保留一个
+            n_outpoints = cls.__merge(os.path.join(path, 'outpoints.bin'), _OUTPOINT,
+                                      heapq.merge(*[_iter_records(i, _OUTPOINT) for i in outpoint_runs]))
+            # 地址去重后写入字符串，同时生成 (地址 id, 偏移, 长度) 记录
+            with open(os.path.join(path, 'addresses.dat'), 'wb') as f:
+                def iter_addresses():
+                    position, last = 0, None
+                    for address_id, data in heapq.merge(*[_iter_address_run(i) for i in address_runs]):
+                        if address_id == last:
+                            continue
+                        f.write(data)
+                        yield address_id, position, len(data)
+                        position, last = position + len(data), address_id
+
+                n_addresses = cls.__merge(os.path.join(path, 'addresses.bin'), _ADDRESS, iter_addresses())
+        finally:
+            shutil.rmtree(dir_runs, ignore_errors=True)
+
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'n_outpoints': n_outpoints, 'n_addresses': n_addresses, 'types': list(dict_type)}, f)
+        return cls(path)
+
+    @staticmethod
+    def __merge(path: str, record: struct.Struct, records: Iterator[tuple]) -> int:
+        """
+        把排好序的记录写入文件（跳过哈希重复的记录），同时写入 fence 文件
+        :return: 记录数
+        """
+        n, last, fences, chunk = 0, None, array('Q'), []
+        with open(path, 'wb') as f:
+            for i in records:
+                if i[0] == last:
+                    continue
+                if n % FENCE == 0:
+                    fences.append(i[0])
+                chunk.append(record.pack(*i))
+                if len(chunk) >= 1 << 14:
+                    f.write(b''.join(chunk))
+                    chunk = []
+                n, last = n + 1, i[0]
+            f.write(b''.join(chunk))
+        with open(path + '.fence', 'wb') as f:
+            f.write(fences.tobytes())
+        return n
+
+    def get(self, key: str) -> dict:
+        """
+        查询单个输出
+        :param key: 输出 key ，格式为 txid,index
+        :return: {"value": 金额, "type": 类型, "addresses": [地址, ...]} ，找不到时返回 None
+        """
+        found = self.outpoints.find(hash_key(key))
+        if found is None:
+            return None
+        _, value, address_id, type_id = found
+        addresses = []
+        if address_id:
+            found = self.addresses.find(address_id)
+            if found is not None:
+                _, offset, length = found
+                addresses = self.address_data[offset:offset + length].decode().split(',')
+        return {'value': value, 'type': self.types[type_id], 'addresses': addresses}
+
+    def batch_get(self, keys: List[str]) -> List[dict]:
+        """
+        批量查询输出
+        :param keys:
+        :return:
+        """
+        return [self.get(i) for i in keys]
+
+    def fill(self, dict_output: dict) -> int:
+        """
+        补全占位详情（由输入生成的、类型为空的输出详情）的金额、类型与地址，直接修改传入的详情
+        :param dict_output: key -> 输出详情，见 parser_block
+        :return: 补全的个数
+        """
+        n_filled = 0
+        for key, info in dict_output.items():
+            if info['type'] is None:
+                found = self.get(key)
+                if found:
+                    info.update(found)
+                    n_filled += 1
+        return n_filled
+
+    def close(self):
+        """
+        释放内存映射
+        :return:
+        """
+        self.outpoints.close()
+        self.addresses.close()
+        if isinstance(self.address_data, mmap.mmap):
+            self.address_data.close()
@@ -1,4 +1,15 @@
-from blockchain_parser.block import Block
+from typing import Iterator, List, Tuple, TYPE_CHECKING
+from .script import decode_script, double_sha256
+import calendar
+import hashlib
+import struct
+
+if TYPE_CHECKING:
+    from blockchain_parser.block import Block
+
+COINBASE_TXID = '0' * 64
+_unpack_uint32 = struct.Struct('<I').unpack_from
+_unpack_uint64 = struct.Struct('<Q').unpack_from
 
 
 def gen_txo_key(txid: str, index: (str, int)):
@@ -11,62 +22,333 @@ def gen_txo_key(txid: str, index: (str, int)):
     return str(txid) + ',' + str(index)
 
 
-def parser_block(block: Block):
-    # 交易数据
-    dict_tx = {
-        tx.txid: {
-            "txid": tx.txid,
-            "block_height": block.height,
-            "is_coinbase": tx.is_coinbase(),
-            "inputs": [gen_txo_key(input_.transaction_hash, input_.transaction_index) for input_ in tx.inputs],
-            "n_outputs": tx.n_outputs,
-        }
-        for tx in block.transactions
-    }
+def merge_address(info_new: dict, info_old: dict) -> dict:
+    """
+    合并同一个地址的新旧详情（输出与标签取并集），结果写回 info_new
+    :param info_new: 新的地址详情
+    :param info_old: 旧的地址详情，可以为空
+    :return: info_new
+    """
+    if info_old:
+        info_new['outputs'] = list(set(info_new['outputs'] + info_old['outputs']))
+        info_new['labels'] = list(set(info_new['labels'] + info_old['labels']))
+    return info_new
+
+
+def merge_output(info_new: dict, info_old: dict) -> dict:
+    """
+    合并同一个输出的新旧详情（新值为空时保留旧值），结果写回 info_new
+    :param info_new: 新的输出详情
+    :param info_old: 旧的输出详情，可以为空
+    :return: info_new
+    """
+    if info_old:
+        info_new['spent_txid'] = info_new['spent_txid'] or info_old['spent_txid']
+        info_new['value'] = info_new['value'] or info_old['value']
+        info_new['type'] = info_new['type'] or info_old['type']
+        info_new['addresses'] = info_new['addresses'] or info_old['addresses']
+    return info_new
+
+
+def placeholder_spent_txid(info_old: dict, info_new: dict) -> str:
+    """
+    旧详情是只有花费交易的占位详情（乱序导入时先导入了花费输出的区块）、新详情带来了真实数据时，返回花费交易的 txid 。
+    调用方查到它所在的区块高度后作为 diff_address_stats 的 spent_height 传入
+    :param info_old: 旧的输出详情，可以为空
+    :param info_new: 新的输出详情
+    :return: 其他情况返回 None
+    """
+    if info_old and info_old['type'] is None and info_old['spent_txid'] and info_new['type'] is not None:
+        return info_old['spent_txid']
+    return None
+
+
+def diff_address_stats(info_old: dict, info_new: dict, deltas: dict, first_height: int,
+                       last_height: int = None, spent_height: int = None) -> dict:
+    """
+    一个输出从旧详情变为新详情（见 merge_output ）后，
+    其地址的统计（见 FileEngine.get_address_stats ）的变化量，累加到 deltas 。
+    只有真实的输出（类型不为空）才计入统计，因此金额与输出数与区块的导入顺序无关；
+    乱序导入时花费输出的区块先导入，只留下占位详情，
+    花费的高度需要通过 spent_height 传入（见 placeholder_spent_txid ）。
+    多签输出的金额完整地计入每一个地址（不按签名人拆分），同一笔金额会出现在多个地址的统计里
+    :param info_old: 旧的输出详情，可以为空
+    :param info_new: 合并后的输出详情
+    :param deltas: 地址 -> 统计的变化量
+    :param first_height: 发生变化的最低区块高度
+    :param last_height: 发生变化的最高区块高度，为空时与 first_height 相同
+    :param spent_height: 之前导入的花费输出的区块高度，为空时忽略
+    :return: deltas
+    """
+    last_height = first_height if last_height is None else last_height
+    if spent_height is not None:
+        last_height = max(last_height, spent_height)
+    for sign, info in ((-1, info_old), (1, info_new)):
+        if not info or info['type'] is None:
+            continue
+        value = sign * (info['value'] or 0)
+        for address in info['addresses']:
+            delta = deltas.get(address)
+            if delta is None:
+                delta = deltas[address] = {'received': 0, 'spent': 0, 'n_outputs': 0, 'n_utxo': 0, 'utxo_value': 0,
+                                           'first_height': first_height, 'last_height': last_height}
+            delta['received'] += value
+            delta['n_outputs'] += sign
+            if info['spent_txid']:
+                delta['spent'] += value
+            else:
+                delta['n_utxo'] += sign
+                delta['utxo_value'] += value
+            delta['first_height'] = min(delta['first_height'], first_height)
+            delta['last_height'] = max(delta['last_height'], last_height)
+    return deltas
+
+
+def merge_address_stats(address: str, delta: dict, stats_old: dict) -> dict:
+    """
+    把统计的变化量合并到旧的地址统计上，生成新的字典（旧的统计不会被修改）
+    :param address:
+    :param delta: 统计的变化量，见 diff_address_stats
+    :param stats_old: 旧的地址统计，可以为空
+    :return:
+    """
+    stats = {'address': address}
+    for field in ('received', 'spent', 'n_outputs', 'n_utxo', 'utxo_value'):
+        stats[field] = delta[field] + (stats_old[field] if stats_old else 0)
+    stats['first_height'] = min(delta['first_height'], stats_old['first_height']) if stats_old \
+        else delta['first_height']
+    stats['last_height'] = max(delta['last_height'], stats_old['last_height']) if stats_old \
+        else delta['last_height']
+    return stats
+
+
+def _read_varint(raw: bytes, offset: int) -> Tuple[int, int]:
+    """
+    读取变长整数
+    :param raw:
+    :param offset:
+    :return: (整数, 新的偏移量)
+    """
+    size = raw[offset]
+    if size < 0xfd:
+        return size, offset + 1
+    if size == 0xfd:
+        return struct.unpack_from('<H', raw, offset + 1)[0], offset + 3
+    if size == 0xfe:
+        return _unpack_uint32(raw, offset + 1)[0], offset + 5
+    return _unpack_uint64(raw, offset + 1)[0], offset + 9
+
+
+def _decode_output(raw: bytes, start: int, script_start: int, end: int) -> Tuple[str, List[str]]:
+    """
+    解析输出的类型与地址，标准脚本直接解析，其他脚本交给 blockchain_parser 处理以保证结果一致
+    :param raw: 区块字节
+    :param start: 输出的起始位置
+    :param script_start: 脚本的起始位置
+    :param end: 输出的结束位置
+    :return: (类型, [地址, ...])
+    """
+    decoded = decode_script(raw[script_start:end])
+    if decoded is None:
+        from blockchain_parser.output import Output
+        output = Output(raw[start:end])
+        decoded = output.type, [i.address for i in output.addresses]
+    return decoded
+
+
+def iter_raw_transactions(raw: bytes, decode: bool = True) -> Iterator[tuple]:
+    """
+    一次遍历区块的原始字节，只解析我们需要的字段
+    :param raw: 区块字节（含 80 字节的区块头）
+    :param decode: 是否解析输出的类型与地址，为否时输出里的类型与地址为 None
+    :return: (txid, 是否是 coinbase 交易, [(输入的 txid, 输入的 index), ...],
+        [(金额, 类型, [地址, ...]), ...]) 的生成器
+    """
+    raw = bytes(raw)
+    sha256 = hashlib.sha256
+    n_tx, offset = _read_varint(raw, 80)
+    for _ in range(n_tx):
+        tx_start = offset
+        offset += 4
+        is_segwit = raw[offset] == 0 and raw[offset + 1] == 1
+        if is_segwit:
+            offset += 2
+        body_start = offset
 
-    # 获取输出和地址
+        # 输入
+        n_inputs, offset = _read_varint(raw, offset)
+        inputs = []
+        is_coinbase = False
+        for _ in range(n_inputs):
+            txid = raw[offset:offset + 32][::-1].hex()
+            is_coinbase = is_coinbase or txid == COINBASE_TXID
+            inputs.append((txid, _unpack_uint32(raw, offset + 32)[0]))
+            script_length, offset = _read_varint(raw, offset + 36)
+            offset += script_length + 4
+
+        # 输出
+        n_outputs, offset = _read_varint(raw, offset)
+        outputs = []
+        for index in range(n_outputs):
+            start = offset
+            script_length, script_start = _read_varint(raw, offset + 8)
+            offset = script_start + script_length
+            if decode and not (is_coinbase and index == 2):
+                outputs.append((_unpack_uint64(raw, start)[0],) + _decode_output(raw, start, script_start, offset))
+            else:
+                outputs.append((_unpack_uint64(raw, start)[0], None, None))  # coinbase 交易的第 3 个输出会被跳过，不需要解析
+        body_end = offset
+
+        # 见证数据
+        if is_segwit:
+            for _ in range(n_inputs):
+                n_items, offset = _read_varint(raw, offset)
+                for _ in range(n_items):
+                    item_length, offset = _read_varint(raw, offset)
+                    offset += item_length
+        offset += 4
+
+        # txid 只对非见证部分做哈希
+        if is_segwit:
+            h = sha256(raw[tx_start:tx_start + 4])
+            h.update(raw[body_start:body_end])
+            h.update(raw[offset - 4:offset])
+            txid = sha256(h.digest()).digest()[::-1].hex()
+        else:
+            txid = double_sha256(raw[tx_start:offset])[::-1].hex()
+        yield txid, is_coinbase, inputs, outputs
+
+
+def _iter_block_transactions(block: 'Block') -> Iterator[tuple]:
+    """
+    从 blockchain_parser 的对象里遍历交易，格式同 iter_raw_transactions
+    :param block:
+    :return:
+    """
+    for tx in block.transactions:
+        inputs = [(i.transaction_hash, i.transaction_index) for i in tx.inputs]
+        is_coinbase = any(i[0] == COINBASE_TXID for i in inputs)
+        outputs = [(i.value, None, None) if is_coinbase and index == 2
+                   else (i.value, i.type, [j.address for j in i.addresses])
+                   for index, i in enumerate(tx.outputs)]
+        yield tx.txid, is_coinbase, inputs, outputs
+
+
+def _build_records(height: int, transactions: Iterator[tuple]):
+    """
+    一次遍历交易，构建交易、地址、输出 3 个字典
+    :param height: 区块高度
+    :param transactions: 格式同 iter_raw_transactions
+    :return:
+    """
+    dict_tx = {}
     dict_output = {}
     dict_address = {}
-    for tx in block.transactions:
-        is_coinbase = tx.is_coinbase()
+    for txid, is_coinbase, inputs, outputs in transactions:
         # 处理输入
-        for input_ in tx.inputs:
-            key = gen_txo_key(input_.transaction_hash, input_.transaction_index)
-            if key not in dict_output:
+        input_keys = []
+        for input_txid, input_index in inputs:
+            key = input_txid + ',' + str(input_index)
+            input_keys.append(key)
+            if input_txid == COINBASE_TXID:
+                continue  # coinbase 的输入不对应真实的输出，不生成占位记录（否则每个区块都会修改同一个 key ）
+            info = dict_output.get(key)
+            if info is None:
                 dict_output[key] = {
                     "key": key,
-                    "txid": input_.transaction_hash,
-                    "index": input_.transaction_index,
+                    "txid": input_txid,
+                    "index": input_index,
                     "value": None,
                     "type": None,
                     "addresses": [],
-                    "spent_txid": tx.txid,
+                    "spent_txid": txid,
                 }
             else:
-                dict_output[key]['spent_txid'] = tx.txid
+                info['spent_txid'] = txid
+
+        # 交易数据
+        dict_tx[txid] = {
+            "txid": txid,
+            "block_height": height,
+            "is_coinbase": is_coinbase,
+            "inputs": input_keys,
+            "n_outputs": len(outputs),
+        }
+
         # 处理输出
-        for index, output in enumerate(tx.outputs):
+        for index, (value, output_type, addresses) in enumerate(outputs):
             if is_coinbase and index == 2:
                 continue  # 跳过异常的输出
-            key = gen_txo_key(tx.txid, index)
+            key = txid + ',' + str(index)
             dict_output[key] = {
                 'key': key,
-                "txid": tx.txid,
+                "txid": txid,
                 "index": index,
-                "value": output.value,
-                "type": output.type,
-                "addresses": list(set(i.address for i in output.addresses)),
+                "value": value,
+                "type": output_type,
+                "addresses": addresses if len(addresses) < 2 else list(dict.fromkeys(addresses)),  # 去重并保持脚本里的顺序
                 "spent_txid": None,
             }
             # 处理地址
-            for address in output.addresses:
-                if address.address not in dict_address:
-                    dict_address[address.address] = {
-                        "address": address.address,
+            for address in addresses:
+                info = dict_address.get(address)
+                if info is None:
+                    dict_address[address] = {
+                        "address": address,
                         "outputs": [key],
                         "labels": []
                     }
                 else:
-                    dict_address[address.address]['outputs'].append(key)
+                    info['outputs'].append(key)
 
     return dict_tx, dict_address, dict_output
+
+
+def parser_raw_block(raw: bytes, height: int):
+    """
+    直接从区块的原始字节解析出交易、地址、输出 3 个字典，结果与 parser_block 一致
+    :param raw: 区块字节（含 80 字节的区块头）
+    :param height: 区块高度
+    :return:
+    """
+    return _build_records(height, iter_raw_transactions(raw))
+
+
+def parser_block(block: 'Block', raw: bool = True):
+    """
+    解析区块，得到交易、地址、输出 3 个字典
+    :param block: blockchain_parser 的区块对象
+    :param raw: 是否直接解析区块的原始字节（更快，且不需要创建 blockchain_parser 的交易、脚本、地址对象）
+    :return:
+    """
+    if raw and isinstance(getattr(block, 'hex', None), (bytes, bytearray, memoryview)):
+        return parser_raw_block(block.hex, block.height)
+    return _build_records(block.height, _iter_block_transactions(block))
+
+
+def parser_block_info(block: 'Block', dict_tx: dict) -> dict:
+    """
+    区块详情
+    {
+        "hash": hash,                      // 区块 hash
+        "height": height,                  // 区块高度
+        "timestamp": timestamp,            // 区块时间（ unix 时间戳，秒）
+        "txids": [txid],                   // 交易 id 列表（按区块里的顺序）
+        "n_tx": n_tx,                      // 交易数
+    }
+    :param block: blockchain_parser 的区块对象
+    :param dict_tx: parser_block 解析出的交易字典
+    :return:
+    """
+    raw = getattr(block, 'hex', None)
+    if isinstance(raw, (bytes, bytearray, memoryview)):
+        timestamp = _unpack_uint32(raw, 68)[0]  # 区块头的第 68~72 字节
+    else:
+        timestamp = calendar.timegm(block.header.timestamp.utctimetuple())
+    return {
+        'hash': block.hash,
+        'height': block.height,
+        'timestamp': timestamp,
+        'txids': list(dict_tx),
+        'n_tx': len(dict_tx),
+    }
@@ -0,0 +1,182 @@
+from typing import List, Dict, Tuple, TYPE_CHECKING
+from html import escape
+import hashlib
+import pickle
+import os
+
+# 单张图里最多绘制的带箭头的边数，超过后所有边合并为一个 LineCollection 绘制，并且不再绘制边标签
+MAX_ARTIST_EDGES = 300
+
+if TYPE_CHECKING:
+    import networkx as nx
+
+
+def graph_signature(graph: 'nx.DiGraph') -> str:
+    """
+    根据图的内容（节点与边，不含权重）生成签名，用作布局缓存的 key
+    :param graph:
+    :return:
+    """
+    sha = hashlib.sha1()
+    for u, v in sorted(graph.edges()):
+        sha.update(f'{u}->{v};'.encode())
+    for n in sorted(graph.nodes()):
+        sha.update(f'{n};'.encode())
+    return sha.hexdigest()
+
+
+class LayoutCache:
+    """
+    按图内容缓存的布局，过滤条件变化（例如调大 min_weight ）后得到的子图可以直接复用已有的布局
+    """
+
+    def __init__(self, path: str = None, max_size: int = 16):
+        """
+        :param path: 缓存文件路径，如果设置的话，布局会持久化到文件，下次运行可以直接复用
+        :param max_size: 最多缓存的布局个数
+        """
+        assert path is None or isinstance(path, str), path
+        assert isinstance(max_size, int) and max_size > 0, max_size
+        self.path = path
+        self.max_size = max_size
+        self.layouts = {}  # 签名 -> {节点: (x, y)}
+        if path and os.path.exists(path):
+            with open(path, 'rb') as f:
+                self.layouts = pickle.load(f)
+
+    def get(self, graph: 'nx.DiGraph') -> Dict[str, Tuple[float, float]]:
+        """
+        获取图的布局：
+        1. 签名完全一致的布局直接返回
+        2. 节点是某个已缓存布局的子集时，复用其中的坐标
+        3. 都没有的话，调用 graphviz 重新计算并缓存
+        :param graph:
+        :return: 节点 -> 坐标
+        """
+        signature = graph_signature(graph)
+        if signature in self.layouts:
+            return self.layouts[signature]
+
+        nodes = set(graph.nodes())
+        for pos in reversed(list(self.layouts.values())):
+            if nodes.issubset(pos.keys()):
+                return {n: pos[n] for n in nodes}
+
+        import networkx as nx
+        pos = nx.drawing.nx_agraph.graphviz_layout(graph)  # 布局('http://pygraphviz.github.io/')
+        self.layouts[signature] = pos
+        while len(self.layouts) > self.max_size:
+            self.layouts.pop(next(iter(self.layouts)))
+        if self.path:
+            with open(self.path, 'wb') as f:
+                pickle.dump(self.layouts, f)
+        return pos
+
+
+def collapse_leaves(edges: List[list],
+                    min_leaf_weight: (int, float),
+                    keep: set = None) -> (List[list], Dict[str, List[str]]):
+    """
+    细节层次（LOD）处理：把权重低于 min_leaf_weight 的叶子节点（只有一条边的节点）合并到所连节点的聚合节点 "xxx_other" 里
+    :param edges: [[u, v, w], ...]
+    :param min_leaf_weight: 叶子节点的边权重低于该值时才合并
+    :param keep: 不参与合并的节点
+    :return: 新的边列表，聚合节点 -> 被合并的节点列表
+    """
+    keep = keep or set()
+    degree = {}
+    for u, v, _ in edges:
+        degree[u] = degree.get(u, 0) + 1
+        degree[v] = degree.get(v, 0) + 1
+
+    dict_weight = {}  # (u, v) -> w
+    dict_other = {}  # 聚合节点 -> 被合并的节点
+    for u, v, w in edges:
+        if w < min_leaf_weight and degree[v] == 1 and v not in keep and degree[u] > 1:
+            other = f'{u}_other_out'
+            dict_other.setdefault(other, []).append(v)
+            v = other
+        elif w < min_leaf_weight and degree[u] == 1 and u not in keep and degree[v] > 1:
+            other = f'{v}_other_in'
+            dict_other.setdefault(other, []).append(u)
+            u = other
+        dict_weight[(u, v)] = dict_weight.get((u, v), 0) + w
+
+    # 只合并了一个节点的聚合节点没有意义，还原回去
+    for other, merged in list(dict_other.items()):
+        if len(merged) > 1:
+            continue
+        del dict_other[other]
+        for (u, v) in list(dict_weight.keys()):
+            if u == other or v == other:
+                key = (merged[0] if u == other else u, merged[0] if v == other else v)
+                dict_weight[key] = dict_weight.get(key, 0) + dict_weight.pop((u, v))
+
+    return [[u, v, w] for (u, v), w in dict_weight.items()], dict_other
+
+
+def cap_edges(edges: List[list], max_edges: int) -> List[list]:
+    """
+    只保留权重最大的 max_edges 条边
+    :param edges: [[u, v, w], ...]
+    :param max_edges:
+    :return:
+    """
+    if max_edges is None or len(edges) <= max_edges:
+        return edges
+    return sorted(edges, key=lambda x: x[2], reverse=True)[:max_edges]
+
+
+def write_static(path: str,
+                 pos: Dict[str, Tuple[float, float]],
+                 nodes: List[Tuple[str, float, str, str]],
+                 edges: List[Tuple[str, str, float, str, float]],
+                 width: int = 1800,
+                 height: int = 1200):
+    """
+    根据预先计算好的布局输出静态的 SVG 或 HTML 文件（按后缀判断），不依赖 matplotlib
+    :param path: 输出路径，后缀为 .svg 或 .html
+    :param pos: 节点 -> 坐标
+    :param nodes: [(地址, 节点大小, 颜色, 标签), ...]
+    :param edges: [(起点, 终点, 权重, 颜色, 透明度), ...]
+    :param width: 画布宽度（像素）
+    :param height: 画布高度（像素）
+    :return:
+    """
+    assert path.endswith(('.svg', '.html')), f'不支持的输出格式 {path}'
+    margin = 40
+    xs = [x for x, _ in pos.values()] or [0]
+    ys = [y for _, y in pos.values()] or [0]
+    x_min, x_span = min(xs), (max(xs) - min(xs)) or 1
+    y_min, y_span = min(ys), (max(ys) - min(ys)) or 1
+
+    def to_canvas(address):
+        x, y = pos[address]
+        return (margin + (x - x_min) / x_span * (width - 2 * margin),
+                height - margin - (y - y_min) / y_span * (height - 2 * margin))
+
+    lines = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+             f'viewBox="0 0 {width} {height}">',
+             '<defs><marker id="arrow" viewBox="0 0 10 10" refX="10" refY="5" markerWidth="6" markerHeight="6" '
+             'orient="auto"><path d="M0,0 L10,5 L0,10 z" fill="#555"/></marker></defs>',
+             '<g stroke-width="2">']
+    for u, v, w, color, alpha in edges:
+        (x1, y1), (x2, y2) = to_canvas(u), to_canvas(v)
+        lines.append(f'<line x1="{x1:.1f}" y1="{y1:.1f}" x2="{x2:.1f}" y2="{y2:.1f}" stroke="{color}" '
+                     f'stroke-opacity="{alpha:.3f}" marker-end="url(#arrow)">'
+                     f'<title>{escape(u)} -> {escape(v)}: {w:.2f} BTC</title></line>')
+    lines.append('</g><g>')
+    for address, size, color, label in nodes:
+        x, y = to_canvas(address)
+        lines.append(f'<circle cx="{x:.1f}" cy="{y:.1f}" r="{max(size ** 0.5 / 2, 2):.1f}" fill="{color}">'
+                     f'<title>{escape(address)}</title></circle>')
+        if label:
+            lines.append(f'<text x="{x:.1f}" y="{y:.1f}" font-size="8" text-anchor="middle">{escape(label)}</text>')
+    lines.append('</g></svg>')
+    svg = '\n'.join(lines)
+
+    if path.endswith('.html'):
+        svg = ('<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>trace</title></head>\n'
+               f'<body>\n{svg}\n</body></html>')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(svg)
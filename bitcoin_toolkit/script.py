@@ -0,0 +1,192 @@
+from functools import lru_cache
+from typing import List, Tuple
+import hashlib
+
+# 与 blockchain_parser 一致的输出类型判断与地址编码，只覆盖标准脚本，其他脚本交给 blockchain_parser 处理
+BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+BECH32_ALPHABET = 'qpzry9x8gf2tvdw0s3jn54khce6mua7l'
+BECH32_HRP = 'bc'
+_BASE58_CHUNK = 58 ** 10
+
+OP_0 = 0x00
+OP_PUSHDATA1 = 0x4c
+OP_PUSHDATA2 = 0x4d
+OP_PUSHDATA4 = 0x4e
+OP_1 = 0x51
+OP_16 = 0x60
+OP_RETURN = 0x6a
+OP_CHECKMULTISIG = 0xae
+
+
+def double_sha256(data: bytes) -> bytes:
+    return hashlib.sha256(hashlib.sha256(data).digest()).digest()
+
+
+def hash160(data: bytes) -> bytes:
+    return hashlib.new('ripemd160', hashlib.sha256(data).digest()).digest()
+
+
+try:
+    hash160(b'')
+except ValueError:
+    # 部分 OpenSSL 版本禁用了 ripemd160 ，改用 blockchain_parser 依赖的纯 python 实现
+    def hash160(data: bytes) -> bytes:
+        from ripemd import ripemd160
+        r160 = ripemd160.new()
+        r160.update(hashlib.sha256(data).digest())
+        return r160.digest()
+
+
+@lru_cache(maxsize=1 << 16)
+def base58check(version: bytes, payload: bytes) -> str:
+    """
+    base58check 编码（热点地址会被反复编码，因此做了缓存）
+    :param version: 版本字节，普通地址为 b'\\x00' ，P2SH 地址为 b'\\x05'
+    :param payload: 20 字节的哈希
+    :return:
+    """
+    data = version + payload
+    data += double_sha256(data)[:4]
+    n = int.from_bytes(data, 'big')
+    # 先按 58^10 分块，减少大整数除法的次数
+    chunks = []
+    while n:
+        n, r = divmod(n, _BASE58_CHUNK)
+        chunks.append(r)
+    chars = []
+    for i, r in enumerate(chunks):
+        last = i == len(chunks) - 1
+        for _ in range(10):
+            if last and not r:
+                break
+            r, c = divmod(r, 58)
+            chars.append(BASE58_ALPHABET[c])
+    pad = len(data) - len(data.lstrip(b'\x00'))
+    return '1' * pad + ''.join(reversed(chars))
+
+
+def _bech32_polymod(values: List[int]) -> int:
+    generator = [0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3]
+    chk = 1
+    for v in values:
+        b = chk >> 25
+        chk = (chk & 0x1ffffff) << 5 ^ v
+        for i in range(5):
+            chk ^= generator[i] if ((b >> i) & 1) else 0
+    return chk
+
+
+@lru_cache(maxsize=1 << 14)
+def bech32(version: int, program: bytes) -> str:
+    """
+    segwit 地址的 bech32 编码（ BIP173 ）
+    :param version: 见证版本
+    :param program: 见证程序
+    :return:
+    """
+    acc, bits, data = 0, 0, [version]
+    for byte in program:
+        acc = (acc << 8) | byte
+        bits += 8
+        while bits >= 5:
+            bits -= 5
+            data.append((acc >> bits) & 31)
+    if bits:
+        data.append((acc << (5 - bits)) & 31)
+    hrp = [ord(i) >> 5 for i in BECH32_HRP] + [0] + [ord(i) & 31 for i in BECH32_HRP]
+    polymod = _bech32_polymod(hrp + data + [0] * 6) ^ 1
+    checksum = [(polymod >> 5 * (5 - i)) & 31 for i in range(6)]
+    return BECH32_HRP + '1' + ''.join(BECH32_ALPHABET[i] for i in data + checksum)
+
+
+def is_valid_script(script: bytes) -> bool:
+    """
+    脚本里的所有 PUSHDATA 是否完整（与 python-bitcoinlib 的 CScript.is_valid 一致）
+    :param script:
+    :return:
+    """
+    i, n = 0, len(script)
+    while i < n:
+        op = script[i]
+        i += 1
+        if op > OP_PUSHDATA4:
+            continue
+        if op < OP_PUSHDATA1:
+            size = op
+        elif op == OP_PUSHDATA1:
+            if i + 1 > n:
+                return False
+            size = script[i]
+            i += 1
+        elif op == OP_PUSHDATA2:
+            if i + 2 > n:
+                return False
+            size = int.from_bytes(script[i:i + 2], 'little')
+            i += 2
+        else:
+            if i + 4 > n:
+                return False
+            size = int.from_bytes(script[i:i + 4], 'little')
+            i += 4
+        if i + size > n:
+            return False
+        i += size
+    return True
+
+
+def _is_public_key(data: bytes) -> bool:
+    return (len(data) == 33 and data[0] in (2, 3)) or (len(data) == 65 and data[0] == 4)
+
+
+def _parse_multisig(script: bytes) -> List[bytes]:
+    """
+    解析标准的多签脚本： OP_m <公钥>... OP_n OP_CHECKMULTISIG ，且 m <= n 、 n 等于公钥个数
+    :param script:
+    :return: 公钥列表，不是标准多签脚本时返回 None
+    """
+    n_script = len(script)
+    if n_script < 4 or not OP_1 <= script[0] <= OP_16 or script[-1] != OP_CHECKMULTISIG:
+        return None
+    m, n = script[0] - 0x50, script[-2] - 0x50
+    if not 1 <= n <= 16 or n < m:
+        return None
+    pubkeys, i = [], 1
+    while i < n_script - 2:
+        size = script[i]
+        if size not in (33, 65) or i + 1 + size > n_script - 2:
+            return None
+        pubkey = script[i + 1:i + 1 + size]
+        if not _is_public_key(pubkey):
+            return None
+        pubkeys.append(pubkey)
+        i += 1 + size
+    return pubkeys if len(pubkeys) == n else None
+
+
+def decode_script(script: bytes) -> Tuple[str, List[str]]:
+    """
+    解析输出脚本的类型与地址，结果与 blockchain_parser 的 Output.type 、 Output.addresses 一致。
+    只处理标准脚本，无法快速判断的脚本返回 None ，由调用方交给 blockchain_parser 处理
+    :param script: 输出脚本
+    :return: (类型, [地址, ...]) 或 None
+    """
+    n = len(script)
+    first = script[0] if n else None
+    if n == 25 and first == 0x76 and script[1] == 0xa9 and script[2] == 0x14 and script[23] == 0x88 \
+            and script[24] == 0xac:
+        return 'pubkeyhash', [base58check(b'\x00', script[3:23])]
+    if n == 23 and first == 0xa9 and script[1] == 0x14 and script[22] == 0x87:
+        return 'p2sh', [base58check(b'\x05', script[2:22])]
+    if n == 22 and first == OP_0 and script[1] == 0x14:
+        return 'p2wpkh', [bech32(0, script[2:])]
+    if n == 34 and first == OP_0 and script[1] == 0x20:
+        return 'p2wsh', [bech32(0, script[2:])]
+    if (n == 35 or n == 67) and first == n - 2 and script[-1] == 0xac and _is_public_key(script[1:-1]):
+        return 'pubkey', [base58check(b'\x00', hash160(script[1:-1]))]
+    if first == OP_RETURN:
+        return ('OP_RETURN', []) if is_valid_script(script) else ('invalid', [])
+    if first is not None and OP_1 <= first <= OP_16:
+        pubkeys = _parse_multisig(script)
+        if pubkeys is not None:
+            return 'multisig', [base58check(b'\x00', hash160(i)) for i in pubkeys]
+    return None
@@ -0,0 +1,524 @@
+from typing import Iterator, List, Mapping
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import MethodType, FunctionType
+from contextlib import contextmanager
+from functools import wraps
+from .trace import Trace
+import threading
+import logging
+import json
+import time
+
+
+def _to_json(obj):
+    # 引擎设置了 record_views 时查询结果是只读视图（见 models ），按字典序列化
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    raise TypeError(f'{type(obj).__name__} 不能序列化为 json')
+
+
+class RWLock:
+    """
+    读写锁：多个读者可以同时持有，写者独占。有写者在等待时新的读者也要等待，避免查询不断时导入一直拿不到锁；
+    写锁可以被持有它的线程重复获取（例如 RedisEngine.from_block 内部调用 from_blocks ）
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition(threading.Lock())
+        self.readers = 0  # 持有读锁的线程数
+        self.writer = None  # 持有写锁的线程
+        self.writer_depth = 0  # 写锁的重入次数
+        self.waiting_writers = 0  # 等待写锁的线程数
+
+    @contextmanager
+    def read(self):
+        with self.cond:
+            while self.writer is not None or self.waiting_writers:
+                self.cond.wait()
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.readers -= 1
+                if not self.readers:
+                    self.cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        ident = threading.get_ident()
+        with self.cond:
+            if self.writer != ident:
+                self.waiting_writers += 1
+                while self.writer is not None or self.readers:
+                    self.cond.wait()
+                self.waiting_writers -= 1
+                self.writer = ident
+            self.writer_depth += 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.writer_depth -= 1
+                if not self.writer_depth:
+                    self.writer = None
+                    self.cond.notify_all()
+
+
+class LockedEngine:
+    """
+    给搜索引擎加上读写锁，使查询与导入（ read_data/write_data 、 Follower 的实时更新）可以在不同线程里同时进行：
+    查询方法（ get_*/batch_get_*/expand ）持有读锁，
+    写入方法（ from_block/from_blocks/rollback_block ）持有写锁，
+    read_data/write_data 每导入一个区块（或一批区块）获取一次写锁，查询只会看到完整导入的区块。
+    其他属性与方法（包括 iter_* ，遍历期间不加锁）直接转发给原引擎
+    """
+    READ_PREFIXES = ('get_', 'batch_get_')
+    READ_METHODS = ('expand',)
+    WRITE_METHODS = ('from_block', 'from_blocks', 'rollback_block')
+
+    def __init__(self, engine):
+        """
+        :param engine: 搜索引擎，见 Trace.set_search_engine
+        """
+        assert hasattr(engine, 'batch_get_tx'), 'engine 需要有 batch_get_tx 方法'
+        object.__setattr__(self, 'engine', engine)
+        object.__setattr__(self, 'lock', RWLock())
+
+    @staticmethod
+    def __locked(func: (FunctionType, MethodType), lock) -> FunctionType:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with lock():
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.engine, name)
+        if not callable(attr):
+            return attr
+        if name.startswith(self.READ_PREFIXES) or name in self.READ_METHODS:
+            return self.__locked(attr, self.lock.read)
+        if name in self.WRITE_METHODS:
+            return self.__locked(attr, self.lock.write)
+        return attr
+
+    def __setattr__(self, name: str, value):
+        setattr(self.engine, name, value)  # 例如 Follower 设置的 undo_depth 、 max_height
+
+    def __ingest(self, method: str, *args, **kwargs):
+        """
+        调用引擎的导入方法，期间把引擎的写入方法替换为加锁的版本（导入方法内部调用的是 self.from_block 等）
+        :param method:
+        :return:
+        """
+        engine = self.engine
+        saved = {name: engine.__dict__.get(name) for name in self.WRITE_METHODS if hasattr(engine, name)}
+        for name in saved:
+            setattr(engine, name, self.__locked(getattr(engine, name), self.lock.write))
+        try:
+            return getattr(engine, method)(*args, **kwargs)
+        finally:
+            for name, func in saved.items():
+                if func is None:
+                    delattr(engine, name)
+                else:
+                    setattr(engine, name, func)
+
+    def read_data(self, *args, **kwargs):
+        """
+        加锁地调用 FileEngine.read_data ，参数相同
+        """
+        return self.__ingest('read_data', *args, **kwargs)
+
+    def write_data(self, *args, **kwargs):
+        """
+        加锁地调用 RedisEngine.write_data/SqliteEngine.write_data ，参数相同
+        """
+        return self.__ingest('write_data', *args, **kwargs)
+
+
+class Coalescer:
+    """
+    合并并发的批量查询：同一时间多个线程查询的 key 去重后合并为一次引擎调用，
+    正在查询中的 key 不会被重复查询，而是等待已有的结果。
+    同一时间只有一个线程（ leader ）发起查询，它只查询开始时已经在等待的 key ，查完后交出 leader ，
+    由还有 key 在等待的线程接手，因此持续有新请求时 leader 自己的请求也能及时返回
+    """
+
+    def __init__(self, func: (FunctionType, MethodType), max_wait: float = 0.002, max_batch: int = 10000):
+        """
+        :param func: 批量查询函数，参数为 key 列表，返回等长的结果列表
+        :param max_wait: 发起查询前等待其他请求的时间（秒）
+        :param max_batch: 单次引擎调用的最多 key 数
+        """
+        assert callable(func), func
+        assert max_wait >= 0, max_wait
+        assert isinstance(max_batch, int) and max_batch > 0, max_batch
+        self.func = func
+        self.max_wait = max_wait
+        self.max_batch = max_batch
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)  # leader 查完一批或者交出 leader 时通知等待的线程
+        self.pending = {}  # 等待查询的 key -> Future
+        self.inflight = {}  # 正在查询的 key -> Future
+        self.flushing = False  # 是否已经有线程负责发起查询
+
+        # 统计
+        self.n_requests = 0  # 请求数
+        self.n_keys = 0  # 请求的 key 数
+        self.n_merged = 0  # 与其他请求合并（没有单独查询）的 key 数
+        self.n_calls = 0  # 引擎调用数
+        self.n_engine_keys = 0  # 引擎查询的 key 数
+
+    def __call__(self, keys: List[str]) -> list:
+        """
+        批量查询
+        :param keys:
+        :return: 与 keys 等长的结果列表
+        """
+        keys = list(keys)
+        futures = []
+        with self.lock:
+            self.n_requests += 1
+            self.n_keys += len(keys)
+            for key in keys:
+                future = self.pending.get(key) or self.inflight.get(key)
+                if future is None:
+                    future = self.pending[key] = Future()
+                else:
+                    self.n_merged += 1
+                futures.append(future)
+
+        while True:
+            with self.cond:
+                while self.flushing and not all(i.done() for i in futures):
+                    self.cond.wait()
+                if all(i.done() for i in futures):
+                    break
+                # 没有 leader 时，未完成的 key 一定还在 pending 里，由当前线程负责查询
+                self.flushing = True
+            # 先等一会儿，让并发的请求加入同一批
+            if self.max_wait:
+                time.sleep(self.max_wait)
+            self.__flush()
+        return [i.result() for i in futures]
+
+    def __flush(self):
+        """
+        分批查询开始时所有等待中的 key （之后加入的 key 由下一个 leader 查询），查完后交出 leader
+        :return:
+        """
+        with self.lock:
+            keys = list(self.pending)
+        try:
+            for i in range(0, len(keys), self.max_batch):
+                with self.lock:
+                    batch = {key: self.pending.pop(key) for key in keys[i:i + self.max_batch]}
+                    self.inflight.update(batch)
+                    self.n_calls += 1
+                    self.n_engine_keys += len(batch)
+                try:
+                    results = list(self.func(list(batch)))
+                    assert len(results) == len(batch), f'查询结果数 {len(results)} 与 key 数 {len(batch)} 不一致'
+                except BaseException as e:
+                    for future in batch.values():
+                        future.set_exception(e)
+                else:
+                    for future, result in zip(batch.values(), results):
+                        future.set_result(result)
+                finally:
+                    with self.cond:
+                        for key in batch:
+                            self.inflight.pop(key, None)
+                        self.cond.notify_all()
+        finally:
+            with self.cond:
+                self.flushing = False
+                self.cond.notify_all()
+
+    def stats(self) -> dict:
+        """
+        合并统计
+        :return:
+        """
+        with self.lock:
+            return {
+                'requests': self.n_requests,
+                'keys': self.n_keys,
+                'merged': self.n_merged,
+                'calls': self.n_calls,
+                'engine_keys': self.n_engine_keys,
+            }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.0'  # 流式返回的结果以关闭连接表示结束
+
+    def log_message(self, format, *args):
+        self.server.service.logger.debug(f'{self.address_string()} {format % args}')
+
+    def __send_json(self, code: int, data: dict):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def __send_lines(self, first: dict, lines: Iterator[dict]):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        try:
+            while first is not None:
+                self.wfile.write(json.dumps(first, default=_to_json).encode() + b'\n')
+                self.wfile.flush()
+                first = next(lines, None)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # 客户端提前断开
+        except Exception as e:
+            # 响应头已经发出，只能在最后一行返回错误
+            self.wfile.write(json.dumps({'error': f'{type(e).__name__}: {e}'}).encode() + b'\n')
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path == '/health':
+            self.__send_json(200, {'status': 'ok', 'ingest_height': service.get_ingest_height()})
+        elif self.path == '/stats':
+            self.__send_json(200, service.stats())
+        else:
+            self.__send_json(404, {'error': f'未知的路径 {self.path}'})
+
+    def do_POST(self):
+        service = self.server.service
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            data = json.loads(self.rfile.read(length) or b'{}')
+            assert isinstance(data, dict), '请求需要是 json 对象'
+            if self.path.startswith('/get/'):
+                lines = service.iter_get(self.path[len('/get/'):], data.get('keys') or [])
+            elif self.path == '/trace':
+                lines = service.iter_trace(data.get('jobs') or [data])
+            else:
+                self.__send_json(404, {'error': f'未知的路径 {self.path}'})
+                return
+            first = next(lines, None)  # 参数错误在返回响应头之前抛出
+        except (AssertionError, ValueError, KeyError) as e:
+            self.__send_json(400, {'error': str(e)})
+            return
+        self.__send_lines(first, lines)
+
+
+class TraceServer:
+    """
+    本地的追溯查询服务（只依赖标准库）：多个分析人员共用一个已经加载好的引擎，不需要各自建立连接、加载数据。
+    查询通过 Coalescer 合并后再访问引擎，追溯任务在线程池里运行，引擎通过 LockedEngine 加锁，导入期间也可以查询。
+    接口（请求体为 json ，批量结果以 json lines 流式返回，每行一个结果）：
+        GET  /health        {"status": "ok", "ingest_height": 已导入的最高区块高度}
+        GET  /stats         查询合并与任务统计
+        POST /get/<kind>    {"keys": [...]} ，
+                            kind 为 tx/txo/address/address_stats/block ，
+                            每行返回 {"key": key, "value": 详情}
+        POST /trace         {"jobs": [任务, ...]} 或单个任务，
+                            任务为 {"txid" 或 "address", "min_height", "max_height",
+                            "max_depth", "start_time", "end_time"} ，每个任务完成后返回一行
+                            {"id": 任务序号, "result": 追溯结果（见 Trace.to_dict ）} ，
+                            失败时为 {"id": 任务序号, "error": 原因}
+    """
+    KINDS = ('tx', 'txo', 'address', 'address_stats', 'block')
+    COALESCED_KINDS = ('tx', 'txo', 'address')
+
+    def __init__(self,
+                 engine,
+                 host: str = '127.0.0.1',
+                 port: int = 8421,
+                 max_workers: int = 4,
+                 max_depth: int = 3,
+                 coalesce_wait: float = 0.002,
+                 max_batch: int = 10000):
+        """
+        :param engine: 搜索引擎，没有加锁时自动用 LockedEngine 包装
+        :param host: 监听的地址，默认只监听本机
+        :param port: 监听的端口，为 0 时自动分配（见 self.url ）
+        :param max_workers: 同时运行的追溯任务数
+        :param max_depth: 任务没有指定时的追溯深度
+        :param coalesce_wait: 合并查询时等待其他请求的时间（秒）
+        :param max_batch: 单次引擎调用的最多 key 数，也是 /get 流式返回的分批大小
+        """
+        assert isinstance(max_workers, int) and max_workers > 0, max_workers
+        assert isinstance(max_depth, int) and 0 <= max_depth < 100, max_depth
+        self.engine = engine if isinstance(engine, LockedEngine) else LockedEngine(engine)
+        self.max_depth = max_depth
+        self.max_batch = max_batch
+        self.logger = logging.getLogger(__name__)
+        self.coalescers = {kind: Coalescer(getattr(self.engine, f'batch_get_{kind}'), coalesce_wait, max_batch)
+                           for kind in self.COALESCED_KINDS}
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.jobs = {'running': 0, 'done': 0, 'failed': 0}
+        self.jobs_lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.service = self
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def get_ingest_height(self) -> int:
+        """
+        引擎已导入的最高区块高度
+        :return: 引擎不支持时返回 None
+        """
+        func = getattr(self.engine, 'get_ingest_height', None)
+        return func() if func else None
+
+    def batch_get(self, kind: str, keys: List[str]) -> list:
+        """
+        批量查询， tx/txo/address 会与其他请求合并
+        :param kind: 见 self.KINDS
+        :param keys:
+        :return:
+        """
+        assert kind in self.KINDS, f'kind 只能是 {self.KINDS} 之一'
+        if kind in self.coalescers:
+            return self.coalescers[kind](keys)
+        func = getattr(self.engine, f'batch_get_{kind}', None)
+        assert func is not None, f'引擎不支持 batch_get_{kind}'
+        return func(keys)
+
+    def iter_get(self, kind: str, keys: List[str]) -> Iterator[dict]:
+        """
+        分批查询并逐行返回
+        :param kind:
+        :param keys:
+        :return: {"key": key, "value": 详情} 的生成器
+        """
+        assert kind in self.KINDS, f'kind 只能是 {self.KINDS} 之一'
+        assert isinstance(keys, list) and all(isinstance(i, str) for i in keys), 'keys 需要是字符串列表'
+        for i in range(0, len(keys), self.max_batch):
+            chunk = keys[i:i + self.max_batch]
+            for key, value in zip(chunk, self.batch_get(kind, chunk)):
+                yield {'key': key, 'value': value}
+
+    def create_trace(self, job: dict) -> Trace:
+        """
+        由任务参数创建追溯实例，查询经过合并后访问引擎
+        :param job: 见类的说明
+        :return:
+        """
+        assert isinstance(job, dict), job
+        trace = Trace(job.get('min_height', 0), job.get('max_height'), init_txid=job.get('txid'),
+                      init_address=job.get('address'), max_depth=job.get('max_depth', self.max_depth))
+        batch_tx, batch_txo, batch_address = (self.coalescers[i] for i in self.COALESCED_KINDS)
+        trace.set_search_func(search_tx=lambda x: batch_tx([x])[0],
+                              search_txo=lambda x: batch_txo([x])[0],
+                              search_address=lambda x: batch_address([x])[0],
+                              batch_search_tx=batch_tx,
+                              batch_search_txo=batch_txo,
+                              batch_search_address=batch_address,
+                              search_tip_height=getattr(self.engine, 'get_ingest_height', None),
+                              search_block_index=getattr(self.engine, 'get_block_index', None))
+        # 与 set_search_engine 一致地使用引擎的输出过滤器与导入过滤器；
+        # 不使用 expand （每个任务一次调用，无法与其他任务合并），也不限定高度范围（合并后的一次查询包含多个任务的 key ）
+        trace.search_output_filter = getattr(self.engine, 'get_output_filter', None)
+        trace.ingest_filter = getattr(self.engine, 'ingest_filter', None)
+        if job.get('start_time') is not None or job.get('end_time') is not None:
+            trace.set_time_range(job.get('start_time'), job.get('end_time'))
+        return trace
+
+    def run_trace(self, job: dict) -> dict:
+        """
+        运行一个追溯任务
+        :param job: 见类的说明
+        :return: 追溯结果，见 Trace.to_dict
+        """
+        with self.jobs_lock:
+            self.jobs['running'] += 1
+        try:
+            trace = self.create_trace(job)
+            trace.start()
+            result = trace.to_dict()
+        except Exception:
+            with self.jobs_lock:
+                self.jobs['failed'] += 1
+            raise
+        finally:
+            with self.jobs_lock:
+                self.jobs['running'] -= 1
+        with self.jobs_lock:
+            self.jobs['done'] += 1
+        return result
+
+    def iter_trace(self, jobs: List[dict]) -> Iterator[dict]:
+        """
+        在线程池里运行多个追溯任务，按完成的先后逐行返回
+        :param jobs:
+        :return: {"id": 任务序号, "result": 追溯结果} 或 {"id": 任务序号, "error": 原因} 的生成器
+        """
+        assert isinstance(jobs, list) and all(isinstance(i, dict) for i in jobs), 'jobs 需要是对象列表'
+        futures = {self.executor.submit(self.run_trace, job): i for i, job in enumerate(jobs)}
+        for future in as_completed(futures):
+            try:
+                yield {'id': futures[future], 'result': future.result()}
+            except Exception as e:
+                yield {'id': futures[future], 'error': f'{type(e).__name__}: {e}'}
+
+    def stats(self) -> dict:
+        """
+        查询合并与任务统计
+        :return:
+        """
+        with self.jobs_lock:
+            jobs = dict(self.jobs)
+        return {'coalescers': {kind: i.stats() for kind, i in self.coalescers.items()}, 'jobs': jobs}
+
+    def serve_forever(self):
+        """
+        在当前线程里运行服务，直到调用 self.close
+        :return:
+        """
+        self.logger.info(f'追溯查询服务已启动：{self.url}')
+        self.httpd.serve_forever()
+
+    def start(self) -> 'TraceServer':
+        """
+        在后台线程里运行服务
+        :return:
+        """
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def close(self):
+        """
+        停止服务并关闭线程池
+        :return:
+        """
+        if self.thread is not None:
+            self.httpd.shutdown()
+            self.thread.join()
+            self.thread = None
+        self.httpd.server_close()
+        self.executor.shutdown(wait=False)
+
+
+def request_lines(url: str, data: dict = None, timeout: float = None) -> Iterator[dict]:
+    """
+    请求 TraceServer 并逐行解析返回的 json lines
+    :param url: 完整的地址，例如 server.url + '/get/tx'
+    :param data: 请求体，为空时发送 GET 请求
+    :param timeout: 超时时间（秒）
+    :return: 每行结果的生成器，返回单个 json 对象的接口只有一行
+    """
+    from urllib.request import Request, urlopen
+    body = json.dumps(data).encode() if data is not None else None
+    request = Request(url, data=body, headers={'Content-Type': 'application/json'})
+    with urlopen(request, timeout=timeout) as response:
+        for line in response:
+            if line.strip():
+                yield json.loads(line)
@@ -0,0 +1,247 @@
+from typing import Iterator, List, Tuple
+from bisect import bisect_left
+from array import array
+from .utils import hash_key, BloomFilter, build_key_filter
+import struct
+import json
+import sys
+
+# 共享内存的布局（所有整数都是本机字节序的 64 位无符号整数）：
+#     magic（ 8 字节）
+#     3 张表（交易、输出、地址）各自的 [行数, 哈希数组的偏移, 偏移数组的偏移, 数据的偏移]
+#     每张表：按哈希排序的 key 哈希数组（ n 个）、每行数据的起始偏移数组（ n + 1 个）、紧凑的 json 数据
+# 查询时对哈希数组做二分查找，再比对 json 里的 key 排除哈希冲突，整个过程不需要复制共享内存里的数据
+MAGIC = b'BTKSHM01'
+TABLES = (('tx', 'txid'), ('txo', 'key'), ('address', 'address'))
+_HEADER = struct.Struct('=' + 'Q' * 4 * len(TABLES))
+
+
+def _attach(name: str):
+    """
+    只读地挂载共享内存，并且不让当前进程退出时回收它（ python 3.13 之前挂载的进程也会登记到 resource_tracker ）
+    :param name:
+    :return:
+    """
+    from multiprocessing import shared_memory
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    # 挂载时不登记（子进程与父进程共用同一个 resource_tracker ，不能在挂载后再注销）
+    from multiprocessing import resource_tracker
+    register = resource_tracker.register
+    resource_tracker.register = lambda *args, **kwargs: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+class _Table:
+    """
+    共享内存里的一张表
+    """
+
+    def __init__(self, buf: memoryview, n: int, hashes_offset: int, offsets_offset: int, data_offset: int,
+                 key_field: str):
+        self.n = n
+        self.hashes = buf[hashes_offset:hashes_offset + 8 * n].cast('Q')
+        self.offsets = buf[offsets_offset:offsets_offset + 8 * (n + 1)].cast('Q')
+        self.data = buf[data_offset:]
+        self.key_field = key_field
+
+    def release(self):
+        for view in (self.hashes, self.offsets, self.data):
+            view.release()
+
+    def row(self, i: int) -> dict:
+        return json.loads(self.data[self.offsets[i]:self.offsets[i + 1]].tobytes())
+
+    def get(self, key: str) -> dict:
+        """
+        二分查找 key 的哈希，再排除哈希冲突
+        :param key:
+        :return:
+        """
+        h = hash_key(key)
+        i = bisect_left(self.hashes, h)
+        while i < self.n and self.hashes[i] == h:
+            info = self.row(i)
+            if info[self.key_field] == key:
+                return info
+            i += 1
+        return None
+
+    def __iter__(self) -> Iterator[dict]:
+        for i in range(self.n):
+            yield self.row(i)
+
+
+class SharedEngine:
+    """
+    基于共享内存的只读搜索引擎：由一个进程把已经加载好的引擎的数据发布到共享内存（ SharedEngine.publish ），
+    其他任意多个进程按名字挂载（ SharedEngine(name) ）后直接在共享内存上查询，整台机器只占用一份内存（需要 python 3.8+ ）
+    """
+
+    def __init__(self, name: str, _shm=None):
+        """
+        :param name: 共享内存的名字，见 publish 返回的实例的 name 属性
+        """
+        self.shm = _shm or _attach(name)
+        self.name = self.shm.name
+        self.owner = _shm is not None  # 发布者负责回收共享内存
+        buf = self.shm.buf
+        assert bytes(buf[:len(MAGIC)]) == MAGIC, f'共享内存 {name} 不是由 SharedEngine.publish 创建的'
+        header = _HEADER.unpack_from(buf, len(MAGIC))
+        self.tables = {}
+        for i, (table, key_field) in enumerate(TABLES):
+            self.tables[table] = _Table(buf, *header[4 * i:4 * i + 4], key_field=key_field)
+        self.output_filter = None  # 有真实数据的输出 key 的布隆过滤器，见 self.get_output_filter
+
+    @classmethod
+    def publish(cls, engine, name: str = None) -> 'SharedEngine':
+        """
+        把引擎的数据发布到共享内存，引擎需要有 iter_tx/iter_txo/iter_address 方法
+        :param engine: 搜索引擎
+        :param name: 共享内存的名字，为空时自动生成
+        :return: 发布者持有的实例，不再需要时调用 unlink 回收共享内存
+        """
+        from multiprocessing import shared_memory
+        tables = []
+        for table, key_field in TABLES:
+            rows = sorted((hash_key(info[key_field]), json.dumps(info, separators=(',', ':')).encode())
+                          for info in getattr(engine, f'iter_{table}')())
+            tables.append(rows)
+
+        # 计算各部分的偏移
+        header, layouts, offset = [], [], len(MAGIC) + _HEADER.size
+        for rows in tables:
+            n = len(rows)
+            hashes_offset = offset
+            offsets_offset = hashes_offset + 8 * n
+            data_offset = offsets_offset + 8 * (n + 1)
+            data_size = sum(len(payload) for _, payload in rows)
+            header.extend([n, hashes_offset, offsets_offset, data_offset])
+            layouts.append((hashes_offset, offsets_offset, data_offset))
+            offset = (data_offset + data_size + 7) // 8 * 8  # 下一张表按 8 字节对齐
+
+        shm = shared_memory.SharedMemory(name=name, create=True, size=max(offset, 1))
+        buf = shm.buf
+        buf[:len(MAGIC)] = MAGIC
+        _HEADER.pack_into(buf, len(MAGIC), *header)
+        for rows, (hashes_offset, offsets_offset, data_offset) in zip(tables, layouts):
+            n = len(rows)
+            offsets, position = array('Q', [0] * (n + 1)), 0
+            for i, (_, payload) in enumerate(rows):
+                position += len(payload)
+                offsets[i + 1] = position
+            buf[hashes_offset:offsets_offset] = array('Q', (h for h, _ in rows)).tobytes()
+            buf[offsets_offset:data_offset] = offsets.tobytes()
+            buf[data_offset:data_offset + position] = b''.join(payload for _, payload in rows)
+        return cls(shm.name, _shm=shm)
+
+    def __batch(self, table: str, keys: List[str]) -> List[dict]:
+        table = self.tables[table]
+        return [table.get(i) if isinstance(i, str) else {} for i in keys]
+
+    def get_address(self, address: str) -> dict:
+        """
+        获取单个地址详情，详情内容请见 FileEngine.get_address
+        :param address:
+        :return:
+        """
+        return self.__batch('address', [address])[0]
+
+    def batch_get_address(self, addresses: List[str]) -> List[dict]:
+        """
+        批量获取地址详情，详情内容请见 FileEngine.get_address
+        :param addresses:
+        :return:
+        """
+        return self.__batch('address', addresses)
+
+    def get_tx(self, txid: str) -> dict:
+        """
+        获取单个交易详情，详情内容请见 FileEngine.get_tx
+        :param txid:
+        :return:
+        """
+        return self.__batch('tx', [txid])[0]
+
+    def batch_get_tx(self, txids: List[str]) -> List[dict]:
+        """
+        批量获取交易详情，详情内容请见 FileEngine.get_tx
+        :param txids:
+        :return:
+        """
+        return self.__batch('tx', txids)
+
+    def get_txo(self, key: str) -> dict:
+        """
+        获取单个 txo 详情，详情内容请见 FileEngine.get_txo
+        :param key:
+        :return:
+        """
+        return self.__batch('txo', [key])[0]
+
+    def batch_get_txo(self, keys: List[str]) -> List[dict]:
+        """
+        批量获取 txo 详情，详情内容请见 FileEngine.get_txo
+        :param keys:
+        :return:
+        """
+        return self.__batch('txo', keys)
+
+    def iter_address(self) -> Iterator[dict]:
+        """
+        遍历所有地址详情
+        :return:
+        """
+        return iter(self.tables['address'])
+
+    def iter_tx(self) -> Iterator[dict]:
+        """
+        遍历所有交易详情
+        :return:
+        """
+        return iter(self.tables['tx'])
+
+    def iter_txo(self) -> Iterator[dict]:
+        """
+        遍历所有输出详情
+        :return:
+        """
+        return iter(self.tables['txo'])
+
+    def get_output_filter(self) -> BloomFilter:
+        """
+        有真实数据的输出 key 的布隆过滤器（见 FileEngine.get_output_filter ），第一次调用时在当前进程里建立
+        :return:
+        """
+        if self.output_filter is None:
+            table = self.tables['txo']
+            self.output_filter = build_key_filter((info['key'] for info in table if info['type'] is not None), table.n)
+        return self.output_filter
+
+    @property
+    def sizes(self) -> Tuple[int, int]:
+        """
+        :return: (总行数, 共享内存的字节数)
+        """
+        return sum(i.n for i in self.tables.values()), self.shm.size
+
+    def close(self):
+        """
+        断开当前进程与共享内存的连接
+        :return:
+        """
+        for table in self.tables.values():
+            table.release()
+        self.tables = {}
+        self.shm.close()
+
+    def unlink(self):
+        """
+        关闭并回收共享内存（由发布者调用，之后其他进程无法再挂载）
+        :return:
+        """
+        self.close()
+        self.shm.unlink()
@@ -0,0 +1,265 @@
+from typing import Iterable, Iterator, Tuple
+from collections.abc import MutableMapping
+from itertools import islice
+from .utils import BloomFilter
+import threading
+import sqlite3
+import json
+import sys
+import os
+
+_MISSING = object()
+
+
+def deep_sizeof(obj) -> int:
+    """
+    对象及其包含的字典、列表、字符串等的总字节数（共享的对象会重复计算，单例 None/True/False 不计算）
+    :param obj:
+    :return:
+    """
+    if obj is None or obj is True or obj is False:
+        return 0
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k) + deep_sizeof(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(i) for i in obj)
+    return size
+
+
+def estimate_sizeof(data: dict, n_samples: int = 1000) -> int:
+    """
+    按均匀采样的数据估计字典的总字节数（不用遍历计算每一条数据）
+    :param data:
+    :param n_samples: 采样的数据条数
+    :return:
+    """
+    if not data:
+        return sys.getsizeof(data)
+    step = max(len(data) // n_samples, 1)
+    samples = [deep_sizeof(k) + deep_sizeof(v) for k, v in islice(data.items(), 0, None, step)]
+    return sys.getsizeof(data) + sum(samples) * len(data) // len(samples)
+
+
+class SpillDict(MutableMapping):
+    """
+    可以把一部分数据转移到磁盘的字典，用于 FileEngine 的内存预算（见 FileEngine.__init__ 的 memory_limit ）：
+    1. 内存里的数据（ hot ）按写入的先后排列，spill 时把最早写入的（通常是高度最低的区块的）数据转移到 sqlite 文件里
+    2. 读取时先查内存，再查磁盘（有布隆过滤器，磁盘上没有的 key 不用查询），磁盘上的数据不会再放回内存
+    3. 写入总是写到内存里，同时删除磁盘上的旧数据，因此修改过的数据（例如输出被花费）会回到内存里
+    值需要可以序列化为 json ，key 需要是字符串
+    """
+
+    def __init__(self, path: str, sample_every: int = 64):
+        """
+        :param path: sqlite 文件路径，只作为临时存储，已有的数据会被清空
+        :param sample_every: 每写入多少条数据采样一次数据的大小
+        """
+        assert isinstance(sample_every, int) and sample_every > 0, sample_every
+        self.hot = {}
+        self.path = str(path)
+        self.lock = threading.Lock()  # 磁盘上的数据可能被多个线程同时查询
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        # 临时数据，不需要日志与同步
+        self.conn.execute('PRAGMA journal_mode = OFF')
+        self.conn.execute('PRAGMA synchronous = OFF')
+        self.conn.execute('DROP TABLE IF EXISTS data')
+        self.conn.execute('CREATE TABLE data (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID')
+        self.n_cold = 0  # 磁盘上的数据条数
+        self.cold_filter = BloomFilter.for_capacity(1 << 16)  # 磁盘上的 key
+        self.cold_capacity = 1 << 16  # 布隆过滤器的容量，超过时重新建立
+
+        # 内存统计：每 sample_every 次写入采样一条数据的大小
+        self.sample_every = sample_every
+        self.n_writes = 0
+        self.n_samples = 0
+        self.sample_bytes = 0
+
+    # ---------------- 磁盘
+    def __get_cold(self, key: str, default=None):
+        if not self.n_cold or key not in self.cold_filter:
+            return default
+        with self.lock:
+            row = self.conn.execute('SELECT value FROM data WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def __discard_cold(self, keys: Iterable[str]) -> int:
+        """
+        删除磁盘上的数据
+        :param keys:
+        :return: 删除的条数
+        """
+        if not self.n_cold:
+            return 0
+        keys = [(i,) for i in keys if i in self.cold_filter]
+        if not keys:
+            return 0
+        with self.lock:
+            before = self.conn.total_changes
+            self.__executemany('DELETE FROM data WHERE key = ?', keys)
+            n = self.conn.total_changes - before
+        self.n_cold -= n
+        return n
+
+    def __executemany(self, sql: str, rows: list):
+        # 连接是自动提交模式，批量写入时放在一个事务里
+        self.conn.execute('BEGIN')
+        try:
+            self.conn.executemany(sql, rows)
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.conn.execute('COMMIT')
+
+    def __iter_cold(self, chunk: int = 10000) -> Iterator[Tuple[str, str]]:
+        """
+        按 key 分页遍历磁盘上的数据（遍历期间可以修改）
+        :param chunk: 每页的条数
+        :return: (key, json) 的生成器
+        """
+        last = ''
+        while self.n_cold:
+            with self.lock:
+                rows = self.conn.execute('SELECT key, value FROM data WHERE key > ? ORDER BY key LIMIT ?',
+                                         (last, chunk)).fetchall()
+            if not rows:
+                return
+            yield from rows
+            last = rows[-1][0]
+
+    def spill(self, n: int) -> int:
+        """
+        把最早写入的 n 条数据转移到磁盘
+        :param n:
+        :return: 估计释放的内存字节数
+        """
+        items = list(islice(self.hot.items(), n))
+        if not items:
+            return 0
+        before = self.memory_usage()
+        rows = [(k, json.dumps(v, separators=(',', ':'))) for k, v in items]
+        with self.lock:
+            self.__executemany('INSERT INTO data VALUES (?, ?)', rows)
+        for key, _ in items:
+            del self.hot[key]
+        self.n_cold += len(items)
+        if self.n_cold > self.cold_capacity:
+            # 过滤器满了，按磁盘上的所有 key 重新建立
+            self.cold_capacity = 2 * self.n_cold
+            self.cold_filter = BloomFilter.for_capacity(self.cold_capacity)
+            with self.lock:
+                for key, in self.conn.execute('SELECT key FROM data'):
+                    self.cold_filter.add(key)
+        else:
+            for key, _ in items:
+                self.cold_filter.add(key)
+        # 删除数据后字典不会缩小，转移较多时重建一次
+        if len(items) * 4 >= len(items) + len(self.hot):
+            self.hot = dict(self.hot)
+        return max(before - self.memory_usage(), 0)
+
+    # ---------------- 内存统计
+    def __sample(self, key: str, value):
+        self.n_writes += 1
+        if self.n_writes % self.sample_every == 1 or self.sample_every == 1:
+            self.n_samples += 1
+            self.sample_bytes += deep_sizeof(key) + deep_sizeof(value)
+
+    def record_bytes(self) -> float:
+        """
+        采样得到的平均每条数据（ key 与值）占用的字节数
+        :return: 还没有采样时返回 0
+        """
+        return self.sample_bytes / self.n_samples if self.n_samples else 0
+
+    def memory_usage(self) -> int:
+        """
+        内存里的数据占用的字节数（字典本身的大小 + 数据条数 × 采样的平均大小）
+        :return:
+        """
+        return sys.getsizeof(self.hot) + int(len(self.hot) * self.record_bytes())
+
+    def memory_report(self) -> dict:
+        """
+        内存与磁盘的使用情况
+        :return: {"entries": 内存里的条数, "bytes": 内存字节数,
+                  "spilled_entries": 磁盘上的条数, "disk_bytes": 文件大小}
+        """
+        return {
+            'entries': len(self.hot),
+            'bytes': self.memory_usage(),
+            'spilled_entries': self.n_cold,
+            'disk_bytes': os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+        }
+
+    # ---------------- 字典接口
+    def get(self, key: str, default=None):
+        value = self.hot.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        return self.__get_cold(key, default)
+
+    def __getitem__(self, key: str):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value):
+        if key not in self.hot:
+            self.__discard_cold([key])
+        self.hot[key] = value
+        self.__sample(key, value)
+
+    def __delitem__(self, key: str):
+        if key in self.hot:
+            del self.hot[key]
+        elif not self.__discard_cold([key]):
+            raise KeyError(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.hot or self.__get_cold(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self.hot) + self.n_cold
+
+    def __iter__(self) -> Iterator[str]:
+        yield from list(self.hot)
+        for key, _ in self.__iter_cold():
+            yield key
+
+    def items(self) -> Iterator[tuple]:
+        """
+        先遍历内存里的数据，再遍历磁盘上的数据
+        :return: 生成器（不是视图）
+        """
+        yield from list(self.hot.items())
+        for key, value in self.__iter_cold():
+            yield key, json.loads(value)
+
+    def values(self) -> Iterator:
+        """
+        见 self.items
+        :return: 生成器（不是视图）
+        """
+        return (value for _, value in self.items())
+
+    def update(self, data: dict = None, **kwargs):
+        data = dict(data or {}, **kwargs)
+        self.__discard_cold([key for key in data if key not in self.hot])
+        self.hot.update(data)
+        for key, value in data.items():
+            self.__sample(key, value)
+
+    def clear(self):
+        self.hot = {}
+        with self.lock:
+            self.conn.execute('DELETE FROM data')
+        self.n_cold = 0
+
+    def close(self):
+        """
+        关闭 sqlite 连接（文件由调用方删除）
+        :return:
+        """
+        self.conn.close()
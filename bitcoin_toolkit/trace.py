@@ -1,25 +1,17 @@
-from . import Node, RedisEngine, FileEngine, gen_txo_key
-from typing import List
+from . import Node, LabelStore, gen_txo_key
+from .render import LayoutCache
+from .metrics import Metrics, NULL_TIMER
+from typing import Iterable, List, Mapping
 from types import MethodType, FunctionType
 import logging
-import networkx as nx
+import time
 import sys
-import matplotlib
-
-matplotlib.use('TkAgg')
-
-import matplotlib.pyplot as plt
-
-# 关闭 matplotlib 的日志
-for name in logging.Logger.manager.loggerDict.keys():
-    if name.startswith('matplotlib'):
-        logging.getLogger(name).setLevel(logging.ERROR)
 
 
 class Trace:
     def __init__(self,
                  min_height: int,
-                 max_height: int,
+                 max_height: int = None,
                  init_txid: str = None,
                  init_address: str = None,
                  max_depth: int = 3,
@@ -27,7 +19,7 @@ class Trace:
         """
         构建一个追溯实例
         :param min_height:   追溯的最小区块高度
-        :param max_height:   追溯的最大区块高度
+        :param max_height:   追溯的最大区块高度，为空时使用引擎已导入的最高高度（每一轮搜索前更新，适合实时跟踪的引擎）
         :param init_txid:    追溯的初始 txid
         :param init_address: 追溯的初始地址，如果传入了 init_txid 则本参数无效
         :param max_depth:    追溯的深度，需要搜索的节点与追溯深度是指数关系，因此深度不要设置太大
@@ -35,8 +27,8 @@ class Trace:
         """
 
         assert isinstance(min_height, int), min_height
-        assert isinstance(max_height, int), max_height
-        assert min_height <= max_height, f'min_height {min_height} 不能大于 max_height {max_height}'
+        assert max_height is None or isinstance(max_height, int), max_height
+        assert max_height is None or min_height <= max_height, f'min_height {min_height} 不能大于 max_height {max_height}'
         assert sum(1 for i in [init_txid, init_address] if i) == 1, 'txid 和 address 只能输入一个'
         assert init_txid is None or isinstance(init_txid, str), init_txid
         assert init_address is None or isinstance(init_address, str), init_address
@@ -45,16 +37,21 @@ class Trace:
 
         # 初始条件
         self.min_height = min_height  # 开始追溯的区块高度
-        self.max_height = max_height  # 结束追溯的区块高度
+        self.init_min_height = min_height  # 传入的最低高度（ min_height 会在追溯时被更新为初始交易的高度）
+        self.max_height = max_height if max_height is not None else sys.maxsize  # 结束追溯的区块高度
+        self.follow_tip = max_height is None  # 是否跟随引擎的最高高度
         self.init_txid = init_txid  # 追溯的起始交易
         self.init_address = init_address  # 追溯的起始地址
         self.max_depth = max_depth  # 追溯的最大深度
         self.debug = debug  # 是否打印日志
-        self.logger = logging.getLogger()
-
-        sh = logging.StreamHandler(stream=sys.stdout)  # output to standard output
-        sh.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
-        self.logger.addHandler(sh)
+        self.logger = logging.getLogger(__name__)
+        self.metrics = None  # 运行指标，默认不统计，见 self.enable_metrics
+
+        # 只在没有任何日志处理器时添加一次，避免多个 Trace 实例重复打印
+        if not self.logger.handlers and not logging.getLogger().handlers:
+            sh = logging.StreamHandler(stream=sys.stdout)  # output to standard output
+            sh.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+            self.logger.addHandler(sh)
         self.logger.setLevel(logging.DEBUG)
 
         # 搜索引擎
@@ -66,11 +63,22 @@ class Trace:
         self.batch_search_txo = None  # 批量查找交易输出的详情
         self.batch_search_address = None  # 批量查找地址详情
         # self.batch_search_block = None
+        self.search_tip_height = None  # 查找引擎已导入的最高区块高度（ max_height 为空时使用）
+        self.set_height_range = None  # 告诉引擎追溯的高度范围（例如 FederatedEngine 据此跳过范围外的分片）
+        self.search_output_filter = None  # 获取有真实数据的输出 key 的布隆过滤器
+        self.search_block_index = None  # 获取区块时间索引（把时间范围转换为高度范围，见 self.set_time_range ）
+        self.ingest_filter = None  # 引擎的导入过滤器，被它丢弃的输出标记为 filtered 节点
+        self.search_expand = None  # 一次完成一轮追溯的所有查询（见 FileEngine.expand ），引擎支持时使用
+        self.output_filter = None  # 不在过滤器里的输出不用查询，直接作为数据缺失处理
 
         # 节点标签
-        self.dict_label = {}  # 地址:标签 字典
+        self.dict_label = {}  # 地址:标签 字典（或 LabelStore 等有 get 方法的标签库）
         self.stop_labels = set()  # 停止追溯的标签
 
+        # 地址聚类
+        self.clusters = None  # 设置后，同一个簇里的地址合并为一个节点，见 self.set_clusters
+        self.max_cluster_size = None  # 地址数超过该值的簇不合并
+
         # 追溯结果
         self.dict_cache_tx = {}  # 缓存的各笔交易详情
         self.dict_cache_txo = {}  # 缓存的各项交易输出
@@ -83,14 +91,21 @@ class Trace:
         self.dict_multisig_node = {}
         self.dict_unknown_node = {}
         self.dict_return_node = {}
+        self.dict_cluster_node = {}
+        self.dict_filtered_node = {}
+
+        # 可视化
+        self.layout_cache = LayoutCache()  # 按图内容缓存的布局
 
-    def set_search_engine(self, engine: (FileEngine, RedisEngine)):
+    def set_search_engine(self, engine):
         """
-        设置搜索引擎
+        设置搜索引擎，只要求有下面的查询方法（ FileEngine 、 RedisEngine 、 SqliteEngine 等），其他方法有则使用。
+        引擎有 view 方法时（例如 FederatedEngine ）使用追溯自己的视图，限定高度范围不影响同时使用该引擎的其他追溯
         :param engine:
         :return:
         """
-        assert isinstance(engine, (FileEngine, RedisEngine)), 'engine 需要是一个实例'
+        if hasattr(engine, 'view'):
+            engine = engine.view()
         assert hasattr(engine, 'get_txo'), 'engine 需要有 get_txo 方法'
         assert hasattr(engine, 'get_tx'), 'engine 需要有 get_tx 方法'
         assert hasattr(engine, 'get_address'), 'engine 需要有 get_address 方法'
@@ -100,9 +115,16 @@ class Trace:
         self.batch_search_tx = (engine.batch_get_tx if hasattr(engine, 'batch_get_tx')
                                 else (lambda xs: [self.search_tx(x) for x in xs]))
         self.batch_search_txo = (engine.batch_get_txo if hasattr(engine, 'batch_get_txo')
-                                 else (lambda xs: [self.search_tx(x) for x in xs]))
+                                 else (lambda xs: [self.search_txo(x) for x in xs]))
         self.batch_search_address = (engine.batch_get_address if hasattr(engine, 'batch_get_address')
-                                     else (lambda xs: [self.search_tx(x) for x in xs]))
+                                     else (lambda xs: [self.search_address(x) for x in xs]))
+        self.search_tip_height = getattr(engine, 'get_ingest_height', None)
+        self.set_height_range = getattr(engine, 'set_height_range', None)
+        self.search_output_filter = getattr(engine, 'get_output_filter', None)
+        self.search_block_index = getattr(engine, 'get_block_index', None)
+        self.ingest_filter = getattr(engine, 'ingest_filter', None)
+        self.search_expand = getattr(engine, 'expand', None)
+        self.__instrument()
         return self
 
     def set_search_func(self,
@@ -112,7 +134,10 @@ class Trace:
                         search_address: (FunctionType, MethodType),
                         batch_search_tx: (FunctionType, MethodType) = None,
                         batch_search_txo: (FunctionType, MethodType) = None,
-                        batch_search_address: (FunctionType, MethodType) = None):
+                        batch_search_address: (FunctionType, MethodType) = None,
+                        search_tip_height: (FunctionType, MethodType) = None,
+                        search_block_index: (FunctionType, MethodType) = None,
+                        search_expand: (FunctionType, MethodType) = None):
         """
         设置地址查找函数和交易查找函数
         :param search_tx:             查找单个交易的详情
@@ -121,6 +146,10 @@ class Trace:
         :param batch_search_tx:       批量查找交易详情
         :param batch_search_txo:      批量查找交易输出的详情
         :param batch_search_address:  批量查找地址详情
+        :param search_tip_height:     查找已导入的最高区块高度（ max_height 为空时使用）
+        :param search_block_index:    获取区块时间索引，见 BlockIndex
+                                      （ set_time_range 时使用）
+        :param search_expand:         一次完成一轮追溯的所有查询，见 FileEngine.expand
         :return:
         """
         self.search_tx = search_tx
@@ -129,19 +158,201 @@ class Trace:
         self.batch_search_tx = batch_search_tx or (lambda xs: [self.search_tx(x) for x in xs])
         self.batch_search_txo = batch_search_txo or (lambda xs: [self.search_txo(x) for x in xs])
         self.batch_search_address = batch_search_address or (lambda xs: [self.search_address(x) for x in xs])
+        self.search_tip_height = search_tip_height
+        self.search_output_filter = None
+        self.search_block_index = search_block_index
+        self.ingest_filter = None
+        self.search_expand = search_expand
+        self.__instrument()
+        return self
+
+    def set_time_range(self, start_time=None, end_time=None):
+        """
+        按时间范围限定追溯的区块高度，通过引擎的区块时间索引转换为高度范围（需要先设置搜索引擎）
+        :param start_time: 开始时间（ unix 时间戳或 datetime ，没有时区的按 UTC 处理），
+            为空时使用构造时的 min_height
+        :param end_time: 结束时间，为空时使用构造时的 max_height
+        :return:
+        """
+        assert self.search_block_index, '搜索引擎需要有 get_block_index 方法'
+        heights = self.search_block_index().height_range(start_time, end_time)
+        assert heights is not None, f'时间范围 {start_time} ~ {end_time} 内没有已导入的区块'
+        min_height, max_height = heights
+        if start_time is not None:
+            self.min_height = self.init_min_height = min_height
+        if end_time is not None:
+            self.max_height = max_height
+            self.follow_tip = False
+        assert self.min_height <= self.max_height, f'min_height {self.min_height} 不能大于 max_height {self.max_height}'
         return self
 
+    def enable_metrics(self, hook: (FunctionType, MethodType) = None) -> Metrics:
+        """
+        开启运行指标统计（各阶段与每一轮的耗时、批量查询的 key 数与耗时、缓存命中率、搜索节点数等），
+        未开启时不做任何统计
+        :param hook: 回调函数 hook(event, data) ，每次记录指标时调用
+        :return: 指标实例，可通过 to_dict 读取
+        """
+        self.metrics = Metrics(hook)
+        self.__instrument()
+        return self.metrics
+
+    def __instrument(self):
+        """
+        开启指标统计时，包装批量查询函数以记录每次调用的 key 数与耗时
+        :return:
+        """
+        if not self.metrics:
+            return
+        for name in ['batch_search_tx', 'batch_search_txo', 'batch_search_address', 'search_expand']:
+            func = getattr(self, name)
+            if func is not None:
+                setattr(self, name, self.metrics.wrap(name, func))
+
+    def __timer(self, name: str):
+        """
+        阶段计时，未开启指标统计时返回空计时器
+        :param name:
+        :return:
+        """
+        return self.metrics.timer(name) if self.metrics else NULL_TIMER
+
+    def __count_nodes(self) -> int:
+        """
+        当前已创建的节点总数
+        :return:
+        """
+        return (len(self.dict_middle_node) + len(self.dict_normal_node) + len(self.dict_multisig_node)
+                + len(self.dict_unknown_node) + len(self.dict_return_node) + len(self.dict_cluster_node)
+                + len(self.dict_filtered_node))
+
+    def __search_tx(self, txids: (list, set)) -> dict:
+        """
+        批量获取交易详情，优先从缓存里读取，没有命中的再从搜索引擎里批量查找
+        :param txids:
+        :return: txid -> 交易详情（不包含没有找到的交易）
+        """
+        result = {i: self.dict_cache_tx[i] for i in txids if i in self.dict_cache_tx}
+        misses = [i for i in txids if i not in result]
+        if misses:
+            dict_tx = {i['txid']: i for i in self.batch_search_tx(misses) if i}
+            self.dict_cache_tx.update(dict_tx)
+            result.update(dict_tx)
+        if self.metrics:
+            self.metrics.record_cache('tx', len(txids) - len(misses), len(misses))
+        return result
+
+    def __expand(self, addresses: List[str], marked_txid: set) -> dict:
+        """
+        通过引擎的 expand 一次获取地址详情、地址的输出、花费这些输出的交易以及这些交易的输入和输出，结果写入缓存
+        :param addresses: 本轮要搜索的地址
+        :param marked_txid: 已经找过的交易，会加入本轮找到的交易
+        :return: 本轮要处理的交易（高度范围内、没有找过的）
+        """
+        result = self.search_expand(addresses, self.min_height, self.max_height)
+        self.dict_cache_tx.update(result['tx'])
+        self.dict_cache_txo.update(result['txo'])
+        txids = set()
+        for info in result['address'].values():
+            for key in info['outputs']:
+                output = result['txo'].get(key)
+                if output and output['spent_txid'] and output['spent_txid'] not in marked_txid:
+                    txids.add(output['spent_txid'])
+        marked_txid.update(txids)
+        return {txid: result['tx'][txid] for txid in txids
+                if txid in result['tx'] and self.min_height <= result['tx'][txid]['block_height'] <= self.max_height}
+
+    def __search_filtered_sources(self, txs: Iterable[dict]):
+        """
+        设置了导入过滤器时，查询没有数据的输入是由哪些交易创建的（结果在缓存里）：
+        交易在引擎里，说明输出被过滤器丢弃了，否则输出在区块范围之前
+        :param txs:
+        :return:
+        """
+        if self.ingest_filter is None:
+            return
+        txids = {key.rsplit(',', 1)[0] for tx in txs if not tx['is_coinbase'] for key in tx['inputs']
+                 if not (self.dict_cache_txo.get(key) or {}).get('addresses')}
+        if txids:
+            self.__search_tx(txids)
+
+    def __is_filtered_input(self, key: str) -> bool:
+        """
+        没有数据的输入是否是被导入过滤器丢弃的输出，见 self.__search_filtered_sources
+        :param key:
+        :return:
+        """
+        return self.ingest_filter is not None and key.rsplit(',', 1)[0] in self.dict_cache_tx
+
+    def __search_txo(self, keys: (list, set)) -> dict:
+        """
+        批量获取交易输出详情，优先从缓存里读取，没有命中的再从搜索引擎里批量查找
+        :param keys:
+        :return: key -> 交易输出详情（不包含没有找到的交易输出）
+        """
+        result = {i: self.dict_cache_txo[i] for i in keys if i in self.dict_cache_txo}
+        misses = [i for i in keys if i not in result]
+        if misses and self.output_filter is not None:
+            # 区块范围之前的输出在引擎里没有数据（或只有占位详情），跳过查询
+            n_misses = len(misses)
+            misses = [i for i in misses if i in self.output_filter]
+            if self.metrics:
+                self.metrics.record_cache('txo_filter', n_misses - len(misses), len(misses))
+        if misses:
+            dict_txo = {i['key']: i for i in self.batch_search_txo(misses) if i}
+            self.dict_cache_txo.update(dict_txo)
+            result.update(dict_txo)
+        if self.metrics:
+            self.metrics.record_cache('txo', len(keys) - len(misses), len(misses))
+        return result
+
     def set_labels(self,
-                   dict_label: dict = None,
+                   dict_label: (dict, LabelStore) = None,
                    stop_labels: (list, tuple, set) = None):
         """
         设置地址标签
-        :param dict_label: 地址 -> 标签
+        :param dict_label: 地址 -> 标签，地址很多时可以传入 LabelStore
         :param stop_labels: 停止追溯的标签列表
         :return:
         """
-        self.dict_label = dict_label
-        self.stop_labels = set(stop_labels)
+        assert dict_label is None or hasattr(dict_label, 'get'), 'dict_label 需要有 get 方法'
+        self.dict_label = dict_label if dict_label is not None else {}
+        self.stop_labels = set(stop_labels or [])
+        return self
+
+    def __filter_stop_nodes(self, nodes: set) -> set:
+        """
+        批量去掉带有停止追溯标签的节点（簇节点里任一地址带有停止追溯的标签时，整个簇都停止追溯）
+        :param nodes:
+        :return:
+        """
+        if not self.stop_labels or not nodes:
+            return nodes
+        nodes = list(nodes)
+        addresses = [i.addresses if i.type == 'cluster' else [i.address] for i in nodes]
+        flat = [address for i in addresses for address in i]
+        if hasattr(self.dict_label, 'batch_get'):
+            labels = self.dict_label.batch_get(flat)
+        else:
+            labels = [self.dict_label.get(i) for i in flat]
+        result, position = set(), 0
+        for node, members in zip(nodes, addresses):
+            if not any(label in self.stop_labels for label in labels[position:position + len(members)]):
+                result.add(node)
+            position += len(members)
+        return result
+
+    def set_clusters(self, clusters, max_cluster_size: int = None):
+        """
+        设置地址聚类，之后同一个簇里的地址合并为一个节点、一起搜索，减少每一轮要搜索的节点数
+        :param clusters: 地址聚类，见 AddressClusters ，为空时取消聚类
+        :param max_cluster_size: 地址数超过该值的簇（例如交易所）不合并，为空时不限制
+        :return:
+        """
+        assert clusters is None or hasattr(clusters, 'get_cluster'), 'clusters 需要有 get_cluster 方法'
+        assert max_cluster_size is None or isinstance(max_cluster_size, int) and max_cluster_size > 1, max_cluster_size
+        self.clusters = clusters
+        self.max_cluster_size = max_cluster_size
         return self
 
     def reset(self):
@@ -157,6 +368,8 @@ class Trace:
         self.dict_multisig_node = {}
         self.dict_unknown_node = {}
         self.dict_return_node = {}
+        self.dict_cluster_node = {}
+        self.dict_filtered_node = {}
 
     def start(self):
         """
@@ -164,27 +377,45 @@ class Trace:
         :return:
         """
         self.reset()  # 先重置
-
-        if self.init_txid:
-            # 获取交易数据并缓存
-            tx = self.search_tx(self.init_txid)
-            if not tx or tx['block_height'] < self.min_height or tx['block_height'] > self.max_height:
-                self.init_nodes = []
-            else:
-                # 更新最低区块高度
-                self.min_height = tx['block_height']
-                # 更新缓存数据
-                self.dict_cache_tx[self.init_txid] = tx
-                dict_inputs = {i['key']: i for i in self.batch_search_txo(tx['inputs'])}
-                self.dict_cache_txo.update(dict_inputs)
-                keys = [gen_txo_key(tx['txid'], i) for i in range(tx['n_outputs'])]
-                dict_outputs = {i['key']: i for i in self.batch_search_txo(keys)}
-                self.dict_cache_txo.update(dict_outputs)
-            self.init_nodes = self.progressing_tx(tx)
-        elif self.init_address:
-            self.init_nodes = [self.create_or_get_normal_node(self.init_address)]
+        if self.follow_tip:
+            # 引擎的数据在持续更新，缓存的交易与输出（例如是否被消费）可能已经过期
+            self.dict_cache_tx = {}
+            self.dict_cache_txo = {}
+        self.__refresh_tip()
+
+        with self.__timer('start'):
+            if self.init_txid:
+                # 获取交易数据并缓存
+                tx = self.__search_tx([self.init_txid]).get(self.init_txid)
+                if not tx or tx['block_height'] < self.min_height or tx['block_height'] > self.max_height:
+                    self.init_nodes = []
+                else:
+                    # 更新最低区块高度
+                    self.min_height = tx['block_height']
+                    # 更新缓存数据
+                    keys = [gen_txo_key(tx['txid'], i) for i in range(tx['n_outputs'])]
+                    self.__search_txo(tx['inputs'] + keys)
+                    self.__search_filtered_sources([tx])
+                self.init_nodes = self.progressing_tx(tx)
+            elif self.init_address:
+                self.init_nodes = [self.create_or_get_normal_node(self.init_address)]
         return self.__bfs()
 
+    def __refresh_tip(self):
+        """
+        max_height 为空时，更新为引擎已导入的最高高度，使追溯过程中能看到新导入的区块；
+        引擎支持时，再把追溯的高度范围告诉引擎，并获取最新的输出过滤器
+        :return:
+        """
+        if self.follow_tip and self.search_tip_height:
+            height = self.search_tip_height()
+            if height is not None:
+                self.max_height = height
+        if self.set_height_range:
+            self.set_height_range(self.init_min_height, self.max_height)
+        if self.search_output_filter:
+            self.output_filter = self.search_output_filter()
+
     def __bfs(self):
         """
         广度优先追溯：
@@ -207,38 +438,57 @@ class Trace:
 
         # 广度优先搜索
         while next_nodes and depth <= self.max_depth:
-            # 第一步：获取所有地址详情
-            addresses = [i.address for i in next_nodes]
-            address_infos = self.batch_search_address(addresses)
-
-            # 第二步：获取所有交易输出详情（满足被消费的条件）
-            outputs = set()
-            for info in address_infos:
-                for key in info['outputs']:
-                    outputs.add(key)
-            dict_txo = {i['key']: i for i in self.batch_search_txo(outputs)}
-            self.dict_cache_txo.update(dict_txo)
-
-            # 第三步，获取所有花费了这些交易输出的交易
-            txids = set([i['spent_txid'] for i in dict_txo.values()
-                         if i['spent_txid'] and i['spent_txid'] not in marked_txid])
-            marked_txid.update(txids)
-            dict_tx = {i['txid']: i for i in self.batch_search_tx(txids)
-                       if self.min_height <= i['block_height'] <= self.max_height}
-            self.dict_cache_tx.update(dict_tx)
-            # 额外添加一下这些交易的输入
-            input_keys = sum([i['inputs'] for i in dict_tx.values()], [])
-            dict_inputs = {i['key']: i for i in self.batch_search_txo(input_keys)}
-            self.dict_cache_txo.update(dict_inputs)
+            self.__refresh_tip()
+            if self.metrics:
+                depth_start, n_nodes, frontier = time.perf_counter(), self.__count_nodes(), len(next_nodes)
+
+            # unknown 、 return 与 filtered 节点的名称是输出 key 而不是地址，不需要查询
+            # （ redis 里会查到同名的输出）
+            addresses = [address for i in next_nodes if i.type not in ('unknown', 'return', 'filtered')
+                         for address in (i.addresses if i.type == 'cluster' else [i.address])]
+            if self.search_expand:
+                # 引擎支持时，第一步到第三步以及交易的输入和输出在一次调用里完成
+                with self.__timer('bfs.expand'):
+                    dict_tx = self.__expand(addresses, marked_txid)
+            else:
+                # 第一步：获取所有地址详情
+                with self.__timer('bfs.address'):
+                    address_infos = self.batch_search_address(addresses)
+
+                # 第二步：获取所有交易输出详情（满足被消费的条件）
+                with self.__timer('bfs.txo'):
+                    outputs = set()
+                    for info in address_infos:
+                        if info:
+                            outputs.update(info['outputs'])
+                    dict_txo = self.__search_txo(outputs)
+
+                # 第三步，获取所有花费了这些交易输出的交易
+                with self.__timer('bfs.tx'):
+                    txids = set([i['spent_txid'] for i in dict_txo.values()
+                                 if i['spent_txid'] and i['spent_txid'] not in marked_txid])
+                    marked_txid.update(txids)
+                    dict_tx = {k: i for k, i in self.__search_tx(txids).items()
+                               if self.min_height <= i['block_height'] <= self.max_height}
+                # 额外添加一下这些交易的输入和输出
+                with self.__timer('bfs.inputs'):
+                    self.__search_txo([key for i in dict_tx.values() for key in i['inputs']]
+                                      + [gen_txo_key(i['txid'], j)
+                                         for i in dict_tx.values() for j in range(i['n_outputs'])])
+            self.__search_filtered_sources(dict_tx.values())
 
             # 第四步，获得下一轮要处理的节点（满足没有被追溯过、且其标签不属于停止追溯的标签）
-            next_nodes = set()
-            for tx in dict_tx.values():
-                next_nodes.update(set(i for i in self.progressing_tx(tx) if i.address not in marked_address))
-            marked_address.update(set(i.address for i in next_nodes))
-            next_nodes = set(i for i in next_nodes if self.dict_label.get(i) not in self.stop_labels)
+            with self.__timer('bfs.progress'):
+                next_nodes = set()
+                for tx in dict_tx.values():
+                    next_nodes.update(set(i for i in self.progressing_tx(tx) if i.address not in marked_address))
+                marked_address.update(set(i.address for i in next_nodes))
+                next_nodes = self.__filter_stop_nodes(next_nodes)
 
             # 更新状态
+            if self.metrics:
+                self.metrics.record_depth(depth, frontier, self.__count_nodes() - n_nodes,
+                                          time.perf_counter() - depth_start)
             depth += 1
             if self.debug:
                 self.logger.info(f'第{depth}轮，搜索{len(next_nodes)}个节点')
@@ -246,7 +496,7 @@ class Trace:
 
         return self.edges
 
-    def progressing_tx(self, tx: dict) -> List[Node]:
+    def progressing_tx(self, tx: Mapping) -> List[Node]:
         """
         处理交易：
         1. 处理交易的输入，处理逻辑可见 self.progressing_inputs 函数文档，得到 [输入的节点列表]
@@ -258,7 +508,7 @@ class Trace:
         :param tx:
         :return: 交易的输出节点列表
         """
-        if not isinstance(tx, dict) or not self.min_height <= tx['block_height'] <= self.max_height:
+        if not isinstance(tx, Mapping) or not self.min_height <= tx['block_height'] <= self.max_height:
             return []  # 区块高度不在指定范围内
 
         start_nodes, start_moneys = self.progressing_inputs(tx)
@@ -339,7 +589,7 @@ class Trace:
         for input_node, money in zip(input_nodes, input_moneys):
             self.__one_2_one(input_node, output_node, money)
 
-    def progressing_inputs(self, tx: dict) -> (List[Node], List[int]):
+    def progressing_inputs(self, tx: Mapping) -> (List[Node], List[int]):
         """
         批量处理输入：
         1. 对于每一笔 [交易的输入] ，找到对应的 [ TXO 详情]
@@ -347,11 +597,14 @@ class Trace:
         3. 通过 [花费该笔 TXO 的地址] 创建 [对应类型的节点]
         :return: 节点列表
         """
-        assert isinstance(tx, dict), tx
+        assert isinstance(tx, Mapping), tx
         nodes, moneys = [], []
         for key in tx['inputs']:
             input_ = self.dict_cache_txo.get(key)
-            if not input_ or len(input_['addresses']) == 0:
+            if (not input_ or len(input_['addresses']) == 0) and self.__is_filtered_input(key):
+                # 创建该输出的交易在引擎里，说明输出被导入过滤器丢弃了
+                node = self.create_or_get_filtered_node(key)
+            elif not input_ or len(input_['addresses']) == 0:
                 # 如果是空字典，或者没有地址，则说明我们并没有获得交易输出的数据，因此用自定义的 address 虚构一个未知节点
                 node = self.create_or_get_unknown_node(key)
             elif len(input_['addresses']) == 1:
@@ -361,10 +614,10 @@ class Trace:
                 # 如果有多个地址，则说明是个多签地址
                 node = self.create_or_get_multisig_node(input_['addresses'])
             nodes.append(node)
-            moneys.append(input_['value'])
-        return nodes, moneys
+            moneys.append(input_['value'] if input_ else None)
+        return self.__merge_cluster_nodes(nodes, moneys)
 
-    def progressing_outputs(self, tx: dict) -> (List[Node], List[int]):
+    def progressing_outputs(self, tx: Mapping) -> (List[Node], List[int]):
         """
         批量处理输出：
         1. 通过 [交易的输出数量] 找到所有的 [ TXO 详情] （交易接口里并不返回具体的 TXO 详情，因为无论如何都要去搜索该笔 TXO 是否被消费）
@@ -372,11 +625,19 @@ class Trace:
         3. 通过 [花费该笔 TXO 的地址] 创建 [对应类型的节点]
         :return: 节点列表
         """
-        assert isinstance(tx, dict), tx
+        assert isinstance(tx, Mapping), tx
         nodes, moneys = [], []
         for index in range(tx['n_outputs']):
             key = tx['txid'] + ',' + str(index)
             output = self.dict_cache_txo.get(key)
+            if ((not output or output['type'] is None) and self.ingest_filter is not None
+                    and not (tx['is_coinbase'] and index == 2)):
+                # 交易在引擎里而输出不在（或只有花费它时生成的占位详情），说明输出被导入过滤器丢弃了
+                # （ coinbase 交易的第 3 个输出总是被跳过）
+                node = self.create_or_get_filtered_node(key)
+                nodes.append(node)
+                moneys.append(None)
+                continue
             if not output or output['value'] == 0:
                 continue
             if len(output['addresses']) == 0:
@@ -389,7 +650,24 @@ class Trace:
                 node = self.create_or_get_multisig_node(output['addresses'])
             nodes.append(node)
             moneys.append(output['value'])
-        return nodes, moneys
+        return self.__merge_cluster_nodes(nodes, moneys)
+
+    def __merge_cluster_nodes(self, nodes: List[Node], moneys: List[int]) -> (List[Node], List[int]):
+        """
+        设置了地址聚类时，合并同一笔交易里重复出现的节点（例如同一个簇的多个输入），金额相加
+        :param nodes:
+        :param moneys:
+        :return:
+        """
+        if not self.clusters or len(nodes) < 2:
+            return nodes, moneys
+        dict_money = {}
+        for node, money in zip(nodes, moneys):
+            if node not in dict_money or dict_money[node] is None:
+                dict_money[node] = money
+            else:
+                dict_money[node] += money or 0
+        return list(dict_money), list(dict_money.values())
 
     def get_node(self, address: str) -> Node:
         """
@@ -400,7 +678,9 @@ class Trace:
         return (self.dict_normal_node.get(address)
                 or self.dict_middle_node.get(address)
                 or self.dict_multisig_node.get(address)
-                or self.dict_unknown_node.get(address))
+                or self.dict_unknown_node.get(address)
+                or self.dict_cluster_node.get(address)
+                or self.dict_filtered_node.get(address))
 
     def create_or_get_return_node(self, address: str) -> Node:
         """
@@ -446,6 +726,17 @@ class Trace:
             self.dict_unknown_node[address] = Node(address, address_type='unknown')
         return self.dict_unknown_node.get(address)
 
+    def create_or_get_filtered_node(self, address: str) -> Node:
+        """
+        创建或获取被导入过滤器丢弃的输出对应的节点
+        :param address:
+        :return:
+        """
+        assert isinstance(address, str)
+        if address not in self.dict_filtered_node:
+            self.dict_filtered_node[address] = Node(address, address_type='filtered')
+        return self.dict_filtered_node.get(address)
+
     def create_or_get_normal_node(self, address: str) -> Node:
         """
         创建或获取普通节点
@@ -453,41 +744,121 @@ class Trace:
         :return:
         """
         assert isinstance(address, str)
+        if self.clusters:
+            cluster_id = self.clusters.get_cluster(address)
+            if cluster_id is not None:
+                node = self.create_or_get_cluster_node(cluster_id)
+                if node:
+                    return node
         if address not in self.dict_normal_node:
             self.dict_normal_node[address] = Node(address, address_type='normal')
         return self.dict_normal_node.get(address)
 
+    def create_or_get_cluster_node(self, cluster_id: int) -> Node:
+        """
+        创建或获取地址聚类后的簇节点
+        :param cluster_id:
+        :return: 簇的地址数超过 self.max_cluster_size 时返回 None
+        """
+        address = f'cluster_{cluster_id}'
+        if address not in self.dict_cluster_node:
+            if self.max_cluster_size and self.clusters.cluster_size(cluster_id) > self.max_cluster_size:
+                return None
+            self.dict_cluster_node[address] = Node(address, address_type='cluster',
+                                                   addresses=self.clusters.get_members(cluster_id))
+        return self.dict_cluster_node.get(address)
+
+    def to_dict(self) -> dict:
+        """
+        以字典形式返回追溯结果，可以直接序列化为 json
+        {
+            "init_nodes": [地址, ...],                      // 追溯起始节点
+            "nodes": [{
+                "address": address,                        // 节点地址
+                "type": type,                              // 节点类型，见 Node
+                "addresses": [address, ...],               // 多签或簇的地址列表，其他节点为空
+                "balance": balance,                        // 余额（聪）
+                "label": label,                            // 标签，没有时为空
+            }, ...],
+            "edges": [[地址1, 地址2, 金额（聪）], ...],      // 节点之间的转账
+        }
+        同类节点按地址排序，边按地址与金额排序，相同的追溯在不同进程里的结果完全相同
+        :return:
+        """
+        nodes = []
+        for dict_node in (self.dict_normal_node, self.dict_middle_node, self.dict_multisig_node, self.dict_unknown_node,
+                          self.dict_return_node, self.dict_cluster_node, self.dict_filtered_node):
+            for _, node in sorted(dict_node.items()):
+                nodes.append({
+                    'address': node.address,
+                    'type': node.type,
+                    'addresses': node.addresses,
+                    'balance': node.balance,
+                    'label': self.dict_label.get(node.address),
+                })
+        return {
+            'init_nodes': [i.address for i in self.init_nodes],
+            'nodes': nodes,
+            'edges': sorted(([u, v, w] for u, v, w in self.edges), key=lambda x: (x[0], x[1], x[2] is None, x[2] or 0)),
+        }
+
     def draw(self,
              min_weight: (int, float) = 10,  # 权重低于该值的边将被过滤
              min_weight_warning: (int, float) = None,  # 权重低于该值的边将显示普通的蓝色，高于该值的边将标红
              min_balance: (int, float) = 50,  # 余额低于该值的节点将不显示标签
              no_label_addresses: (list, tuple) = None,  # 在该列表中的地址将不显示标签
+             min_leaf_weight: (int, float) = None,  # 权重低于该值的叶子节点将合并为聚合节点
+             max_edges: int = None,  # 最多绘制的边数
+             output: str = None,  # 输出文件路径
              ):
         """
         TODO 1: 应用 Elliptic 规则
         TODO 2: 动画化
         图中，每个节点代表了一个地址，每条有向的边代表了址 a -> 地址 b 的累计转账比特币（单位 btc）
         边将分为 3 个部分：要隐藏的边，显示为普通颜色的边，标红的边
+        布局按图的内容缓存，只修改过滤条件时不会重新计算布局
         :param min_weight: 要展示的最小累计转账比特币，低于该值的边将隐藏
         :param min_balance: 要展示的最小余额，余额低于该值的节点将隐藏
         :param min_weight_warning: 需要突出显示的最小累计转账比特币，超过该值的边将变红色（最好比 min_weight 要大一些）
         :param no_label_addresses: 不显示标签的地址
+        :param min_leaf_weight: 细节层次（LOD）模式，叶子节点的边权重低于该值时，
+            合并到所连节点的 "xxx_other" 聚合节点
+        :param max_edges: 最多绘制的边数（按权重从大到小保留）
+        :param output: 输出文件路径，后缀为 .svg/.html 时直接输出带预计算坐标的静态文件，
+            其他后缀（如 .png）用 matplotlib 保存，为空时弹窗显示
         :return:
         """
         assert isinstance(min_weight, (int, float)), min_weight
         assert isinstance(min_balance, (int, float)), min_balance
         min_weight_warning = min_weight_warning or sys.maxsize
         assert isinstance(min_weight_warning, (int, float)), min_weight_warning
+        assert min_leaf_weight is None or isinstance(min_leaf_weight, (int, float)), min_leaf_weight
+        assert max_edges is None or isinstance(max_edges, int) and max_edges > 0, max_edges
+        assert output is None or isinstance(output, str), output
+
+        # 绘图相关的依赖比较重，只在绘图时才导入
+        from .render import MAX_ARTIST_EDGES, collapse_leaves, cap_edges, write_static
+        import networkx as nx
 
         # 过滤 edges
         edges = [[u, v, w / 1e8] for u, v, w in self.edges if w and w / 1e8 >= min_weight]
         if not edges:
             return
 
+        # 合并相同方向的边，并做细节层次处理
+        dict_weight = {}
+        for u, v, w in edges:
+            dict_weight[(u, v)] = dict_weight.get((u, v), 0) + w
+        edges = [[u, v, w] for (u, v), w in dict_weight.items()]
+        dict_other = {}
+        if min_leaf_weight is not None:
+            edges, dict_other = collapse_leaves(edges, min_leaf_weight, keep=set(i.address for i in self.init_nodes))
+        edges = cap_edges(edges, max_edges)
+
         # 第一步，构建网络
         graph = nx.DiGraph()
         graph.add_weighted_edges_from(edges)
-        pos = nx.drawing.nx_agraph.graphviz_layout(graph)  # 布局('http://pygraphviz.github.io/')
+        pos = self.layout_cache.get(graph)
 
         # 新的边和权重
         edges = [(u, v, d['weight']) for u, v, d in graph.edges(data=True)]
@@ -496,70 +867,86 @@ class Trace:
 
         # 第二步，预处理
         # 对节点按照类型分组，便于可视化时区分
-        nodes = [self.get_node(i) for i in graph.nodes.keys()]
-        nodes_actual = []
-        nodes_middle = []
-        for n in nodes:
+        dict_balance = {}  # 地址 -> 余额，聚合节点的余额为被合并节点余额之和
+        nodes_actual, nodes_middle, nodes_other = [], [], []
+        for address in graph.nodes.keys():
+            if address in dict_other:
+                nodes_other.append(address)
+                dict_balance[address] = sum(self.get_node(i).balance for i in dict_other[address])
+                continue
+            n = self.get_node(address)
+            dict_balance[address] = n.balance
             if n.type == 'middle':
-                nodes_middle.append(n)
+                nodes_middle.append(address)
             else:
-                nodes_actual.append(n)
-        addresses_actual = [i.address for i in nodes_actual]
-        addresses_middle = [i.address for i in nodes_middle]
+                nodes_actual.append(address)
         # 设置节点大小与要显示的标签（金额≥设定值、且类型不为中间节点）
-        node_sizes_actual = [max(n.balance / 1e8, 1) for n in nodes_actual]
-        node_sizes_middle = [max(n.balance / 1e8, 1) for n in nodes_middle]
-        node_size_max = max(max(node_sizes_actual), max(node_sizes_middle))
-        node_sizes_actual = [100 * (i / node_size_max) ** 0.1 for i in node_sizes_actual]  # 归一化再缩放，让小 size 的节点更大
-        node_sizes_middle = [100 * (i / node_size_max) ** 0.1 for i in node_sizes_middle]
-        node_size_mean = ((sum(node_sizes_actual) + sum(node_sizes_middle))
-                          / (len(node_sizes_actual) + len(node_sizes_middle)))
-        nodes_label = {n.address: self.dict_label.get(n.address, n.address + f'({n.balance / 1e8:.0f} BTC)')
-                       for n in nodes_actual if n.balance / 1e8 >= min_balance and n.type != 'middle'}
-        # 设置边标签，以及边与边标签的颜色与透明度（跟流转金额有关）
-        edge_labels = {(u, v): f'{w:.0f}' for (u, v, w) in edges}
-        # edge_labels_colors = {(u, v): 'r' if i >= min_weight_warning else 'b' for (u, v, w) in edges}
-        edge_label_alphas = {(u, v): (w / max_weight) ** 0.5 for u, v, w in edges}
+        node_size_max = max(max(max(i / 1e8, 1) for i in dict_balance.values()), 1)
+        dict_size = {k: 100 * (max(i / 1e8, 1) / node_size_max) ** 0.1  # 归一化再缩放，让小 size 的节点更大
+                     for k, i in dict_balance.items()}
+        node_size_mean = sum(dict_size.values()) / len(dict_size)
+        no_label_addresses = set(no_label_addresses or [])
+        nodes_label = {i: self.dict_label.get(i, i + f'({dict_balance[i] / 1e8:.0f} BTC)')
+                       for i in nodes_actual if dict_balance[i] / 1e8 >= min_balance and i not in no_label_addresses}
+        nodes_label.update({i: f'other x{len(dict_other[i])}({dict_balance[i] / 1e8:.0f} BTC)'
+                            for i in nodes_other})
+        # 设置边的颜色与透明度（跟流转金额有关）
         edge_colors = ['r' if i >= min_weight_warning else 'b' for i in weights]
         edge_alphas = [(i / max_weight) ** 0.5 for i in weights]
 
         if self.debug:
-            nodes.sort(key=lambda x: x.balance, reverse=True)
-            for n in nodes:
-                m = int(n.balance / 1e8)
+            for address in sorted(dict_balance, key=dict_balance.get, reverse=True):
+                m = int(dict_balance[address] / 1e8)
                 if m >= 0:
-                    self.logger.info(f'地址 {n.address:>45s} 余额 {m:>5d} BTC')
+                    self.logger.info(f'地址 {address:>45s} 余额 {m:>5d} BTC')
                 else:
                     break
 
+        # 静态输出，直接使用预计算的坐标，不需要 matplotlib
+        if output and output.endswith(('.svg', '.html')):
+            dict_color = {'r': 'red', 'b': 'blue'}
+            write_static(output, pos,
+                         nodes=([(i, dict_size[i], 'orange', nodes_label.get(i)) for i in nodes_actual]
+                                + [(i, dict_size[i], 'blue', None) for i in nodes_middle]
+                                + [(i, dict_size[i], 'gray', nodes_label.get(i)) for i in nodes_other]),
+                         edges=[(u, v, w, dict_color[c], a)
+                                for (u, v, w), c, a in zip(edges, edge_colors, edge_alphas)])
+            return
+
         # 第三步，绘图
+        import matplotlib
+        import matplotlib.pyplot as plt
+        logging.getLogger('matplotlib').setLevel(logging.ERROR)  # 关闭 matplotlib 的日志
         plt.subplots(1, figsize=(18, 12), dpi=100)
         # 节点
-        nx.draw_networkx_nodes(graph, pos, node_color="orange", node_size=node_sizes_actual, nodelist=addresses_actual)
-        nx.draw_networkx_nodes(graph, pos, node_color="blue", node_size=node_sizes_middle, nodelist=addresses_middle)
-        m_labels = nx.draw_networkx_labels(graph, pos, font_size=8, font_color='k', labels=nodes_label)
-        no_label_addresses = set(no_label_addresses or [])
-        if no_label_addresses:
-            for address, text in m_labels.items():
-                if address in no_label_addresses:
-                    text.set_alpha(0)  # 透明度
-        # 边
-        m_edges = nx.draw_networkx_edges(graph, pos, node_size=node_size_mean, arrowstyle="->", arrowsize=10, width=2,
-                                         edge_color=edge_colors, edge_cmap=plt.cm.Blues)
-        for i, alpha in enumerate(edge_alphas):
-            m_edges[i].set_alpha(alpha)  # 透明度
+        for nodelist, color in [(nodes_actual, 'orange'), (nodes_middle, 'blue'), (nodes_other, 'gray')]:
+            if nodelist:
+                nx.draw_networkx_nodes(graph, pos, node_color=color, nodelist=nodelist,
+                                       node_size=[dict_size[i] for i in nodelist])
+        nx.draw_networkx_labels(graph, pos, font_size=8, font_color='k', labels=nodes_label)
+        # 边，边数较多时不再为每条边单独生成箭头对象，而是合并成一个 LineCollection
+        arrows = len(edges) <= MAX_ARTIST_EDGES
+        arrow_kwargs = {'arrowstyle': '->', 'arrowsize': 10, 'node_size': node_size_mean} if arrows else {}
+        nx.draw_networkx_edges(graph, pos, edgelist=[(u, v) for u, v, _ in edges], arrows=arrows, width=2,
+                               edge_color=[matplotlib.colors.to_rgba(c, a) for c, a in zip(edge_colors, edge_alphas)],
+                               **arrow_kwargs)
 
         # 边标签
-        bbox = {'facecolor': 'none', 'edgecolor': 'none'}  # 去掉边框和背景色
-        e_labels = nx.draw_networkx_edge_labels(graph, pos, font_color='blue', edge_labels=edge_labels, bbox=bbox)
-        for key, text in e_labels.items():
-            text.set_alpha(edge_label_alphas[key])  # 透明度
-            # text.set_color(edge_labels_colors[key])  # 颜色
-
-        pc = matplotlib.collections.PatchCollection(m_edges, cmap=plt.cm.Blues)
-        pc.set_array(weights)
-        plt.colorbar(pc)
-
+        if arrows:
+            bbox = {'facecolor': 'none', 'edgecolor': 'none'}  # 去掉边框和背景色
+            edge_labels = {(u, v): f'{w:.0f}' for (u, v, w) in edges}
+            edge_label_alphas = {(u, v): a for (u, v, _), a in zip(edges, edge_alphas)}
+            e_labels = nx.draw_networkx_edge_labels(graph, pos, font_color='blue', edge_labels=edge_labels, bbox=bbox)
+            for key, text in e_labels.items():
+                text.set_alpha(edge_label_alphas[key])  # 透明度
+
+        sm = plt.cm.ScalarMappable(cmap=plt.cm.Blues, norm=plt.Normalize(min(weights), max_weight))
+        sm.set_array(weights)
         ax = plt.gca()
+        plt.colorbar(sm, ax=ax)
         ax.set_axis_off()
-        plt.show()
+        if output:
+            plt.savefig(output)
+            plt.close()
+        else:
+            plt.show()
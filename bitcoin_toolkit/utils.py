@@ -0,0 +1,82 @@
+from typing import Iterable
+import hashlib
+
+
+def hash_key(key: str) -> int:
+    """
+    key （ txid 、 txid,index 、地址等）的 64 位哈希，用作排序键或布隆过滤器的输入
+    :param key:
+    :return: 0 ~ 2^64-1 的整数
+    """
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+class BloomFilter:
+    """
+    布隆过滤器：不存在的 key 一定判断为不存在，存在的 key 有很小的概率（每个 key 10 比特时约 1% ）误判为存在。
+    位数组可以是 bytearray ，也可以是内存映射文件的 memoryview
+    """
+
+    def __init__(self, n_bits: int, n_hashes: int, bits=None):
+        """
+        :param n_bits: 位数
+        :param n_hashes: 每个 key 的哈希函数个数
+        :param bits: 位数组，为空时新建
+        """
+        assert isinstance(n_bits, int) and n_bits > 0, n_bits
+        assert isinstance(n_hashes, int) and n_hashes > 0, n_hashes
+        self.n_bits = n_bits
+        self.n_hashes = n_hashes
+        self.bits = bits if bits is not None else bytearray((n_bits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity: int, bits_per_key: int = 10) -> 'BloomFilter':
+        """
+        按预计的 key 数创建
+        :param capacity: 预计的 key 数
+        :param bits_per_key: 每个 key 占用的位数，越大误判率越低
+        :return:
+        """
+        return cls(max(capacity * bits_per_key, 64), max(round(bits_per_key * 0.693), 1))
+
+    def __positions(self, h: int):
+        # 由 64 位哈希拆成两个 32 位哈希，再组合出 n_hashes 个位置（ Kirsch-Mitzenmacher ）
+        h1, h2 = h & 0xffffffff, (h >> 32) | 1
+        return ((h1 + i * h2) % self.n_bits for i in range(self.n_hashes))
+
+    def add_hash(self, h: int):
+        """
+        :param h: key 的 64 位哈希，见 hash_key
+        :return:
+        """
+        bits = self.bits
+        for i in self.__positions(h):
+            bits[i >> 3] |= 1 << (i & 7)
+
+    def contains_hash(self, h: int) -> bool:
+        """
+        :param h: key 的 64 位哈希，见 hash_key
+        :return:
+        """
+        bits = self.bits
+        return all(bits[i >> 3] & (1 << (i & 7)) for i in self.__positions(h))
+
+    def add(self, key: str):
+        self.add_hash(hash_key(key))
+
+    def __contains__(self, key: str) -> bool:
+        return self.contains_hash(hash_key(key))
+
+
+def build_key_filter(keys: Iterable[str], capacity: int, bits_per_key: int = 10) -> BloomFilter:
+    """
+    由 key 建立布隆过滤器
+    :param keys:
+    :param capacity: 预计的 key 数（之后还会继续添加 key 时，需要预留一些）
+    :param bits_per_key: 每个 key 占用的位数
+    :return:
+    """
+    bloom = BloomFilter.for_capacity(max(capacity, 1), bits_per_key)
+    for key in keys:
+        bloom.add(key)
+    return bloom
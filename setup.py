@@ -63,7 +63,7 @@ setup(
     version=get_version(),  # 版本号
     packages=find_packages(),  # 指定子目录的python包
     install_requires=[  # 依赖列表
-        'redis>=3.2.1',
+        'redis>=3.5.0',
         'psutil>=5.7.0',
         'blockchain-parser>=0.1.4',
         'networkx>=2.4',
@@ -77,6 +77,9 @@ setup(
         'pytest-flakes >= 4.0.0',
     ],
     include_package_data=True,  # 启用清单文件MANIFEST.in
+    entry_points={
+        'console_scripts': ['bitcoin-toolkit = bitcoin_toolkit.cli:main'],  # 命令行工具
+    },
     cmdclass={
         'clean': CleanHook,  # python setup.py clean 清理工作区
         'test': ActionOnTest,  # python setup.py test 测试
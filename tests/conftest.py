@@ -0,0 +1,91 @@
+"""
+测试用的公共 fixture ，数据来自 benchmarks/synthetic.py 生成的合成区块链，不需要本地的 blocks 目录
+"""
+import itertools
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from synthetic import SyntheticChain  # noqa: E402
+
+from bitcoin_toolkit import FileEngine  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def chain() -> SyntheticChain:
+    return SyntheticChain(n_blocks=12, txs_per_block=40, hub_share=0.3, multisig_share=0.1, seed=7)
+
+
+@pytest.fixture(scope='session')
+def raw_blocks(chain) -> list:
+    return list(chain.iter_raw_blocks())
+
+
+@pytest.fixture
+def dir_blocks(tmp_path) -> str:
+    """
+    空的 blocks 目录（ FileEngine 要求存在 index 子目录）
+    """
+    os.makedirs(tmp_path / 'index')
+    return str(tmp_path)
+
+
+@pytest.fixture
+def file_engine(chain, dir_blocks) -> FileEngine:
+    """
+    导入了整条合成链的 FileEngine ，作为其他引擎的对照
+    """
+    engine = FileEngine(dir_blocks, *chain.heights, show_warning=False)
+    engine.read_data(blocks=chain.iter_blocks())
+    return engine
+
+
+@pytest.fixture
+def blocks_on_disk(monkeypatch, raw_blocks):
+    """
+    让 Blockchain.get_ordered_blocks 直接返回合成链的区块（ fork 出的子进程会继承）
+    """
+    from blockchain_parser.block import Block
+    from blockchain_parser.blockchain import Blockchain
+
+    def get_ordered_blocks(self, index, start=0, end=None, cache=None):
+        return (Block(raw, height) for height, raw in raw_blocks if height >= start and (end is None or height < end))
+
+    monkeypatch.setattr(Blockchain, 'get_ordered_blocks', get_ordered_blocks)
+
+
+@pytest.fixture(scope='session')
+def redis_server(tmp_path_factory):
+    redislite = pytest.importorskip('redislite')
+    server = redislite.Redis(str(tmp_path_factory.mktemp('redis') / 'redis.db'), serverconfig={'save': ''})
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def new_redis_client(redis_server):
+    """
+    创建清空后的 redis 客户端的函数，每次使用不同的 db （一个测试需要多个库时使用）
+    """
+    import redis
+
+    def new_client():
+        client = redis.Redis(unix_socket_path=redis_server.socket_file, db=next(_redis_dbs), decode_responses=True,
+                             socket_timeout=None)
+        client.flushdb()
+        return client
+
+    return new_client
+
+
+@pytest.fixture
+def redis_client(new_redis_client):
+    """
+    清空后的 redis 客户端
+    """
+    return new_redis_client()
+
+
+_redis_dbs = itertools.cycle(range(16))
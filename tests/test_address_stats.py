@@ -0,0 +1,77 @@
+import random
+
+from bitcoin_toolkit import FileEngine, RedisEngine, SqliteEngine
+
+
+def brute_force_stats(engine) -> dict:
+    """
+    遍历 FileEngine 里每个地址的全部输出计算统计
+    """
+    def height(txid):
+        return engine.dict_tx[txid]['block_height']
+
+    result = {}
+    for address, info in engine.dict_address.items():
+        outputs = [engine.dict_output[key] for key in info['outputs']]
+        outputs = [i for i in outputs if i['type'] is not None]
+        if not outputs:
+            continue
+        heights = [height(i['txid']) for i in outputs] + [height(i['spent_txid']) for i in outputs if i['spent_txid']]
+        unspent = [i['value'] or 0 for i in outputs if not i['spent_txid']]
+        result[address] = {
+            'address': address,
+            'received': sum(i['value'] or 0 for i in outputs),
+            'spent': sum(i['value'] or 0 for i in outputs if i['spent_txid']),
+            'n_outputs': len(outputs),
+            'n_utxo': len(unspent),
+            'utxo_value': sum(unspent),
+            'first_height': min(heights),
+            'last_height': max(heights),
+        }
+    return result
+
+
+def assert_stats(engine, expected):
+    addresses = list(expected)
+    assert engine.batch_get_address_stats(addresses) == list(expected.values())
+    assert engine.get_address_stats(addresses[0]) == expected[addresses[0]]
+
+
+def test_file_engine(file_engine):
+    expected = brute_force_stats(file_engine)
+    assert expected
+    assert_stats(file_engine, expected)
+    assert file_engine.get_address_stats('1nope') is None
+
+
+def test_sqlite_engine(file_engine, chain, dir_blocks, tmp_path):
+    engine = SqliteEngine(tmp_path / 'btc.sqlite')
+    engine.write_data(dir_blocks, *chain.heights, blocks=chain.iter_blocks(), batch_blocks=5)
+    assert_stats(engine, brute_force_stats(file_engine))
+
+
+def test_redis_engine_out_of_order(file_engine, chain, redis_client):
+    # 区块乱序导入（并行导入时的情况），统计的结果不变
+    blocks = list(chain.iter_blocks())
+    random.Random(1).shuffle(blocks)
+    engine = RedisEngine(client=redis_client)
+    for i in range(0, len(blocks), 4):
+        engine.from_blocks(blocks[i:i + 4])
+    assert_stats(engine, brute_force_stats(file_engine))
+
+
+def test_rollback(file_engine, chain, dir_blocks, redis_client):
+    blocks = list(chain.iter_blocks())
+    partial = FileEngine(dir_blocks, 0, 8, show_warning=False)
+    partial.read_data(blocks=iter(blocks[:9]))
+    engines = [FileEngine(dir_blocks, *chain.heights, show_warning=False), RedisEngine(client=redis_client)]
+    for engine in engines:
+        engine.undo_depth = 5
+        for block in blocks:
+            engine.from_block(block)
+        for height in range(11, 8, -1):
+            engine.rollback_block(height)
+        assert_stats(engine, brute_force_stats(partial))
+        for block in blocks[-3:]:
+            engine.from_block(block)
+        assert_stats(engine, brute_force_stats(file_engine))
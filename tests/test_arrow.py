@@ -0,0 +1,53 @@
+import pytest
+
+from bitcoin_toolkit import ArrowEngine, export_arrow
+
+from .utils import diff_engines, normalize, seed_txids, trace_result
+
+pytest.importorskip('pyarrow')
+
+
+@pytest.fixture
+def labeled_engine(file_engine):
+    for address in list(file_engine.dict_address)[:3]:
+        file_engine.dict_address[address]['labels'] = ['exchange', 'hot wallet']
+    # 只有标签、没有输出的地址
+    for address in ('1LabelOnlyA', '1LabelOnlyB', '1LabelOnlyC'):
+        file_engine.dict_address[address] = {'address': address, 'outputs': [], 'labels': ['sanction']}
+    return file_engine
+
+
+@pytest.mark.parametrize('fmt', ['arrow', 'parquet'])
+def test_export_and_read(labeled_engine, tmp_path, fmt):
+    result = export_arrow(labeled_engine, tmp_path, fmt=fmt, rows_per_part=100)
+    assert result['tx']['rows'] == len(labeled_engine.dict_tx)
+    assert result['txo']['rows'] == len(labeled_engine.dict_output)
+    assert result['address_label']['rows'] == 9
+    assert result['txo']['parts'] == -(-len(labeled_engine.dict_output) // 100)
+
+    engine = ArrowEngine(tmp_path)
+    assert diff_engines(engine, labeled_engine) == []
+    assert engine.batch_get_tx(['00' * 32]) == [None]
+    assert engine.batch_get_txo(['00' * 32 + ',0']) == [None]
+    assert engine.batch_get_address(['1nope']) == [None]
+    assert sum(1 for _ in engine.iter_tx()) == len(labeled_engine.dict_tx)
+    expected = sorted((normalize(i) for i in labeled_engine.iter_address()), key=lambda i: i['address'])
+    for batch_size in (2, 1000):
+        assert sorted((normalize(i) for i in engine.iter_address(batch_size)), key=lambda i: i['address']) == expected
+
+
+def test_trace(labeled_engine, tmp_path):
+    export_arrow(labeled_engine, tmp_path)
+    engine = ArrowEngine(tmp_path)
+    for txid in seed_txids(labeled_engine):
+        assert trace_result(engine, txid) == trace_result(labeled_engine, txid)
+
+
+def test_single_key_lookups(labeled_engine, tmp_path):
+    # 分片的第一个排序键以 0 字节结尾时（例如 index 为 0 的输出），查询的 key 不能被截断
+    export_arrow(labeled_engine, tmp_path)
+    engine = ArrowEngine(tmp_path)
+    keys = list(labeled_engine.dict_output)[:50]
+    assert [engine.get_txo(key)['key'] for key in keys] == keys
+    txids = list(labeled_engine.dict_tx)[:50]
+    assert [engine.get_tx(txid)['txid'] for txid in txids] == txids
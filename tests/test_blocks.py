@@ -0,0 +1,91 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from bitcoin_toolkit import BlockIndex, FederatedEngine, FileEngine, RedisEngine, SqliteEngine, Trace
+
+from .utils import trace_result
+
+
+def expected_block(block) -> dict:
+    return {
+        'hash': block.hash,
+        'height': block.height,
+        'timestamp': int(block.header.timestamp.replace(tzinfo=timezone.utc).timestamp()),
+        'txids': [i.txid for i in block.transactions],
+        'n_tx': block.n_transactions,
+    }
+
+
+@pytest.fixture
+def blocks(chain) -> list:
+    return list(chain.iter_blocks())
+
+
+@pytest.fixture
+def engines(chain, dir_blocks, blocks, file_engine, redis_client, tmp_path) -> dict:
+    sqlite_engine = SqliteEngine(tmp_path / 'btc.sqlite')
+    sqlite_engine.write_data(dir_blocks, *chain.heights, blocks=iter(blocks))
+    redis_engine = RedisEngine(client=redis_client)
+    redis_engine.from_blocks(blocks)
+    shard = FileEngine(dir_blocks, 6, 11, show_warning=False)
+    shard.read_data(blocks=iter(blocks))
+    return {
+        'file': file_engine,
+        'sqlite': sqlite_engine,
+        'redis': redis_engine,
+        'federated': FederatedEngine([(0, 5, sqlite_engine), (6, 11, shard)]),
+    }
+
+
+def test_get_block(engines, blocks):
+    hashes = [i.hash for i in blocks] + ['0' * 64]
+    expected = [expected_block(i) for i in blocks] + [None]
+    for name, engine in engines.items():
+        assert engine.batch_get_block(hashes) == expected, name
+        assert engine.get_block(blocks[3].hash) == expected[3], name
+        index = engine.get_block_index()
+        assert list(index.items()) == [(i['height'], i['timestamp']) for i in expected[:-1]], name
+
+
+def test_block_index():
+    # 区块时间不严格递增
+    index = BlockIndex()
+    for height, timestamp in [(3, 30), (1, 10), (2, 25), (4, 20)]:
+        index.add(height, timestamp)
+    assert list(index.items()) == [(1, 10), (2, 25), (3, 30), (4, 20)]
+    assert list(index.max_timestamps) == [10, 25, 30, 30]
+    assert index.height_range(21, 29) == (2, 2)
+    assert index.height_range(26) == (3, 4)
+    assert index.height_range(end_time=9) is None
+    assert index.get_timestamp(2) == 25 and index.get_timestamp(5) is None
+    index.remove(2)
+    assert list(index.max_timestamps) == [10, 30, 30]
+    assert list(BlockIndex.from_items([(4, 20), (1, 10), (3, 30), (1, 11)]).items()) == [(1, 11), (3, 30), (4, 20)]
+    assert index.height_range(11) == (3, 4)
+    # 没有时区的 datetime 按 UTC 处理
+    assert index.height_range(datetime(1970, 1, 1, 0, 0, 11)) == \
+        index.height_range(datetime.fromtimestamp(11, timezone.utc)) == (3, 4)
+
+
+def test_rollback(chain, dir_blocks, blocks, redis_client):
+    for engine in (FileEngine(dir_blocks, *chain.heights, show_warning=False), RedisEngine(client=redis_client)):
+        engine.undo_depth = 3
+        for block in blocks:
+            engine.from_block(block)
+        engine.rollback_block(11)
+        assert engine.get_block(blocks[-1].hash) is None
+        assert len(engine.get_block_index()) == 11 and engine.get_block_index().get_timestamp(11) is None
+
+
+def test_trace_time_range(engines, blocks):
+    timestamps = [expected_block(i)['timestamp'] for i in blocks]
+    txid = blocks[3].transactions[1].txid
+    for name, engine in engines.items():
+        trace = Trace(0, init_txid=txid, max_depth=5).set_search_engine(engine)
+        trace.set_time_range(datetime.fromtimestamp(timestamps[2], timezone.utc), timestamps[8])
+        assert (trace.min_height, trace.max_height, trace.follow_tip) == (2, 8, False), name
+        trace.start()
+        assert trace.to_dict() == trace_result(engine, txid, 2, 8, max_depth=5), name
+    with pytest.raises(AssertionError):
+        Trace(0, init_txid=txid).set_search_engine(engines['file']).set_time_range(end_time=timestamps[0] - 1)
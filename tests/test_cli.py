@@ -0,0 +1,100 @@
+import csv
+import json
+
+import pytest
+
+from bitcoin_toolkit import SqliteEngine
+from bitcoin_toolkit.arrow import TABLES
+from bitcoin_toolkit.cli import iter_seeds, run
+
+from .utils import diff_engines, seed_txids, trace_result
+
+
+@pytest.fixture
+def sqlite_path(blocks_on_disk, chain, dir_blocks, tmp_path) -> str:
+    path = str(tmp_path / 'btc.sqlite')
+    summary = run(['--quiet', 'ingest', '--engine', 'sqlite', '--sqlite', path, '--dir-blocks', dir_blocks,
+                   '--min-height', '0', '--max-height', '11', '--batch-blocks', '5'])
+    assert summary['blocks'] == 12 and summary['txs'] == sum(len(i.transactions) for i in chain.iter_blocks())
+    return path
+
+
+@pytest.fixture
+def seeds_file(file_engine, tmp_path) -> tuple:
+    txids = seed_txids(file_engine, 6)
+    address = sorted(file_engine.dict_address)[0]
+    path = tmp_path / 'seeds.txt'
+    path.write_text('# 起点\n\n' + '\n'.join(i.upper() for i in txids) + f'\n{address}\n')
+    return str(path), txids + [address]
+
+
+def read_jsonl(path) -> list:
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_iter_seeds(seeds_file):
+    path, seeds = seeds_file
+    assert list(iter_seeds(path, ['t1'], ['a1'])) == \
+        [('txid', 't1'), ('address', 'a1')] + [('txid', i) for i in seeds[:-1]] + [('address', seeds[-1])]
+
+
+def test_ingest(sqlite_path, file_engine):
+    assert diff_engines(SqliteEngine(sqlite_path), file_engine) == []
+
+
+def test_trace(sqlite_path, seeds_file, file_engine, tmp_path):
+    path, seeds = seeds_file
+    outputs = []
+    for i in range(2):
+        output = str(tmp_path / f'out{i}.jsonl')
+        summary = run(['--quiet', 'trace', '--engine', 'sqlite', '--sqlite', sqlite_path, '--seeds', path,
+                       '--depth', '3', '--workers', '3', '--output', output, '--max-height', '11'])
+        assert (summary['failed'], summary['skipped'], summary['seeds']) == (0, 0, len(seeds))
+        outputs.append([{k: v for k, v in line.items() if k != 'seconds'} for line in read_jsonl(output)])
+    # 结果按起点的顺序写出，与线程完成的先后无关
+    assert outputs[0] == outputs[1]
+    assert [i['seed'] for i in outputs[0]] == seeds
+    for line in outputs[0][:-1]:
+        assert line['result'] == trace_result(file_engine, line['seed'], 0, 11)
+
+    output = str(tmp_path / 'out.csv')
+    run(['--quiet', 'trace', '--engine', 'sqlite', '--sqlite', sqlite_path, '--seeds', path,
+         '--format', 'csv', '--output', output, '--max-height', '11'])
+    with open(output, newline='') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ['seed', 'from', 'to', 'value']
+    expected = [[line['seed'], u, v, '' if w is None else str(w)]
+                for line in outputs[0] for u, v, w in line['result']['edges']]
+    assert rows[1:] == expected
+
+
+def test_trace_file_engine_and_budget(blocks_on_disk, dir_blocks, seeds_file, tmp_path):
+    path, seeds = seeds_file
+    output = str(tmp_path / 'out.jsonl')
+    summary = run(['--quiet', 'trace', '--engine', 'file', '--dir-blocks', dir_blocks, '--min-height', '0',
+                   '--max-height', '11', '--txid', seeds[0], '--output', output])
+    assert summary['blocks'] == 12 and summary['lookups'] > 0
+    assert read_jsonl(output)[0]['seed'] == seeds[0]
+    summary = run(['--quiet', 'trace', '--engine', 'file', '--dir-blocks', dir_blocks, '--min-height', '0',
+                   '--max-height', '11', '--seeds', path, '--budget', '1e-9', '--output', output])
+    assert summary['skipped'] == len(seeds) and read_jsonl(output) == []
+
+
+def test_export(sqlite_path, file_engine, tmp_path):
+    summary = run(['--quiet', 'export', '--engine', 'sqlite', '--sqlite', sqlite_path,
+                   '--output', str(tmp_path / 'arrow')])
+    assert set(summary['tables']) == set(TABLES)
+    txid = seed_txids(file_engine)[0]
+    output = str(tmp_path / 'out.jsonl')
+    run(['--quiet', 'trace', '--engine', 'arrow', '--arrow', str(tmp_path / 'arrow'), '--txid', txid,
+         '--max-height', '11', '--output', output])
+    assert read_jsonl(output)[0]['result'] == trace_result(file_engine, txid, 0, 11)
+
+
+def test_errors(sqlite_path, capsys):
+    with pytest.raises(SystemExit) as info:
+        run(['trace', '--engine', 'sqlite', '--sqlite', sqlite_path])
+    assert info.value.code == 2 and '--seeds' in capsys.readouterr().err
+    with pytest.raises(SystemExit):
+        run(['trace', '--engine', 'sqlite', '--txid', 'a'])
@@ -0,0 +1,78 @@
+import networkx as nx
+import pytest
+
+from bitcoin_toolkit import AddressClusters, Trace
+from bitcoin_toolkit.cluster import looks_like_coinjoin
+
+from .utils import seed_txids
+
+
+def brute_force_clusters(engine) -> list:
+    """
+    用 networkx 的连通分量计算共同输入聚类
+    """
+    graph = nx.Graph()
+    for tx in engine.dict_tx.values():
+        if tx['is_coinbase']:
+            continue
+        addresses = []
+        for key in tx['inputs']:
+            info = engine.dict_output.get(key)
+            if info and len(info['addresses']) == 1 and info['addresses'][0] not in addresses:
+                addresses.append(info['addresses'][0])
+        if len(addresses) < 2:
+            continue
+        values = [engine.dict_output.get(f"{tx['txid']},{i}", {}).get('value') for i in range(tx['n_outputs'])]
+        if not looks_like_coinjoin(len(addresses), values):
+            nx.add_path(graph, addresses)
+    return sorted(sorted(i) for i in nx.connected_components(graph))
+
+
+@pytest.fixture
+def clusters(file_engine) -> AddressClusters:
+    clusters = AddressClusters.build(file_engine, batch_size=50)
+    yield clusters
+    clusters.close()
+
+
+def test_looks_like_coinjoin():
+    assert looks_like_coinjoin(3, [100, 100, 100, 7])
+    assert not looks_like_coinjoin(2, [100, 100, 100])  # 输入地址比相同金额的输出少
+    assert not looks_like_coinjoin(3, [100, 200, None])
+    assert not looks_like_coinjoin(3, [])
+
+
+def test_build(clusters, file_engine):
+    expected = brute_force_clusters(file_engine)
+    assert expected and sorted(sorted(i) for i in clusters.iter_clusters()) == expected
+    assert clusters.n_clusters == len(expected)
+    for members in expected:
+        cluster_id = clusters.get_cluster(members[0])
+        assert clusters.batch_get_cluster(members) == [cluster_id] * len(members)
+        assert clusters.cluster_size(cluster_id) == len(members)
+    assert clusters.get_cluster('1nope') is None and clusters.get_cluster(5) is None
+
+
+def test_save_and_load(clusters, tmp_path):
+    path = str(tmp_path / 'clusters.bin')
+    clusters.save(path)
+    loaded = AddressClusters.load(path)
+    assert list(loaded.iter_clusters()) == list(clusters.iter_clusters())
+    assert (loaded.n_addresses, loaded.n_txs, loaded.n_coinjoin) == \
+        (clusters.n_addresses, clusters.n_txs, clusters.n_coinjoin)
+    loaded.close()
+
+
+def test_trace_with_clusters(clusters, file_engine):
+    def run(max_cluster_size=None):
+        trace = Trace(0, 11, init_txid=txid, max_depth=3).set_search_engine(file_engine)
+        trace.set_clusters(clusters, max_cluster_size).start()
+        return trace
+
+    txid = seed_txids(file_engine)[0]
+    trace = run()
+    assert trace.dict_cluster_node
+    for node in trace.dict_cluster_node.values():
+        assert {clusters.get_cluster(i) for i in node.addresses} == {clusters.get_cluster(node.addresses[0])}
+    capped = run(max_cluster_size=2)
+    assert all(len(node.addresses) <= 2 for node in capped.dict_cluster_node.values())
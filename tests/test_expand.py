@@ -0,0 +1,69 @@
+import pytest
+
+from bitcoin_toolkit import RedisEngine, Trace
+
+from .utils import normalize, seed_txids
+
+
+def normalize_expand(result) -> dict:
+    return {kind: {key: normalize(value) for key, value in records.items()} for kind, records in result.items()}
+
+
+def brute_force_expand(engine, addresses, min_height, max_height) -> dict:
+    """
+    用单个查询拼出 expand 的结果
+    """
+    result = {'address': {}, 'tx': {}, 'txo': {}}
+    for address in addresses:
+        info = engine.get_address(address)
+        if info:
+            result['address'][address] = info
+            for key in info['outputs']:
+                result['txo'][key] = engine.get_txo(key)
+    for output in list(result['txo'].values()):
+        tx = engine.get_tx(output['spent_txid']) if output['spent_txid'] else None
+        if tx:
+            result['tx'][tx['txid']] = tx
+            if min_height <= tx['block_height'] <= max_height:
+                keys = tx['inputs'] + [f"{tx['txid']},{i}" for i in range(tx['n_outputs'])]
+                result['txo'].update({key: engine.get_txo(key) for key in keys if engine.get_txo(key)})
+    return result
+
+
+def run_trace(engine, txid, use_expand) -> dict:
+    trace = Trace(0, 11, init_txid=txid, max_depth=6).set_search_engine(engine)
+    if not use_expand:
+        trace.search_expand = None
+    trace.start()
+    return trace.to_dict()
+
+
+@pytest.fixture(params=['flat', 'grouped'])
+def redis_engine(request, chain, dir_blocks, redis_client) -> RedisEngine:
+    engine = RedisEngine(client=redis_client, layout=request.param)
+    engine.write_data(dir_blocks, *chain.heights, blocks=chain.iter_blocks(), batch_blocks=1)
+    return engine
+
+
+def test_file_engine(file_engine):
+    addresses = sorted(file_engine.dict_address)[:60] + ['1nope']
+    result = file_engine.expand(addresses, 2, 9)
+    assert result['tx']
+    assert normalize_expand(result) == normalize_expand(brute_force_expand(file_engine, addresses, 2, 9))
+    assert file_engine.expand([]) == {'address': {}, 'tx': {}, 'txo': {}}
+
+
+def test_redis_engine(redis_engine, file_engine):
+    addresses = sorted(file_engine.dict_address)[:60] + ['1nope']
+    for heights in ((2, 9), (None, None)):
+        assert normalize_expand(redis_engine.expand(addresses, *heights)) == \
+            normalize_expand(file_engine.expand(addresses, *heights))
+    assert redis_engine.expand([]) == redis_engine.expand(['1nope']) == {'address': {}, 'tx': {}, 'txo': {}}
+
+
+def test_trace(redis_engine, file_engine):
+    for txid in seed_txids(file_engine):
+        expected = run_trace(file_engine, txid, False)
+        assert run_trace(file_engine, txid, True) == expected
+        assert run_trace(redis_engine, txid, True) == expected
+        assert run_trace(redis_engine, txid, False) == expected
@@ -0,0 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from bitcoin_toolkit import FederatedEngine, FileEngine, Trace
+
+from .utils import diff_engines, seed_txids, trace_result
+
+RANGES = [(0, 3), (4, 7), (8, 11)]
+
+
+def load(chain, dir_blocks, min_height, max_height) -> FileEngine:
+    engine = FileEngine(dir_blocks, min_height, max_height, show_warning=False)
+    engine.read_data(blocks=chain.iter_blocks())
+    return engine
+
+
+@pytest.fixture
+def federated(chain, dir_blocks) -> FederatedEngine:
+    engine = FederatedEngine([(lo, hi, load(chain, dir_blocks, lo, hi)) for lo, hi in RANGES])
+    yield engine
+    engine.close()
+
+
+def test_same_as_single_engine(federated, file_engine):
+    assert diff_engines(federated, file_engine) == []
+    hashes = list(file_engine.dict_block)
+    assert federated.batch_get_block(hashes) == file_engine.batch_get_block(hashes)
+    assert federated.get_ingest_height() == 11
+    assert [federated.shard_of_height(h) for h in (0, 4, 11)] == [0, 1, 2]
+    output_filter = federated.get_output_filter()
+    assert all(key in output_filter for key, info in file_engine.dict_output.items() if info['type'] is not None)
+
+
+@pytest.mark.parametrize('min_height, max_height', [(0, 11), (4, 7), (4, 11)])
+def test_trace_height_range(federated, chain, dir_blocks, file_engine, min_height, max_height):
+    reference = load(chain, dir_blocks, min_height, max_height)
+    for txid in seed_txids(reference):
+        assert trace_result(federated, txid, min_height, max_height) == \
+            trace_result(reference, txid, min_height, max_height)
+
+
+def test_views_are_independent(federated, chain, dir_blocks):
+    txid = seed_txids(load(chain, dir_blocks, 4, 7))[0]
+    expected = {hi: trace_result(load(chain, dir_blocks, 4, hi), txid, 4, hi) for hi in (7, 11)}
+    with ThreadPoolExecutor(4) as executor:
+        futures = [(hi, executor.submit(trace_result, federated, txid, 4, hi)) for hi in (7, 11) * 4]
+        assert all(future.result() == expected[hi] for hi, future in futures)
+
+    # 每个追溯使用自己的视图，共享的引擎不受影响
+    active = list(federated.active)
+    trace = Trace(4, 7, init_txid=txid).set_search_engine(federated)
+    trace.start()
+    assert federated.active == active
+    assert federated.view(4, 7).active != active
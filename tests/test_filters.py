@@ -0,0 +1,103 @@
+import pytest
+
+from bitcoin_toolkit import AddressClusters, FileEngine, IngestFilter, RedisEngine, SqliteEngine, Trace
+
+from .utils import seed_txids
+
+
+@pytest.fixture
+def min_value(file_engine) -> int:
+    values = sorted(info['value'] for info in file_engine.dict_output.values() if info['type'] is not None)
+    return values[len(values) // 4]
+
+
+def make_filter(min_value) -> IngestFilter:
+    return IngestFilter(min_value=min_value, exclude_types=['OP_RETURN'])
+
+
+def expected_outputs(file_engine, ingest_filter) -> set:
+    """
+    :return: 过滤后应该保留的有真实数据的输出 key
+    """
+    return {key for key, info in file_engine.dict_output.items()
+            if info['type'] is not None and ingest_filter.check(info) is None}
+
+
+def real_outputs(engine) -> set:
+    return {key for key, info in engine.dict_output.items() if info['type'] is not None}
+
+
+def test_check():
+    ingest_filter = IngestFilter(min_value=1000, exclude_types=['OP_RETURN'], allow_addresses=['1a', '1b'])
+    assert ingest_filter.check({'type': None, 'value': None, 'addresses': []}) is None
+    assert ingest_filter.check({'type': 'OP_RETURN', 'value': 0, 'addresses': []}) == 'type'
+    assert ingest_filter.check({'type': 'p2pkh', 'value': 999, 'addresses': ['1a']}) == 'min_value'
+    assert ingest_filter.check({'type': 'p2pkh', 'value': 1000, 'addresses': ['1c']}) == 'allowlist'
+    assert ingest_filter.check({'type': 'p2pkh', 'value': 1000, 'addresses': ['1b']}) is None
+    with pytest.raises(AssertionError):
+        IngestFilter(allow_clusters=[1])
+
+
+def test_engines(file_engine, min_value, chain, dir_blocks, redis_client, tmp_path):
+    expected = expected_outputs(file_engine, make_filter(min_value))
+    assert len(expected) < len(real_outputs(file_engine))
+
+    engine = FileEngine(dir_blocks, *chain.heights, show_warning=False)
+    engine.ingest_filter = make_filter(min_value)
+    engine.read_data(blocks=chain.iter_blocks())
+    assert real_outputs(engine) == expected
+    # 被丢弃、之后又被花费的输出只留下记录花费交易的占位详情
+    assert all(file_engine.dict_output[key]['spent_txid'] == info['spent_txid']
+               for key, info in engine.dict_output.items() if info['type'] is None)
+    assert engine.dict_tx == file_engine.dict_tx  # 交易仍然保留
+    for address, info in engine.dict_address.items():
+        assert info['outputs'] and set(info['outputs']) <= expected
+    report = engine.ingest_filter.report()
+    assert report['dropped_outputs'] == len(real_outputs(file_engine)) - len(expected)
+    assert report['n_outputs'] == sum(1 for i in file_engine.dict_output.values() if i['type'] is not None)
+
+    sqlite_engine = SqliteEngine(tmp_path / 'btc.sqlite')
+    sqlite_engine.ingest_filter = make_filter(min_value)
+    sqlite_engine.write_data(dir_blocks, *chain.heights, blocks=chain.iter_blocks())
+    assert {i[0] for i in sqlite_engine.conn.execute('select key from txo')} == set(engine.dict_output)
+    assert sqlite_engine.ingest_filter.report() == report
+
+    redis_engine = RedisEngine(client=redis_client)
+    redis_engine.ingest_filter = make_filter(min_value)
+    redis_engine.write_data(dir_blocks, *chain.heights, blocks=chain.iter_blocks())
+    assert {i['key'] for i in redis_engine.iter_txo()} == set(engine.dict_output)
+    assert redis_engine.ingest_filter.report() == report
+
+    # 被丢弃的输出追溯时标记为 filtered 节点，而不是金额未知的 unknown 节点
+    n_filtered = 0
+    for txid in seed_txids(file_engine):
+        trace = Trace(0, 11, init_txid=txid, max_depth=4).set_search_engine(engine)
+        trace.start()
+        n_filtered += len(trace.dict_filtered_node)
+        reference = Trace(0, 11, init_txid=txid, max_depth=4).set_search_engine(file_engine)
+        reference.start()
+        assert not reference.dict_filtered_node
+        assert len(trace.dict_unknown_node) <= len(reference.dict_unknown_node)
+    assert n_filtered
+
+
+def test_allowlist(file_engine, chain, dir_blocks):
+    allowed = set(sorted(file_engine.dict_address)[::3])
+    engine = FileEngine(dir_blocks, *chain.heights, show_warning=False)
+    engine.ingest_filter = IngestFilter(allow_addresses=iter(allowed))
+    engine.read_data(blocks=chain.iter_blocks())
+    assert real_outputs(engine) == expected_outputs(file_engine, engine.ingest_filter)
+    # 保留的输出都至少有一个收款地址在白名单里（多签输出的其他地址也会写入）
+    assert all(allowed & set(engine.dict_output[key]['addresses'])
+               for info in engine.dict_address.values() for key in info['outputs'])
+
+    clusters = AddressClusters.build(file_engine, batch_size=50)
+    members = set(max(clusters.iter_clusters(), key=len))
+    cluster_id = clusters.get_cluster(next(iter(members)))
+    engine = FileEngine(dir_blocks, *chain.heights, show_warning=False)
+    engine.ingest_filter = IngestFilter(allow_clusters=[cluster_id], clusters=clusters)
+    engine.read_data(blocks=chain.iter_blocks())
+    assert members & set(engine.dict_address)
+    assert all(members & set(engine.dict_output[key]['addresses'])
+               for info in engine.dict_address.values() for key in info['outputs'])
+    clusters.close()
@@ -0,0 +1,141 @@
+import random
+import struct
+
+import pytest
+from blockchain_parser.block import Block
+from synthetic import MAGIC, SyntheticChain, double_sha256
+
+from bitcoin_toolkit import FileEngine, Follower, RedisEngine
+from bitcoin_toolkit.follow import get_coinbase_height
+
+from .utils import diff_engines
+
+
+@pytest.fixture(scope='module')
+def main_chain() -> list:
+    return [raw for _, raw in SyntheticChain(n_blocks=20, txs_per_block=30, hub_share=0.3, seed=1).iter_raw_blocks()]
+
+
+def make_fork(main_chain: list, version: int = None) -> list:
+    """
+    从主链的高度 12 分叉出的 5 个区块（比主链高度 13~15 的 3 个区块更长）
+    :param version: 区块版本号，为 1 时区块里没有高度
+    """
+    blocks, prev_hash = [], double_sha256(main_chain[12][:80])
+    for _, raw in SyntheticChain(n_blocks=5, txs_per_block=30, seed=99, start_height=13).iter_raw_blocks():
+        head = struct.pack('<I', version) if version is not None else raw[:4]
+        raw = head + prev_hash + raw[36:]
+        blocks.append(raw)
+        prev_hash = double_sha256(raw[:80])
+    return blocks
+
+
+@pytest.fixture(scope='module')
+def fork_chain(main_chain) -> list:
+    return make_fork(main_chain)
+
+
+def write_blocks(path: str, raws: list, padding: int = 0):
+    with open(path, 'ab') as f:
+        for raw in raws:
+            f.write(MAGIC + struct.pack('<I', len(raw)) + raw)
+        f.write(b'\x00' * padding)  # 全节点会预先用 0 填充文件
+
+
+def reference(dir_blocks: str, raws: list) -> FileEngine:
+    engine = FileEngine(dir_blocks, 0, None, show_warning=False)
+    for height, raw in enumerate(raws):
+        engine.from_block(Block(raw, height))
+    return engine
+
+
+def ingest(request, dir_blocks: str, raws: list):
+    """
+    创建 Follower 之前导入的区块（没有回滚信息）
+    """
+    if request.param == 'file':
+        engine = FileEngine(dir_blocks, 0, None, show_warning=False)
+    else:
+        engine = RedisEngine(client=request.getfixturevalue('redis_client'))
+    for height, raw in enumerate(raws):
+        engine.from_block(Block(raw, height))
+    return engine
+
+
+@pytest.fixture(params=['file', 'redis'])
+def engine(request, dir_blocks, main_chain):
+    return ingest(request, dir_blocks, main_chain[:10])
+
+
+@pytest.fixture(params=['file', 'redis'])
+def synced_engine(request, dir_blocks, main_chain):
+    """
+    创建 Follower 之前已经导入到高度 15 的引擎
+    """
+    return ingest(request, dir_blocks, main_chain[:16])
+
+
+def test_get_coinbase_height(main_chain):
+    assert [get_coinbase_height(raw) for raw in main_chain] == list(range(len(main_chain)))
+    assert get_coinbase_height(struct.pack('<I', 1) + main_chain[0][4:]) is None  # 版本 1 的区块没有高度
+
+
+def test_follow_reorg(engine, dir_blocks, main_chain, fork_chain):
+    follower = Follower(engine, dir_blocks, poll_interval=0, undo_depth=20)
+    write_blocks(f'{dir_blocks}/blk00000.dat', main_chain[:12])
+    assert follower.poll() == 2 and follower.tip[0] == 11
+
+    # 不完整的区块与预先填充的 0 等下次再读
+    write_blocks(f'{dir_blocks}/blk00001.dat', main_chain[12:16], padding=100)
+    assert follower.poll() == 4 and follower.tip[0] == 15
+
+    # 分叉链乱序写入新文件，更长时回滚 13~15 再导入分叉链
+    shuffled = fork_chain[:]
+    random.Random(0).shuffle(shuffled)
+    write_blocks(f'{dir_blocks}/blk00002.dat', shuffled)
+    assert follower.poll() == 5 and follower.tip[0] == 17
+    assert diff_engines(engine, reference(dir_blocks, main_chain[:13] + fork_chain)) == []
+    assert engine.get_ingested_blocks()[17] == double_sha256(fork_chain[-1][:80])[::-1].hex()
+
+    # 主链追上并超过分叉链后切换回来，回滚的主链区块从缓存的位置重新读取
+    write_blocks(f'{dir_blocks}/blk00002.dat', main_chain[16:])
+    assert follower.poll() == 7 and follower.tip[0] == 19
+    assert diff_engines(engine, reference(dir_blocks, main_chain)) == []
+    assert len(follower.pending) == len(fork_chain)
+    assert follower.pending_bytes == sum(len(raw) for raw in fork_chain)
+
+
+@pytest.mark.parametrize('version', [None, 1])
+def test_fork_below_start(synced_engine, dir_blocks, main_chain, version, caplog):
+    # 分叉链需要回滚创建 Follower 之前导入的区块 13~15 ，它们没有回滚信息，忽略分叉链而不是回滚失败
+    follower = Follower(synced_engine, dir_blocks, poll_interval=0, undo_depth=20)
+    fork_chain = make_fork(main_chain, version)
+    write_blocks(f'{dir_blocks}/blk00000.dat', main_chain[:16] + fork_chain)
+    assert follower.poll() == 0 and follower.tip[0] == 15
+    assert diff_engines(synced_engine, reference(dir_blocks, main_chain[:16])) == []
+    assert '忽略' in caplog.text
+    # 高于 15 的区块（版本 1 的区块读取不到高度，除了直接连到主链上的第一个）仍然缓存着，但不会切换过去
+    hashes = [double_sha256(raw[:80])[::-1].hex() for raw in fork_chain]
+    assert list(follower.pending) == (hashes[3:] if version is None else hashes[1:])
+
+    # 之后由 Follower 导入的区块可以正常回滚
+    write_blocks(f'{dir_blocks}/blk00000.dat', main_chain[16:])
+    assert follower.poll() == 4 and follower.tip[0] == 19
+    assert diff_engines(synced_engine, reference(dir_blocks, main_chain)) == []
+
+
+def test_pending_pool(engine, dir_blocks, main_chain, fork_chain):
+    follower = Follower(engine, dir_blocks, poll_interval=0, undo_depth=5)
+    # 低于回滚范围的区块不会被缓存
+    write_blocks(f'{dir_blocks}/blk00000.dat', main_chain[:3])
+    follower.poll()
+    assert follower.pending == {} and follower.pending_bytes == 0
+
+    # 缓存只保存位置，总大小超过上限时丢弃最早的区块
+    follower.max_pending_bytes = sum(len(raw) for raw in fork_chain[-2:])
+    write_blocks(f'{dir_blocks}/blk00000.dat', fork_chain)
+    assert follower.poll() == 0
+    hashes = [double_sha256(raw[:80])[::-1].hex() for raw in fork_chain]
+    assert list(follower.pending) == hashes[-2:]
+    assert all(len(location) == 4 and isinstance(location[1], str) for location in follower.pending.values())
+    assert follower.pending_bytes == follower.max_pending_bytes
@@ -0,0 +1,35 @@
+import subprocess
+import sys
+
+IMPORT_BUDGET = 0.1  # 核心的 Trace 加引擎接口的导入耗时预算（秒），见 README
+HEAVY_MODULES = ('matplotlib', 'networkx', 'blockchain_parser', 'psutil', 'redis', 'pyarrow', 'http.server')
+
+
+def imported_modules(code: str) -> set:
+    """
+    在新的解释器里运行 code ，返回运行后已导入的重依赖
+    """
+    script = f'import sys\n{code}\nprint(",".join(sorted(sys.modules)))'
+    output = subprocess.run([sys.executable, '-c', script], check=True, capture_output=True, text=True).stdout
+    modules = set(output.strip().split(','))
+    return {name for name in HEAVY_MODULES if name in modules}
+
+
+def test_import_is_headless():
+    assert imported_modules('import bitcoin_toolkit') == set()
+
+
+def test_heavy_dependencies_load_on_use(dir_blocks):
+    assert imported_modules('import bitcoin_toolkit\nbitcoin_toolkit.TraceServer') == {'http.server'}
+    code = f'from bitcoin_toolkit import FileEngine\nFileEngine({dir_blocks!r}, 0, 10)'
+    assert imported_modules(code) == {'psutil'}
+
+
+def test_import_time_budget():
+    code = 'import time\nstart = time.perf_counter()\nfrom bitcoin_toolkit import Trace, FileEngine\n' \
+           'print(time.perf_counter() - start)'
+    # 第一次导入写入字节码缓存，之后取多次测量里最快的一次，减少机器负载的影响
+    subprocess.run([sys.executable, '-c', code], check=True, capture_output=True)
+    seconds = min(float(subprocess.run([sys.executable, '-c', code], check=True, capture_output=True,
+                                       text=True).stdout) for _ in range(5))
+    assert seconds < IMPORT_BUDGET, f'导入耗时 {seconds * 1000:.1f} ms ，超过预算 {IMPORT_BUDGET * 1000:.0f} ms'
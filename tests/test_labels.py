@@ -0,0 +1,89 @@
+import random
+from collections import Counter
+
+import pytest
+
+from bitcoin_toolkit import AddressClusters, LabelStore, Trace
+
+from .utils import seed_txids
+
+
+@pytest.fixture
+def labels(file_engine) -> dict:
+    """
+    给最常收款的几个热点地址和一部分随机地址打上标签
+    """
+    counter = Counter(address for info in file_engine.dict_output.values() for address in info['addresses'])
+    rng = random.Random(1)
+    labels = {address: rng.choice(['mixer', 'sanction']) for address in rng.sample(sorted(counter), 50)}
+    labels.update({address: 'exchange' for address, _ in counter.most_common(3)})
+    return labels
+
+
+@pytest.fixture
+def label_store(labels, tmp_path) -> LabelStore:
+    path = tmp_path / 'labels.csv'
+    with open(path, 'w') as f:
+        f.write('address,label\n')
+        for address, label in labels.items():
+            f.write(f'{address},{label}\n')
+        for i in range(1000):
+            f.write(f'fake{i},exchange\n')
+    store = LabelStore.from_csv(str(path), skip_header=True)
+    yield store
+    store.close()
+
+
+def test_round_trip(labels, label_store, file_engine, tmp_path):
+    addresses = list(file_engine.dict_address) + ['1nope']
+    expected = [labels.get(i) for i in addresses]
+    assert label_store.batch_get(addresses) == expected
+    assert len(label_store) == len(labels) + 1000
+    assert 'fake5' in label_store and '1nope' not in label_store
+    assert label_store.get('1nope', 'unknown') == 'unknown'
+
+    path = str(tmp_path / 'labels.bin')
+    label_store.save(path)
+    loaded = LabelStore.load(path)
+    assert loaded.batch_get(addresses) == expected
+    loaded.close()
+    assert LabelStore.build(labels.items()).batch_get(addresses) == expected
+
+
+def run_trace(engine, txid, dict_label=None, stop_labels=None) -> Trace:
+    trace = Trace(0, 11, init_txid=txid, max_depth=4).set_search_engine(engine)
+    trace.set_labels(dict_label, stop_labels).start()
+    return trace
+
+
+def test_stop_labels(labels, label_store, file_engine):
+    n_stopped = 0
+    for txid in seed_txids(file_engine):
+        with_dict = run_trace(file_engine, txid, labels, ['exchange'])
+        assert with_dict.to_dict() == run_trace(file_engine, txid, label_store, ['exchange']).to_dict()
+        # 带有停止标签的地址不再向下追溯，只会少追溯一部分交易
+        unlimited = run_trace(file_engine, txid, labels)
+        assert {(u, v) for u, v, _ in with_dict.edges} <= {(u, v) for u, v, _ in unlimited.edges}
+        n_stopped += len(with_dict.edges) < len(unlimited.edges)
+    assert n_stopped
+
+
+def test_stop_labels_with_clusters(file_engine):
+    clusters = AddressClusters.build(file_engine, batch_size=50)
+    members = [sorted(i) for i in clusters.iter_clusters()]
+    one = {i[-1]: 'exchange' for i in members}
+    every = {address: 'exchange' for i in members for address in i}
+
+    def run(dict_label):
+        trace = Trace(0, 11, init_txid=txid, max_depth=4).set_search_engine(file_engine)
+        trace.set_clusters(clusters).set_labels(dict_label, ['exchange']).start()
+        return trace.to_dict()
+
+    # 簇里任一地址带有停止标签时，整个簇都停止追溯
+    n_stopped = 0
+    for txid in seed_txids(file_engine):
+        result = run(one)
+        assert result == run(every)
+        n_stopped += result != run(None)
+    assert n_stopped
+    clusters.close()
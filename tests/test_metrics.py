@@ -0,0 +1,64 @@
+from bitcoin_toolkit import Trace
+
+from .utils import seed_txids
+
+
+def run_trace(engine, txid: str, metrics: bool = False, hook=None) -> Trace:
+    trace = Trace(engine.min_height, engine.max_height, init_txid=txid, max_depth=3).set_search_engine(engine)
+    if metrics:
+        trace.enable_metrics(hook)
+    trace.start()
+    return trace
+
+
+def test_metrics_do_not_change_results(file_engine):
+    for txid in seed_txids(file_engine):
+        assert run_trace(file_engine, txid, True).to_dict() == run_trace(file_engine, txid).to_dict()
+
+
+def test_metrics_report(file_engine):
+    events = []
+    trace = run_trace(file_engine, seed_txids(file_engine)[0], True, lambda event, data: events.append(event))
+    report = trace.metrics.to_dict()
+    assert report['depths'] and [i['depth'] for i in report['depths']] == sorted(i['depth'] for i in report['depths'])
+    assert len(report['depths']) <= trace.max_depth + 1
+    for name in ('batch_search_tx', 'batch_search_txo'):
+        info = report['calls'][name]
+        assert info['count'] > 0 and info['keys'] >= info['max_keys'] > 0
+    for info in report['cache'].values():
+        assert info['hit_rate'] is None or 0 <= info['hit_rate'] <= 1
+    assert {'stage', 'call', 'depth'} <= set(events)
+    assert events.count('depth') == len(report['depths'])
+
+    # 再次开启时重新统计，不会重复包装查询函数；交易与输出已经缓存，不再查询
+    metrics = trace.enable_metrics()
+    trace.start()
+    assert trace.batch_search_tx.__wrapped__ == file_engine.batch_get_tx
+    assert metrics.calls['search_expand'] == dict(report['calls']['search_expand'],
+                                                  seconds=metrics.calls['search_expand']['seconds'])
+    assert 'batch_search_tx' not in metrics.calls
+    assert metrics.cache['tx']['misses'] == metrics.cache['txo']['misses'] == 0
+
+
+def test_trace_follows_spending_transactions(file_engine):
+    txid = seed_txids(file_engine)[0]
+    trace = run_trace(file_engine, txid)
+    result = trace.to_dict()
+    assert result['edges']
+    # 起始交易的输出被花费后，花费交易的收款地址也在追溯结果里
+    spent = [info for info in file_engine.dict_output.values() if info['txid'] == txid and info['spent_txid']]
+    addresses = {node['address'] for node in result['nodes']}
+    for info in spent:
+        spending = file_engine.dict_tx[info['spent_txid']]
+        outputs = [file_engine.dict_output.get(f"{spending['txid']},{i}") for i in range(spending['n_outputs'])]
+        assert any(set(o['addresses']) & addresses for o in outputs if o and o['type'] == 'pubkeyhash')
+
+
+def test_trace_tolerates_missing_records(file_engine):
+    # 删除一部分输出与交易（例如区块范围之外的数据），追溯不报错
+    for key in list(file_engine.dict_output)[::5]:
+        del file_engine.dict_output[key]
+    for txid in list(file_engine.dict_tx)[1::7]:
+        del file_engine.dict_tx[txid]
+    for txid in seed_txids(file_engine):
+        run_trace(file_engine, txid).to_dict()
@@ -0,0 +1,80 @@
+import json
+import pickle
+
+import pytest
+
+from bitcoin_toolkit import RedisEngine, SqliteEngine
+from bitcoin_toolkit.models import Address, Bitcoin, Block, Output, Transaction
+
+from .utils import normalize, seed_txids, trace_result
+
+
+@pytest.fixture
+def engines(chain, dir_blocks, new_redis_client, tmp_path) -> dict:
+    sqlite_engine = SqliteEngine(tmp_path / 'btc.sqlite')
+    sqlite_engine.write_data(dir_blocks, *chain.heights, blocks=chain.iter_blocks())
+    engines = {'sqlite': sqlite_engine}
+    for layout in ('flat', 'grouped'):
+        engines[layout] = RedisEngine(client=new_redis_client(), layout=layout)
+        engines[layout].from_blocks(list(chain.iter_blocks()))
+    return engines
+
+
+def test_record():
+    info = {'txid': 'ab', 'block_height': 3, 'is_coinbase': 0, 'inputs': '["cd,0"]', 'n_outputs': 2}
+    for row in (tuple(info.values()), list(info.values()), info, json.dumps(info)):
+        tx = Transaction(row)
+        assert tx.txid == tx['txid'] == 'ab' and tx.is_coinbase is False
+        assert tx.inputs == ['cd,0'] and tx['inputs'] is tx['inputs']  # 第一次访问时解码并缓存
+        assert tx.output_keys() == ['ab,0', 'ab,1']
+        assert tx.to_dict() == dict(tx) == dict(info, is_coinbase=False, inputs=['cd,0'])
+        assert 'txid' in tx and 'foo' not in tx and tx.get('foo', 3) == 3
+        assert pickle.loads(pickle.dumps(tx)) == tx
+        with pytest.raises(AttributeError):
+            tx.txid = 'x'
+        with pytest.raises(AttributeError):
+            tx.foo
+        assert not hasattr(tx, '__dict__')
+    assert Transaction.of(None) is None and Transaction.of(tx) is tx
+    assert Output({'type': None}).is_placeholder()
+
+
+def test_engine_views(engines, file_engine):
+    txids = list(file_engine.dict_tx) + ['0' * 64]
+    keys = list(file_engine.dict_output) + ['0' * 64 + ',1']
+    addresses = list(file_engine.dict_address) + ['1nope']
+    hashes = list(file_engine.dict_block)
+    for name, engine in engines.items():
+        engine.record_views = True
+        for view, kind, items, expected in (
+                (Transaction, 'tx', txids, file_engine.dict_tx),
+                (Output, 'txo', keys, file_engine.dict_output),
+                (Address, 'address', addresses, file_engine.dict_address),
+                (Block, 'block', hashes, file_engine.dict_block)):
+            records = getattr(engine, f'batch_get_{kind}')(items)
+            for key, record in zip(items, records):
+                if key not in expected:
+                    assert record is None, (name, kind)
+                else:
+                    assert isinstance(record, view), (name, kind)
+                    assert normalize(record) == normalize(expected[key]), (name, kind, key)
+        for txid in seed_txids(file_engine):
+            assert trace_result(engine, txid, max_depth=6) == trace_result(file_engine, txid, max_depth=6), name
+
+
+def test_bitcoin(file_engine, engines):
+    txid = seed_txids(file_engine)[0]
+    for engine in (file_engine, engines['sqlite']):
+        bitcoin = Bitcoin(engine)
+        tx = bitcoin.get_tx(txid)
+        assert isinstance(tx, Transaction) and dict(tx) == file_engine.dict_tx[txid]
+        inputs = bitcoin.get_inputs(tx)
+        assert [i.key if i else None for i in inputs] == \
+            [key if key in file_engine.dict_output else None for key in tx.inputs]
+        outputs = bitcoin.get_outputs(tx)
+        assert [i.key for i in outputs] == tx.output_keys()
+        spent = next(i for i in outputs if i.spent_txid)
+        assert bitcoin.get_spent_tx(spent).txid == spent.spent_txid
+        block_hash = next(iter(file_engine.dict_block))
+        assert bitcoin.get_block(block_hash).hash == block_hash
+        assert bitcoin.get_address('1nope') is None and bitcoin.get_tx('0' * 64) is None
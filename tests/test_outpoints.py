@@ -0,0 +1,75 @@
+import os
+
+import pytest
+
+from bitcoin_toolkit import FileEngine, OutpointIndex, RedisEngine, SqliteEngine, Trace
+
+from .utils import seed_txids
+
+MIN_HEIGHT = 6  # 只导入后半段区块的引擎的最低高度
+
+
+@pytest.fixture
+def outpoint_index(chain, dir_blocks, tmp_path) -> OutpointIndex:
+    # run_size 很小，需要多路归并多个临时文件
+    index = OutpointIndex.build(tmp_path / 'outpoints', dir_blocks, blocks=chain.iter_blocks(), run_size=50)
+    yield index
+    index.close()
+
+
+def simplify(info) -> dict:
+    return {'value': info['value'], 'type': info['type'], 'addresses': sorted(info['addresses'])}
+
+
+def count_placeholders(dict_output) -> int:
+    return sum(1 for info in dict_output.values() if info['type'] is None)
+
+
+def test_build(outpoint_index, file_engine, tmp_path):
+    real = {key: info for key, info in file_engine.dict_output.items()
+            if info['type'] is not None and info['type'] != 'OP_RETURN'}
+    assert [simplify(i) if i else None for i in outpoint_index.batch_get(list(real))] == \
+        [simplify(i) for i in real.values()]
+    assert outpoint_index.get('0' * 64 + ',0') is None
+    assert os.listdir(tmp_path / 'outpoints') and not any(
+        i.startswith('tmp') for i in os.listdir(tmp_path / 'outpoints'))  # 临时文件已经删除
+
+
+def test_fill(outpoint_index, chain, dir_blocks, file_engine, tmp_path, redis_client):
+    def check(dict_output):
+        # 区块范围内花费的、全链里有真实数据的输出都被补全
+        assert count_placeholders(dict_output) == n_placeholders
+        for key, info in dict_output.items():
+            if info['type'] is not None and file_engine.dict_output.get(key, {}).get('type') is not None:
+                assert simplify(info) == simplify(file_engine.dict_output[key])
+
+    plain = FileEngine(dir_blocks, MIN_HEIGHT, 11, show_warning=False)
+    plain.read_data(blocks=chain.iter_blocks())
+    # 全链里也只是占位详情的（花费了合成链之前的虚构输出）补全不了
+    n_placeholders = sum(1 for key, info in plain.dict_output.items()
+                         if info['type'] is None and file_engine.dict_output[key]['type'] is None)
+    assert count_placeholders(plain.dict_output) > n_placeholders
+
+    engine = FileEngine(dir_blocks, MIN_HEIGHT, 11, show_warning=False)
+    engine.outpoint_index = outpoint_index
+    engine.read_data(blocks=chain.iter_blocks())
+    check(engine.dict_output)
+
+    sqlite_engine = SqliteEngine(tmp_path / 'btc.sqlite')
+    sqlite_engine.outpoint_index = outpoint_index
+    sqlite_engine.write_data(dir_blocks, MIN_HEIGHT, 11, blocks=chain.iter_blocks())
+    assert sqlite_engine.conn.execute('select count(*) from txo where type is null').fetchone()[0] == n_placeholders
+
+    redis_engine = RedisEngine(client=redis_client)
+    redis_engine.outpoint_index = outpoint_index
+    redis_engine.write_data(dir_blocks, MIN_HEIGHT, 11, blocks=chain.iter_blocks())
+    check({info['key']: info for info in redis_engine.iter_txo()})
+
+    # 补全后追溯时金额未知的节点更少
+    for txid in seed_txids(engine):
+        unknown = []
+        for search_engine in (plain, engine):
+            trace = Trace(MIN_HEIGHT, 11, init_txid=txid, max_depth=3).set_search_engine(search_engine)
+            trace.start()
+            unknown.append(len(trace.dict_unknown_node))
+        assert unknown[1] <= unknown[0]
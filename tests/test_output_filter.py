@@ -0,0 +1,106 @@
+import pytest
+
+from bitcoin_toolkit import ArrowEngine, FederatedEngine, FileEngine, RedisEngine, SharedEngine, SqliteEngine, \
+    Trace, export_arrow
+
+from .utils import seed_txids
+
+
+def split_keys(file_engine) -> tuple:
+    """
+    :return: (有真实数据的输出 key 列表, 由输入生成的占位输出 key 列表)
+    """
+    real = [key for key, info in file_engine.dict_output.items() if info['type'] is not None]
+    placeholder = [key for key, info in file_engine.dict_output.items() if info['type'] is None]
+    assert real and placeholder
+    return real, placeholder
+
+
+def assert_filter(output_filter, file_engine):
+    real, placeholder = split_keys(file_engine)
+    assert all(key in output_filter for key in real)
+    # 布隆过滤器只会误判少量占位输出
+    assert sum(key in output_filter for key in placeholder) <= len(placeholder) * 0.1
+
+
+@pytest.fixture
+def engines(chain, dir_blocks, file_engine, tmp_path) -> dict:
+    sqlite_engine = SqliteEngine(tmp_path / 'btc.sqlite')
+    sqlite_engine.write_data(dir_blocks, *chain.heights, blocks=chain.iter_blocks())
+    export_arrow(file_engine, tmp_path / 'arrow')
+    shards = []
+    for min_height, max_height in ((0, 5), (6, 11)):
+        shard = FileEngine(dir_blocks, min_height, max_height, show_warning=False)
+        shard.read_data(blocks=chain.iter_blocks())
+        shards.append((min_height, max_height, shard))
+    shared = SharedEngine.publish(file_engine)
+    yield {
+        'file': file_engine,
+        'sqlite': sqlite_engine,
+        'arrow': ArrowEngine(tmp_path / 'arrow'),
+        'shared': shared,
+        'federated': FederatedEngine(shards),
+    }
+    shared.unlink()
+
+
+def test_filters(engines, file_engine):
+    for engine in engines.values():
+        assert_filter(engine.get_output_filter(), file_engine)
+
+
+def test_trace(engines, file_engine):
+    for txid in seed_txids(file_engine):
+        trace = Trace(0, 11, init_txid=txid, max_depth=4)
+        trace.set_search_func(search_tx=file_engine.get_tx, search_txo=file_engine.get_txo,
+                              search_address=file_engine.get_address).start()
+        expected = trace.to_dict()
+        for name, engine in engines.items():
+            trace = Trace(0, 11, init_txid=txid, max_depth=4).set_search_engine(engine)
+            metrics = trace.enable_metrics()
+            trace.start()
+            assert trace.to_dict() == expected, name
+            assert 'txo_filter' in metrics.to_dict()['cache'], name
+
+
+def test_skips_placeholders(file_engine):
+    # 起始交易花费了区块范围之前的输出时，这些输出不用查询
+    _, placeholder = split_keys(file_engine)
+    txid = file_engine.dict_output[placeholder[0]]['spent_txid']
+    trace = Trace(0, 11, init_txid=txid, max_depth=2).set_search_engine(file_engine)
+    metrics = trace.enable_metrics()
+    trace.start()
+    assert metrics.to_dict()['cache']['txo_filter']['hits'] > 0
+
+
+def test_file_engine_update(chain, dir_blocks, file_engine):
+    engine = FileEngine(dir_blocks, *chain.heights, show_warning=False)
+    blocks = list(chain.iter_blocks())
+    for block in blocks[:6]:
+        engine.from_block(block)
+    output_filter = engine.get_output_filter()
+    for block in blocks[6:]:
+        engine.from_block(block)
+    assert engine.get_output_filter() is output_filter
+    assert_filter(output_filter, file_engine)
+
+
+def test_redis_engine(redis_client, chain, file_engine):
+    engine = RedisEngine(client=redis_client)
+    blocks = list(chain.iter_blocks())
+    engine.from_blocks(blocks[:6])
+    assert engine.get_output_filter() is None
+    output_filter = engine.build_output_filter()
+    engine.from_blocks(blocks[6:])
+    # 由当前实例导入的区块会同步更新过滤器
+    assert engine.get_output_filter() is output_filter
+    assert_filter(output_filter, file_engine)
+
+    engine.undo_depth = 5
+    engine.from_block(blocks[-1])
+    engine.rollback_block(blocks[-1].height)
+    assert engine.get_output_filter() is output_filter
+
+    # 其他实例导入了区块后不再使用过滤器
+    RedisEngine(client=redis_client).from_block(blocks[-1])
+    assert engine.get_output_filter() is None
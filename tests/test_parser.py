@@ -0,0 +1,68 @@
+import struct
+
+from blockchain_parser.block import Block
+from synthetic import double_sha256, merkle_root, p2pkh_script, push, varint
+
+from bitcoin_toolkit import parser_block, parser_raw_block
+from bitcoin_toolkit.parser import iter_raw_transactions
+
+
+def build_block(txs: list, height: int = 100) -> Block:
+    """
+    用给定的交易（第一笔为 coinbase ）构造区块，区块头里的 merkle root 只对非见证部分计算
+    """
+    header = (struct.pack('<I', 0x20000000) + b'\x00' * 32 + merkle_root([double_sha256(strip) for _, strip in txs])
+              + struct.pack('<III', 1500000000, 0x1d00ffff, 0))
+    return Block(header + varint(len(txs)) + b''.join(raw for raw, _ in txs), height)
+
+
+def coinbase_tx(height: int) -> tuple:
+    script_sig = push(struct.pack('<I', height))
+    outputs = [p2pkh_script(bytes(20)), b'\x6a' + push(bytes(32)), p2pkh_script(bytes([1]) * 20)]
+    raw = (struct.pack('<I', 1) + varint(1) + b'\x00' * 32 + b'\xff\xff\xff\xff' + varint(len(script_sig))
+           + script_sig + b'\xff\xff\xff\xff' + varint(len(outputs))
+           + b''.join(struct.pack('<Q', 1000) + varint(len(i)) + i for i in outputs) + b'\x00' * 4)
+    return raw, raw
+
+
+def segwit_tx(scripts: list) -> tuple:
+    """
+    两个输入的隔离见证交易
+    :return: (完整字节, 去掉见证数据后的字节)
+    """
+    inputs = varint(2) + b''.join(bytes([i]) * 32 + struct.pack('<I', i) + b'\x00' + b'\xff' * 4 for i in (1, 2))
+    outputs = varint(len(scripts)) + b''.join(struct.pack('<Q', 5000 * (i + 1)) + varint(len(script)) + script
+                                              for i, script in enumerate(scripts))
+    witness = (varint(2) + push(bytes(71)) + push(bytes([2]) * 33)) * 2
+    version, lock_time = struct.pack('<I', 2), b'\x00' * 4
+    return version + b'\x00\x01' + inputs + outputs + witness + lock_time, version + inputs + outputs + lock_time
+
+
+def test_raw_matches_blockchain_parser(chain):
+    for block in chain.iter_blocks():
+        assert parser_block(block) == parser_block(block, raw=False)
+
+
+def test_segwit_and_nonstandard_outputs():
+    scripts = [b'\x00\x14' + bytes([3]) * 20,  # P2WPKH
+               b'\x00\x20' + bytes([4]) * 32,  # P2WSH
+               b'\xa9\x14' + bytes([5]) * 20 + b'\x87',  # P2SH
+               b'\x51\x21' + bytes([2]) * 33 + b'\x51\xae',  # 1-of-1 多签
+               b'\x51\x52\x93']  # 非标准脚本
+    block = build_block([coinbase_tx(100), segwit_tx(scripts)])
+    dict_tx, dict_address, dict_output = parser_block(block)
+    assert (dict_tx, dict_address, dict_output) == parser_block(block, raw=False)
+    txids = [tx.txid for tx in block.transactions]
+    assert list(dict_tx) == txids
+    assert dict_tx[txids[1]]['inputs'] == [f'{bytes([i]).hex() * 32},{i}' for i in (1, 2)]
+    assert dict_tx[txids[1]]['n_outputs'] == len(scripts)
+    assert f'{txids[0]},2' not in dict_output  # coinbase 的第 3 个输出被跳过
+
+
+def test_parser_raw_block_and_decode(chain):
+    height, raw = next(iter(chain.iter_raw_blocks()))
+    assert parser_raw_block(raw, height) == parser_block(Block(raw, height), raw=False)
+    for decoded, plain in zip(iter_raw_transactions(raw), iter_raw_transactions(raw, decode=False)):
+        assert decoded[:3] == plain[:3]
+        assert [i[0] for i in decoded[3]] == [i[0] for i in plain[3]]
+        assert all(i[1] is None and i[2] is None for i in plain[3])
@@ -0,0 +1,70 @@
+import multiprocessing
+
+import pytest
+
+from bitcoin_toolkit import FileEngine, RedisEngine
+
+from .utils import diff_engines, seed_txids, trace_result
+
+
+def assert_same(engine, file_engine):
+    assert diff_engines(engine, file_engine) == []
+    addresses = list(file_engine.dict_address)
+    assert engine.batch_get_address_stats(addresses) == file_engine.batch_get_address_stats(addresses)
+    assert sorted(i['key'] for i in engine.iter_txo()) == sorted(file_engine.dict_output)
+    assert sorted(i['txid'] for i in engine.iter_tx()) == sorted(file_engine.dict_tx)
+    assert sorted(i['address'] for i in engine.iter_address()) == sorted(file_engine.dict_address)
+
+
+@pytest.fixture
+def grouped(chain, redis_client) -> RedisEngine:
+    engine = RedisEngine(client=redis_client, layout='grouped')
+    engine.undo_depth = 3
+    for block in chain.iter_blocks():
+        engine.from_block(block)
+    return engine
+
+
+def test_same_as_file_engine(grouped, file_engine):
+    assert_same(grouped, file_engine)
+    key = next(iter(file_engine.dict_output))
+    assert grouped.get_txo(key) == file_engine.dict_output[key]
+    assert grouped.batch_get_txo(['0' * 64 + ',1']) == [None]
+    assert grouped.get_tx('0' * 64) is None and grouped.batch_get_address([]) == []
+
+
+def test_fewer_keys(grouped, file_engine):
+    # 同一笔交易的所有输出保存在一个 hash 里， flat 布局每个输出各占一个 key
+    n_keys = sum(1 for _ in grouped.redis.scan_iter(RedisEngine.PREFIX_TXO + '*'))
+    assert n_keys <= len({key.rsplit(',', 1)[0] for key in file_engine.dict_output}) < len(file_engine.dict_output)
+
+
+def test_layout_is_stored(grouped):
+    assert RedisEngine(client=grouped.redis).layout == 'grouped'
+    with pytest.raises(AssertionError):
+        RedisEngine(client=grouped.redis, layout='flat')
+
+
+def test_rollback(grouped, chain, dir_blocks, file_engine):
+    blocks = list(chain.iter_blocks())
+    for height in range(11, 8, -1):
+        grouped.rollback_block(height)
+    partial = FileEngine(dir_blocks, 0, 8, show_warning=False)
+    partial.read_data(blocks=iter(blocks[:9]))
+    assert_same(grouped, partial)
+    for block in blocks[-3:]:
+        grouped.from_block(block)
+    assert_same(grouped, file_engine)
+
+
+def test_trace(grouped, file_engine):
+    grouped.build_output_filter()
+    for txid in seed_txids(file_engine):
+        assert trace_result(grouped, txid, max_depth=5) == trace_result(file_engine, txid, max_depth=5)
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork', reason='需要 fork 启动子进程')
+def test_parallel_write_data(redis_client, blocks_on_disk, chain, dir_blocks, file_engine):
+    engine = RedisEngine(client=redis_client, layout='grouped')
+    engine.parallel_write_data(dir_blocks, *chain.heights, workers=3, blocks_per_task=2, batch_blocks=1)
+    assert_same(engine, file_engine)
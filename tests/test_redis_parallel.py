@@ -0,0 +1,58 @@
+import multiprocessing
+import random
+import threading
+
+import pytest
+
+from bitcoin_toolkit import FileEngine, RedisEngine
+
+from .utils import diff_engines
+
+
+def assert_same(engine, file_engine):
+    assert diff_engines(engine, file_engine) == []
+    addresses = list(file_engine.dict_address)
+    assert engine.batch_get_address_stats(addresses) == file_engine.batch_get_address_stats(addresses)
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork', reason='需要 fork 启动子进程')
+def test_parallel_write_data(redis_client, blocks_on_disk, chain, dir_blocks, file_engine):
+    engine = RedisEngine(client=redis_client)
+    engine.parallel_write_data(dir_blocks, *chain.heights, workers=3, blocks_per_task=2, batch_blocks=1)
+    assert_same(engine, file_engine)
+    assert engine.get_ingest_height() == chain.heights[1]
+    assert engine.get_ingested_blocks() == file_engine.get_ingested_blocks()
+
+
+def test_concurrent_writers(redis_server, redis_client, chain, file_engine):
+    # 多个连接乱序、并发地写入互相花费的区块，合并结果与顺序导入相同
+    import redis
+    blocks = list(chain.iter_blocks())
+    random.Random(0).shuffle(blocks)
+    db = redis_client.connection_pool.connection_kwargs['db']
+
+    def worker(part):
+        client = redis.Redis(unix_socket_path=redis_server.socket_file, db=db, decode_responses=True)
+        engine = RedisEngine(client=client)
+        engine.WATCH_CHUNK = 30
+        for i in range(0, len(part), 2):
+            engine.from_blocks(part[i:i + 2])
+
+    threads = [threading.Thread(target=worker, args=(blocks[i::3],)) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    engine = RedisEngine(client=redis_client)
+    assert_same(engine, file_engine)
+    assert engine.get_ingest_height() == chain.heights[1]
+
+
+def test_coinbase_inputs_have_no_placeholder(file_engine):
+    assert not any(key.startswith('0' * 64) for key in file_engine.dict_output)
+
+
+def test_file_engine_single_height(blocks_on_disk, chain, dir_blocks):
+    engine = FileEngine(dir_blocks, 0, 0, show_warning=False)
+    engine.read_data()
+    assert list(engine.get_ingested_blocks()) == [0]
@@ -0,0 +1,68 @@
+import itertools
+
+import pytest
+
+from bitcoin_toolkit import RedisEngine
+
+from .utils import diff_engines
+
+
+def crash_on_transaction(client, n: int):
+    """
+    让 client 的第 n 个事务在提交时中断，模拟导入到一半时进程退出
+    """
+    counter = itertools.count()
+    pipeline = client.pipeline
+
+    def interrupt(*args, **kwargs):
+        raise KeyboardInterrupt
+
+    def crashing_pipeline(transaction=True, **kwargs):
+        pipe = pipeline(transaction=transaction, **kwargs)
+        if transaction and next(counter) == n:
+            pipe.execute = interrupt
+        return pipe
+
+    client.pipeline = crashing_pipeline
+
+
+def assert_same(engine, file_engine):
+    assert diff_engines(engine, file_engine) == []
+    addresses = list(file_engine.dict_address)
+    assert engine.batch_get_address_stats(addresses) == file_engine.batch_get_address_stats(addresses)
+    assert engine.get_ingested_blocks() == file_engine.get_ingested_blocks()
+    assert engine.get_ingest_height() == file_engine.get_ingest_height()
+
+
+def test_write_data(redis_client, chain, dir_blocks, file_engine):
+    engine = RedisEngine(client=redis_client).write_data(dir_blocks, *chain.heights, blocks=chain.iter_blocks(),
+                                                         batch_blocks=5)
+    assert_same(engine, file_engine)
+    assert sum(1 for _ in engine.iter_tx()) == len(file_engine.dict_tx)
+
+
+@pytest.mark.parametrize('crash_at', [3, 12])
+def test_resume_after_crash(redis_client, chain, dir_blocks, file_engine, crash_at):
+    engine = RedisEngine(client=redis_client)
+    engine.WATCH_CHUNK = 50  # 每批区块分成多个事务写入，在批次中间中断
+    crash_on_transaction(redis_client, crash_at)
+    with pytest.raises(KeyboardInterrupt):
+        engine.write_data(dir_blocks, *chain.heights, blocks=chain.iter_blocks(), batch_blocks=4)
+    ingested = engine.get_ingested_blocks()
+    assert len(ingested) < chain.n_blocks
+    assert engine.get_ingest_height() == (max(ingested) if ingested else None)
+
+    batches = []
+    from_blocks = engine.from_blocks
+    engine.from_blocks = lambda blocks: (batches.append([i.height for i in blocks]), from_blocks(blocks))
+    engine.write_data(dir_blocks, *chain.heights, blocks=chain.iter_blocks(), batch_blocks=4, resume=True)
+    assert all(height not in ingested for batch in batches for height in batch)
+    assert_same(engine, file_engine)
+
+
+def test_resume_rejects_other_chain(redis_client, chain, dir_blocks):
+    from synthetic import SyntheticChain
+    engine = RedisEngine(client=redis_client).write_data(dir_blocks, *chain.heights, blocks=chain.iter_blocks())
+    other = SyntheticChain(n_blocks=2, txs_per_block=5, seed=1)
+    with pytest.raises(AssertionError):
+        engine.write_data(dir_blocks, *other.heights, blocks=other.iter_blocks(), resume=True)
@@ -0,0 +1,76 @@
+import networkx as nx
+
+from bitcoin_toolkit import Trace
+from bitcoin_toolkit.render import LayoutCache, cap_edges, collapse_leaves, graph_signature
+
+
+def build_trace(n_leaves: int = 6) -> Trace:
+    """
+    a0 -> hub -> leaf_i 的星形追溯结果，叶子的金额依次增大
+    """
+    trace = Trace(0, 10, init_address='a0', debug=False)
+    edges = [('a0', 'hub', 100 * 10 ** 8)] + [('hub', f'leaf{i}', (i + 1) * 10 ** 8) for i in range(n_leaves)]
+    for u, v, w in edges:
+        trace.create_or_get_normal_node(u).add_out(v, w)
+        trace.create_or_get_normal_node(v).add_in(u, w)
+        trace.edges.append((u, v, w))
+    trace.init_nodes = [trace.get_node('a0')]
+    return trace
+
+
+def test_graph_signature_ignores_weights():
+    g1, g2 = nx.DiGraph(), nx.DiGraph()
+    g1.add_weighted_edges_from([('a', 'b', 1), ('b', 'c', 2)])
+    g2.add_weighted_edges_from([('b', 'c', 5), ('a', 'b', 7)])
+    assert graph_signature(g1) == graph_signature(g2)
+    g2.add_edge('c', 'a')
+    assert graph_signature(g1) != graph_signature(g2)
+
+
+def test_collapse_leaves():
+    edges = [['a0', 'hub', 100]] + [['hub', f'leaf{i}', i + 1] for i in range(6)]
+    collapsed, dict_other = collapse_leaves(edges, 3, keep={'a0'})
+    assert dict_other == {'hub_other_out': ['leaf0', 'leaf1']}
+    assert ['hub', 'hub_other_out', 3] in collapsed
+    assert sum(w for _, _, w in collapsed) == sum(w for _, _, w in edges)
+
+    # 只合并一个节点时还原
+    collapsed, dict_other = collapse_leaves(edges, 2, keep={'a0'})
+    assert dict_other == {}
+    assert sorted(map(tuple, collapsed)) == sorted(map(tuple, edges))
+
+
+def test_cap_edges():
+    edges = [['a', 'b', 1], ['b', 'c', 3], ['c', 'd', 2]]
+    assert cap_edges(edges, None) is edges
+    assert cap_edges(edges, 2) == [['b', 'c', 3], ['c', 'd', 2]]
+
+
+def test_layout_cache_reuses_subgraph(tmp_path):
+    path = str(tmp_path / 'layouts.pkl')
+    cache = LayoutCache(path)
+    graph = nx.DiGraph()
+    graph.add_edges_from([('a', 'b'), ('b', 'c'), ('c', 'd')])
+    pos = cache.get(graph)
+    assert set(pos) == {'a', 'b', 'c', 'd'}
+
+    sub = graph.subgraph(['a', 'b', 'c']).copy()
+    assert cache.get(sub) == {n: pos[n] for n in 'abc'}
+    assert len(cache.layouts) == 1
+    assert LayoutCache(path).layouts == cache.layouts  # 持久化到文件
+
+
+def test_draw_static(tmp_path):
+    trace = build_trace()
+    svg = tmp_path / 'trace.svg'
+    trace.draw(min_weight=1, min_leaf_weight=3, output=str(svg))
+    text = svg.read_text(encoding='utf-8')
+    assert text.startswith('<svg')
+    assert 'hub_other_out' in text and 'leaf0' not in text and 'leaf5' in text
+
+    html = tmp_path / 'trace.html'
+    trace.draw(min_weight=1, max_edges=3, output=str(html))
+    text = html.read_text(encoding='utf-8')
+    assert text.startswith('<!DOCTYPE html>')
+    assert text.count('<line ') == 3
+    assert len(trace.layout_cache.layouts) == 1  # 边数受限的图是已有布局的子图
@@ -0,0 +1,149 @@
+import threading
+import time
+import urllib.error
+
+import pytest
+
+from bitcoin_toolkit import FileEngine, LockedEngine, TraceServer
+from bitcoin_toolkit.server import Coalescer, RWLock, request_lines
+
+from .utils import seed_txids, trace_result
+
+
+def test_coalescer_merges_inflight_keys():
+    entered, release = threading.Event(), threading.Event()
+    calls = []
+
+    def func(keys):
+        calls.append(keys)
+        entered.set()
+        release.wait()
+        return [key.upper() for key in keys]
+
+    coalescer = Coalescer(func, max_wait=0)
+    results = [None] * 5
+
+    def request(i):
+        results[i] = coalescer(['x', 'y'])
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(5)]
+    threads[0].start()
+    entered.wait()
+    # 其他线程查询的 key 正在查询中，等待已有的结果
+    for thread in threads[1:]:
+        thread.start()
+    while coalescer.stats()['requests'] < 5:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == [['X', 'Y']] * 5
+    assert calls == [['x', 'y']]
+    assert coalescer.stats() == {'requests': 5, 'keys': 10, 'merged': 8, 'calls': 1, 'engine_keys': 2}
+
+
+def test_coalescer_concurrent():
+    coalescer = Coalescer(lambda keys: [key.upper() for key in keys], max_wait=0.001, max_batch=7)
+    errors = []
+
+    def request(n):
+        for i in range(20):
+            keys = [f'k{(n * 7 + i + j) % 50}' for j in range(15)]
+            if coalescer(keys) != [key.upper() for key in keys]:
+                errors.append(keys)
+
+    threads = [threading.Thread(target=request, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    stats = coalescer.stats()
+    assert stats['requests'] == 160 and stats['engine_keys'] <= stats['keys'] - stats['merged']
+    assert coalescer(['k%d' % i for i in range(20)]) == ['K%d' % i for i in range(20)]
+
+
+def test_coalescer_errors():
+    def fail(keys):
+        raise KeyError('boom')
+
+    with pytest.raises(KeyError):
+        Coalescer(fail, max_wait=0)(['a'])
+    with pytest.raises(AssertionError):
+        Coalescer(lambda keys: [], max_wait=0)(['a'])
+    # 出错后不会卡住之后的查询
+    coalescer = Coalescer(lambda keys: [1 / len(keys[0]) for _ in keys], max_wait=0)
+    with pytest.raises(ZeroDivisionError):
+        coalescer([''])
+    assert coalescer(['ab']) == [0.5]
+
+
+def test_rwlock_reentrant_writer():
+    lock = RWLock()
+    with lock.write():
+        with lock.write():
+            pass
+    with lock.read():
+        with lock.read():
+            pass
+    assert lock.writer is None and lock.readers == 0
+
+
+def test_locked_engine_during_ingest(chain, dir_blocks, file_engine):
+    engine = FileEngine(dir_blocks, *chain.heights, show_warning=False)
+    locked = LockedEngine(engine)
+    txids = list(file_engine.dict_tx)
+    heights = {}
+    for txid, info in file_engine.dict_tx.items():
+        heights.setdefault(info['block_height'], set()).add(txid)
+    thread = threading.Thread(target=locked.read_data, kwargs={'blocks': chain.iter_blocks()})
+    thread.start()
+    while thread.is_alive():
+        found = {txid for txid, info in zip(txids, locked.batch_get_tx(txids)) if info}
+        # 查询只会看到完整导入的区块
+        for height, block_txids in heights.items():
+            assert not found & block_txids or block_txids <= found
+    thread.join()
+    assert locked.batch_get_tx(txids) == [file_engine.dict_tx[i] for i in txids]
+    assert 'from_block' not in engine.__dict__  # 导入后恢复原来的写入方法
+    locked.undo_depth = 3
+    assert engine.undo_depth == 3
+
+
+@pytest.fixture
+def server(file_engine):
+    server = TraceServer(file_engine, port=0, max_workers=3).start()
+    yield server
+    server.close()
+
+
+def test_get(server, file_engine):
+    assert list(request_lines(server.url + '/health')) == [{'status': 'ok', 'ingest_height': 11}]
+    keys = list(file_engine.dict_tx)[:30] + ['missing']
+    lines = list(request_lines(server.url + '/get/tx', {'keys': keys}))
+    assert lines == [{'key': key, 'value': file_engine.dict_tx.get(key)} for key in keys]
+    addresses = list(file_engine.dict_address)[:5]
+    lines = list(request_lines(server.url + '/get/address_stats', {'keys': addresses}))
+    assert [i['value'] for i in lines] == file_engine.batch_get_address_stats(addresses)
+
+
+def test_errors(server):
+    for path, data, code in (('/get/foo', {'keys': []}, 400), ('/get/tx', {'keys': [1]}, 400),
+                             ('/nope', {}, 404)):
+        with pytest.raises(urllib.error.HTTPError) as info:
+            list(request_lines(server.url + path, data))
+        assert info.value.code == code
+    lines = list(request_lines(server.url + '/trace', {'jobs': [{'txid': '0' * 64, 'address': '1a'}]}))
+    assert len(lines) == 1 and lines[0]['id'] == 0 and 'error' in lines[0]
+
+
+def test_trace(server, file_engine):
+    txids = seed_txids(file_engine)
+    jobs = [{'txid': txid, 'min_height': 0, 'max_height': 11, 'max_depth': 4} for txid in txids]
+    lines = list(request_lines(server.url + '/trace', {'jobs': jobs}))
+    assert sorted(i['id'] for i in lines) == list(range(len(jobs)))
+    for line in lines:
+        assert line['result'] == trace_result(file_engine, txids[line['id']], 0, 11, max_depth=4)
+    stats = list(request_lines(server.url + '/stats'))[0]
+    assert stats['jobs'] == {'running': 0, 'done': len(jobs), 'failed': 0}
+    assert stats['coalescers']['tx']['requests'] > 0
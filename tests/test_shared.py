@@ -0,0 +1,52 @@
+import multiprocessing
+
+import pytest
+
+from bitcoin_toolkit import SharedEngine
+
+from .utils import diff_engines, seed_txids, trace_result
+
+
+def trace_in_worker(args) -> dict:
+    """
+    在子进程里按名字挂载共享内存并追溯
+    """
+    name, txid = args
+    engine = SharedEngine(name)
+    try:
+        return trace_result(engine, txid)
+    finally:
+        engine.close()
+
+
+@pytest.fixture
+def shared_engine(file_engine):
+    engine = SharedEngine.publish(file_engine)
+    yield engine
+    engine.unlink()
+
+
+def test_same_as_file_engine(shared_engine, file_engine):
+    assert diff_engines(shared_engine, file_engine) == []
+    assert shared_engine.batch_get_tx(['0' * 64, 5]) == [None, {}]
+    n_rows = len(file_engine.dict_tx) + len(file_engine.dict_output) + len(file_engine.dict_address)
+    assert shared_engine.sizes[0] == n_rows
+    assert sum(1 for _ in shared_engine.iter_txo()) == len(file_engine.dict_output)
+    output_filter = shared_engine.get_output_filter()
+    assert all(key in output_filter for key, info in file_engine.dict_output.items() if info['type'] is not None)
+
+
+def test_attach_from_other_processes(shared_engine, file_engine):
+    txids = seed_txids(file_engine)
+    with multiprocessing.get_context('spawn').Pool(2) as pool:
+        results = pool.map(trace_in_worker, [(shared_engine.name, txid) for txid in txids])
+    assert results == [trace_result(file_engine, txid) for txid in txids]
+
+
+def test_unlink(file_engine):
+    engine = SharedEngine.publish(file_engine)
+    name = engine.name
+    SharedEngine(name).close()
+    engine.unlink()
+    with pytest.raises(FileNotFoundError):
+        SharedEngine(name)
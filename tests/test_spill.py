@@ -0,0 +1,90 @@
+import gc
+import os
+
+import pytest
+
+from bitcoin_toolkit import FileEngine
+from bitcoin_toolkit.spill import SpillDict
+
+from .utils import seed_txids, trace_result
+
+
+def assert_same_data(engine, reference):
+    for name in FileEngine.SPILLABLE:
+        data, expected = getattr(engine, name), getattr(reference, name)
+        assert len(data) == len(expected), name
+        assert dict(data.items()) == expected, name
+
+
+def test_spill_dict(tmp_path):
+    data = SpillDict(tmp_path / 'data.sqlite', sample_every=1)
+    for i in range(100):
+        data[f'k{i}'] = {'i': i, 'values': [i] * 3}
+    assert data.memory_usage() > 0
+    freed = data.spill(60)
+    assert freed > 0 and data.memory_report()['spilled_entries'] == 60 and len(data.hot) == 40
+    assert len(data) == 100 and 'k0' in data and 'k99' in data and 'k100' not in data
+    assert data['k3'] == {'i': 3, 'values': [3, 3, 3]} and data.get('nope', 1) == 1
+    # 修改磁盘上的数据后回到内存里
+    data['k3'] = {'i': -3}
+    assert 'k3' in data.hot and data.n_cold == 59 and data['k3'] == {'i': -3}
+    del data['k4']
+    del data['k50']
+    with pytest.raises(KeyError):
+        del data['k4']
+    data.update({'k5': 5, 'new': 0})
+    assert len(data) == 99 and sorted(data) == sorted(set(f'k{i}' for i in range(100)) - {'k4', 'k50'} | {'new'})
+    assert dict(data.items())['k5'] == 5
+    data.clear()
+    assert len(data) == 0 and list(data) == []
+    data.close()
+
+
+@pytest.fixture
+def spill_engine(chain, dir_blocks, file_engine) -> FileEngine:
+    memory_limit = file_engine.memory_report()['total_bytes'] // 4
+    engine = FileEngine(dir_blocks, *chain.heights, memory_limit=memory_limit)
+    engine.undo_depth = 3
+    engine.read_data(blocks=chain.iter_blocks())
+    return engine
+
+
+def test_same_as_in_memory(spill_engine, file_engine):
+    report = spill_engine.memory_report()
+    assert sum(report[name]['spilled_entries'] for name in FileEngine.SPILLABLE) > 0
+    assert spill_engine.memory_usage() <= spill_engine.memory_limit
+    assert_same_data(spill_engine, file_engine)
+    keys = list(file_engine.dict_output)
+    assert spill_engine.batch_get_txo(keys) == file_engine.batch_get_txo(keys)
+    assert spill_engine.get_tx('0' * 64) is None and spill_engine.get_txo('0' * 64 + ',1') is None
+    assert sorted(i['key'] for i in spill_engine.iter_txo()) == sorted(keys)
+    for txid in seed_txids(file_engine):
+        assert trace_result(spill_engine, txid, max_depth=5) == trace_result(file_engine, txid, max_depth=5)
+
+
+def test_rollback(spill_engine, chain, dir_blocks):
+    partial = FileEngine(dir_blocks, 0, 8, show_warning=False)
+    partial.read_data(blocks=chain.iter_blocks())
+    for height in range(11, 8, -1):
+        spill_engine.rollback_block(height)
+    assert_same_data(spill_engine, partial)
+
+
+def test_memory_report(file_engine):
+    report = file_engine.memory_report()
+    names = list(FileEngine.SPILLABLE) + ['dict_undo', 'block_index', 'output_filter']
+    assert report['total_bytes'] == sum(report[name]['bytes'] for name in names)
+    assert report['dict_tx']['entries'] == len(file_engine.dict_tx) and report['memory_limit'] is None
+    assert report['output_filter']['bytes'] == 0
+    file_engine.get_output_filter()
+    assert file_engine.memory_report()['output_filter']['bytes'] > 0
+
+
+def test_spill_dir_removed(chain, dir_blocks):
+    engine = FileEngine(dir_blocks, *chain.heights, memory_limit=1 << 16)
+    engine.read_data(blocks=chain.iter_blocks())
+    spill_dir = engine.spill_dir
+    assert sorted(os.listdir(spill_dir)) == sorted(f'{name}.sqlite' for name in FileEngine.SPILLABLE)
+    del engine
+    gc.collect()
+    assert not os.path.exists(spill_dir)
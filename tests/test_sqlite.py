@@ -0,0 +1,54 @@
+import threading
+
+import pytest
+
+from bitcoin_toolkit import SqliteEngine
+
+from .utils import diff_engines, normalize, seed_txids, trace_result
+
+
+@pytest.fixture
+def sqlite_engine(chain, dir_blocks, tmp_path) -> SqliteEngine:
+    engine = SqliteEngine(tmp_path / 'btc.sqlite')
+    engine.write_data(dir_blocks, *chain.heights, blocks=chain.iter_blocks(), batch_blocks=5)
+    return engine
+
+
+def test_same_as_file_engine(sqlite_engine, file_engine):
+    assert diff_engines(sqlite_engine, file_engine) == []
+    addresses = list(file_engine.dict_address)
+    assert sqlite_engine.batch_get_address_stats(addresses) == file_engine.batch_get_address_stats(addresses)
+    hashes = list(file_engine.dict_block)
+    assert [normalize(i) for i in sqlite_engine.batch_get_block(hashes)] == \
+        [normalize(i) for i in file_engine.batch_get_block(hashes)]
+    assert sqlite_engine.batch_get_tx(['0' * 64]) == [None]
+    assert sum(1 for _ in sqlite_engine.iter_txo()) == len(file_engine.dict_output)
+
+
+def test_reimport_and_reopen(sqlite_engine, file_engine, chain, dir_blocks):
+    sqlite_engine.write_data(dir_blocks, *chain.heights, blocks=chain.iter_blocks())
+    sqlite_engine.close()
+    reopened = SqliteEngine(sqlite_engine.path)
+    assert diff_engines(reopened, file_engine) == []
+    addresses = list(file_engine.dict_address)
+    assert reopened.batch_get_address_stats(addresses) == file_engine.batch_get_address_stats(addresses)
+
+
+def test_connection_per_thread(sqlite_engine):
+    conns = []
+    thread = threading.Thread(target=lambda: conns.append(sqlite_engine.conn))
+    thread.start()
+    thread.join()
+    assert conns[0] is not sqlite_engine.conn
+    assert sqlite_engine.conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    assert sqlite_engine.conn.execute('PRAGMA synchronous').fetchone()[0] == 1  # NORMAL
+
+
+def test_output_filter(sqlite_engine, file_engine):
+    output_filter = sqlite_engine.get_output_filter()
+    assert all(key in output_filter for key, info in file_engine.dict_output.items() if info['type'] is not None)
+
+
+def test_trace(sqlite_engine, file_engine):
+    for txid in seed_txids(file_engine):
+        assert trace_result(sqlite_engine, txid) == trace_result(file_engine, txid)
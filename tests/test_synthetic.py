@@ -0,0 +1,57 @@
+import json
+import os
+import subprocess
+import sys
+
+from synthetic import SyntheticChain, double_sha256, merkle_root
+
+
+def test_deterministic(chain):
+    again = SyntheticChain(n_blocks=12, txs_per_block=40, hub_share=0.3, multisig_share=0.1, seed=7)
+    assert list(again.iter_raw_blocks()) == list(chain.iter_raw_blocks())
+    other = SyntheticChain(n_blocks=12, txs_per_block=40, hub_share=0.3, multisig_share=0.1, seed=8)
+    assert list(other.iter_raw_blocks()) != list(chain.iter_raw_blocks())
+
+
+def test_blocks_are_valid(chain):
+    prev_hash = '0' * 64
+    for block in chain.iter_blocks():
+        assert block.header.previous_block_hash == prev_hash
+        assert len(block.transactions) == chain.txs_per_block
+        assert block.transactions[0].is_coinbase()
+        hashes = [bytes.fromhex(tx.txid)[::-1] for tx in block.transactions]
+        assert merkle_root(hashes)[::-1].hex() == block.header.merkle_root
+        prev_hash = block.hash
+    assert chain.heights == (0, 11)
+
+
+def test_write_blk_files(chain, tmp_path):
+    from blockchain_parser.blockchain import Blockchain
+    paths = chain.write_blk_files(str(tmp_path), max_file_size=64 * 1024)
+    assert len(paths) > 1
+    raws = [raw for _, raw in chain.iter_raw_blocks()]
+    hashes = [double_sha256(raw[:80])[::-1].hex() for raw in raws]
+    blocks = Blockchain(str(tmp_path)).get_unordered_blocks()
+    assert [block.hash for block in blocks] == hashes
+
+
+def test_spends_earlier_outputs(file_engine):
+    types = {info['type'] for info in file_engine.dict_output.values()}
+    assert {'pubkeyhash', 'multisig', 'OP_RETURN'} <= types
+    spent = [info for info in file_engine.dict_output.values() if info['spent_txid'] and info['type'] is not None]
+    assert spent
+    for info in spent:
+        spending = file_engine.dict_tx[info['spent_txid']]
+        assert spending['block_height'] >= file_engine.dict_tx[info['txid']]['block_height']
+
+
+def test_benchmark_runner(tmp_path):
+    output = str(tmp_path / 'bench.json')
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'run.py')
+    subprocess.run([sys.executable, script, '--blocks', '3', '--txs', '20', '--depths', '1', '--no-memory',
+                    '--output', output], check=True, capture_output=True)
+    with open(output) as f:
+        report = json.load(f)
+    assert report['config']['blocks'] == 3
+    for name in ('parser_block', 'file_engine.read_data', 'sqlite_engine.write_data', 'trace.start.depth_1'):
+        assert name in report['results']
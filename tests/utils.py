@@ -0,0 +1,62 @@
+"""
+测试用的辅助函数
+"""
+from typing import Iterable
+
+
+def normalize(record) -> dict:
+    """
+    把引擎返回的详情转为可以直接比较的字典（列表字段的顺序与引擎的写入顺序有关，排序后再比较）
+    :param record: 引擎返回的详情，没有找到时为 None
+    :return:
+    """
+    if record is None:
+        return None
+    record = dict(record)
+    for field in ('outputs', 'labels'):
+        if field in record:
+            record[field] = sorted(record[field])
+    return record
+
+
+def diff_engines(engine, reference, kinds: Iterable[str] = ('tx', 'txo', 'address')) -> list:
+    """
+    比较 engine 与对照引擎（ FileEngine ）里的全部数据
+    :param engine: 要检查的引擎
+    :param reference: 对照的 FileEngine
+    :param kinds: 要比较的数据类型
+    :return: [(类型, key, 对照的详情, 引擎的详情), ...] ，相同时为空
+    """
+    sources = {'tx': reference.dict_tx, 'txo': reference.dict_output, 'address': reference.dict_address}
+    diffs = []
+    for kind in kinds:
+        keys = list(sources[kind])
+        values = getattr(engine, f'batch_get_{kind}')(keys)
+        for key, value in zip(keys, values):
+            if normalize(sources[kind][key]) != normalize(value):
+                diffs.append((kind, key, sources[kind][key], value))
+    return diffs
+
+
+def seed_txids(engine, n: int = 3) -> list:
+    """
+    挑选追溯的起始交易：最早的、有输出被花费的普通交易
+    :param engine: FileEngine
+    :param n: 交易数
+    :return: [txid, ...]
+    """
+    spent = {info['txid'] for info in engine.dict_output.values() if info['spent_txid']}
+    txs = sorted((info['block_height'], txid) for txid, info in engine.dict_tx.items()
+                 if txid in spent and not info['is_coinbase'])
+    return [txid for _, txid in txs[:n]]
+
+
+def trace_result(engine, txid: str, min_height: int = 0, max_height: int = None, max_depth: int = 3) -> dict:
+    """
+    用 engine 从 txid 开始追溯
+    :return: 追溯结果，见 Trace.to_dict
+    """
+    from bitcoin_toolkit import Trace
+    trace = Trace(min_height, max_height, init_txid=txid, max_depth=max_depth).set_search_engine(engine)
+    trace.start()
+    return trace.to_dict()